@@ -0,0 +1,137 @@
+/*
+ * doorlock_control のマイクロベンチマーク (gen_code の common/microbench.py がビルド・実行します)
+ *
+ * update_door_lock_state を 100ms 周期の制御ループと同じように呼び出し、1 呼び出しあたりの
+ * 時間 (ns) とサイクル数 (x86 のみ, TSC) を測ります。計測は BENCH_ROUNDS 回行い、最小値を採ります。
+ * 結果は 1 行の JSON で標準出力に書きます:
+ *   {"calls": 1048576, "ns_per_call": 9.812, "calls_per_sec": 101916000, "cycles_per_call": 31.4}
+ */
+#define _POSIX_C_SOURCE 199309L
+
+#include <stdio.h>
+#include <stdint.h>
+#include "doorlock_control.h"
+
+#if defined(_WIN32)
+#include <windows.h>
+#else
+#include <time.h>
+#endif
+
+#if defined(__x86_64__) || defined(__i386__)
+#include <x86intrin.h>
+#define BENCH_HAS_CYCLES 1
+#else
+#define BENCH_HAS_CYCLES 0
+#endif
+
+#define BENCH_ROUNDS 7
+/* 1 回の計測の最短時間 (20ms)。これに届くまで呼び出し回数を倍にします */
+#define BENCH_MIN_ROUND_NS 20000000.0
+#define CONTROL_PERIOD_MS 100u
+/* スイッチ入力を切り替える間隔 (呼び出し回数)。手動操作後の自動制御無効期間より長くします */
+#define SWITCH_PHASE_SHIFT 9u
+
+typedef struct {
+    int vehicle_speed_kph;
+    ShiftPosition shift_position;
+} VehicleInput;
+
+typedef struct {
+    DoorLockCommand driver;
+    DoorLockCommand passenger;
+    DoorLockCommand rear;
+} SwitchInput;
+
+/* 発進・走行・減速・停車を繰り返す速度プロファイル (異常入力を 1 つ含みます) */
+static const VehicleInput vehicle_inputs[] = {
+    {0, SHIFT_P}, {0, SHIFT_D}, {5, SHIFT_D}, {12, SHIFT_D},
+    {19, SHIFT_D}, {20, SHIFT_D}, {35, SHIFT_D}, {60, SHIFT_D},
+    {60, SHIFT_D}, {40, SHIFT_D}, {20, SHIFT_D}, {8, SHIFT_D},
+    {0, SHIFT_D}, {0, SHIFT_N}, {-1, SHIFT_P}, {0, SHIFT_R},
+};
+
+static const SwitchInput switch_inputs[] = {
+    {UNLOCK, UNLOCK, UNLOCK}, {LOCK, LOCK, LOCK}, {UNLOCK, LOCK, UNLOCK}, {LOCK, UNLOCK, UNLOCK},
+};
+
+#define VEHICLE_INPUT_COUNT (sizeof(vehicle_inputs) / sizeof(vehicle_inputs[0]))
+#define SWITCH_INPUT_COUNT (sizeof(switch_inputs) / sizeof(switch_inputs[0]))
+
+/* 戻り値を捨てると呼び出しごと最適化で消えるため、volatile に書き込みます */
+static volatile uint32_t sink;
+static uint32_t now_ms;
+
+static double now_ns(void) {
+#if defined(_WIN32)
+    LARGE_INTEGER frequency, counter;
+    QueryPerformanceFrequency(&frequency);
+    QueryPerformanceCounter(&counter);
+    return (double)counter.QuadPart * 1e9 / (double)frequency.QuadPart;
+#else
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double)ts.tv_sec * 1e9 + (double)ts.tv_nsec;
+#endif
+}
+
+static uint64_t now_cycles(void) {
+#if BENCH_HAS_CYCLES
+    return (uint64_t)__rdtsc();
+#else
+    return 0u;
+#endif
+}
+
+static void run_calls(uint32_t calls) {
+    uint32_t i;
+    for (i = 0u; i < calls; i++) {
+        const VehicleInput *vehicle = &vehicle_inputs[i % VEHICLE_INPUT_COUNT];
+        const SwitchInput *switches = &switch_inputs[(i >> SWITCH_PHASE_SHIFT) % SWITCH_INPUT_COUNT];
+        now_ms += CONTROL_PERIOD_MS;
+        sink ^= (uint32_t)update_door_lock_state(vehicle->vehicle_speed_kph, vehicle->shift_position,
+                                                 switches->driver, switches->passenger, switches->rear, now_ms);
+    }
+}
+
+int main(void) {
+    uint32_t calls = 1024u;
+    double best_ns = 0.0;
+    double best_cycles = 0.0;
+    int round;
+
+    /* 校正: 1 回の計測が BENCH_MIN_ROUND_NS 以上になる呼び出し回数を探します (ウォームアップを兼ねます) */
+    for (;;) {
+        double start = now_ns();
+        run_calls(calls);
+        if (now_ns() - start >= BENCH_MIN_ROUND_NS || calls >= 0x40000000u) {
+            break;
+        }
+        calls *= 2u;
+    }
+
+    for (round = 0; round < BENCH_ROUNDS; round++) {
+        double start = now_ns();
+        uint64_t start_cycles = now_cycles();
+        double ns_per_call;
+        double cycles_per_call;
+        run_calls(calls);
+        cycles_per_call = (double)(now_cycles() - start_cycles) / (double)calls;
+        ns_per_call = (now_ns() - start) / (double)calls;
+        if (round == 0 || ns_per_call < best_ns) {
+            best_ns = ns_per_call;
+        }
+        if (round == 0 || cycles_per_call < best_cycles) {
+            best_cycles = cycles_per_call;
+        }
+    }
+
+    printf("{\"calls\": %lu, \"ns_per_call\": %.3f, \"calls_per_sec\": %.0f, ",
+           (unsigned long)calls, best_ns, best_ns > 0.0 ? 1e9 / best_ns : 0.0);
+    if (BENCH_HAS_CYCLES) {
+        printf("\"cycles_per_call\": %.1f}\n", best_cycles);
+    } else {
+        printf("\"cycles_per_call\": null}\n");
+    }
+    return 0;
+}
@@ -0,0 +1,309 @@
+/*
+ * brake_app -> body_app の仮想時刻統合テスト（gen_code の common/integration.py がビルド・実行します）
+ *
+ * brake_app の車速生成 (speed_generator.c) と body_app の制御周期処理 (body_control.c, doorlock_control.c)
+ * を、実時間の sleep と UDP の代わりに仮想時計とメモリ上の伝送路 (sim_transport.c) でつなぐ。
+ * 時刻は次のイベントまで一度に進めるので、長い車速トレースもミリ秒で再生でき、ポートも使わないため
+ * 何本でも同時に実行できる。
+ *
+ * 使い方:
+ *   integration_sim [--trace FILE] [--repeat N] [--duration-ms N] [--latency-ms N]
+ *
+ * トレースを指定しない場合は brake_app の車速パターンを SPEED_GEN_CYCLE_MS 周期で送信する。
+ * トレースは 1 行 1 イベント（# 以降はコメント）:
+ *   <時刻ms> speed <km/h>                   brake_app が車速を送信する
+ *   <時刻ms> shift P|N|D|R                  シフトレンジを変える
+ *   <時刻ms> switch <運転席> <助手席> <後席>  ロックスイッチを変える (LOCK/UNLOCK)
+ *   <時刻ms> expect LOCK|UNLOCK             その時刻以降の最初の制御周期の指令を検査する
+ * 結果は最後の行に JSON で出力する。検査に失敗した場合は終了コード 1、トレースの誤りは 2。
+ */
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+
+#include "speed_generator.h"
+#include "body_control.h"
+#include "sim_transport.h"
+
+#define MAX_LINE 256
+#define MAX_REPORTED_FAILURES 20
+
+typedef enum {
+    EVENT_SPEED,
+    EVENT_SHIFT,
+    EVENT_SWITCH,
+    EVENT_EXPECT
+} SimEventKind;
+
+typedef struct {
+    uint32_t time_ms;
+    SimEventKind kind;
+    int value;
+    DoorLockCommand switches[3];
+    int line;
+} SimEvent;
+
+typedef struct {
+    uint32_t time_ms;
+    int line;
+    DoorLockCommand expected;
+    DoorLockCommand actual;
+    int speed_kph;
+} SimFailure;
+
+static SimEvent *events = NULL;
+static size_t event_count = 0;
+static size_t event_capacity = 0;
+
+static const char *command_name(DoorLockCommand command) {
+    return command == LOCK ? "LOCK" : "UNLOCK";
+}
+
+static int parse_command(const char *text, DoorLockCommand *command) {
+    if (strcmp(text, "LOCK") == 0) {
+        *command = LOCK;
+    } else if (strcmp(text, "UNLOCK") == 0) {
+        *command = UNLOCK;
+    } else {
+        return 0;
+    }
+    return 1;
+}
+
+static int parse_shift(const char *text, int *shift) {
+    static const char *names[] = {"P", "N", "D", "R"};
+    static const ShiftPosition positions[] = {SHIFT_P, SHIFT_N, SHIFT_D, SHIFT_R};
+    size_t i;
+    for (i = 0; i < sizeof(names) / sizeof(names[0]); i++) {
+        if (strcmp(text, names[i]) == 0) {
+            *shift = (int)positions[i];
+            return 1;
+        }
+    }
+    return 0;
+}
+
+static SimEvent *append_event(void) {
+    if (event_count == event_capacity) {
+        size_t capacity = event_capacity ? event_capacity * 2 : 64;
+        SimEvent *grown = (SimEvent *)realloc(events, capacity * sizeof(SimEvent));
+        if (grown == NULL) {
+            fprintf(stderr, "[Sim] Out of memory\n");
+            exit(2);
+        }
+        events = grown;
+        event_capacity = capacity;
+    }
+    return &events[event_count++];
+}
+
+static int load_trace(const char *path) {
+    FILE *file = fopen(path, "r");
+    char line[MAX_LINE];
+    int line_number = 0;
+    uint32_t last_time = 0;
+    if (file == NULL) {
+        fprintf(stderr, "[Sim] Cannot open trace %s\n", path);
+        return 0;
+    }
+    while (fgets(line, sizeof(line), file) != NULL) {
+        char kind[16], arg1[16], arg2[16], arg3[16];
+        unsigned long time_ms;
+        char *comment = strchr(line, '#');
+        int fields;
+        int ok = 0;
+        SimEvent event;
+        line_number++;
+        if (comment != NULL) {
+            *comment = '\0';
+        }
+        fields = sscanf(line, "%lu %15s %15s %15s %15s", &time_ms, kind, arg1, arg2, arg3);
+        if (fields <= 0) {
+            continue;  /* 空行・コメント行 */
+        }
+        memset(&event, 0, sizeof(event));
+        event.time_ms = (uint32_t)time_ms;
+        event.line = line_number;
+        if (fields == 3 && strcmp(kind, "speed") == 0) {
+            char *end;
+            event.kind = EVENT_SPEED;
+            event.value = (int)strtol(arg1, &end, 10);
+            ok = *end == '\0';
+        } else if (fields == 3 && strcmp(kind, "shift") == 0) {
+            event.kind = EVENT_SHIFT;
+            ok = parse_shift(arg1, &event.value);
+        } else if (fields == 5 && strcmp(kind, "switch") == 0) {
+            event.kind = EVENT_SWITCH;
+            ok = parse_command(arg1, &event.switches[0]) && parse_command(arg2, &event.switches[1])
+                 && parse_command(arg3, &event.switches[2]);
+        } else if (fields == 3 && strcmp(kind, "expect") == 0) {
+            DoorLockCommand expected;
+            event.kind = EVENT_EXPECT;
+            ok = parse_command(arg1, &expected);
+            event.value = (int)expected;
+        }
+        if (!ok || event.time_ms < last_time) {
+            fprintf(stderr, "[Sim] %s:%d: invalid or out-of-order event\n", path, line_number);
+            fclose(file);
+            return 0;
+        }
+        last_time = event.time_ms;
+        *append_event() = event;
+    }
+    fclose(file);
+    return 1;
+}
+
+/* トレースを repeat 回つなげる。1 回分の長さは最後のイベントの次の制御周期まで */
+static uint32_t repeat_trace(unsigned long repeat) {
+    size_t original = event_count;
+    uint32_t period;
+    unsigned long round;
+    size_t i;
+    if (original == 0) {
+        return 0;
+    }
+    period = (events[original - 1].time_ms / CONTROL_PERIOD_MS + 1u) * CONTROL_PERIOD_MS;
+    for (round = 1; round < repeat; round++) {
+        for (i = 0; i < original; i++) {
+            SimEvent event = events[i];
+            event.time_ms += (uint32_t)(round * period);
+            *append_event() = event;
+        }
+    }
+    return (uint32_t)(repeat * period);
+}
+
+int main(int argc, char **argv) {
+    const char *trace = NULL;
+    unsigned long repeat = 1;
+    unsigned long duration_ms = 0;
+    unsigned long latency_ms = 0;
+    BodyControlInputs inputs = {SHIFT_D, UNLOCK, UNLOCK, UNLOCK};  /* body_app の模擬入力と同じ初期値 */
+    SimFailure failures[MAX_REPORTED_FAILURES];
+    unsigned long failure_count = 0;
+    unsigned long checks = 0;
+    unsigned long steps = 0;
+    unsigned long transitions = 0;
+    DoorLockCommand last_command = UNLOCK;
+    size_t next_event = 0;
+    size_t first_pending = 0;
+    uint32_t now = 0;
+    uint32_t next_brake = 0;
+    uint32_t next_body = 0;
+    int i;
+
+    for (i = 1; i < argc; i++) {
+        if (strcmp(argv[i], "--trace") == 0 && i + 1 < argc) {
+            trace = argv[++i];
+        } else if (strcmp(argv[i], "--repeat") == 0 && i + 1 < argc) {
+            repeat = strtoul(argv[++i], NULL, 10);
+        } else if (strcmp(argv[i], "--duration-ms") == 0 && i + 1 < argc) {
+            duration_ms = strtoul(argv[++i], NULL, 10);
+        } else if (strcmp(argv[i], "--latency-ms") == 0 && i + 1 < argc) {
+            latency_ms = strtoul(argv[++i], NULL, 10);
+        } else {
+            fprintf(stderr, "usage: %s [--trace FILE] [--repeat N] [--duration-ms N] [--latency-ms N]\n", argv[0]);
+            return 2;
+        }
+    }
+    if (trace != NULL) {
+        uint32_t length;
+        if (!load_trace(trace)) {
+            return 2;
+        }
+        length = repeat_trace(repeat ? repeat : 1);
+        if (duration_ms == 0) {
+            duration_ms = length;
+        }
+    } else if (duration_ms == 0) {
+        duration_ms = 60000;
+    }
+    sim_transport_init((uint32_t)latency_ms);
+
+    for (;;) {
+        uint32_t next;
+        uint32_t delivery;
+
+        /* 同じ時刻では 入力イベント -> 送信 -> 配送 -> 制御周期 の順に処理する */
+        while (next_event < event_count && events[next_event].time_ms <= now) {
+            const SimEvent *event = &events[next_event++];
+            if (event->kind == EVENT_SPEED) {
+                sim_transport_send(event->value, now);
+            } else if (event->kind == EVENT_SHIFT) {
+                inputs.shift_position = (ShiftPosition)event->value;
+            } else if (event->kind == EVENT_SWITCH) {
+                inputs.driver_lock_switch = event->switches[0];
+                inputs.passenger_lock_switch = event->switches[1];
+                inputs.rear_lock_switch = event->switches[2];
+            }
+        }
+        if (trace == NULL && now >= next_brake) {
+            sim_transport_send(speed_generator_next(), now);
+            next_brake += SPEED_GEN_CYCLE_MS;
+        }
+        sim_transport_deliver(now);
+
+        if (now >= next_body) {
+            BodyControlResult result = body_control_step(&inputs, now);
+            if (steps > 0 && result.command != last_command) {
+                transitions++;
+            }
+            last_command = result.command;
+            steps++;
+            /* この周期までに期限の来た検査 */
+            for (; first_pending < next_event; first_pending++) {
+                const SimEvent *event = &events[first_pending];
+                if (event->kind != EVENT_EXPECT) {
+                    continue;
+                }
+                checks++;
+                if ((DoorLockCommand)event->value != result.command) {
+                    if (failure_count < MAX_REPORTED_FAILURES) {
+                        SimFailure *failure = &failures[failure_count];
+                        failure->time_ms = now;
+                        failure->line = event->line;
+                        failure->expected = (DoorLockCommand)event->value;
+                        failure->actual = result.command;
+                        failure->speed_kph = result.vehicle_speed_kph;
+                    }
+                    failure_count++;
+                    printf("FAIL t=%lu ms (trace line %d): expected %s, got %s (speed %d km/h, shift %d)\n",
+                           (unsigned long)now, event->line, command_name((DoorLockCommand)event->value),
+                           command_name(result.command), result.vehicle_speed_kph, (int)inputs.shift_position);
+                }
+            }
+            next_body += CONTROL_PERIOD_MS;
+        }
+
+        /* 次にイベントのある時刻まで仮想時計を進める */
+        next = next_body;
+        if (trace == NULL && next_brake < next) {
+            next = next_brake;
+        }
+        if (next_event < event_count && events[next_event].time_ms < next) {
+            next = events[next_event].time_ms;
+        }
+        if (sim_transport_next_delivery(&delivery) && delivery < next) {
+            next = delivery;
+        }
+        if (next > duration_ms) {
+            break;
+        }
+        now = next;
+    }
+
+    printf("{\"virtual_ms\": %lu, \"control_steps\": %lu, \"messages\": %lu, \"dropped\": %lu, "
+           "\"transitions\": %lu, \"checks\": %lu, \"failures\": %lu, \"first_failures\": [",
+           (unsigned long)now, steps, (unsigned long)sim_transport_sent(), (unsigned long)sim_transport_dropped(),
+           transitions, checks, failure_count);
+    for (i = 0; i < (int)failure_count && i < MAX_REPORTED_FAILURES; i++) {
+        printf("%s{\"time_ms\": %lu, \"line\": %d, \"expected\": \"%s\", \"actual\": \"%s\", \"speed_kph\": %d}",
+               i ? ", " : "", (unsigned long)failures[i].time_ms, failures[i].line,
+               command_name(failures[i].expected), command_name(failures[i].actual), failures[i].speed_kph);
+    }
+    printf("]}\n");
+    free(events);
+    return failure_count ? 1 : 0;
+}
@@ -0,0 +1,75 @@
+/*
+ * 統合テスト用のメモリ上の伝送路（udp_sender.c / udp_receiver.c の代わりにリンクする）
+ */
+
+#include "sim_transport.h"
+#include "udp_receiver.h"
+
+typedef struct {
+    uint32_t deliver_at_ms;
+    int speed;
+} SimMessage;
+
+static SimMessage queue[SIM_TRANSPORT_CAPACITY];
+static uint32_t queue_head = 0u;
+static uint32_t queue_count = 0u;
+static uint32_t latency = 0u;
+static uint32_t sent = 0u;
+static uint32_t dropped = 0u;
+static volatile int latest_vehicle_speed = 0;
+
+void sim_transport_init(uint32_t latency_ms) {
+    queue_head = 0u;
+    queue_count = 0u;
+    latency = latency_ms;
+    sent = 0u;
+    dropped = 0u;
+    latest_vehicle_speed = 0;
+}
+
+void sim_transport_send(int speed, uint32_t now_ms) {
+    SimMessage *message;
+    if (queue_count == SIM_TRANSPORT_CAPACITY) {
+        queue_head = (queue_head + 1u) % SIM_TRANSPORT_CAPACITY;
+        queue_count--;
+        dropped++;
+    }
+    message = &queue[(queue_head + queue_count) % SIM_TRANSPORT_CAPACITY];
+    message->deliver_at_ms = now_ms + latency;
+    message->speed = speed;
+    queue_count++;
+    sent++;
+}
+
+void sim_transport_deliver(uint32_t now_ms) {
+    // 遅延は一定なので、キューは配送時刻の順に並んでいる
+    while (queue_count > 0u && queue[queue_head].deliver_at_ms <= now_ms) {
+        latest_vehicle_speed = queue[queue_head].speed;
+        queue_head = (queue_head + 1u) % SIM_TRANSPORT_CAPACITY;
+        queue_count--;
+    }
+}
+
+int sim_transport_next_delivery(uint32_t *time_ms) {
+    if (queue_count == 0u) {
+        return 0;
+    }
+    *time_ms = queue[queue_head].deliver_at_ms;
+    return 1;
+}
+
+uint32_t sim_transport_sent(void) {
+    return sent;
+}
+
+uint32_t sim_transport_dropped(void) {
+    return dropped;
+}
+
+// --- udp_receiver.h の実装（受信スレッドは使わない） ---
+void start_udp_speed_receiver(void) {
+}
+
+int get_latest_vehicle_speed(void) {
+    return latest_vehicle_speed;
+}
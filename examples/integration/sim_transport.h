@@ -0,0 +1,25 @@
+#ifndef SIM_TRANSPORT_H
+#define SIM_TRANSPORT_H
+
+#include <stdint.h>
+
+/*
+ * brake_app -> body_app のメモリ上の伝送路（UDP の代わり）
+ *
+ * 送信した車速は latency_ms 後に配送され、body_app 側の get_latest_vehicle_speed() (udp_receiver.h)
+ * が最後に配送された値を返す。キューがあふれた場合は最も古いメッセージを捨てる（UDP の欠落と同じ扱い）。
+ */
+
+// メッセージを最大いくつ保持するか
+#define SIM_TRANSPORT_CAPACITY 64u
+
+void sim_transport_init(uint32_t latency_ms);
+void sim_transport_send(int speed, uint32_t now_ms);
+// now_ms までに届くメッセージを配送する
+void sim_transport_deliver(uint32_t now_ms);
+// 次のメッセージが届く時刻。キューが空なら 0 を返す
+int sim_transport_next_delivery(uint32_t *time_ms);
+uint32_t sim_transport_sent(void);
+uint32_t sim_transport_dropped(void);
+
+#endif // SIM_TRANSPORT_H
@@ -0,0 +1,23 @@
+/*
+ * body_app の制御周期処理
+ *
+ * 受信した車速と車速以外の入力から update_door_lock_state を呼び出す。
+ * 車速の取得元（UDP受信・統合テストのメモリ上の伝送路）はリンクするモジュールで切り替わる。
+ */
+
+#include "body_control.h"
+#include "udp_receiver.h"
+
+BodyControlResult body_control_step(const BodyControlInputs *inputs, uint32_t current_time_ms) {
+    BodyControlResult result;
+    result.vehicle_speed_kph = get_latest_vehicle_speed();
+    result.command = update_door_lock_state(
+        result.vehicle_speed_kph,
+        inputs->shift_position,
+        inputs->driver_lock_switch,
+        inputs->passenger_lock_switch,
+        inputs->rear_lock_switch,
+        current_time_ms
+    );
+    return result;
+}
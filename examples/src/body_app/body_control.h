@@ -0,0 +1,35 @@
+#ifndef BODY_CONTROL_H
+#define BODY_CONTROL_H
+
+#include <stdint.h>
+#include "doorlock_control.h"
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+// ドアロック制御の周期
+#define CONTROL_PERIOD_MS 500
+
+// 車速以外の制御入力（シフトレンジ・ロックスイッチ）
+typedef struct {
+    ShiftPosition shift_position;
+    DoorLockCommand driver_lock_switch;
+    DoorLockCommand passenger_lock_switch;
+    DoorLockCommand rear_lock_switch;
+} BodyControlInputs;
+
+// 1周期分の制御結果
+typedef struct {
+    int vehicle_speed_kph;
+    DoorLockCommand command;
+} BodyControlResult;
+
+// 1周期分の制御: 直近の受信車速と入力からドアロック指令を決める（周期の待ちは呼び出し側で行う）
+BodyControlResult body_control_step(const BodyControlInputs *inputs, uint32_t current_time_ms);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif // BODY_CONTROL_H
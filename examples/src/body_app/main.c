@@ -13,10 +13,10 @@
 
 
 #include "doorlock_control.h"
+#include "body_control.h"
 
 #define UDP_PORT 50000
 #define UDP_BUFSIZE 4
-#define CONTROL_PERIOD_MS 500
 
 #include "udp_receiver.h"
 
@@ -36,10 +36,7 @@ static DoorLockCommand get_rear_lock_switch(void) { return UNLOCK; }
 
 
 int main(void) {
-    ShiftPosition shift_position = SHIFT_D;
-    DoorLockCommand driver_lock_switch = UNLOCK;
-    DoorLockCommand passenger_lock_switch = UNLOCK;
-    DoorLockCommand rear_lock_switch = UNLOCK;
+    BodyControlInputs inputs;
     uint32_t current_time_ms = 0;
 
     printf("[App] Speed-linked door lock control application started.\n");
@@ -49,25 +46,16 @@ int main(void) {
     start_udp_speed_receiver();
 
     while (1) {
-        int vehicle_speed_kph = get_latest_vehicle_speed();
-
         // シフト・スイッチは模擬関数で取得
-        shift_position = get_shift_position();
-        driver_lock_switch = get_driver_lock_switch();
-        passenger_lock_switch = get_passenger_lock_switch();
-        rear_lock_switch = get_rear_lock_switch();
-
-        DoorLockCommand cmd = update_door_lock_state(
-            vehicle_speed_kph,
-            shift_position,
-            driver_lock_switch,
-            passenger_lock_switch,
-            rear_lock_switch,
-            current_time_ms
-        );
-
-        printf("[App] Received speed: %d km/h\n", vehicle_speed_kph);
-        if (cmd == LOCK) {
+        inputs.shift_position = get_shift_position();
+        inputs.driver_lock_switch = get_driver_lock_switch();
+        inputs.passenger_lock_switch = get_passenger_lock_switch();
+        inputs.rear_lock_switch = get_rear_lock_switch();
+
+        BodyControlResult result = body_control_step(&inputs, current_time_ms);
+
+        printf("[App] Received speed: %d km/h\n", result.vehicle_speed_kph);
+        if (result.command == LOCK) {
             printf("[App] Door lock command: LOCK\n");
         } else {
             printf("[App] Door lock command: UNLOCK\n");
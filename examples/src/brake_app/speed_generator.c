@@ -12,22 +12,25 @@
 #include <unistd.h>
 #endif
 
-#define SPEED_GEN_CYCLE_MS 500
-
-// 車速生成コールバック型
-typedef void (*SpeedCallback)(int speed);
+#include "speed_generator.h"
 
 // サンプル車速パターン
 static int speed_pattern[] = {0, 5, 12, 20, 35, 40, 50, 60, 35, 20, 18, 7, 0, 0, 0};
 static int speed_pattern_len = sizeof(speed_pattern) / sizeof(speed_pattern[0]);
+static int speed_pattern_idx = 0;
+
+// 1周期分の車速を返す（パターンを繰り返す）。周期の待ちは呼び出し側で行う
+int speed_generator_next(void) {
+    int speed = speed_pattern[speed_pattern_idx];
+    speed_pattern_idx = (speed_pattern_idx + 1) % speed_pattern_len;
+    return speed;
+}
 
 // 車速生成メインループ
 void run_speed_generator(SpeedCallback cb) {
-    int idx = 0;
     while (1) {
-        int speed = speed_pattern[idx];
+        int speed = speed_generator_next();
         if (cb) cb(speed);
-        idx = (idx + 1) % speed_pattern_len;
 #ifdef _WIN32
         Sleep(SPEED_GEN_CYCLE_MS);
 #else
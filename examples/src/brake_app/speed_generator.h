@@ -5,9 +5,15 @@
 extern "C" {
 #endif
 
+// 車速の生成周期
+#define SPEED_GEN_CYCLE_MS 500
+
 // コールバック型
 typedef void (*SpeedCallback)(int speed);
 
+// 1周期分の車速を返す（統合テストでは仮想時刻で直接呼び出す）
+int speed_generator_next(void);
+
 // 車速生成メインループ
 void run_speed_generator(SpeedCallback cb);
 
@@ -1,42 +1,106 @@
-from google.adk.agents import LoopAgent, SequentialAgent
-
 from .code_writer_agent.agent import code_writer_agent
 from .code_reviewer_agent.agent import code_reviewer_agent
 from .code_refactorer_agent.agent import code_refactorer_agent
-from .code_builder_agent.agent import code_builder_agent
+from .code_builder_agent.agent import (
+    CodeBuilderAgent, code_builder_agent, performance_agent, performance_baseline_agent,
+)
 from .test_writer_agent.agent import test_writer_agent
-from .test_runner_agent.agent import test_runner_agent
+from .header_writer_agent.agent import header_writer_agent
+from .test_runner_agent.agent import TestRunnerAgent, coverage_agent, integration_test_agent, test_runner_agent
+from .common.integration import integration_enabled
+from .common.microbench import benchmark_enabled
+from .common.checkpoint import ResumableLoopAgent, ResumableSequentialAgent
+from .common.convergence import ConvergentLoopAgent
+from .common.routing import route_models
+from .common.scheduler import schedule_models
+from .common.speculative import SpeculativeRefactorAgent, speculative_settings
+from .common.telemetry import instrument
 
 MAX_ITERATIONS = 5
 
-code_refinement_loop = LoopAgent(
+# GEN_CODE_SPECULATIVE_CANDIDATES=K (K > 1) refactors and builds K candidates in parallel per iteration
+# and keeps the first one that builds (see common/speculative.py).
+SPECULATIVE = speculative_settings()
+
+if SPECULATIVE["candidates"] > 1:
+    refactor_steps = [
+        SpeculativeRefactorAgent(
+            name="SpeculativeRefactorAgent",
+            sub_agents=[code_refactorer_agent, code_builder_agent] + ([
+                TestRunnerAgent(name="CandidateTestRunnerAgent", output_key="candidate_test_result")
+            ] if SPECULATIVE["run_tests"] else []),
+            candidates=SPECULATIVE["candidates"],
+            time_budget_seconds=SPECULATIVE["time_budget_seconds"],
+            test_key="candidate_test_result" if SPECULATIVE["run_tests"] else None,
+        )
+    ]
+elif benchmark_enabled():
+    # GEN_CODE_PERF_BENCHMARK=1: a green build only exits the loop if its -O2 benchmark shows no runtime
+    # regression against the writer's code or the previous iteration (see common/microbench.py)
+    refactor_steps = [
+        code_refactorer_agent,
+        CodeBuilderAgent(name="CodeBuilderAgent", description="Build code generated from requirements.",
+                         escalate_on_success=False),
+        performance_agent,
+    ]
+else:
+    refactor_steps = [code_refactorer_agent, code_builder_agent]
+
+# Besides a successful build, the loop also stops once the refactored code no longer changes
+# (the exit reason is stored in state["refinement_exit_reason"], see common/convergence.py).
+code_refinement_loop = ConvergentLoopAgent(
     name="CodeRefinementLoop",
     # Agent order is crucial: Review First, then refactoring and build code.
     sub_agents=[
         code_reviewer_agent,
-        code_refactorer_agent,
-        code_builder_agent,
+        *refactor_steps,
     ],
+    refactor_agent_name=refactor_steps[0].name,
     max_iterations=MAX_ITERATIONS # Limit loops
 )
 
-test_refinement_loop = LoopAgent(
+# The loop stops once the tests pass and reach the coverage thresholds; below them, the test writer
+# only adds tests for the uncovered regions (see common/coverage.py).
+test_refinement_loop = ResumableLoopAgent(
     name="TestRefinementLoop",
-    # Agent order is crucial: Write tests First, then executing tests.
+    # Agent order is crucial: Write tests First, then executing tests and measuring their coverage.
     sub_agents=[
         test_writer_agent,
         test_runner_agent,
+        coverage_agent,
     ],
     max_iterations=MAX_ITERATIONS # Limit loops
 )
 
-root_agent  = SequentialAgent(
+# With GEN_CODE_CHECKPOINT_DIR set, the pipeline and its loops write a checkpoint after every sub-agent
+# and a run can be resumed where it stopped (see common/checkpoint.py).
+root_agent  = ResumableSequentialAgent(
     name="CodePipelineAgent",
     sub_agents=[
         code_writer_agent,
+        # GEN_CODE_PERF_BENCHMARK=1: benchmark the writer's code as the baseline of the refinement loop
+        *([performance_baseline_agent] if benchmark_enabled() and SPECULATIVE["candidates"] <= 1 else []),
         code_refinement_loop,
-        test_refinement_loop
+        test_refinement_loop,
+        # GEN_CODE_INTEGRATION_TEST=1: replay speed traces through brake_app and body_app in virtual time
+        # (see common/integration.py)
+        *([integration_test_agent] if integration_enabled() else []),
     ],
     description="Executes a sequence of code writing, reviewing, and refactoring.",
     # The agents will run in the order provided: Writer -> Reviewer -> Refactorer -> Builder -> Test Writer
 )
+
+# Fast models for the first passes, a stronger one after repeated build/test failures
+# (GEN_CODE_MODEL_TIERS / GEN_CODE_MODEL_ESCALATE_AFTER / GEN_CODE_MODEL_BUDGETS, see common/routing.py).
+route_models(root_agent)
+route_models(header_writer_agent)
+
+# Every model call of every concurrent pipeline goes through one rate-limit-aware scheduler
+# (GEN_CODE_MODEL_RPM / GEN_CODE_MODEL_TPM, see common/scheduler.py).
+schedule_models(root_agent)
+schedule_models(header_writer_agent)
+
+# Record wall time, tokens, tool time and loop iterations of every sub-agent (see common/telemetry.py)
+instrument(root_agent)
+# Multi-module runs write the header of every module first (see batch.run_modules)
+instrument(header_writer_agent)
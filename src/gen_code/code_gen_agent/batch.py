@@ -0,0 +1,365 @@
+"""
+Runs the CodePipelineAgent on many requirement documents concurrently.
+
+Each document gets its own session and its own workspace (a copy of 'examples' with a
+private build tree), so runs never overwrite each other's generated files or builds.
+
+Usage:
+    python -m gen_code.code_gen_agent.batch examples/docs/door_lock.md other_spec.md -j 4
+    python -m gen_code.code_gen_agent.batch --resume .checkpoints/door_lock-1a2b3c4d
+    python -m gen_code.code_gen_agent.batch --manifest examples/docs/items_modules.json -j 4
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import logging
+import warnings
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from google.adk.agents import BaseAgent
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.runners import Runner
+from google.adk.sessions import BaseSessionService
+from google.genai import types
+
+from gen_code.code_gen_agent.common.build_engine import get_builder, release_builders
+from gen_code.code_gen_agent.common.checkpoint import checkpointer, restore_session
+from gen_code.code_gen_agent.common.constants import ROOT_DIR
+from gen_code.code_gen_agent.common.diagnostics import summarize
+from gen_code.code_gen_agent.common.modules import (
+    MODULE_STATE_KEY, ModuleManifest, header_message, load_manifest, module_files, module_message, module_state,
+    prepare_module_workspace, read_headers, write_modules_cmake,
+)
+from gen_code.code_gen_agent.common.patch import write_files_atomically
+from gen_code.code_gen_agent.common.session_store import create_session_service
+from gen_code.code_gen_agent.common.telemetry import telemetry
+from gen_code.code_gen_agent.common.workspace import WORKSPACE_STATE_KEY, create_workspace
+
+APP_NAME = "code_gen_batch"
+USER_ID = "batch"
+DEFAULT_WORKSPACE_ROOT = ROOT_DIR / ".workspaces"
+
+
+@dataclass
+class PipelineRun:
+    """Summary of one pipeline run."""
+    spec: str
+    session_id: str
+    workspace: str
+    build_status: Optional[str] = None
+    test_status: Optional[str] = None
+    line_coverage: Optional[float] = None
+    integration_status: Optional[str] = None
+    elapsed_seconds: float = 0.0
+    error: Optional[str] = None
+    events: int = 0
+    final_response: Optional[str] = None
+
+
+def _status(result) -> Optional[str]:
+    return result.get("status") if isinstance(result, dict) else None
+
+
+async def _execute(
+        runner: Runner,
+        session_service: BaseSessionService,
+        run: PipelineRun,
+        content: Optional[types.Content],
+        run_config=None
+    ) -> None:
+    kwargs = {"run_config": run_config} if run_config is not None else {}
+    async for event in runner.run_async(user_id=USER_ID, session_id=run.session_id, new_message=content, **kwargs):
+        run.events += 1
+        if event.is_final_response() and event.content and event.content.parts:
+            run.final_response = event.content.parts[0].text
+
+    session = await session_service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=run.session_id)
+    if session:
+        run.build_status = _status(session.state.get("build_result"))
+        run.test_status = _status(session.state.get("test_result"))
+        coverage = session.state.get("test_coverage")
+        run.line_coverage = coverage.get("line_percent") if isinstance(coverage, dict) else None
+        run.integration_status = _status(session.state.get("integration_result"))
+
+
+async def _start(
+        runner: Runner,
+        session_service: BaseSessionService,
+        run: PipelineRun,
+        state: Dict[str, Any],
+        text: str,
+        run_config=None
+    ) -> None:
+    await session_service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=run.session_id, state=state)
+    content = types.Content(role="user", parts=[types.Part(text=text)])
+    await _execute(runner, session_service, run, content, run_config)
+
+
+def _finish(run: PipelineRun, started: float) -> PipelineRun:
+    # 失敗して途中で終わった実行の位置もプロセス内に残しません (再開はチェックポイントから行います)
+    checkpointer.forget(run.session_id)
+    run.elapsed_seconds = round(time.monotonic() - started, 3)
+    print(f"[Batch] Finished '{run.spec}' in {run.elapsed_seconds}s (build={run.build_status}, test={run.test_status})")
+    return run
+
+
+async def run_pipeline(
+        runner: Runner,
+        session_service: BaseSessionService,
+        spec_path: Path,
+        workspace: Path,
+        run_config=None
+    ) -> PipelineRun:
+    """Runs the pipeline on one requirement document inside the given workspace."""
+    session_id = f"{spec_path.stem}-{uuid.uuid4().hex[:8]}"
+    run = PipelineRun(spec=str(spec_path), session_id=session_id, workspace=str(workspace))
+    started = time.monotonic()
+    try:
+        await asyncio.to_thread(create_workspace, workspace)
+        await _start(runner, session_service, run, {WORKSPACE_STATE_KEY: str(workspace)},
+                     spec_path.read_text(encoding="utf-8"), run_config)
+    except Exception as e:
+        run.error = f"{type(e).__name__}: {e}"
+        print(f"[Batch] Run for '{spec_path}' failed: {run.error}")
+    release_builders(workspace)
+    return _finish(run, started)
+
+
+async def resume_pipeline(
+        runner: Runner,
+        session_service: BaseSessionService,
+        checkpoint_dir: Path,
+        run_config=None,
+        restore: bool = False
+    ) -> PipelineRun:
+    """Resumes a checkpointed run at the sub-agent after the last completed one (see common/checkpoint.py)."""
+    run = PipelineRun(spec=str(checkpoint_dir), session_id="", workspace="")
+    started = time.monotonic()
+    try:
+        session = await restore_session(session_service, checkpoint_dir, restore=restore)
+        run.session_id = session.id
+        run.workspace = str(session.state.get(WORKSPACE_STATE_KEY, ""))
+        # 要求文書は復元したイベントに含まれているため、新しいメッセージは送りません
+        await _execute(runner, session_service, run, None, run_config)
+    except Exception as e:
+        run.error = f"{type(e).__name__}: {e}"
+        print(f"[Batch] Resuming '{checkpoint_dir}' failed: {run.error}")
+    if run.workspace:
+        release_builders(Path(run.workspace))
+    return _finish(run, started)
+
+
+async def run_batch(
+        spec_paths: Sequence[Path],
+        agent: Optional[BaseAgent] = None,
+        max_parallel: Optional[int] = None,
+        workspace_root: Path = DEFAULT_WORKSPACE_ROOT,
+        session_service: Optional[BaseSessionService] = None,
+        run_config=None,
+        resume: Sequence[Path] = (),
+        restore: bool = False
+    ) -> List[PipelineRun]:
+    """
+    Runs the pipeline on every requirement document with at most `max_parallel` runs at once,
+    then on every checkpoint in `resume`. Results are returned in that order.
+    """
+    if agent is None:
+        from gen_code.code_gen_agent.agent import root_agent
+        agent = root_agent
+    max_parallel = max_parallel or os.cpu_count() or 1
+    session_service = session_service or create_session_service()
+    runner = Runner(agent=agent, app_name=APP_NAME, session_service=session_service)
+    semaphore = asyncio.Semaphore(max_parallel)
+    batch_dir = Path(workspace_root) / time.strftime("%Y%m%d-%H%M%S")
+
+    async def _bounded(index: int, spec_path: Path) -> PipelineRun:
+        async with semaphore:
+            workspace = batch_dir / f"{index:03d}-{spec_path.stem}"
+            return await run_pipeline(runner, session_service, spec_path, workspace, run_config)
+
+    async def _bounded_resume(checkpoint_dir: Path) -> PipelineRun:
+        async with semaphore:
+            return await resume_pipeline(runner, session_service, checkpoint_dir, run_config, restore)
+
+    print(f"[Batch] Running {len(spec_paths)} spec(s) and resuming {len(resume)} checkpoint(s) with up to {max_parallel} in parallel. "
+          f"Workspaces: {batch_dir}")
+    return list(await asyncio.gather(
+        *(_bounded(i, Path(p)) for i, p in enumerate(spec_paths)),
+        *(_bounded_resume(Path(c)) for c in resume),
+    ))
+
+
+def _built(run: PipelineRun) -> bool:
+    return run.error is None and run.build_status == "success"
+
+
+async def run_modules(
+        manifest_path: Path,
+        agent: Optional[BaseAgent] = None,
+        header_agent: Optional[BaseAgent] = None,
+        max_parallel: Optional[int] = None,
+        workspace_root: Path = DEFAULT_WORKSPACE_ROOT,
+        session_service: Optional[BaseSessionService] = None,
+        run_config=None
+    ) -> List[PipelineRun]:
+    """
+    Generates every module of a module manifest (see common/modules.py) and links body_app once.
+
+    1. The header of every module is written into a shared application workspace, one dependency level
+       at a time (the modules of a level in parallel), so each header can include the ones it uses.
+    2. Every module runs the full pipeline in its own workspace (a copy of the application workspace)
+       as soon as the modules it depends on are built; its header, source and tests are then copied back.
+    3. body_app is linked once in the application workspace with every module that was built.
+
+    Returns one run per module (in dependency order) followed by the link.
+    """
+    if agent is None:
+        from gen_code.code_gen_agent.agent import root_agent
+        agent = root_agent
+    if header_agent is None:
+        from gen_code.code_gen_agent.agent import header_writer_agent
+        header_agent = header_writer_agent
+    manifest = load_manifest(manifest_path)
+    levels = manifest.levels()
+    max_parallel = max_parallel or os.cpu_count() or 1
+    session_service = session_service or create_session_service()
+    runner = Runner(agent=agent, app_name=APP_NAME, session_service=session_service)
+    header_runner = Runner(agent=header_agent, app_name=APP_NAME, session_service=session_service)
+    semaphore = asyncio.Semaphore(max_parallel)
+    run_dir = Path(workspace_root) / f"{time.strftime('%Y%m%d-%H%M%S')}-{Path(manifest_path).stem}"
+    app = run_dir / "app"
+    app_examples = app / "examples"
+
+    def _module_run(name: str, workspace: Path, suffix: str = "") -> PipelineRun:
+        return PipelineRun(spec=f"{manifest_path}#{name}", session_id=f"{name}{suffix}-{uuid.uuid4().hex[:8]}", workspace=str(workspace))
+
+    async def _header(name: str) -> None:
+        async with semaphore:
+            module = manifest.modules[name]
+            run = _module_run(name, app, "-header")
+            state = {WORKSPACE_STATE_KEY: str(app), MODULE_STATE_KEY: module_state(module, manifest)}
+            try:
+                await _start(header_runner, session_service, run, state,
+                             header_message(module, read_headers(app_examples, manifest.dependencies(name))), run_config)
+            except Exception as e:
+                print(f"[Modules] Header of '{name}' failed: {type(e).__name__}: {e}")
+
+    async def _module(name: str) -> PipelineRun:
+        module = manifest.modules[name]
+        # 依存モジュールが (さらにその依存を待ってから) ビルドされるまで待ちます
+        dependency_runs = [await tasks[dependency] for dependency in module.depends_on]
+        workspace = run_dir / name
+        run = _module_run(name, workspace)
+        started = time.monotonic()
+        header = read_headers(app_examples, [name]).get(name)
+        failed = [r.spec.rsplit("#", 1)[-1] for r in dependency_runs if not _built(r)]
+        if failed or header is None:
+            run.error = f"Dependency not built: {', '.join(failed)}" if failed else f"Header '{name}.h' was not generated"
+            print(f"[Modules] Skipping '{name}': {run.error}")
+            return _finish(run, started)
+        async with semaphore:
+            try:
+                await asyncio.to_thread(create_workspace, workspace, app)
+                prepare_module_workspace(workspace / "examples", manifest, name)
+                state = {WORKSPACE_STATE_KEY: str(workspace), MODULE_STATE_KEY: module_state(module, manifest)}
+                message = module_message(module, header, read_headers(app_examples, manifest.dependencies(name)))
+                await _start(runner, session_service, run, state, message, run_config)
+            except Exception as e:
+                run.error = f"{type(e).__name__}: {e}"
+                print(f"[Modules] Run for '{name}' failed: {run.error}")
+        if _built(run):
+            # 後続のモジュールと最終リンクが使えるよう、生成物をアプリケーションのワークスペースに戻します
+            generated = {app_examples / f: (workspace / "examples" / f).read_text(encoding="utf-8")
+                         for f in module_files(name) if (workspace / "examples" / f).is_file()}
+            write_files_atomically(generated)
+        release_builders(workspace)
+        return _finish(run, started)
+
+    print(f"[Modules] {len(manifest.modules)} module(s) in {len(levels)} dependency level(s) from '{manifest_path}', "
+          f"up to {max_parallel} in parallel. Workspaces: {run_dir}")
+    await asyncio.to_thread(create_workspace, app)
+    write_modules_cmake(app_examples, manifest)
+    for level in levels:
+        await asyncio.gather(*(_header(name) for name in level))
+
+    tasks: Dict[str, asyncio.Task] = {}
+    for name in (name for level in levels for name in level):
+        tasks[name] = asyncio.create_task(_module(name))
+    runs = list(await asyncio.gather(*tasks.values()))
+    runs.append(await _link(manifest, app, [run.spec.rsplit("#", 1)[-1] for run in runs if _built(run)]))
+    return runs
+
+
+async def _link(manifest: ModuleManifest, app: Path, modules: Sequence[str]) -> PipelineRun:
+    """Builds body_app (and brake_app) once with every built module."""
+    run = PipelineRun(spec=f"{manifest.path} (link)", session_id="", workspace=str(app))
+    started = time.monotonic()
+    try:
+        write_modules_cmake(app / "examples", manifest, modules)
+        builder = await asyncio.to_thread(get_builder, app / "examples")
+        process = await builder.build_async()
+        result = summarize("success" if process.returncode == 0 else "error", process.stdout, process.stderr,
+                           log_file=builder.build_dir / "logs" / "link.log")
+        run.build_status = result["status"]
+        run.final_response = f"Linked {len(modules)}/{len(manifest.modules)} module(s): {result['summary']}"
+        if result["status"] != "success":
+            run.error = f"Link failed: {result['summary']} (full log: {result['log_file']})"
+    except Exception as e:
+        run.error = f"{type(e).__name__}: {e}"
+    release_builders(app)
+    print(f"[Modules] {run.final_response or run.error}")
+    return _finish(run, started)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the code generation pipeline on many requirement documents.")
+    parser.add_argument("specs", nargs="*", type=Path, help="Requirement documents (one pipeline run each)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Maximum concurrent runs (default: CPU count)")
+    parser.add_argument("--workspace-root", type=Path, default=DEFAULT_WORKSPACE_ROOT, help="Directory for per-run workspaces")
+    parser.add_argument("--output", type=Path, default=None, help="Write the JSON summary to this file")
+    parser.add_argument("--trace-dir", type=Path, default=None, help="Export the timing trace and its summary to this directory")
+    parser.add_argument("--stream", action="store_true", help="Stream model responses (SSE) and write files while they are generated")
+    parser.add_argument("--session-db", type=Path, default=None, help="Persist sessions to this SQLite file (default: $GEN_CODE_SESSION_DB, else in memory)")
+    parser.add_argument("--checkpoint-dir", type=Path, default=None, help="Write a checkpoint after every sub-agent to this directory")
+    parser.add_argument("--resume", nargs="+", type=Path, default=[], help="Resume the runs checkpointed in these directories")
+    parser.add_argument("--restore-files", action="store_true", help="On resume, rewrite sources that differ from the checkpoint")
+    parser.add_argument("--manifest", type=Path, default=None, help="Generate the modules of this module manifest and link body_app once")
+    args = parser.parse_args(argv)
+    if not args.specs and not args.resume and not args.manifest:
+        parser.error("give at least one requirement document, --resume or --manifest")
+    if args.manifest and (args.specs or args.resume):
+        parser.error("--manifest cannot be combined with requirement documents or --resume")
+
+    warnings.filterwarnings("ignore")
+    logging.basicConfig(level=logging.ERROR)
+    load_dotenv()
+
+    run_config = RunConfig(streaming_mode=StreamingMode.SSE) if args.stream else None
+    if args.checkpoint_dir:
+        checkpointer.root = args.checkpoint_dir
+    session_service = create_session_service(args.session_db)
+    if args.manifest:
+        runs = asyncio.run(run_modules(args.manifest, max_parallel=args.jobs, workspace_root=args.workspace_root,
+                                       session_service=session_service, run_config=run_config))
+    else:
+        runs = asyncio.run(run_batch(args.specs, max_parallel=args.jobs, workspace_root=args.workspace_root,
+                                     session_service=session_service, run_config=run_config,
+                                     resume=args.resume, restore=args.restore_files))
+    if args.trace_dir:
+        print(json.dumps(telemetry.export(args.trace_dir), indent=2, ensure_ascii=False))
+    summary = json.dumps([asdict(run) for run in runs], indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(summary, encoding="utf-8")
+    print(summary)
+    return 0 if all(run.error is None for run in runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
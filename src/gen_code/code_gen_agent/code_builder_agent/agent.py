@@ -1,14 +1,176 @@
-from google.adk.agents import LlmAgent
+import asyncio
+from pathlib import Path
+from typing import Any, AsyncGenerator, Dict
 
+from google.adk.agents import BaseAgent, LlmAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.adk.tools.tool_context import ToolContext
+from google.genai import types
+from typing_extensions import override
+
+from gen_code.code_gen_agent.common.build_engine import get_builder
+from gen_code.code_gen_agent.common.diagnostics import format_result
+from gen_code.code_gen_agent.common.microbench import (
+    PERFORMANCE_REPORT_STATE_KEY, PERFORMANCE_STATE_KEY, budget_violations, compare, format_measurement,
+    format_report, register_bench_target, run_benchmark, stage_writer_output,
+)
 from gen_code.code_gen_agent.common.models import Model
+from gen_code.code_gen_agent.common.modules import module_name
+from gen_code.code_gen_agent.common.result_cache import get_result, put_result
+from gen_code.code_gen_agent.common.telemetry import telemetry
+from gen_code.code_gen_agent.common.workspace import resolve_root
 from .prompt import agent_instruction
-from .tools import build_tool
+from .tools import DEFAULT_BUILD_TIMEOUT_SECONDS, build_tool, build_source_code_async
+
+
+class CodeBuilderAgent(BaseAgent):
+    """
+    Builds the generated code by awaiting 'build_source_code_async' directly.
+
+    Drop-in replacement for the LLM-driven builder: the result dict is stored in
+    state['build_result'] and a successful build escalates to exit the loop, without
+    spending a model round trip to call the tool and format its output.
+    With escalate_on_success=False the loop is left to a following PerformanceAgent.
+    """
+
+    output_key: str = "build_result"
+    escalate_on_success: bool = True
+
+    @override
+    async def _run_async_impl(
+            self, ctx: InvocationContext
+        ) -> AsyncGenerator[Event, None]:
+        tool_context = ToolContext(ctx)
+        with telemetry.span("build_source_code_async", "tool", ctx.session.id, agent=self.name) as span:
+            result = await build_source_code_async(str(resolve_root(tool_context.state)), tool_context)
+            span["status"] = result.get("status")
+        tool_context.state[self.output_key] = result
+        if not self.escalate_on_success:
+            tool_context.actions.escalate = None
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=format_result(result))]),
+            actions=tool_context.actions,
+        )
+
+
+class PerformanceAgent(BaseAgent):
+    """
+    Benchmarks the module of a green build at -O2 into state['performance'] (see common/microbench.py).
+
+    Runs after a CodeBuilderAgent that does not escalate itself and exits the loop unless the numbers
+    regressed against the previous measurement or exceed the per-cycle budget. In that case the report is
+    stored in state['performance_report'] for the next reviewer and refactorer pass.
+    Modules without a benchmark harness exit the loop like a green build.
+
+    With baseline=True it runs once before the refinement loop and only measures the writer's code
+    (staged as the module's sources in a scratch workspace, see `stage_writer_output`), so the first
+    green refactor is compared against it instead of being accepted unmeasured.
+    """
+
+    output_key: str = PERFORMANCE_STATE_KEY
+    report_key: str = PERFORMANCE_REPORT_STATE_KEY
+    build_key: str = "build_result"
+    baseline: bool = False
+
+    async def _measure(self, ctx: InvocationContext, tool_context: ToolContext, workspace: Path) -> Dict[str, Any]:
+        builder = await asyncio.to_thread(get_builder, workspace / "examples")
+        module = module_name(tool_context.state)
+        # 同じソースの測定値を再利用するので、変更のない反復で測定のばらつきが回帰に見えることはありません
+        cache_key = builder.result_key("performance", [register_bench_target(builder, module)])
+        with telemetry.span("run_benchmark", "tool", ctx.session.id, agent=self.name) as span:
+            result = get_result(cache_key, workspace)
+            if result is None:
+                result = await run_benchmark(builder, module, DEFAULT_BUILD_TIMEOUT_SECONDS)
+                if result["status"] == "success":
+                    put_result(cache_key, result, workspace)
+            span["status"] = result["status"]
+        return result
+
+    @override
+    async def _run_async_impl(
+            self, ctx: InvocationContext
+        ) -> AsyncGenerator[Event, None]:
+        tool_context = ToolContext(ctx)
+        build_result = tool_context.state.get(self.build_key)
+        if self.baseline:
+            # ライターのコードを測定し、最初のリファクタリング結果の比較対象にします (ループは終了させません)
+            slot = await asyncio.to_thread(stage_writer_output, resolve_root(tool_context.state), tool_context.state)
+            if slot is None:
+                result = {"status": "unavailable", "module": module_name(tool_context.state),
+                          "reason": "the writer's output has not been written"}
+            else:
+                result = await self._measure(ctx, tool_context, slot)
+            if result["status"] == "success":
+                tool_context.state[self.output_key] = result
+                summary = f"Performance baseline: {format_measurement(result)}"
+            else:
+                summary = f"Performance baseline not measured: {result.get('reason')}"
+            print(f"[Performance] {summary}")
+            tool_context.state[self.report_key] = ""
+        elif not isinstance(build_result, dict) or build_result.get("status") != "success":
+            # ビルドに失敗したコードは測定しません。前回の測定値は次の比較用に残します
+            summary = "Performance not measured: the build did not succeed."
+            tool_context.state[self.report_key] = ""
+        else:
+            result = await self._measure(ctx, tool_context, resolve_root(tool_context.state))
+            regressions = compare(tool_context.state.get(self.output_key), result) if result["status"] == "success" else []
+            violations = budget_violations(result) if result["status"] == "success" else []
+            report = format_report(result, regressions, violations)
+            if result["status"] == "success":
+                tool_context.state[self.output_key] = result
+                summary = f"Performance: {format_measurement(result)}"
+            else:
+                summary = f"Performance not measured: {result.get('reason')}"
+            print(f"[Performance] {summary}")
+            tool_context.state[self.report_key] = report
+            if report:
+                summary += "\n" + report
+            else:
+                # 回帰も予算超過もない (または測定対象がない) ので、改善ループを終了します
+                tool_context.actions.escalate = True
+                print(f"  [Tool Call] exit_loop triggered by {self.name}")
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=summary)]),
+            actions=tool_context.actions,
+        )
+
 
 # Code Builder Agent
-# Takes the original code and the review comments (read from state) and refactors the code.
-code_builder_agent = LlmAgent(
+# Builds the code written by the refactorer and exits the loop when the build succeeds.
+code_builder_agent = CodeBuilderAgent(
+    name="CodeBuilderAgent",
+    description="Build code generated from requirements.",
+)
+
+# Performance Agent
+# With GEN_CODE_PERF_BENCHMARK=1 it follows a non-escalating builder in the refinement loop (see agent.py)
+# and exits the loop once the build is green and its benchmark shows no regression.
+performance_agent = PerformanceAgent(
+    name="PerformanceAgent",
+    description="Benchmark the built module at -O2 and flag runtime regressions.",
+)
+
+# Measures the writer's code (file_codewriter.h/.c staged as the module in examples/build-baseline)
+# before the refinement loop, so that PerformanceAgent compares the first green refactor against it.
+performance_baseline_agent = PerformanceAgent(
+    name="PerformanceBaselineAgent",
+    description="Benchmark the written module at -O2 before it is refactored.",
+    baseline=True,
+)
+
+# LLM-driven variant of the builder (one model call to invoke the tool and one to report its output).
+code_builder_llm_agent = LlmAgent(
     name="CodeBuilderAgent",
-    model=Model.GEMINI_2_0_FLASH,
+    model=Model.GEMINI_2_0_FLASH.value,
     instruction=agent_instruction,
     description="Build code generated from requirements.",
     output_key="build_result",
@@ -1,90 +1,187 @@
-import subprocess
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, Mapping, Optional
 from google.adk.tools import FunctionTool
 from google.adk.tools.tool_context import ToolContext
 
+from gen_code.code_gen_agent.common.build_engine import get_builders, BuildResult, IncrementalBuilder
+from gen_code.code_gen_agent.common.diagnostics import merge_results, summarize
+from gen_code.code_gen_agent.common.modules import module_targets
+from gen_code.code_gen_agent.common.process import LiveLog
+from gen_code.code_gen_agent.common.result_cache import get_result, put_result, reproducible
+from gen_code.code_gen_agent.common.workspace import resolve_root
+
 # このファイルの場所に基づいてプロジェクトのルートディレクトリを決定します。
 # tools.py が <project_root>/src/gen_code/code_gen_agent/code_builder_agent/tools.py にあると仮定します。
 # ファイル構造が異なる場合は、parentsの数を調整してください。
 _PROJECT_ROOT = Path(__file__).resolve().parents[4]
 # DEFAULT_EXAMPLES_PATH = str(_PROJECT_ROOT / "examples")
 DEFAULT_EXAMPLES_PATH = str(_PROJECT_ROOT)
+DEFAULT_BUILD_TIMEOUT_SECONDS = float(os.environ.get("GEN_CODE_BUILD_TIMEOUT", "600"))
+
+def _missing_directory_result(build_directory: str) -> dict:
+    return {
+        "status": "error",
+        "stdout": f"Checked path: {build_directory}",
+        "stderr": f"[ERROR] 1: Build directory '{build_directory}' not found or is not a directory.",
+        "error_message": f"Build directory '{build_directory}' not found or is not a directory."
+    }
+
+def _to_result(process: BuildResult, log_file: Path, timeout_seconds: Optional[float] = None) -> dict:
+    # 生ログはファイルに退避し、state には整形済みの診断情報とログの末尾だけを残します
+    status = "success" if process.returncode == 0 else "error"
+    result = summarize(status, process.stdout, process.stderr, log_file=log_file)
+    if process.timed_out:
+        result["error_message"] = f"[ERROR] 5: Build timed out after {timeout_seconds} seconds (partial output returned)."
+    elif status == "error":
+        result["error_message"] = f"[ERROR] 2: Build failed with return code: {process.returncode}"
+        print(f"  [Tool Call Error] Build failed: {result['summary']} (full log: {result['log_file']})")
+    return result
+
+def _exception_result(e: Exception) -> dict:
+    if isinstance(e, FileNotFoundError):
+        # 'cmake' コマンドが見つからない場合 (subprocess.runがcwdで見つからない場合もここにくる可能性あり)
+        # もしbuild_path.is_dir()チェック後なら、これは主にcmakeコマンド自体の問題
+        return {
+            "status": "error",
+            "stdout": "",
+            "stderr": "[ERROR] 3: The 'cmake' command was not found. Please ensure cmake and ninja are installed and in your PATH.",
+            "error_message": "The 'cmake' command was not found."
+        }
+    # Other unexpected errors
+    return {
+        "status": "error",
+        "stdout": "",
+        "stderr": str(e),
+        "error_message": f"[ERROR] 4: An unexpected error occurred: {str(e)}"
+    }
+
+def _finish(result: dict, tool_context: ToolContext) -> dict:
+    if result["status"] == "success":
+        tool_context.actions.escalate = True  # Exit loop
+        print(f"  [Tool Call] exit_loop triggered by {tool_context.agent_name}")
+    return result
+
+def _build(builder: IncrementalBuilder, state: Mapping[str, Any], build_path: Path, agent_name: str) -> dict:
+    # モジュール単位の実行 (state['module']) では、そのモジュールだけをコンパイルします
+    targets, _ = module_targets(builder, state)
+    cache_key = builder.result_key("build", targets)
+    result = get_result(cache_key, build_path)
+    if result is not None:
+        print(f"  [Tool Call] Build result cache hit ({cache_key[:12]}, {builder.toolchain}) for {agent_name}")
+        return result
+    # 構成済みのビルドツリーを再利用し、変更されたターゲットだけをビルドします
+    result = _to_result(builder.build(targets), builder.build_dir / "logs" / f"build-{cache_key[:12]}.log")
+    if reproducible(result):
+        put_result(cache_key, result, build_path)
+    return result
+
+async def _build_async(
+        builder: IncrementalBuilder,
+        state: Mapping[str, Any],
+        build_path: Path,
+        agent_name: str,
+        timeout_seconds: float
+    ) -> dict:
+    targets, _ = module_targets(builder, state)
+    cache_key = builder.result_key("build", targets)
+    result = get_result(cache_key, build_path)
+    if result is not None:
+        print(f"  [Tool Call] Build result cache hit ({cache_key[:12]}, {builder.toolchain}) for {agent_name}")
+        return result
+    with LiveLog(builder.build_dir / "gen_code_live.log") as live_log:
+        process = await builder.build_async(targets, timeout=timeout_seconds, on_output=live_log)
+    result = _to_result(process, builder.build_dir / "logs" / f"build-{cache_key[:12]}.log", timeout_seconds)
+    if not process.timed_out and reproducible(result):
+        put_result(cache_key, result, build_path)
+    return result
 
 def build_source_code(
         build_directory: str,
         tool_context: ToolContext
     ) -> dict:
     """
-    Builds the source code by executing 'make build' in the specified directory.
-    Typically targets the 'examples' directory of the project.
+    Builds the source code incrementally in the 'examples' directory of the current workspace
+    (state['workspace_dir'], or the project root if no workspace is set).
+    The CMake build tree is kept between calls: it is only reconfigured when a CMakeLists.txt or
+    toolchain file changes, and only the applications whose sources changed are rebuilt.
+    If the same sources and CMake/toolchain inputs were built before (in any session), the stored
+    result is returned without building. With several toolchains (GEN_CODE_TOOLCHAINS=gcc,clang) each
+    one builds its own tree concurrently and their diagnostics are merged into one result.
 
     Args:
-        build_directory (str): The path to the directory where 'make build' will be executed.
+        build_directory (str): The path to the project directory containing 'examples'.
                                 Defaults to the project's 'examples' directory
                                 (e.g., '/home/user/workspace/code-gen-agent/examples' if the project is at that location).
 
     Returns:
-        dict: A dictionary containing the build status, standard output, and standard error.
-              Example: {'status': 'success' or 'error', 'stdout': '...', 'stderr': '...'}
+        dict: A dictionary containing the build status, the parsed compiler/linker diagnostics and
+              the tail of standard output and standard error. The full log is written to 'log_file'.
+              Example: {'status': 'success' or 'error', 'summary': '1 error(s), 0 warning(s), 0 failed test(s)',
+                        'diagnostics': [{'severity': 'error', 'file': '...', 'line': 12, 'column': 5, 'message': '...'}],
+                        'failed_tests': [], 'stdout': '...', 'stderr': '...', 'log_file': '...'}
               May also include an 'error_message' key in case of an error.
     """
-    build_directory = DEFAULT_EXAMPLES_PATH
+    # LLM が指定したパスではなく、このセッションのワークスペースを常に使います
+    build_directory = str(resolve_root(tool_context.state))
     try:
         build_path = Path(build_directory)
         # ビルドディレクトリが存在し、それがディレクトリであることを確認します
         if not build_path.is_dir():
-            return {
-                "status": "error",
-                "stdout": f"DEFAULT_EXAMPLES_PATH: {DEFAULT_EXAMPLES_PATH}",
-                "stderr": f"[ERROR] 1: Build directory '{build_directory}' not found or is not a directory.",
-                "error_message": f"Build directory '{build_directory}' not found or is not a directory."
-            }
-
-        # Command to execute
-        command = ["make", "build"]
-
-        # Execute the command using subprocess.run
-        # The cwd parameter specifies the working directory for the command
-        process = subprocess.run(
-            command,
-            cwd=str(build_path),
-            capture_output=True,  # Capture standard output and standard error
-            text=True,            # Decode output as text
-            check=False           # Do not raise an exception if the return code is non-zero
-        )
-
-        if process.returncode == 0:
-            tool_context.actions.escalate = True  # Exit loop
-            print(f"  [Tool Call] exit_loop triggered by {tool_context.agent_name}")
-            return {
-                "status": "success",
-                "stdout": process.stdout,
-                "stderr": process.stderr
-            }
-        else:
-            return {
-                "status": "error",
-                "stdout": process.stdout,
-                "stderr": process.stderr,
-                "error_message": f"[ERROR] 2: Build failed with return code: {process.returncode}"
-            }
-    except FileNotFoundError:
-        # 'make' コマンドが見つからない場合 (subprocess.runがcwdで見つからない場合もここにくる可能性あり)
-        # もしbuild_path.is_dir()チェック後なら、これは主にmakeコマンド自体の問題
-        return {
-            "status": "error",
-            "stdout": "",
-            "stderr": "[ERROR] 3: The 'make' command was not found. Please ensure make is installed and in your PATH.",
-            "error_message": "The 'make' command was not found."
-        }
+            return _missing_directory_result(build_directory)
+
+        # ツールチェーンごとのビルドツリーを並行してビルドし、診断情報を 1 つの結果にまとめます
+        builders = get_builders(build_path / "examples")
+        with ThreadPoolExecutor(max_workers=len(builders)) as executor:
+            results = list(executor.map(lambda builder: _build(builder, tool_context.state, build_path, tool_context.agent_name), builders))
+        return _finish(merge_results({builder.toolchain: result for builder, result in zip(builders, results)}), tool_context)
     except Exception as e:
-        # Other unexpected errors
-        return {
-            "status": "error",
-            "stdout": "",
-            "stderr": str(e),
-            "error_message": f"[ERROR] 4: An unexpected error occurred: {str(e)}"
-        }
+        return _exception_result(e)
+
+async def build_source_code_async(
+        build_directory: str,
+        tool_context: ToolContext,
+        timeout_seconds: Optional[float] = None
+    ) -> dict:
+    """
+    Builds the source code like 'build_source_code' without blocking other sessions.
+    The build output is streamed to 'examples/build/gen_code_live.log' while it runs.
+    If the build does not finish within the timeout, its whole process group is killed and the
+    output captured so far is returned. Cancelling the call also kills the build.
+
+    Args:
+        build_directory (str): The path to the project directory containing 'examples'.
+        timeout_seconds (Optional[float]): Maximum build time. Defaults to GEN_CODE_BUILD_TIMEOUT (600 seconds).
+
+    Returns:
+        dict: A dictionary containing the build status, the parsed compiler/linker diagnostics and
+              the tail of standard output and standard error. The full log is written to 'log_file'.
+              Example: {'status': 'success' or 'error', 'summary': '1 error(s), 0 warning(s), 0 failed test(s)',
+                        'diagnostics': [{'severity': 'error', 'file': '...', 'line': 12, 'column': 5, 'message': '...'}],
+                        'failed_tests': [], 'stdout': '...', 'stderr': '...', 'log_file': '...'}
+              May also include an 'error_message' key in case of an error.
+    """
+    # LLM が指定したパスではなく、このセッションのワークスペースを常に使います
+    build_directory = str(resolve_root(tool_context.state))
+    timeout_seconds = timeout_seconds or DEFAULT_BUILD_TIMEOUT_SECONDS
+    try:
+        build_path = Path(build_directory)
+        if not build_path.is_dir():
+            return _missing_directory_result(build_directory)
+
+        # 初回は GoogleTest キャッシュの作成を伴うことがあるため、イベントループの外で取得します
+        builders = await asyncio.to_thread(get_builders, build_path / "examples")
+        results = await asyncio.gather(*(
+            _build_async(builder, tool_context.state, build_path, tool_context.agent_name, timeout_seconds) for builder in builders
+        ))
+        return _finish(merge_results({builder.toolchain: result for builder, result in zip(builders, results)}), tool_context)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        return _exception_result(e)
 
 # FunctionTool uses the updated build_source_code function
 build_tool = FunctionTool(func=build_source_code)
+build_tool_async = FunctionTool(func=build_source_code_async)
@@ -1,16 +1,21 @@
 from google.adk.agents import LlmAgent
 
 from gen_code.code_gen_agent.common.models import Model
+from gen_code.code_gen_agent.common.llm_cache import llm_cache
 from gen_code.code_gen_agent.common.gen_file import generate_file_callback
-from .prompt import agent_instruction
+from gen_code.code_gen_agent.common.streaming import code_streamer
+from .prompt import refactor_instruction
 
 # Code Refactorer Agent
 # Takes the original code and the review comments (read from state) and refactors the code.
 code_refactorer_agent = LlmAgent(
     name="CodeRefactorerAgent",
-    model=Model.GEMINI_2_0_FLASH,
-    instruction=agent_instruction,
+    model=Model.GEMINI_2_0_FLASH.value,
+    instruction=refactor_instruction,
     description="Refactors code based on review comments.",
     output_key="refactored_code",
-    after_agent_callback=generate_file_callback
+    before_model_callback=llm_cache.before_model,
+    # With SSE streaming, code_streamer writes each file as soon as its JSON string is complete
+    after_model_callback=[llm_cache.after_model, code_streamer.after_model],
+    after_agent_callback=[generate_file_callback, code_streamer.after_agent]
 )
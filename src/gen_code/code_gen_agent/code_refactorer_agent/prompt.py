@@ -1,3 +1,13 @@
+from google.adk.agents.readonly_context import ReadonlyContext
+
+from gen_code.code_gen_agent.common.gen_file import (
+    REFACTOR_FULL_REWRITE_KEY,
+    REFACTOR_PATCH_STATUS_KEY,
+    refactor_base_paths,
+)
+from gen_code.code_gen_agent.common.microbench import PERFORMANCE_REPORT_STATE_KEY
+from gen_code.code_gen_agent.common.patch import patch_output_enabled
+
 agent_instruction = """You are a C Code Refactoring Agent.
 You will be provided with the content of a C source file (.c) and a C header file (.h).
 Your task is to refactor both files according to the given refactoring instructions or general best practices if no specific instructions are provided.
@@ -13,3 +23,69 @@ Example of your JSON output:
   "refactored_source_file_content": "// Refactored source file content...\\n#include \\"my_module.h\\"\\n#include <stdio.h>\\n\\nvoid new_function_name(int x) {\\n  printf(\\"Value: %d\\\\n\\", x);\\n}\\n"
 }
 """
+
+diff_instruction = """You are a C Code Refactoring Agent.
+Refactor the C header file and C source file below according to the review comments, the latest build result
+or general best practices if no specific instructions are provided.
+
+Do NOT output the complete files. Output only the changes, as one or more search/replace blocks:
+
+<<<<<<< SEARCH header
+(lines copied exactly from the current header file, including indentation)
+=======
+(the lines that replace them)
+>>>>>>> REPLACE
+
+Use "header" or "source" after SEARCH to select the file.
+The SEARCH part must match exactly one location of the current file; include enough surrounding lines to make it unique.
+Keep every block as small as possible. If nothing needs to change, output a single block with an empty SEARCH and REPLACE for the source file.
+
+Current header file:
+```c
+<<header>>
+```
+
+Current source file:
+```c
+<<source>>
+```
+"""
+
+full_rewrite_notice = """Your previous patch could not be applied to the current files:
+<<conflicts>>
+This time output the complete files as described below.
+
+"""
+
+performance_notice = """
+
+The runtime benchmark of your last version flagged the following.
+Address it in this refactoring:
+<<report>>
+"""
+
+
+def _base_instruction(state) -> str:
+    if not patch_output_enabled():
+        return agent_instruction
+    if state.get(REFACTOR_FULL_REWRITE_KEY):
+        conflicts = (state.get(REFACTOR_PATCH_STATUS_KEY) or {}).get("conflicts", [])
+        return full_rewrite_notice.replace("<<conflicts>>", "\n".join(f"- {c}" for c in conflicts)) + agent_instruction
+    try:
+        files = {label: path.read_text(encoding="utf-8") for label, path in refactor_base_paths(state).items()}
+    except OSError:
+        return agent_instruction
+    return diff_instruction.replace("<<header>>", files["header"]).replace("<<source>>", files["source"])
+
+
+def refactor_instruction(context: ReadonlyContext) -> str:
+    """
+    Diff mode (GEN_CODE_REFACTOR_OUTPUT=diff) embeds the current files and asks for search/replace blocks.
+    The full JSON rewrite is used otherwise, when the files cannot be read, and after a patch conflict.
+    A runtime regression of the last build (state['performance_report']) is appended in both modes.
+    """
+    instruction = _base_instruction(context.state)
+    report = context.state.get(PERFORMANCE_REPORT_STATE_KEY)
+    if report:
+        instruction += performance_notice.replace("<<report>>", report)
+    return instruction
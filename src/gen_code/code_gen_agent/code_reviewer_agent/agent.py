@@ -1,14 +1,101 @@
-from google.adk.agents import LlmAgent
+from typing import AsyncGenerator, Dict, List
+
+from google.adk.agents import BaseAgent, LlmAgent, ParallelAgent, SequentialAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import types
+from typing_extensions import override
 
 from gen_code.code_gen_agent.common.models import Model
-from .prompt import agent_instruction
+from gen_code.code_gen_agent.common.llm_cache import llm_cache
+from .prompt import (
+    agent_instruction,
+    focused_instruction_template,
+    correctness_criteria,
+    safety_criteria,
+    performance_criteria,
+    concurrency_criteria,
+)
+from .tools import format_findings, merge_reviews
+
+# 観点ごとのレビュアー: (観点, エージェント名, 説明, 評価基準)。並び順は同順位の指摘の優先度です。
+REVIEW_FOCUSES = (
+    ("correctness", "CorrectnessReviewerAgent", "correctness and undefined behavior", correctness_criteria),
+    ("safety", "SafetyReviewerAgent", "embedded safety (MISRA C style rules)", safety_criteria),
+    ("concurrency", "ConcurrencyReviewerAgent", "concurrency and interrupt safety", concurrency_criteria),
+    ("performance", "PerformanceReviewerAgent", "performance and resource usage", performance_criteria),
+)
+
+
+def _focused_reviewer(focus: str, name: str, description: str, criteria: str) -> LlmAgent:
+    return LlmAgent(
+        name=name,
+        model=Model.GEMINI_2_0_FLASH.value,
+        instruction=focused_instruction_template.replace("<<focus>>", description).replace("<<criteria>>", criteria),
+        description=f"Reviews code for {description}.",
+        output_key=f"review_comments_{focus}",
+        before_model_callback=llm_cache.before_model,
+        after_model_callback=llm_cache.after_model
+    )
+
+
+class ReviewMergerAgent(BaseAgent):
+    """
+    Merges the focused reviews into state['review_comments'] without a model call.
+
+    Near-duplicate findings are merged and the rest ranked by severity and by how many reviewers
+    raised them. When no reviewer reports anything, the comments are "No major issues found.".
+    The structured findings are stored in state['review_findings'].
+    """
+
+    output_key: str = "review_comments"
+    findings_key: str = "review_findings"
+
+    @override
+    async def _run_async_impl(
+            self, ctx: InvocationContext
+        ) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        reviews: Dict[str, str] = {focus: state.get(f"review_comments_{focus}") or "" for focus, *_ in REVIEW_FOCUSES}
+        findings: List[Dict] = merge_reviews(reviews, [focus for focus, *_ in REVIEW_FOCUSES])
+        comments = format_findings(findings)
+        print(f"[Review] Merged {sum(1 for r in reviews.values() if r)} review(s) into {len(findings)} finding(s).")
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=comments)]),
+            actions=EventActions(state_delta={self.output_key: comments, self.findings_key: findings}),
+        )
+
 
 # Code Reviewer Agent
-# Takes the code generated by the previous agent (read from state) and provides feedback.
-code_reviewer_agent = LlmAgent(
+# Focused reviewers run concurrently on the code generated by the previous agent (read from state),
+# then their comments are merged, deduplicated and ranked into state['review_comments'].
+code_reviewer_agent = SequentialAgent(
+    name="CodeReviewerAgent",
+    sub_agents=[
+        ParallelAgent(
+            name="ParallelReviewAgent",
+            sub_agents=[_focused_reviewer(*focus) for focus in REVIEW_FOCUSES],
+            description="Runs the focused reviewers concurrently.",
+        ),
+        ReviewMergerAgent(
+            name="ReviewMergerAgent",
+            description="Merges and ranks the focused review comments.",
+        ),
+    ],
+    description="Reviews code and provides feedback.",
+)
+
+# Single-prompt variant of the reviewer (one model call covering every review criterion).
+code_reviewer_llm_agent = LlmAgent(
     name="CodeReviewerAgent",
     model=Model.GEMINI_2_0_FLASH.value,
     instruction=agent_instruction,
     description="Reviews code and provides feedback.",
     output_key="review_comments",
+    before_model_callback=llm_cache.before_model,
+    after_model_callback=llm_cache.after_model
 )
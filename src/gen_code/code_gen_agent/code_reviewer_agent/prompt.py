@@ -18,3 +18,41 @@ Provide your feedback as a concise, bulleted list. Focus on the most important p
 If the code is excellent and requires no changes, simply state: "No major issues found."
 Output *only* the review comments or the "No major issues" statement.
 """
+
+# 観点別レビュアー (ParallelAgent で並列実行) の共通テンプレート。<<focus>> と <<criteria>> を置き換えて使います。
+focused_instruction_template = """You are an expert C Code Reviewer for embedded software, focusing only on <<focus>>.
+    Other reviewers cover the remaining aspects, so do not comment on anything outside your focus.
+
+    **Code to Review:**
+    ```c
+    {generated_code}
+    ```
+
+**Review Criteria:**
+<<criteria>>
+
+**Output:**
+Provide your findings as a concise, bulleted list ("- " per finding), most important first.
+Start every finding with its severity in brackets: [high], [medium] or [low].
+Example: - [high] `update_door_lock_state` reads `history` before it is initialized.
+If there is nothing to report for your focus, simply state: "No major issues found."
+Output *only* the findings or the "No major issues" statement.
+"""
+
+correctness_criteria = """1.  **Logic Errors:** Does the code implement the requirement? Are conditions, state transitions and return values right?
+2.  **Undefined Behavior:** Signed overflow, uninitialized reads, out-of-bounds access, invalid casts, sequence point violations.
+3.  **Edge Cases:** Boundary values, invalid inputs and error paths."""
+
+safety_criteria = """1.  **MISRA C Style Rules:** Implicit conversions, essential types, side effects in conditions, single exit points, `switch` without `default`.
+2.  **Defensive Coding:** Range checks of inputs, handling of invalid enum values, no dynamic memory or recursion.
+3.  **Determinism:** Bounded loops and execution time, fixed-width integer types where sizes matter."""
+
+performance_criteria = """1.  **Efficiency:** Unnecessary computation, redundant branches or memory accesses in frequently called functions.
+2.  **Memory:** Stack usage, size of static data, data type sizes suitable for a microcontroller.
+3.  **Timing:** Work per call of periodic functions and anything that scales with input size.
+
+{performance_report?}"""
+
+concurrency_criteria = """1.  **Shared State:** Static/global variables accessed from interrupts, tasks or multiple callers without protection.
+2.  **Atomicity:** Read-modify-write sequences and multi-word updates that can be interrupted; missing `volatile`.
+3.  **Reentrancy:** Functions that are not reentrant but may be called concurrently; timer and callback races."""
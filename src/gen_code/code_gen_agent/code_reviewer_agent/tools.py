@@ -0,0 +1,75 @@
+import re
+import difflib
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+
+from gen_code.code_gen_agent.common.convergence import NO_ISSUES_VERDICT, VERDICT_NO_ISSUES, parse_review_verdict
+
+MAX_REVIEW_COMMENTS = 15
+# 類似度がこの値以上のコメントは同じ指摘とみなします
+DUPLICATE_SIMILARITY = 0.75
+
+SEVERITY_RANK = {"high": 0, "medium": 1, "low": 2}
+_SEVERITY = re.compile(r"^\s*\[(?P<severity>high|medium|low)\]\s*", re.IGNORECASE)
+_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+_WORD = re.compile(r"[a-z0-9_]+")
+
+
+def parse_findings(review: str) -> List[Dict[str, Any]]:
+    """Splits one reviewer's output into findings ({'severity', 'text'}); continuation lines are joined."""
+    if parse_review_verdict(review) == VERDICT_NO_ISSUES or not review.strip():
+        return []
+    items: List[List[str]] = []
+    for line in review.strip().splitlines():
+        if not line.strip():
+            continue
+        if _BULLET.match(line) or not items:
+            items.append([_BULLET.sub("", line, count=1).strip()])
+        else:
+            items[-1].append(line.strip())
+    findings = []
+    for item in items:
+        text = " ".join(item)
+        match = _SEVERITY.match(text)
+        severity = match.group("severity").lower() if match else "medium"
+        text = _SEVERITY.sub("", text, count=1).strip()
+        if text:
+            findings.append({"severity": severity, "text": text})
+    return findings
+
+
+def _similarity(a: str, b: str) -> float:
+    words_a, words_b = set(_WORD.findall(a.lower())), set(_WORD.findall(b.lower()))
+    jaccard = len(words_a & words_b) / len(words_a | words_b) if words_a and words_b else 0.0
+    return max(jaccard, difflib.SequenceMatcher(None, a.lower(), b.lower()).ratio())
+
+
+def merge_reviews(reviews: Mapping[str, str], focus_order: Sequence[str]) -> List[Dict[str, Any]]:
+    """
+    Merges the findings of several focused reviewers (focus -> review text).
+    Near-duplicate findings are merged (highest severity wins, every focus is kept); the result
+    is ranked by severity, then by the number of reviewers that raised it, then by focus order.
+    """
+    merged: List[Dict[str, Any]] = []
+    for focus in focus_order:
+        for finding in parse_findings(reviews.get(focus) or ""):
+            duplicate = next((m for m in merged if _similarity(m["text"], finding["text"]) >= DUPLICATE_SIMILARITY), None)
+            if duplicate is None:
+                merged.append({**finding, "focus": [focus]})
+                continue
+            if focus not in duplicate["focus"]:
+                duplicate["focus"].append(focus)
+            if SEVERITY_RANK[finding["severity"]] < SEVERITY_RANK[duplicate["severity"]]:
+                duplicate["severity"] = finding["severity"]
+
+    def _rank(item: Tuple[int, Dict[str, Any]]) -> Tuple[int, int, int, int]:
+        index, finding = item
+        return (SEVERITY_RANK[finding["severity"]], -len(finding["focus"]), focus_order.index(finding["focus"][0]), index)
+
+    return [finding for _, finding in sorted(enumerate(merged), key=_rank)][:MAX_REVIEW_COMMENTS]
+
+
+def format_findings(findings: List[Dict[str, Any]]) -> str:
+    """Renders merged findings as the bulleted review_comments text read by the refactorer."""
+    if not findings:
+        return NO_ISSUES_VERDICT
+    return "\n".join(f"- [{f['severity']}] ({', '.join(f['focus'])}) {f['text']}" for f in findings)
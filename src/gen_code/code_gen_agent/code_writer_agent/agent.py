@@ -1,7 +1,9 @@
 from google.adk.agents import LlmAgent
 
 from gen_code.code_gen_agent.common.models import Model
+from gen_code.code_gen_agent.common.llm_cache import llm_cache
 from gen_code.code_gen_agent.common.gen_file import generate_file_callback
+from gen_code.code_gen_agent.common.streaming import code_streamer
 from .prompt import agent_instruction
 
 # Code Writer Agent
@@ -12,5 +14,8 @@ code_writer_agent = LlmAgent(
     instruction=agent_instruction,
     description="Writes initial C code based on a specification.",
     output_key="generated_code",
-    after_agent_callback=generate_file_callback
+    before_model_callback=llm_cache.before_model,
+    # With SSE streaming, code_streamer writes each file as soon as its JSON string is complete
+    after_model_callback=[llm_cache.after_model, code_streamer.after_model],
+    after_agent_callback=[generate_file_callback, code_streamer.after_agent]
 )
@@ -0,0 +1,441 @@
+import os
+import re
+import time
+import json
+import asyncio
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from gen_code.code_gen_agent.common.build_scheduler import build_scheduler
+from gen_code.code_gen_agent.common.constants import ROOT_DIR
+from gen_code.code_gen_agent.common.gtest_cache import gtest_configure_args
+from gen_code.code_gen_agent.common.process import OutputCallback
+
+# CMake のソースツリー (examples) からの相対パスで、ターゲットとそのソースディレクトリを対応付けます。
+DEFAULT_TARGET_DIRS: Dict[str, Tuple[str, ...]] = {
+    "body_app": ("src/body_app",),
+    "brake_app": ("src/brake_app",),
+    "test_doorlock_control": ("tests", "src/body_app"),
+}
+DEFAULT_BUILD_TARGETS: Tuple[str, ...] = ("body_app", "brake_app")
+TEST_TARGET = "test_doorlock_control"
+DEFAULT_TOOLCHAIN = "gcc"
+# ビルドするツールチェーン (examples/cmake/<name>.cmake) のカンマ区切りリスト。先頭が主ツールチェーンです
+TOOLCHAINS_ENV = "GEN_CODE_TOOLCHAINS"
+
+_STAMP_FILENAME = ".gen_code_build_state.json"
+_GTEST_REPORT_DIRNAME = "gtest_reports"
+_SOURCE_SUFFIXES = (".c", ".h", ".cpp", ".hpp")
+_TOOLCHAIN_COMPILER = re.compile(r"^\s*set\s*\(\s*CMAKE_C_COMPILER\s+\"?([^\s\")]+)", re.MULTILINE)
+
+
+@dataclass
+class BuildResult:
+    """Outcome of one incremental build, accumulated across every command that ran."""
+    returncode: int = 0
+    stdout: str = ""
+    stderr: str = ""
+    commands: List[List[str]] = field(default_factory=list)
+    configured: bool = False
+    targets: List[str] = field(default_factory=list)
+    timed_out: bool = False
+    reports: List[str] = field(default_factory=list)
+
+
+def _in_build_tree(path: Path, source_dir: Path) -> bool:
+    top = path.relative_to(source_dir).parts[0]
+    return top == "build" or top.startswith("build-")
+
+
+def _hash_files(paths: Sequence[Path], base: Path) -> str:
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(str(path.relative_to(base)).encode("utf-8"))
+        digest.update(b"\0")
+        try:
+            digest.update(path.read_bytes())
+        except OSError:
+            digest.update(b"<missing>")
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class IncrementalBuilder:
+    """
+    Keeps one configured CMake build tree alive between builds.
+
+    The tree is only reconfigured when a CMakeLists.txt, a toolchain file or the generator
+    changes, and only the targets whose source directory changed since the last successful
+    build are rebuilt. Ninja already skips up-to-date objects, so an unchanged target costs
+    nothing and the expensive configure step disappears from the refinement loop.
+    """
+
+    def __init__(
+            self,
+            source_dir: Path,
+            build_dir: Optional[Path] = None,
+            toolchain: str = DEFAULT_TOOLCHAIN,
+            target_dirs: Optional[Dict[str, Tuple[str, ...]]] = None,
+            generator: Optional[str] = None,
+            configure_args: Sequence[str] = ()
+        ):
+        self.source_dir = Path(source_dir).resolve()
+        self.build_dir = Path(build_dir).resolve() if build_dir else self.source_dir / build_dir_name(toolchain)
+        self.toolchain = toolchain
+        self.toolchain_file = self.source_dir / "cmake" / f"{toolchain}.cmake"
+        self.target_dirs = dict(target_dirs or DEFAULT_TARGET_DIRS)
+        self.generator = generator or ("MinGW Makefiles" if os.name == "nt" else "Ninja")
+        self.configure_args = list(configure_args)
+        self.lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Fingerprints
+    # ------------------------------------------------------------------
+    def configure_fingerprint(self) -> str:
+        inputs = list(self.source_dir.rglob("CMakeLists.txt")) + list((self.source_dir / "cmake").glob("*.cmake"))
+        # 全てのツールチェーンのビルドツリー (build, build-<toolchain>) は入力から除外します
+        inputs = [p for p in inputs if self.build_dir not in p.parents and not _in_build_tree(p, self.source_dir)]
+        digest = hashlib.sha256(_hash_files(inputs, self.source_dir).encode("utf-8"))
+        digest.update(self.generator.encode("utf-8"))
+        # ワークスペース間で結果キャッシュを共有できるよう、パスは相対パスでハッシュします。
+        digest.update(str(self.toolchain_file.relative_to(self.source_dir)).encode("utf-8"))
+        digest.update("\0".join(self.configure_args).encode("utf-8"))
+        return digest.hexdigest()
+
+    def target_fingerprint(self, target: str) -> str:
+        inputs = []
+        for target_dir in self.target_dirs[target]:
+            inputs += [p for p in (self.source_dir / target_dir).rglob("*") if p.is_file() and p.suffix in _SOURCE_SUFFIXES]
+        return _hash_files(inputs, self.source_dir)
+
+    def result_key(self, kind: str, targets: Optional[Sequence[str]] = None) -> str:
+        """Content hash of every input that determines the outcome of a build/test run."""
+        digest = hashlib.sha256(kind.encode("utf-8"))
+        digest.update(self.configure_fingerprint().encode("utf-8"))
+        for target in targets or DEFAULT_BUILD_TARGETS:
+            digest.update(target.encode("utf-8"))
+            digest.update(self.target_fingerprint(target).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _load_stamp(self) -> dict:
+        stamp_path = self.build_dir / _STAMP_FILENAME
+        try:
+            return json.loads(stamp_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_stamp(self, stamp: dict) -> None:
+        stamp_path = self.build_dir / _STAMP_FILENAME
+        tmp_path = stamp_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(stamp, indent=2), encoding="utf-8")
+        os.replace(tmp_path, stamp_path)
+
+    # ------------------------------------------------------------------
+    # Planning
+    # ------------------------------------------------------------------
+    def needs_configure(self, stamp: Optional[dict] = None) -> bool:
+        stamp = self._load_stamp() if stamp is None else stamp
+        if not (self.build_dir / "CMakeCache.txt").is_file():
+            return True
+        return stamp.get("configure") != self.configure_fingerprint()
+
+    def touched_targets(self, stamp: Optional[dict] = None, targets: Optional[Sequence[str]] = None) -> List[str]:
+        stamp = self._load_stamp() if stamp is None else stamp
+        built = stamp.get("targets", {})
+        touched = []
+        for target in targets or DEFAULT_BUILD_TARGETS:
+            if built.get(target) != self.target_fingerprint(target):
+                touched.append(target)
+        return touched
+
+    def configure_command(self) -> List[str]:
+        return [
+            "cmake", "-S", str(self.source_dir), "-B", str(self.build_dir),
+            "-G", self.generator,
+            "-D", f"CMAKE_TOOLCHAIN_FILE={self.toolchain_file}",
+            *self.configure_args,
+        ]
+
+    def build_command(self, target: Optional[str] = None) -> List[str]:
+        command = ["cmake", "--build", str(self.build_dir)]
+        if target:
+            command += ["--target", target]
+        return command
+
+    def ctest_command(self, target: str = TEST_TARGET) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Returns the ctest command running the tests of `target` and the environment that makes every
+        gtest executable write an XML report (one file per executable) into a fresh report directory.
+        The coverage counters of the previous run are removed, so they only count this run.
+        """
+        report_dir = self.build_dir / "tests" / _GTEST_REPORT_DIRNAME
+        if report_dir.is_dir():
+            for report in report_dir.glob("*.xml"):
+                report.unlink()
+        report_dir.mkdir(parents=True, exist_ok=True)
+        # gcov のカウンタ (.gcda) は実行のたびに加算されるため、前回の実行分を消します (common/coverage.py)
+        for counters in (self.build_dir / "tests").rglob("*.gcda"):
+            counters.unlink(missing_ok=True)
+        # 他のテストターゲット (未ビルドのモジュールのテストなど) は実行しません
+        return ["ctest", "-VV", "-O", "test.log", "-R", f"^{target}$"], {"GTEST_OUTPUT": f"xml:{report_dir}{os.sep}"}
+
+    def _collect_reports(self, result: BuildResult) -> None:
+        report_dir = self.build_dir / "tests" / _GTEST_REPORT_DIRNAME
+        result.reports = sorted(str(p) for p in report_dir.glob("*.xml"))
+
+    def plan(self, targets: Optional[Sequence[str]] = None) -> BuildResult:
+        """Returns the commands an incremental build would run, without running them."""
+        stamp = self._load_stamp()
+        result = BuildResult()
+        if self.needs_configure(stamp):
+            # 構成が変わった場合、以前のビルド結果は信用できないため全ターゲットを再ビルドします。
+            stamp = {}
+            result.configured = True
+            result.commands.append(self.configure_command())
+        result.targets = self.touched_targets(stamp, targets)
+        result.commands += [self.build_command(target) for target in result.targets]
+        return result
+
+    # ------------------------------------------------------------------
+    # Execution
+    # ------------------------------------------------------------------
+    def _record_success(self, result: BuildResult) -> None:
+        stamp = {} if result.configured else self._load_stamp()
+        stamp["configure"] = self.configure_fingerprint()
+        built = stamp.setdefault("targets", {})
+        for target in result.targets:
+            built[target] = self.target_fingerprint(target)
+        self._save_stamp(stamp)
+
+    def build(self, targets: Optional[Sequence[str]] = None) -> BuildResult:
+        """
+        Configures the tree if needed and rebuilds the touched targets.
+        Raises FileNotFoundError if cmake (or the generator it needs) is not installed.
+        """
+        with self.lock:
+            result = self.plan(targets)
+            if not result.commands:
+                result.stdout = f"[Build] Up to date: {', '.join(targets or DEFAULT_BUILD_TARGETS)}\n"
+                return result
+
+            self.build_dir.mkdir(parents=True, exist_ok=True)
+            if self._execute(result, result.commands, self.source_dir):
+                self._record_success(result)
+            return result
+
+    def test(self, target: str = TEST_TARGET) -> BuildResult:
+        """Builds the test executable incrementally and runs ctest in the tests build directory."""
+        with self.lock:
+            result = self.plan([target])
+            self.build_dir.mkdir(parents=True, exist_ok=True)
+            if not self._execute(result, result.commands, self.source_dir):
+                return result
+            self._record_success(result)
+
+            ctest_command, env = self.ctest_command(target)
+            result.commands.append(ctest_command)
+            self._execute(result, [ctest_command], self.build_dir / "tests", env)
+            self._collect_reports(result)
+            return result
+
+    def _execute(
+            self,
+            result: BuildResult,
+            commands: Sequence[List[str]],
+            cwd: Path,
+            env: Optional[Dict[str, str]] = None
+        ) -> bool:
+        for command in commands:
+            print(f"  [Build] Executing command: '{' '.join(command)}'")
+            # 全てのビルドツリーのコマンドは共通のジョブスロットで実行されます (common/build_scheduler.py)
+            process = build_scheduler.submit(command, cwd, env)
+            result.stdout += process.stdout
+            result.stderr += process.stderr
+            if process.returncode != 0:
+                result.returncode = process.returncode
+                return False
+        return True
+
+
+    # ------------------------------------------------------------------
+    # Asynchronous execution
+    # ------------------------------------------------------------------
+    async def build_async(
+            self,
+            targets: Optional[Sequence[str]] = None,
+            timeout: Optional[float] = None,
+            on_output: Optional[OutputCallback] = None
+        ) -> BuildResult:
+        """Same as build(), but does not block the event loop and honours a timeout/cancellation."""
+        await self._acquire_async()
+        try:
+            result = self.plan(targets)
+            if not result.commands:
+                result.stdout = f"[Build] Up to date: {', '.join(targets or DEFAULT_BUILD_TARGETS)}\n"
+                return result
+
+            self.build_dir.mkdir(parents=True, exist_ok=True)
+            deadline = time.monotonic() + timeout if timeout else None
+            if await self._execute_async(result, result.commands, self.source_dir, deadline, on_output):
+                self._record_success(result)
+            return result
+        finally:
+            self.lock.release()
+
+    async def test_async(
+            self,
+            target: str = TEST_TARGET,
+            timeout: Optional[float] = None,
+            on_output: Optional[OutputCallback] = None
+        ) -> BuildResult:
+        """Same as test(), but does not block the event loop and honours a timeout/cancellation."""
+        await self._acquire_async()
+        try:
+            result = self.plan([target])
+            self.build_dir.mkdir(parents=True, exist_ok=True)
+            deadline = time.monotonic() + timeout if timeout else None
+            if not await self._execute_async(result, result.commands, self.source_dir, deadline, on_output):
+                return result
+            self._record_success(result)
+
+            ctest_command, env = self.ctest_command(target)
+            result.commands.append(ctest_command)
+            await self._execute_async(result, [ctest_command], self.build_dir / "tests", deadline, on_output, env)
+            self._collect_reports(result)
+            return result
+        finally:
+            self.lock.release()
+
+    async def _acquire_async(self) -> None:
+        # 同じビルドツリーへの同期ビルドとも排他するため threading.Lock をスレッド上で待ちます
+        acquire = asyncio.ensure_future(asyncio.to_thread(self.lock.acquire))
+        try:
+            await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # 待機中にキャンセルされた場合、後から取得されたロックを解放します
+            acquire.add_done_callback(lambda _: self.lock.release())
+            raise
+
+    async def _execute_async(
+            self,
+            result: BuildResult,
+            commands: Sequence[List[str]],
+            cwd: Path,
+            deadline: Optional[float],
+            on_output: Optional[OutputCallback],
+            env: Optional[Dict[str, str]] = None
+        ) -> bool:
+        for command in commands:
+            print(f"  [Build] Executing command: '{' '.join(command)}'")
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            process = await build_scheduler.submit_async(command, cwd, timeout=remaining, on_output=on_output, env=env)
+            result.stdout += process.stdout
+            result.stderr += process.stderr
+            if process.timed_out:
+                result.timed_out = True
+                result.returncode = process.returncode or -1
+                return False
+            if process.returncode != 0:
+                result.returncode = process.returncode
+                return False
+        return True
+
+
+def diagnostics_configure_args(toolchain: str = DEFAULT_TOOLCHAIN) -> List[str]:
+    """
+    Makes gcc emit machine-readable JSON diagnostics when GEN_CODE_DIAGNOSTICS_FORMAT=json.
+    clang has no equivalent flag, so its text diagnostics are parsed instead.
+    """
+    if os.environ.get("GEN_CODE_DIAGNOSTICS_FORMAT", "text").lower() != "json" or toolchain != "gcc":
+        return []
+    return ["-D", "CMAKE_C_FLAGS=-fdiagnostics-format=json"]
+
+
+def build_dir_name(toolchain: str = DEFAULT_TOOLCHAIN) -> str:
+    """The default toolchain builds in examples/build, the others in examples/build-<toolchain>."""
+    return "build" if toolchain == DEFAULT_TOOLCHAIN else f"build-{toolchain}"
+
+
+def toolchains() -> List[str]:
+    """The toolchain matrix (GEN_CODE_TOOLCHAINS, e.g. "gcc,clang"). The first one is the primary toolchain."""
+    names = [name.strip() for name in os.environ.get(TOOLCHAINS_ENV, DEFAULT_TOOLCHAIN).split(",") if name.strip()]
+    return names or [DEFAULT_TOOLCHAIN]
+
+
+def toolchain_available(source_dir: Path, toolchain: str) -> bool:
+    """True if the toolchain file exists and the C compiler it names is installed."""
+    toolchain_file = Path(source_dir) / "cmake" / f"{toolchain}.cmake"
+    try:
+        match = _TOOLCHAIN_COMPILER.search(toolchain_file.read_text(encoding="utf-8"))
+    except OSError:
+        return False
+    return match is None or shutil.which(match.group(1)) is not None
+
+
+# ビルドツリーごとのビルダー (最近使った順)。ワークスペースを使い終えたら release_builders() で外します
+_builders: "OrderedDict[Path, IncrementalBuilder]" = OrderedDict()
+_builders_lock = threading.Lock()
+# 解放されなかったワークスペースのビルダーも、これを超えた分は使われていない古いものから外します
+MAX_BUILDERS = 32
+
+
+def _evict_idle_builders(keep: Path) -> None:
+    """Drops the least recently used builders beyond MAX_BUILDERS that are not building. Called with the lock held."""
+    excess = len(_builders) - MAX_BUILDERS
+    idle = [d for d, builder in _builders.items() if d != keep and not builder.lock.locked()]
+    for build_dir in idle[:max(0, excess)]:
+        del _builders[build_dir]
+
+
+def get_builder(
+        source_dir: Optional[Path] = None,
+        toolchain: str = DEFAULT_TOOLCHAIN
+    ) -> IncrementalBuilder:
+    """Returns the process-wide builder owning the build tree of the given workspace."""
+    source_dir = Path(source_dir or ROOT_DIR / "examples").resolve()
+    build_dir = source_dir / build_dir_name(toolchain)
+    with _builders_lock:
+        builder = _builders.get(build_dir)
+        if builder is not None:
+            _builders.move_to_end(build_dir)
+    if builder is None:
+        # テストは examples/tests の構成時に GoogleTest を必要とするため、常にキャッシュ済みの gtest を渡します。
+        # 構成引数はビルダーの作成時に一度だけ決めます (gtest の解決結果はプロセス内でメモ化されています)
+        configure_args = (gtest_configure_args() + diagnostics_configure_args(toolchain)
+                          + build_scheduler.configure_args())
+        with _builders_lock:
+            builder = _builders.setdefault(
+                build_dir, IncrementalBuilder(source_dir, build_dir, toolchain=toolchain, configure_args=configure_args))
+            _evict_idle_builders(keep=build_dir)
+    return builder
+
+
+def release_builders(workspace: Path) -> int:
+    """Forgets the builders of every build tree inside a workspace the caller is done with. Returns how many."""
+    workspace = Path(workspace).resolve()
+    with _builders_lock:
+        released = [build_dir for build_dir in _builders if build_dir.is_relative_to(workspace)]
+        for build_dir in released:
+            del _builders[build_dir]
+    return len(released)
+
+
+def get_builders(source_dir: Optional[Path] = None) -> List[IncrementalBuilder]:
+    """
+    Returns one builder (and persistent build tree) per toolchain of the matrix, primary first.
+    Toolchains whose compiler is not installed are skipped with a warning; the primary one is always kept.
+    """
+    source_dir = Path(source_dir or ROOT_DIR / "examples").resolve()
+    names = toolchains()
+    builders = [get_builder(source_dir, names[0])]
+    for name in names[1:]:
+        if toolchain_available(source_dir, name):
+            builders.append(get_builder(source_dir, name))
+        else:
+            print(f"  [Build] Warning: skipping toolchain '{name}' (cmake/{name}.cmake or its compiler not found)")
+    return builders
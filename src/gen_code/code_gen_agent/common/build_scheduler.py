@@ -0,0 +1,303 @@
+"""
+Process-wide scheduler for build and test commands.
+
+Every configure, `cmake --build` and ctest command of every IncrementalBuilder in the process is
+submitted to `build_scheduler` as a job:
+
+- a global job-slot limit (GEN_CODE_BUILD_JOBS, default: the number of cores) implemented as a GNU make
+  jobserver. The slots are bytes in a FIFO: a job takes one slot before its command starts, and Ninja
+  (1.13+) reads the slots for its extra parallel compiles from MAKEFLAGS. Concurrent pipelines therefore
+  share the cores instead of each starting one compile per core. Without FIFOs (Windows) jobs are not limited.
+- a content-addressed object cache (common/object_cache.py) installed as the compiler launcher, keyed
+  on the preprocessed source, the code generation flags and the compiler. A source that another
+  workspace or an earlier iteration already compiled is copied instead of compiled.
+  GEN_CODE_OBJECT_CACHE=1 enables it; GEN_CODE_OBJECT_CACHE_MAX_MB (default 512) bounds its size.
+  It is off by default: the launcher starts a Python interpreter and the preprocessor for every compile,
+  which costs more than compiling the small C sources of examples/ (the --coverage test sources, the
+  only expensive compiles, cannot be cached).
+- metrics: jobs, slot waits (the last MAX_WAIT_SAMPLES jobs), and object cache hits/misses with the hit rate.
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+from gen_code.code_gen_agent.common.constants import CACHE_DIR
+from gen_code.code_gen_agent.common.disk_cache import DiskCache
+from gen_code.code_gen_agent.common.object_cache import OBJECT_CACHE_LOG_ENV, OBJECT_SUFFIX
+from gen_code.code_gen_agent.common.process import ProcessResult, OutputCallback, run_process
+from gen_code.code_gen_agent.common.telemetry import telemetry
+
+BUILD_JOBS_ENV = "GEN_CODE_BUILD_JOBS"
+OBJECT_CACHE_ENV = "GEN_CODE_OBJECT_CACHE"
+OBJECT_CACHE_MAX_MB_ENV = "GEN_CODE_OBJECT_CACHE_MAX_MB"
+OBJECT_CACHE_DIR = CACHE_DIR / "objects"
+
+_LAUNCHER = Path(__file__).resolve().with_name("object_cache.py")
+_TOKEN = b"+"
+# 待ち時間のパーセンタイルに使う直近のジョブ数
+MAX_WAIT_SAMPLES = 10_000
+
+
+class JobServer:
+    """GNU make style jobserver: a named FIFO holding one byte per free job slot."""
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.path = Path(tempfile.mkdtemp(prefix="gen_code_jobserver_")) / "fifo"
+        os.mkfifo(self.path)
+        # 読み書き両方で開くと、書き手がいなくても EOF になりません
+        self._fd = os.open(self.path, os.O_RDWR)
+        self._nonblocking_fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+        os.write(self._fd, _TOKEN * slots)
+
+    def makeflags(self) -> str:
+        return f"-j{self.slots} --jobserver-auth=fifo:{self.path}"
+
+    def acquire(self) -> bytes:
+        return os.read(self._fd, 1)
+
+    async def acquire_async(self) -> bytes:
+        loop = asyncio.get_running_loop()
+        # add_reader は fd ごとに 1 つなので、待機ごとに fd を複製します
+        fd = os.dup(self._nonblocking_fd)
+        try:
+            while True:
+                try:
+                    return os.read(fd, 1)
+                except BlockingIOError:
+                    pass
+                readable = loop.create_future()
+                loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+                try:
+                    await readable
+                finally:
+                    loop.remove_reader(fd)
+        finally:
+            os.close(fd)
+
+    def release(self, token: bytes) -> None:
+        os.write(self._fd, token)
+
+    def refill(self) -> None:
+        """Restores all slots. Only safe while no job runs (a killed Ninja does not return its slots)."""
+        while True:
+            try:
+                if not os.read(self._nonblocking_fd, 4096):
+                    break
+            except BlockingIOError:
+                break
+        os.write(self._fd, _TOKEN * self.slots)
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p / 100))], 3) if values else 0.0
+
+
+class BuildScheduler:
+    """Runs build/test commands within the global job slots and tracks the object cache. Thread-safe."""
+
+    def __init__(
+            self,
+            jobs: Optional[int] = None,
+            object_cache: bool = False,
+            object_cache_max_bytes: int = 512 * 1024 * 1024
+        ):
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.object_cache = DiskCache(OBJECT_CACHE_DIR, object_cache_max_bytes, enabled=object_cache, suffix=OBJECT_SUFFIX)
+        self._jobserver: Optional[JobServer] = None
+        self._lock = threading.Lock()
+        # スロットを待っているジョブも含めた数。0 のときだけスロットを補充できます
+        self._users = 0
+        self._running = 0
+        self._metrics: Dict[str, Any] = {}
+        self.reset_metrics()
+
+    def configure(self, jobs: Optional[int] = None, object_cache: Optional[bool] = None) -> None:
+        """Changes the slot count (None: number of cores) and switches the object cache. Only while no job runs."""
+        with self._lock:
+            if self._users:
+                raise RuntimeError("Cannot reconfigure the build scheduler while jobs are running")
+            self.jobs = max(1, jobs or os.cpu_count() or 1)
+            if object_cache is not None:
+                self.object_cache.enabled = object_cache
+            # 次のジョブでスロット数の新しいジョブサーバーを作ります
+            self._jobserver = None
+
+    def reset_metrics(self) -> None:
+        self._metrics = {"jobs": 0, "max_running": 0, "waits_ms": deque(maxlen=MAX_WAIT_SAMPLES),
+                         "object_hits": 0, "object_misses": 0, "uncacheable": 0}
+
+    def configure_args(self) -> List[str]:
+        """CMake arguments that run every compile through the object cache."""
+        if not self.object_cache.enabled:
+            return []
+        launcher = ";".join([sys.executable, "-S", str(_LAUNCHER), str(self.object_cache.directory)])
+        return ["-D", f"CMAKE_C_COMPILER_LAUNCHER={launcher}", "-D", f"CMAKE_CXX_COMPILER_LAUNCHER={launcher}"]
+
+    # ------------------------------------------------------------------
+    # Job slots
+    # ------------------------------------------------------------------
+    def _server(self) -> Optional[JobServer]:
+        if self._jobserver is None and hasattr(os, "mkfifo"):
+            self._jobserver = JobServer(self.jobs)
+        return self._jobserver
+
+    def _enter(self) -> Optional[JobServer]:
+        with self._lock:
+            self._users += 1
+            return self._server()
+
+    def _started(self, waited: float) -> None:
+        with self._lock:
+            self._running += 1
+            self._metrics["jobs"] += 1
+            self._metrics["max_running"] = max(self._metrics["max_running"], self._running)
+            self._metrics["waits_ms"].append(waited * 1000)
+
+    def _leave(self, server: Optional[JobServer], token: Optional[bytes], started: bool) -> None:
+        with self._lock:
+            if token is not None:
+                server.release(token)
+            if started:
+                self._running -= 1
+            self._users -= 1
+            if self._users == 0 and server is not None:
+                server.refill()
+
+    def _environment(self, server: Optional[JobServer], log: Path, env: Optional[Mapping[str, str]]) -> Dict[str, str]:
+        environment = dict(env or {})
+        if server is not None:
+            environment["MAKEFLAGS"] = server.makeflags()
+        environment[OBJECT_CACHE_LOG_ENV] = str(log)
+        return environment
+
+    def _account(self, log: Path, span: Dict[str, Any]) -> None:
+        try:
+            outcomes = log.read_text(encoding="ascii").split()
+        except OSError:
+            outcomes = []
+        finally:
+            log.unlink(missing_ok=True)
+        hits, misses, skipped = outcomes.count("hit"), outcomes.count("miss"), outcomes.count("skip")
+        with self._lock:
+            self._metrics["object_hits"] += hits
+            self._metrics["object_misses"] += misses
+            self._metrics["uncacheable"] += skipped
+        span.update(object_hits=hits, object_misses=misses)
+        if hits or misses:
+            print(f"  [BuildScheduler] Object cache: {hits} hit(s), {misses} miss(es), {skipped} uncacheable")
+        if misses:
+            self.object_cache.evict()
+
+    def _log_path(self) -> Path:
+        fd, name = tempfile.mkstemp(prefix="gen_code_objects_", suffix=".log")
+        os.close(fd)
+        return Path(name)
+
+    # ------------------------------------------------------------------
+    # Submission
+    # ------------------------------------------------------------------
+    def submit(self, command: Sequence[str], cwd: Path, env: Optional[Mapping[str, str]] = None) -> subprocess.CompletedProcess:
+        """
+        Runs a command in one job slot, blocking until a slot is free.
+        Not for event loop threads: blocking there keeps the loop's async jobs from returning their slots,
+        so coroutines use submit_async() (or call this through asyncio.to_thread).
+        """
+        if _in_event_loop():
+            raise RuntimeError("BuildScheduler.submit() blocks the event loop; use submit_async() or asyncio.to_thread()")
+        server = self._enter()
+        token = None
+        started = False
+        log = self._log_path()
+        try:
+            with telemetry.span("build_job", "build", "", command=command[0]) as span:
+                waited = time.monotonic()
+                if server is not None:
+                    token = server.acquire()
+                self._started(time.monotonic() - waited)
+                started = True
+                process = subprocess.run(
+                    list(command), cwd=str(cwd), capture_output=True, text=True, check=False,
+                    env={**os.environ, **self._environment(server, log, env)}
+                )
+                self._account(log, span)
+            return process
+        finally:
+            self._leave(server, token, started)
+
+    async def submit_async(
+            self,
+            command: Sequence[str],
+            cwd: Path,
+            timeout: Optional[float] = None,
+            on_output: Optional[OutputCallback] = None,
+            env: Optional[Mapping[str, str]] = None
+        ) -> ProcessResult:
+        """Same as submit() without blocking the event loop. The slot wait counts against the timeout."""
+        server = self._enter()
+        token = None
+        started = False
+        log = self._log_path()
+        try:
+            with telemetry.span("build_job", "build", "", command=command[0]) as span:
+                waited = time.monotonic()
+                if server is not None:
+                    try:
+                        token = await asyncio.wait_for(server.acquire_async(), timeout)
+                    except asyncio.TimeoutError:
+                        log.unlink(missing_ok=True)
+                        return ProcessResult(returncode=-1, stdout="", stderr="No free build job slot before the timeout\n",
+                                             timed_out=True)
+                waited = time.monotonic() - waited
+                self._started(waited)
+                started = True
+                remaining = None if timeout is None else max(timeout - waited, 0.0)
+                process = await run_process(command, cwd, timeout=remaining, on_output=on_output,
+                                            env=self._environment(server, log, env))
+                self._account(log, span)
+            return process
+        finally:
+            self._leave(server, token, started)
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+    def metrics(self) -> Dict[str, Any]:
+        hits, misses = self._metrics["object_hits"], self._metrics["object_misses"]
+        with self._lock:
+            waits = list(self._metrics["waits_ms"])
+        return {
+            "jobs": self._metrics["jobs"],
+            "job_slots": self.jobs,
+            "max_running": self._metrics["max_running"],
+            "slot_wait_ms.p50": _percentile(waits, 50),
+            "slot_wait_ms.p95": _percentile(waits, 95),
+            "object_hits": hits,
+            "object_misses": misses,
+            "uncacheable_compiles": self._metrics["uncacheable"],
+            "object_hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+        }
+
+
+# プロセス全体で共有するスケジューラー。スロット数は GEN_CODE_BUILD_JOBS で設定します。
+build_scheduler = BuildScheduler(
+    jobs=int(os.environ.get(BUILD_JOBS_ENV, "0")) or None,
+    object_cache=os.environ.get(OBJECT_CACHE_ENV, "0") == "1",
+    object_cache_max_bytes=int(os.environ.get(OBJECT_CACHE_MAX_MB_ENV, "512")) * 1024 * 1024,
+)
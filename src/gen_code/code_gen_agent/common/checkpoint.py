@@ -0,0 +1,310 @@
+"""
+Checkpoint and resume of the pipeline at sub-agent granularity.
+
+The pipeline and its loops are `ResumableSequentialAgent` / `ResumableLoopAgent` (and
+`ConvergentLoopAgent`, see common/convergence.py). Each of them reports its position (sub-agent index,
+loop iteration) to the process-wide `checkpointer`. When checkpointing is enabled
+(GEN_CODE_CHECKPOINT_DIR or `batch --checkpoint-dir`), the checkpointer writes a checkpoint after
+every sub-agent completes:
+
+    <checkpoint dir>/<session id>/checkpoint.json   position, session state and the source file hashes
+    <checkpoint dir>/<session id>/events.jsonl      session events (the conversation the LLM agents see)
+    <checkpoint dir>/<session id>/files/<sha256>    content-addressed copy of examples/src and examples/tests
+
+`restore_session` recreates the session from a checkpoint and arms the position, so the next run of
+the pipeline on that session starts at the sub-agent (and loop iteration) after the last completed one.
+Before resuming, the sources in the workspace are compared with the checkpointed hashes; a mismatch
+raises `CheckpointMismatchError` unless the checkpointed files are restored.
+
+Usage:
+    python -m gen_code.code_gen_agent.batch --resume .checkpoints/door_lock-1a2b3c4d
+"""
+import os
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from google.adk.agents import LoopAgent, SequentialAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.state import State
+from typing_extensions import override
+
+from gen_code.code_gen_agent.common.patch import write_files_atomically
+from gen_code.code_gen_agent.common.workspace import create_workspace, resolve_root
+
+CHECKPOINT_DIR_ENV = "GEN_CODE_CHECKPOINT_DIR"
+CHECKPOINT_VERSION = 1
+CHECKPOINT_FILE = "checkpoint.json"
+EVENTS_FILE = "events.jsonl"
+FILES_DIR = "files"
+# チェックポイントに含めるワークスペース内のディレクトリ (生成物を含む)
+SOURCE_DIRS = ("examples/src", "examples/tests")
+
+
+class CheckpointMismatchError(ValueError):
+    """The sources in the workspace no longer match the checkpoint."""
+
+    def __init__(self, message: str, mismatched: List[str]):
+        super().__init__(message)
+        self.mismatched = mismatched
+
+
+def _is_ignored(relative: Path) -> bool:
+    return any(part == "build" or part.startswith("build-") for part in relative.parts)
+
+
+def hash_sources(root: Path) -> Dict[str, str]:
+    """sha256 of every file under SOURCE_DIRS of a workspace, keyed by its path relative to the workspace root."""
+    hashes: Dict[str, str] = {}
+    for directory in SOURCE_DIRS:
+        base = root / directory
+        if not base.is_dir():
+            continue
+        for path in sorted(base.rglob("*")):
+            relative = path.relative_to(root)
+            if path.is_file() and not _is_ignored(relative):
+                hashes[relative.as_posix()] = hashlib.sha256(path.read_bytes()).hexdigest()
+    return hashes
+
+
+def _mismatched_files(expected: Dict[str, str], actual: Dict[str, str]) -> List[str]:
+    return sorted(name for name in set(expected) | set(actual) if expected.get(name) != actual.get(name))
+
+
+def _describe(position: Dict[str, Dict[str, Any]]) -> str:
+    parts = []
+    for name, cursor in position.items():
+        if "iteration" in cursor:
+            parts.append(f"{name} iteration {cursor['iteration']} step {cursor.get('index', 0)}")
+        else:
+            parts.append(f"{name} step {cursor.get('index', 0)}")
+    return " > ".join(parts) or "the beginning"
+
+
+class Checkpointer:
+    """
+    Tracks the position of the resumable agents per session and writes checkpoints when `root` is set.
+    Without a root only the in-memory position is kept, so the agents behave exactly like
+    SequentialAgent/LoopAgent.
+    """
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = Path(root) if root else None
+        # セッションごとの位置 {コンテナ名: {"index": ..., "iteration": ...}} (外側のコンテナが先)
+        self._positions: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # restore_session で設定された再開位置。各コンテナが最初に一度だけ取り出します。
+        self._armed: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # セッションごとに events.jsonl へ書き込み済みのイベント数
+        self._written_events: Dict[str, int] = {}
+
+    def resume_point(self, ctx: InvocationContext, agent_name: str) -> Optional[Dict[str, Any]]:
+        """Returns (and consumes) the armed position of a container for this session, if any."""
+        armed = self._armed.get(ctx.session.id)
+        if not armed or agent_name not in armed:
+            return None
+        cursor = armed.pop(agent_name)
+        if not armed:
+            del self._armed[ctx.session.id]
+        self._positions.setdefault(ctx.session.id, {})[agent_name] = cursor
+        return cursor
+
+    def update(self, ctx: InvocationContext, agent_name: str, cursor: Optional[Dict[str, Any]]) -> None:
+        """
+        Records the position of a container; None removes it (the container finished).
+        When the outermost container finishes, everything kept for the session is forgotten.
+        """
+        positions = self._positions.setdefault(ctx.session.id, {})
+        if cursor is None:
+            positions.pop(agent_name, None)
+            if not positions:
+                self.forget(ctx.session.id)
+        else:
+            positions[agent_name] = cursor
+
+    def forget(self, session_id: str) -> None:
+        """Drops the in-memory position and event count of a session that finished, failed or was deleted."""
+        self._positions.pop(session_id, None)
+        self._armed.pop(session_id, None)
+        self._written_events.pop(session_id, None)
+
+    async def save(self, ctx: InvocationContext, agent_name: str, cursor: Optional[Dict[str, Any]]) -> None:
+        """Records the position after a completed sub-agent and writes the checkpoint."""
+        self.update(ctx, agent_name, cursor)
+        if self.root is None:
+            return
+        session = ctx.session
+        position = json.loads(json.dumps(self._positions.get(session.id, {}), default=str))
+        state = {k: v for k, v in session.state.items() if not k.startswith(State.TEMP_PREFIX)}
+        written = self._written_events.get(session.id)
+        if written is None:
+            # 同じセッションの次の実行では、既に書き込んだイベントをチェックポイントから数えます
+            written = await asyncio.to_thread(self._events_on_disk, session.id)
+        events = [event for event in session.events[written:] if not event.partial]
+        self._written_events[session.id] = written + len(events)
+        await asyncio.to_thread(self._write, session, position, state, events, written + len(events))
+
+    def _events_on_disk(self, session_id: str) -> int:
+        try:
+            return json.loads((self.root / session_id / CHECKPOINT_FILE).read_text(encoding="utf-8"))["events"]
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _write(self, session: Session, position: Dict[str, Any], state: Dict[str, Any], events: List[Event], event_count: int) -> None:
+        directory = self.root / session.id
+        (directory / FILES_DIR).mkdir(parents=True, exist_ok=True)
+        workspace = resolve_root(state)
+        files = hash_sources(workspace)
+        for name, digest in files.items():
+            snapshot = directory / FILES_DIR / digest
+            if not snapshot.exists():
+                shutil.copyfile(workspace / name, snapshot)
+        if events:
+            with open(directory / EVENTS_FILE, "a", encoding="utf-8") as f:
+                for event in events:
+                    f.write(event.model_dump_json(exclude_none=True) + "\n")
+        checkpoint = {
+            "version": CHECKPOINT_VERSION,
+            "app_name": session.app_name,
+            "user_id": session.user_id,
+            "session_id": session.id,
+            "saved_at": time.time(),
+            "position": position,
+            "state": state,
+            "events": event_count,
+            "workspace": str(workspace),
+            "files": files,
+        }
+        write_files_atomically({directory / CHECKPOINT_FILE: json.dumps(checkpoint, indent=2, ensure_ascii=False, default=str)})
+        print(f"[Checkpoint] Saved '{session.id}' at {_describe(position)}")
+
+    def arm(self, session_id: str, position: Dict[str, Dict[str, Any]], written_events: int) -> None:
+        self._armed[session_id] = dict(position)
+        self._written_events[session_id] = written_events
+
+
+def load_checkpoint(checkpoint_dir: Path) -> Dict[str, Any]:
+    path = Path(checkpoint_dir) / CHECKPOINT_FILE
+    if not path.is_file():
+        raise FileNotFoundError(f"No checkpoint at {path}")
+    checkpoint = json.loads(path.read_text(encoding="utf-8"))
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {checkpoint.get('version')} in {path}")
+    return checkpoint
+
+
+def restore_files(checkpoint_dir: Path, checkpoint: Dict[str, Any]) -> None:
+    """Rewrites the workspace sources from the checkpoint's file copies (recreating the workspace if needed)."""
+    workspace = Path(checkpoint["workspace"])
+    if not (workspace / "examples").is_dir():
+        create_workspace(workspace)
+    expected: Dict[str, str] = checkpoint["files"]
+    for name in _mismatched_files(expected, hash_sources(workspace)):
+        if name not in expected:
+            (workspace / name).unlink()
+    write_files_atomically({
+        workspace / name: (Path(checkpoint_dir) / FILES_DIR / digest).read_text(encoding="utf-8")
+        for name, digest in expected.items()
+    })
+
+
+def verify_sources(checkpoint: Dict[str, Any]) -> None:
+    """Raises CheckpointMismatchError when the workspace sources differ from the checkpoint."""
+    mismatched = _mismatched_files(checkpoint["files"], hash_sources(Path(checkpoint["workspace"])))
+    if mismatched:
+        raise CheckpointMismatchError(
+            f"{len(mismatched)} source file(s) in {checkpoint['workspace']} differ from the checkpoint: "
+            f"{', '.join(mismatched[:5])}", mismatched)
+
+
+async def restore_session(
+        session_service: BaseSessionService,
+        checkpoint_dir: Path,
+        restore: bool = False,
+        recorder: Optional[Checkpointer] = None
+    ) -> Session:
+    """
+    Recreates the checkpointed session (state and events) in `session_service` and arms its position.
+    The workspace sources must match the checkpoint; with `restore` they are rewritten from it instead.
+    """
+    recorder = recorder or checkpointer
+    checkpoint_dir = Path(checkpoint_dir)
+    checkpoint = load_checkpoint(checkpoint_dir)
+    if restore:
+        await asyncio.to_thread(restore_files, checkpoint_dir, checkpoint)
+    await asyncio.to_thread(verify_sources, checkpoint)
+
+    app_name, user_id, session_id = checkpoint["app_name"], checkpoint["user_id"], checkpoint["session_id"]
+    if await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id):
+        await session_service.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+    session = await session_service.create_session(
+        app_name=app_name, user_id=user_id, session_id=session_id, state=checkpoint["state"])
+
+    # チェックポイント以降に書かれたイベントは捨てます
+    lines = (checkpoint_dir / EVENTS_FILE).read_text(encoding="utf-8").splitlines() if (checkpoint_dir / EVENTS_FILE).exists() else []
+    lines = lines[:checkpoint["events"]]
+    write_files_atomically({checkpoint_dir / EVENTS_FILE: "".join(line + "\n" for line in lines)})
+    for line in lines:
+        event = Event.model_validate_json(line)
+        # state はチェックポイントの値が最新なので、古い state_delta は再適用しません
+        event.actions.state_delta = {}
+        await session_service.append_event(session=session, event=event)
+
+    recorder.arm(session_id, checkpoint["position"], len(lines))
+    print(f"[Checkpoint] Restored '{session_id}' ({len(lines)} event(s)); resuming at {_describe(checkpoint['position'])}")
+    return session
+
+
+class ResumableSequentialAgent(SequentialAgent):
+    """SequentialAgent that checkpoints after each sub-agent and can start at a checkpointed one."""
+
+    @override
+    async def _run_async_impl(
+            self, ctx: InvocationContext
+        ) -> AsyncGenerator[Event, None]:
+        resume = checkpointer.resume_point(ctx, self.name) or {}
+        for index in range(resume.get("index", 0), len(self.sub_agents)):
+            checkpointer.update(ctx, self.name, {"index": index})
+            async for event in self.sub_agents[index].run_async(ctx):
+                yield event
+            await checkpointer.save(ctx, self.name, {"index": index + 1})
+        checkpointer.update(ctx, self.name, None)
+
+
+class ResumableLoopAgent(LoopAgent):
+    """LoopAgent that checkpoints after each sub-agent and can start at a checkpointed iteration and step."""
+
+    @override
+    async def _run_async_impl(
+            self, ctx: InvocationContext
+        ) -> AsyncGenerator[Event, None]:
+        resume = checkpointer.resume_point(ctx, self.name) or {}
+        times_looped = resume.get("iteration", 1) - 1
+        start_index = resume.get("index", 0)
+        while not self.max_iterations or times_looped < self.max_iterations:
+            for index in range(start_index, len(self.sub_agents)):
+                checkpointer.update(ctx, self.name, {"iteration": times_looped + 1, "index": index})
+                escalated = False
+                async for event in self.sub_agents[index].run_async(ctx):
+                    yield event
+                    if event.actions.escalate:
+                        escalated = True
+                        break
+                if escalated:
+                    checkpointer.update(ctx, self.name, None)
+                    return
+                next_step = {"iteration": times_looped + 1, "index": index + 1} if index + 1 < len(self.sub_agents) \
+                    else {"iteration": times_looped + 2, "index": 0}
+                await checkpointer.save(ctx, self.name, next_step)
+            start_index = 0
+            times_looped += 1
+        checkpointer.update(ctx, self.name, None)
+
+
+# プロセス全体で共有するチェックポインター。GEN_CODE_CHECKPOINT_DIR で書き込みが有効になります。
+checkpointer = Checkpointer(root=Path(os.environ[CHECKPOINT_DIR_ENV]) if os.environ.get(CHECKPOINT_DIR_ENV) else None)
@@ -0,0 +1,168 @@
+import re
+import json
+import hashlib
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from google.adk.agents import BaseAgent, LoopAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from typing_extensions import override
+
+from gen_code.code_gen_agent.common.checkpoint import checkpointer
+
+# レビュアーが指摘なしの場合に出力する定型文 (code_reviewer_agent/prompt.py)
+NO_ISSUES_VERDICT = "No major issues found."
+
+VERDICT_NO_ISSUES = "no_issues"
+VERDICT_ISSUES = "issues"
+VERDICT_UNKNOWN = "unknown"
+
+EXIT_BUILD_SUCCEEDED = "build_succeeded"
+EXIT_CODE_UNCHANGED = "refactored_code_unchanged"
+EXIT_MAX_ITERATIONS = "max_iterations"
+
+
+def parse_review_verdict(review: Any) -> str:
+    """Classifies the reviewer output as 'no_issues', 'issues' or 'unknown' (empty/missing)."""
+    if not isinstance(review, str) or not review.strip():
+        return VERDICT_UNKNOWN
+    text = re.sub(r"[`*\s]+", " ", review).strip().lower()
+    # 定型文だけ (前後の装飾や句読点の揺れは許容) の場合のみ「指摘なし」とみなします
+    if NO_ISSUES_VERDICT.lower().rstrip(".") in text and len(text) <= len(NO_ISSUES_VERDICT) + 20:
+        return VERDICT_NO_ISSUES
+    return VERDICT_ISSUES
+
+
+def code_hash(output: Any) -> Optional[str]:
+    """
+    Content hash of a header/source pair produced by the writer or refactorer.
+    The JSON values are hashed with trailing whitespace normalized, so re-serialization or
+    formatting noise in the model output does not count as a change.
+    """
+    if not isinstance(output, str) or not output.strip():
+        return None
+    text = re.sub(r"^```[a-zA-Z]*\s*|\s*```$", "", output.strip())
+    try:
+        data = json.loads(text)
+        parts = [data[key] for key in sorted(data) if isinstance(data[key], str)] if isinstance(data, dict) else [text]
+    except ValueError:
+        parts = [text]
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update("\n".join(line.rstrip() for line in part.strip().splitlines()).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ConvergentLoopAgent(LoopAgent):
+    """
+    LoopAgent for the review -> refactor -> build cycle that stops as soon as the output is stable.
+
+    On top of LoopAgent's escalation/max_iterations exit it
+    - skips the reviewer when the code under review is unchanged and its last verdict was
+      "No major issues found." (the previous review_comments stay in state),
+    - stops without building when the refactored header/source pair hashes the same as in the
+      previous iteration, since the build would fail exactly as it did before,
+    - skips the build when the refactorer's patch could not be applied (see common/patch.py).
+    The exit reason and one history entry per iteration are written to state.
+    """
+
+    review_agent_name: str = "CodeReviewerAgent"
+    review_key: str = "review_comments"
+    review_input_key: str = "generated_code"
+    refactor_agent_name: str = "CodeRefactorerAgent"
+    refactor_key: str = "refactored_code"
+    build_agent_name: str = "CodeBuilderAgent"
+    build_key: str = "build_result"
+    patch_status_key: str = "refactor_patch_status"
+    exit_reason_key: str = "refinement_exit_reason"
+    history_key: str = "refinement_history"
+
+    def _state_event(self, ctx: InvocationContext, state_delta: Dict[str, Any]) -> Event:
+        return Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta=state_delta),
+        )
+
+    def _skip_reason(self, sub_agent: BaseAgent, state: Dict[str, Any], history: List[Dict[str, Any]]) -> Optional[str]:
+        if sub_agent.name == self.build_agent_name:
+            # パッチが競合した反復では新しいコードがないため、ビルドしても前回のファイルを検証するだけです
+            patch_status = state.get(self.patch_status_key)
+            if isinstance(patch_status, dict) and patch_status.get("status") == "conflict":
+                return "the refactorer's patch could not be applied"
+            return None
+        if sub_agent.name != self.review_agent_name or not history:
+            return None
+        previous = history[-1]
+        if previous.get("review_verdict") == VERDICT_NO_ISSUES and \
+                previous.get("review_input_hash") == code_hash(state.get(self.review_input_key)):
+            return "code under review unchanged and last verdict was 'No major issues found.'"
+        return None
+
+    @override
+    async def _run_async_impl(
+            self, ctx: InvocationContext
+        ) -> AsyncGenerator[Event, None]:
+        # チェックポイントから再開する場合は、途中の反復の履歴と記録から続けます
+        resume = checkpointer.resume_point(ctx, self.name) or {}
+        history: List[Dict[str, Any]] = list(resume.get("history", []))
+        iteration = resume.get("iteration", 1) - 1
+        start_index = resume.get("index", 0)
+        while not self.max_iterations or iteration < self.max_iterations:
+            iteration += 1
+            state = ctx.session.state
+            entry: Dict[str, Any] = (resume.get("entry") if start_index else None) or {"iteration": iteration, "skipped": []}
+            exit_reason: Optional[str] = None
+
+            for index in range(start_index, len(self.sub_agents)):
+                sub_agent = self.sub_agents[index]
+                checkpointer.update(ctx, self.name, {"iteration": iteration, "index": index, "entry": entry, "history": history})
+                skip_reason = self._skip_reason(sub_agent, state, history)
+                if skip_reason:
+                    print(f"[Convergence] {self.name} iteration {iteration}: skipping {sub_agent.name} ({skip_reason})")
+                    entry["skipped"].append(sub_agent.name)
+                    if sub_agent.name == self.review_agent_name:
+                        entry["review_verdict"] = history[-1].get("review_verdict")
+                        entry["review_input_hash"] = history[-1].get("review_input_hash")
+                    continue
+
+                escalated = False
+                async for event in sub_agent.run_async(ctx):
+                    yield event
+                    if event.actions.escalate:
+                        escalated = True
+                        break
+
+                if sub_agent.name == self.review_agent_name:
+                    entry["review_verdict"] = parse_review_verdict(state.get(self.review_key))
+                    entry["review_input_hash"] = code_hash(state.get(self.review_input_key))
+                elif sub_agent.name == self.refactor_agent_name:
+                    entry["code_hash"] = code_hash(state.get(self.refactor_key))
+
+                if escalated:
+                    exit_reason = EXIT_BUILD_SUCCEEDED
+                    break
+                if sub_agent.name == self.refactor_agent_name and history and \
+                        entry["code_hash"] and entry["code_hash"] == history[-1].get("code_hash"):
+                    exit_reason = EXIT_CODE_UNCHANGED
+                    break
+                await checkpointer.save(ctx, self.name, {"iteration": iteration, "index": index + 1, "entry": entry, "history": history})
+
+            build_result = state.get(self.build_key)
+            entry["build_status"] = build_result.get("status") if isinstance(build_result, dict) else None
+            history.append(entry)
+            if exit_reason is None and self.max_iterations and iteration >= self.max_iterations:
+                exit_reason = EXIT_MAX_ITERATIONS
+            delta: Dict[str, Any] = {self.history_key: list(history)}
+            if exit_reason:
+                delta[self.exit_reason_key] = exit_reason
+                print(f"[Convergence] {self.name} stopped after iteration {iteration}: {exit_reason}")
+            yield self._state_event(ctx, delta)
+            start_index = 0
+            if exit_reason:
+                checkpointer.update(ctx, self.name, None)
+                return
+            await checkpointer.save(ctx, self.name, {"iteration": iteration + 1, "index": 0, "history": history})
+        checkpointer.update(ctx, self.name, None)
@@ -0,0 +1,224 @@
+"""
+Coverage of the unit tests, read from the gcov data of the --coverage instrumented test executable.
+
+IncrementalBuilder.ctest_command deletes the .gcda files before every ctest run: gcov merges new counts into
+files whose checksum still matches (e.g. when only the test .cpp changed), so the counters of earlier test
+versions would otherwise count toward the thresholds.
+After the tests ran, `collect_coverage(builder)` runs `gcov --json-format --stdout` on the .gcda files of
+TEST_TARGET and reduces them to a compact map of what the tests did not reach:
+
+    {"status": "success", "line_percent": 87.5, "branch_percent": 75.0,
+     "lines": [35, 40], "branches": [18, 24],
+     "uncovered": {"src/body_app/doorlock_control.c": {
+         "update_door_lock_state": {"lines": [61, 62, 63], "branches": {"58": "1/2"}, "called": true}}}}
+
+Only functions with gaps are listed. The test writer gets the gaps (`coverage_targets`) to write tests for
+just those regions, and the test refinement loop keeps iterating until GEN_CODE_COVERAGE_THRESHOLD (line %)
+and GEN_CODE_BRANCH_COVERAGE_THRESHOLD (branch %) are met. Both default to 0, which stops at the first
+green test run as before. GEN_CODE_GCOV selects the gcov binary (e.g. "llvm-cov gcov" for clang builds).
+"""
+import os
+import re
+import json
+import shlex
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from gen_code.code_gen_agent.common.build_engine import IncrementalBuilder, TEST_TARGET
+
+COVERAGE_THRESHOLD_ENV = "GEN_CODE_COVERAGE_THRESHOLD"
+BRANCH_COVERAGE_THRESHOLD_ENV = "GEN_CODE_BRANCH_COVERAGE_THRESHOLD"
+GCOV_ENV = "GEN_CODE_GCOV"
+
+COVERAGE_STATE_KEY = "test_coverage"
+COVERAGE_TARGETS_STATE_KEY = "coverage_targets"
+
+# プロンプトに載せる未カバー行のソースの上限
+MAX_SOURCE_LINES = 40
+_TEST_NAME = re.compile(r"^\s*TEST(?:_F|_P)?\s*\(\s*(\w+)\s*,\s*(\w+)\s*\)", re.MULTILINE)
+
+
+def coverage_thresholds() -> Tuple[float, float]:
+    """(line %, branch %) the tests must reach before the test refinement loop stops."""
+    return (float(os.environ.get(COVERAGE_THRESHOLD_ENV, "0")),
+            float(os.environ.get(BRANCH_COVERAGE_THRESHOLD_ENV, "0")))
+
+
+def gcov_command() -> List[str]:
+    return shlex.split(os.environ.get(GCOV_ENV, "gcov"))
+
+
+def gcda_files(builder: IncrementalBuilder, target: str = TEST_TARGET) -> List[Path]:
+    object_dir = builder.build_dir / "tests" / "CMakeFiles" / f"{target}.dir"
+    return sorted(object_dir.rglob("*.gcda")) if object_dir.is_dir() else []
+
+
+def _counters_are_stale(builder: IncrementalBuilder, gcda: List[Path], target: str) -> bool:
+    # テスト結果がキャッシュから返された場合、カウンタはこのツリーで最後に実行した別の内容のものです
+    newest_counter = max(p.stat().st_mtime for p in gcda)
+    for target_dir in builder.target_dirs.get(target, ()):
+        for path in (builder.source_dir / target_dir).rglob("*"):
+            if path.is_file() and path.stat().st_mtime > newest_counter:
+                return True
+    return False
+
+
+def _percent(covered: int, total: int) -> float:
+    return round(100.0 * covered / total, 1) if total else 100.0
+
+
+def _function_at(functions: List[Dict[str, Any]], line_number: int) -> Optional[Dict[str, Any]]:
+    for function in functions:
+        if function["start_line"] <= line_number <= function["end_line"]:
+            return function
+    return None
+
+
+def parse_gcov_json(
+        documents: Iterable[Dict[str, Any]],
+        source_dir: Path,
+        sources: Optional[Sequence[str]] = None
+    ) -> Dict[str, Any]:
+    """
+    Reduces gcov JSON documents to the compact coverage map of the sources under source_dir/src
+    (or only of `sources`, paths relative to source_dir).
+    """
+    source_root = (source_dir / "src").resolve()
+    lines_total = lines_covered = branches_total = branches_covered = 0
+    uncovered: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for document in documents:
+        base = Path(document.get("current_working_directory") or source_dir)
+        for file_entry in document.get("files", []):
+            path = (base / file_entry["file"]).resolve()
+            if source_root not in path.parents:
+                # テストコード自身やヘッダーライブラリ (gtest) は対象外です
+                continue
+            relative = path.relative_to(source_dir.resolve()).as_posix()
+            if sources is not None and relative not in sources:
+                continue
+            functions = file_entry.get("functions", [])
+            gaps: Dict[str, Dict[str, Any]] = {}
+            for line in file_entry.get("lines", []):
+                function = _function_at(functions, line["line_number"])
+                name = line.get("function_name") or (function["name"] if function else "<file scope>")
+                lines_total += 1
+                if line["count"] > 0:
+                    lines_covered += 1
+                else:
+                    gaps.setdefault(name, {"lines": [], "branches": {}})["lines"].append(line["line_number"])
+                branches = [b for b in line.get("branches", []) if not b.get("throw")]
+                taken = sum(1 for b in branches if b["count"] > 0)
+                branches_total += len(branches)
+                branches_covered += taken
+                if taken < len(branches):
+                    gaps.setdefault(name, {"lines": [], "branches": {}})["branches"][str(line["line_number"])] = f"{taken}/{len(branches)}"
+            for function in functions:
+                if function["name"] in gaps:
+                    gaps[function["name"]]["called"] = function["execution_count"] > 0
+            if gaps:
+                uncovered.setdefault(relative, {}).update(gaps)
+    return {
+        "status": "success",
+        "line_percent": _percent(lines_covered, lines_total),
+        "branch_percent": _percent(branches_covered, branches_total),
+        "lines": [lines_covered, lines_total],
+        "branches": [branches_covered, branches_total],
+        "uncovered": uncovered,
+    }
+
+
+def collect_coverage(
+        builder: IncrementalBuilder,
+        target: str = TEST_TARGET,
+        sources: Optional[Sequence[str]] = None
+    ) -> Dict[str, Any]:
+    """
+    Runs gcov on the counters of the last test run and returns the compact coverage map.
+    Returns {"status": "unavailable", "reason": ...} when there are no counters or gcov cannot read them.
+    """
+    gcda = gcda_files(builder, target)
+    if not gcda:
+        return {"status": "unavailable", "reason": f"no .gcda files for {target} (tests did not run?)"}
+    if _counters_are_stale(builder, gcda, target):
+        return {"status": "unavailable", "reason": "the .gcda files are older than the sources (cached test result)"}
+    try:
+        process = subprocess.run(
+            gcov_command() + ["--json-format", "--stdout", "--branch-probabilities", *map(str, gcda)],
+            cwd=builder.build_dir / "tests", capture_output=True, text=True, timeout=120,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return {"status": "unavailable", "reason": f"gcov failed: {e}"}
+    documents = []
+    for line in process.stdout.splitlines():
+        line = line.strip()
+        if line.startswith("{"):
+            try:
+                documents.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    if not documents:
+        reason = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "no gcov output"
+        return {"status": "unavailable", "reason": reason}
+    return parse_gcov_json(documents, builder.source_dir, sources)
+
+
+def threshold_met(coverage: Dict[str, Any], thresholds: Optional[Tuple[float, float]] = None) -> bool:
+    line_threshold, branch_threshold = thresholds or coverage_thresholds()
+    return coverage.get("line_percent", 0.0) >= line_threshold and coverage.get("branch_percent", 0.0) >= branch_threshold
+
+
+def _ranges(numbers: List[int]) -> str:
+    spans: List[List[int]] = []
+    for number in sorted(set(numbers)):
+        if spans and spans[-1][1] + 1 == number:
+            spans[-1][1] = number
+        else:
+            spans.append([number, number])
+    return ", ".join(str(first) if first == last else f"{first}-{last}" for first, last in spans)
+
+
+def existing_test_names(test_file: Path) -> List[str]:
+    try:
+        return [f"{suite}.{name}" for suite, name in _TEST_NAME.findall(test_file.read_text(encoding="utf-8"))]
+    except OSError:
+        return []
+
+
+def format_targets(
+        coverage: Dict[str, Any],
+        source_dir: Path,
+        test_file: Optional[Path] = None,
+        thresholds: Optional[Tuple[float, float]] = None
+    ) -> str:
+    """Renders the uncovered regions (with their source lines) for the test writer's prompt."""
+    line_threshold, branch_threshold = thresholds or coverage_thresholds()
+    text = [
+        f"Line coverage {coverage['line_percent']}% (target {line_threshold:g}%), "
+        f"branch coverage {coverage['branch_percent']}% (target {branch_threshold:g}%).",
+        "Uncovered regions:",
+    ]
+    source_lines: List[str] = []
+    for relative, functions in coverage.get("uncovered", {}).items():
+        try:
+            source = (source_dir / relative).read_text(encoding="utf-8").splitlines()
+        except OSError:
+            source = []
+        for name, gaps in functions.items():
+            details = []
+            if not gaps.get("called", True):
+                details.append("never called")
+            if gaps["lines"]:
+                details.append(f"lines {_ranges(gaps['lines'])}")
+            if gaps["branches"]:
+                details.append("branches taken " + ", ".join(f"{taken} at line {line}" for line, taken in gaps["branches"].items()))
+            text.append(f"- {relative} {name}(): {'; '.join(details)}")
+            for number in sorted({*gaps["lines"], *map(int, gaps["branches"])}):
+                if 0 < number <= len(source) and len(source_lines) < MAX_SOURCE_LINES:
+                    source_lines.append(f"{relative}:{number}: {source[number - 1].strip()}")
+    if source_lines:
+        text += ["Source of these lines:", *source_lines]
+    names = existing_test_names(test_file) if test_file else []
+    if names:
+        text.append("Existing test cases (already passing, do not redefine them): " + ", ".join(names))
+    return "\n".join(text)
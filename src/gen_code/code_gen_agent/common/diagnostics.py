@@ -0,0 +1,287 @@
+import re
+import json
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+# state に残す診断情報の上限。生ログ全体はファイルに退避します。
+MAX_DIAGNOSTICS = 20
+MAX_FAILED_TESTS = 20
+LOG_TAIL_CHARS = 2000
+MESSAGE_CHARS = 300
+
+# gcc/clang: path/to/file.c:12:5: error: message
+_COMPILER_LINE = re.compile(
+    r"^(?P<file>[^\s:][^:\n]*?):(?P<line>\d+):(?:(?P<column>\d+):)?\s*"
+    r"(?P<severity>fatal error|error|warning|note):\s*(?P<message>.*)$"
+)
+# GNU ld: file.c:(.text+0x1a): undefined reference to `foo'
+_LINKER_LINE = re.compile(r"^(?P<file>[^\s:][^:\n]*?):(?:\(.*?\)|\d+):\s*(?P<message>undefined reference to .*)$")
+_LINKER_GENERIC = re.compile(r"(?P<message>(?:undefined reference to|multiple definition of|ld returned \d+ exit status).*)$")
+# CMake Error at tests/CMakeLists.txt:12 (find_package):
+_CMAKE_ERROR = re.compile(r"^CMake Error(?: at (?P<file>[^:]+):(?P<line>\d+))?.*?:?$")
+# gtest text output: /path/test.cpp:42: Failure
+_GTEST_FAILURE = re.compile(r"^(?P<file>[^\s:][^:\n]*?):(?P<line>\d+): Failure$")
+_GTEST_FAILED = re.compile(r"^\[\s+FAILED\s+\]\s+(?P<name>[\w/]+\.[\w/]+)(?:\s|$)")
+_GTEST_LOCATION = re.compile(r"^(?P<file>[^\s:][^:\n]*?):(?P<line>\d+)")
+
+
+def _truncate(text: str, limit: int = MESSAGE_CHARS) -> str:
+    text = text.strip()
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def tail(text: str, limit: int = LOG_TAIL_CHARS) -> str:
+    """Keeps the last `limit` characters of a log, cut at a line boundary."""
+    if not text or len(text) <= limit:
+        return text or ""
+    cut = text[-limit:]
+    newline = cut.find("\n")
+    return "...\n" + (cut[newline + 1:] if 0 <= newline < len(cut) - 1 else cut)
+
+
+def _json_diagnostics(line: str) -> List[Dict[str, Any]]:
+    """gcc -fdiagnostics-format=json prints one JSON array per translation unit."""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return []
+    if not isinstance(data, list):
+        return []
+    diagnostics = []
+    for item in data:
+        if not isinstance(item, dict) or "kind" not in item:
+            continue
+        caret = {}
+        for location in item.get("locations") or []:
+            caret = location.get("caret") or {}
+            if caret:
+                break
+        diagnostics.append({
+            "severity": item.get("kind"),
+            "file": caret.get("file"),
+            "line": caret.get("line"),
+            "column": caret.get("column"),
+            "message": _truncate(item.get("message", "")),
+        })
+    return diagnostics
+
+
+def parse_compiler_output(text: str) -> List[Dict[str, Any]]:
+    """Extracts compiler, linker and CMake diagnostics from a build log (text or gcc JSON)."""
+    diagnostics: List[Dict[str, Any]] = []
+    lines = (text or "").splitlines()
+    for index, raw in enumerate(lines):
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith("[{"):
+            diagnostics.extend(_json_diagnostics(line))
+            continue
+        match = _COMPILER_LINE.match(line)
+        if match:
+            diagnostics.append({
+                "severity": match.group("severity"),
+                "file": match.group("file"),
+                "line": int(match.group("line")),
+                "column": int(match.group("column")) if match.group("column") else None,
+                "message": _truncate(match.group("message")),
+            })
+            continue
+        match = _LINKER_LINE.match(line)
+        if match:
+            diagnostics.append({"severity": "error", "file": match.group("file"), "line": None, "column": None,
+                                "message": _truncate(match.group("message"))})
+            continue
+        match = _LINKER_GENERIC.search(line)
+        if match:
+            diagnostics.append({"severity": "error", "file": None, "line": None, "column": None,
+                                "message": _truncate(match.group("message"))})
+            continue
+        if line.startswith("CMake Error"):
+            match = _CMAKE_ERROR.match(line)
+            detail = " ".join(l.strip() for l in lines[index + 1:index + 4] if l.strip())
+            diagnostics.append({
+                "severity": "error",
+                "file": match.group("file") if match else None,
+                "line": int(match.group("line")) if match and match.group("line") else None,
+                "column": None,
+                "message": _truncate(detail or line),
+            })
+    return diagnostics
+
+
+def _dedupe(diagnostics: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    seen = set()
+    unique = []
+    for diagnostic in diagnostics:
+        key = (diagnostic.get("severity"), diagnostic.get("file"), diagnostic.get("line"), diagnostic.get("message"))
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(diagnostic)
+    return unique
+
+
+def _rank(diagnostics: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    order = {"fatal error": 0, "error": 1, "warning": 2, "note": 3}
+    return sorted(diagnostics, key=lambda d: order.get(str(d.get("severity")), 4))
+
+
+def parse_gtest_xml(paths: Iterable[Path]) -> List[Dict[str, Any]]:
+    """Extracts failing test cases and their assertion locations from gtest XML reports."""
+    failed = []
+    for path in paths:
+        try:
+            root = ET.parse(path).getroot()
+        except (OSError, ET.ParseError):
+            continue
+        for case in root.iter("testcase"):
+            failures = case.findall("failure")
+            if not failures:
+                continue
+            name = f"{case.get('classname')}.{case.get('name')}"
+            for failure in failures:
+                message = failure.get("message") or failure.text or ""
+                location = _GTEST_LOCATION.match(message)
+                failed.append({
+                    "name": name,
+                    "file": location.group("file") if location else case.get("file"),
+                    "line": int(location.group("line")) if location else None,
+                    "message": _truncate(message.split("\n", 1)[1] if location and "\n" in message else message),
+                })
+    return failed
+
+
+def parse_gtest_text(text: str) -> List[Dict[str, Any]]:
+    """Fallback for when no XML report exists: parses '[  FAILED  ]' lines and 'file:line: Failure' blocks."""
+    failed: List[Dict[str, Any]] = []
+    locations: List[Dict[str, Any]] = []
+    lines = (text or "").splitlines()
+    for index, raw in enumerate(lines):
+        # ctest -VV の出力は "1: " のようなテスト番号が前置されます
+        line = re.sub(r"^\d+:\s", "", raw.strip())
+        match = _GTEST_FAILURE.match(line)
+        if match:
+            detail = []
+            for next_line in lines[index + 1:index + 4]:
+                next_line = re.sub(r"^\d+:\s", "", next_line.strip())
+                if next_line.startswith("["):
+                    break
+                detail.append(next_line)
+            locations.append({"file": match.group("file"), "line": int(match.group("line")), "message": _truncate(" ".join(detail))})
+            continue
+        match = _GTEST_FAILED.match(line)
+        if match and not any(f["name"] == match.group("name") for f in failed):
+            location = locations.pop(0) if locations else {"file": None, "line": None, "message": ""}
+            failed.append({"name": match.group("name"), **location})
+    return failed
+
+
+def summarize(
+        status: str,
+        stdout: str,
+        stderr: str,
+        log_file: Optional[Path] = None,
+        gtest_reports: Iterable[Path] = ()
+    ) -> Dict[str, Any]:
+    """
+    Builds the compact, prompt-friendly result stored in state: ranked unique diagnostics,
+    failing tests with assertion locations and a bounded tail of the raw output.
+    The full log is written to `log_file` when given.
+    """
+    combined = f"{stdout or ''}\n{stderr or ''}"
+    if log_file is not None:
+        try:
+            log_file.parent.mkdir(parents=True, exist_ok=True)
+            log_file.write_text(combined, encoding="utf-8")
+        except OSError as e:
+            print(f"[Diagnostics] Warning: failed to write log file {log_file}: {e}")
+            log_file = None
+
+    diagnostics = _rank(_dedupe(parse_compiler_output(combined)))
+    failed_tests = parse_gtest_xml(gtest_reports) or parse_gtest_text(combined)
+    errors = sum(1 for d in diagnostics if d.get("severity") in ("error", "fatal error"))
+    warnings = sum(1 for d in diagnostics if d.get("severity") == "warning")
+
+    return {
+        "status": status,
+        "summary": f"{errors} error(s), {warnings} warning(s), {len(failed_tests)} failed test(s)",
+        "diagnostics": diagnostics[:MAX_DIAGNOSTICS],
+        "failed_tests": failed_tests[:MAX_FAILED_TESTS],
+        "stdout": tail(stdout),
+        "stderr": tail(stderr),
+        "log_file": str(log_file) if log_file else None,
+    }
+
+
+def _message_key(message: Optional[str]) -> str:
+    # gcc と clang で同じ指摘の表記を揃えます (引用符の種類、末尾の [-Wxxx])
+    text = (message or "").replace("\u2018", "'").replace("\u2019", "'").replace('"', "'")
+    return re.sub(r"\s*\[-W[\w=-]+\]$", "", text).strip()
+
+
+def merge_results(results: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merges the results of the same build/test run under several toolchains (primary first) into one.
+    The run fails if any toolchain failed. Diagnostics and failed tests reported by several toolchains
+    (same location and message, ignoring quoting and warning flags) appear once, with the toolchains
+    that reported them. 'toolchains' keeps the status and log of each toolchain.
+    """
+    if len(results) == 1:
+        return next(iter(results.values()))
+    names = list(results)
+    failing = [name for name in names if results[name].get("status") != "success"]
+
+    diagnostics: Dict[Any, Dict[str, Any]] = {}
+    failed_tests: Dict[Any, Dict[str, Any]] = {}
+    for name in names:
+        for diagnostic in results[name].get("diagnostics") or []:
+            key = (diagnostic.get("severity"), diagnostic.get("file"), diagnostic.get("line"), _message_key(diagnostic.get("message")))
+            diagnostics.setdefault(key, {**diagnostic, "toolchains": []})["toolchains"].append(name)
+        for failed in results[name].get("failed_tests") or []:
+            key = (failed.get("name"), failed.get("file"), failed.get("line"))
+            failed_tests.setdefault(key, {**failed, "toolchains": []})["toolchains"].append(name)
+    ranked = _rank(list(diagnostics.values()))
+    errors = sum(1 for d in ranked if d.get("severity") in ("error", "fatal error"))
+    warnings = sum(1 for d in ranked if d.get("severity") == "warning")
+
+    # ログの末尾は失敗したツールチェーン (なければ主ツールチェーン) のものを残します
+    shown = failing or names[:1]
+    statuses = ", ".join(f"{name}: {results[name].get('status')}" for name in names)
+    merged = {
+        "status": "error" if failing else "success",
+        "summary": f"{errors} error(s), {warnings} warning(s), {len(failed_tests)} failed test(s) ({statuses})",
+        "diagnostics": ranked[:MAX_DIAGNOSTICS],
+        "failed_tests": list(failed_tests.values())[:MAX_FAILED_TESTS],
+        "stdout": tail("".join(f"[{name}]\n{results[name]['stdout']}\n" for name in shown if results[name].get("stdout"))),
+        "stderr": tail("".join(f"[{name}]\n{results[name]['stderr']}\n" for name in shown if results[name].get("stderr"))),
+        "log_file": results[shown[0]].get("log_file"),
+        "toolchains": {name: {key: results[name].get(key) for key in ("status", "summary", "log_file")} for name in names},
+    }
+    error_messages = [f"{name}: {results[name]['error_message']}" for name in failing if results[name].get("error_message")]
+    if error_messages:
+        merged["error_message"] = "; ".join(error_messages)
+    return merged
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    """Renders a compact build/test result as markdown for the agent's event content."""
+    lines = [f"Status: {result.get('status')}"]
+    if result.get("summary"):
+        lines.append(f"Summary: {result['summary']}")
+    if result.get("error_message"):
+        lines.append(f"Error: {result['error_message']}")
+    for diagnostic in result.get("diagnostics") or []:
+        location = ":".join(str(part) for part in (diagnostic.get("file"), diagnostic.get("line"), diagnostic.get("column")) if part)
+        toolchains = f" [{', '.join(diagnostic['toolchains'])}]" if diagnostic.get("toolchains") else ""
+        lines.append(f"- {diagnostic.get('severity')}{toolchains}: {location or '(no location)'}: {diagnostic.get('message')}")
+    for failed in result.get("failed_tests") or []:
+        toolchains = f" [{', '.join(failed['toolchains'])}]" if failed.get("toolchains") else ""
+        lines.append(f"- FAILED{toolchains} {failed.get('name')} at {failed.get('file')}:{failed.get('line')}: {failed.get('message')}")
+    output = "\n".join(part for part in (result.get("stdout"), result.get("stderr")) if part)
+    if output:
+        lines.append(f"Output (tail):\n```text\n{output}\n```")
+    if result.get("log_file"):
+        lines.append(f"Full log: {result['log_file']}")
+    return "\n".join(lines)
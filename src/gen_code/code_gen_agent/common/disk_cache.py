@@ -0,0 +1,91 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+def hash_key(*parts: Any) -> str:
+    """Builds a stable cache key from JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    Content-addressed JSON store on the local disk, shared by every session and process.
+    Stores of other files (e.g. the object cache of common/object_cache.py) reuse its eviction with another `suffix`.
+
+    Entries are written atomically (temp file + rename), so concurrent writers never expose
+    a partial entry. Reads refresh the entry's mtime, and once the store grows beyond
+    `max_bytes` the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = 64 * 1024 * 1024, enabled: bool = True, suffix: str = ".json"):
+        self.directory = Path(directory)
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}{self.suffix}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)  # LRU: 参照時刻を更新
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_name, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[Cache] Warning: failed to store entry {key[:12]} in {self.directory}: {e}")
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """Deletes least recently used entries until the store fits in max_bytes."""
+        with self._lock:
+            entries = []
+            total = 0
+            for path in self.directory.glob(f"*/*{self.suffix}"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
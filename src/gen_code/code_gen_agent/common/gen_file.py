@@ -2,13 +2,32 @@
 import os
 import re
 import json
-from typing import Optional, Dict, Any
+from pathlib import Path
+from types import MappingProxyType
+from typing import Optional, Dict, Any, Mapping, Tuple
 
 from google.adk.agents.callback_context import CallbackContext
 from google.genai import types
 
-from gen_code.code_gen_agent.common.constants import ROOT_DIR
 from gen_code.code_gen_agent.common.constants import AGENT_STATE_KEYS
+from gen_code.code_gen_agent.common.modules import module_name
+from gen_code.code_gen_agent.common.patch import PatchError, apply_edits, parse_edits, write_files_atomically
+from gen_code.code_gen_agent.common.workspace import resolve_root
+
+REFACTOR_HEADER_KEY = "refactored_header_file_content"
+REFACTOR_SOURCE_KEY = "refactored_source_file_content"
+# リファクタリング結果が一度でもファイルに書き込まれたか (以降のパッチはそのファイルに当てます)
+REFACTOR_WRITTEN_KEY = "refactored_files_written"
+# パッチの適用結果と、競合時に次の反復で全文出力を要求するためのフラグ
+REFACTOR_PATCH_STATUS_KEY = "refactor_patch_status"
+REFACTOR_FULL_REWRITE_KEY = "refactor_full_rewrite"
+
+# JSON でヘッダー/ソースを出力するエージェントごとの (ヘッダーのキー, ソースのキー, 出力ファイル名)
+# 出力ファイル名が None のエージェントは、実行中のモジュール名 (state['module'], 既定は doorlock_control) に書き込みます
+JSON_CODE_OUTPUTS: Mapping[str, Tuple[str, str, Optional[str]]] = MappingProxyType({
+    "CodeWriterAgent": ("header_file_content", "source_file_content", "file_codewriter"),
+    "CodeRefactorerAgent": (REFACTOR_HEADER_KEY, REFACTOR_SOURCE_KEY, None),
+})
 
 def _extract_c_code_from_markdown(markdown_code: str) -> str:
     if not isinstance(markdown_code, str):
@@ -50,6 +69,50 @@ def _extract_specific_codes_from_json_output(json_string: str, header_key: str,
         print(f"[Callback] Error: Unexpected error during JSON parsing: {e}")
         return {}
 
+def output_file_paths(state: Mapping[str, Any], agent_name: str) -> Dict[str, Path]:
+    """Header/source paths the JSON output of the given agent is written to."""
+    output_dir_path = resolve_root(state) / "examples" / "src" / "body_app"
+    base_filename = JSON_CODE_OUTPUTS[agent_name][2] or module_name(state)
+    return {"header": output_dir_path / f"{base_filename}.h", "source": output_dir_path / f"{base_filename}.c"}
+
+def refactor_base_paths(state: Mapping[str, Any]) -> Dict[str, Path]:
+    """
+    Files the refactorer's patches apply to: its own previous output, or the writer's output
+    before the first refactoring has been written.
+    """
+    return output_file_paths(state, "CodeRefactorerAgent" if state.get(REFACTOR_WRITTEN_KEY) else "CodeWriterAgent")
+
+def _apply_refactor_patch(callback_context: CallbackContext, llm_output_str: str) -> None:
+    """
+    パッチ形式の出力を現在のファイルに適用し、モジュールの .h/.c (既定は doorlock_control.h/.c) に書き込みます。
+    競合した場合はファイルを変更せず、次の反復で全文を出力させます。
+    """
+    state = callback_context.state
+    edits = parse_edits(llm_output_str)
+    base_paths = refactor_base_paths(state)
+    try:
+        current = {label: path.read_text(encoding="utf-8") for label, path in base_paths.items()}
+        patched = apply_edits(current, edits)
+    except (OSError, PatchError) as e:
+        conflicts = e.conflicts if isinstance(e, PatchError) else [str(e)]
+        print(f"[Callback] Patch from 'CodeRefactorerAgent' could not be applied, requesting a full rewrite: {conflicts}")
+        state[REFACTOR_PATCH_STATUS_KEY] = {"status": "conflict", "edits": len(edits), "conflicts": conflicts}
+        state[REFACTOR_FULL_REWRITE_KEY] = True
+        return
+
+    output_paths = output_file_paths(state, "CodeRefactorerAgent")
+    write_files_atomically({
+        output_paths["header"]: patched["header"],
+        output_paths["source"]: patched["source"],
+    })
+    print(f"[Callback] Applied {len(edits)} edit(s) from 'CodeRefactorerAgent' to {output_paths['header'].with_suffix('')}.h/.c")
+    state[REFACTOR_PATCH_STATUS_KEY] = {"status": "applied", "edits": len(edits), "conflicts": []}
+    state[REFACTOR_WRITTEN_KEY] = True
+    # 後続 (収束判定など) が常にコード全体を参照できるよう、適用後の内容を全文形式で保存します
+    state[AGENT_STATE_KEYS["CodeRefactorerAgent"]] = json.dumps(
+        {REFACTOR_HEADER_KEY: patched["header"], REFACTOR_SOURCE_KEY: patched["source"]}, ensure_ascii=False
+    )
+
 def _write_code_to_file(filepath: str, code: str, agent_name: str, file_type: str):
     """指定されたパスにコードを書き込むヘルパー関数"""
     try:
@@ -71,7 +134,8 @@ def generate_file_callback(
 ) -> Optional[types.Content]:
     agent_name = callback_context.agent_name
     invocation_id = callback_context.invocation_id
-    current_state: Dict[str, Any] = callback_context.state.to_dict()
+    # to_dict() は生成コードやビルド結果を含む state 全体をコピーするため、State を直接参照します
+    current_state = callback_context.state
 
     print(f"\n[Callback] In 'generate_file_callback' for agent: {agent_name} (Inv: {invocation_id})")
 
@@ -111,7 +175,7 @@ def generate_file_callback(
         return None
 
     output_base_filename = f"file_{agent_name.lower().replace('agent', '')}"
-    output_dir_path = ROOT_DIR / "examples" / "src" / "body_app"
+    output_dir_path = resolve_root(callback_context.state) / "examples" / "src" / "body_app"
 
     extracted_codes: Dict[str, str] = {}
     header_key = ""
@@ -120,13 +184,14 @@ def generate_file_callback(
     output_filename_suffix_c = ".c"
 
     if agent_name == "CodeWriterAgent":
-        header_key = "header_file_content"
-        source_key = "source_file_content"
+        header_key, source_key, _ = JSON_CODE_OUTPUTS[agent_name]
         extracted_codes = _extract_specific_codes_from_json_output(llm_output_str, header_key, source_key)
     elif agent_name == "CodeRefactorerAgent":
-        header_key = "refactored_header_file_content"
-        source_key = "refactored_source_file_content"
-        output_base_filename = "doorlock_control"
+        if parse_edits(llm_output_str):
+            _apply_refactor_patch(callback_context, llm_output_str)
+            return None
+        header_key, source_key, _ = JSON_CODE_OUTPUTS[agent_name]
+        output_base_filename = module_name(current_state)
         # output_filename_suffix_h = "_refactored.h"
         # output_filename_suffix_c = "_refactored.c"
         extracted_codes = _extract_specific_codes_from_json_output(llm_output_str, header_key, source_key)
@@ -153,4 +218,29 @@ def generate_file_callback(
     _write_code_to_file(str(header_filepath), header_code, agent_name, f"{agent_name} header file")
     _write_code_to_file(str(source_filepath), source_code, agent_name, f"{agent_name} source file")
 
+    if agent_name == "CodeRefactorerAgent":
+        callback_context.state[REFACTOR_WRITTEN_KEY] = True
+        callback_context.state[REFACTOR_FULL_REWRITE_KEY] = False
+        callback_context.state[REFACTOR_PATCH_STATUS_KEY] = {"status": "rewritten", "edits": 0, "conflicts": []}
+
+    return None
+
+def generate_header_callback(
+    callback_context: CallbackContext
+) -> Optional[types.Content]:
+    """
+    Writes the header of the current module (state['module']) from the HeaderWriterAgent output
+    ({"header_file_content": "..."}), before any module source is generated.
+    """
+    agent_name = callback_context.agent_name
+    llm_output_str = callback_context.state.get(AGENT_STATE_KEYS[agent_name])
+    if not isinstance(llm_output_str, str) or not llm_output_str.strip():
+        print(f"[Callback] Error: Agent '{agent_name}' produced no header to write.")
+        return None
+    header_code = _extract_specific_codes_from_json_output(llm_output_str, "header_file_content", "source_file_content").get("header")
+    if not header_code:
+        print(f"[Callback] Warning: Could not extract 'header_file_content' from '{agent_name}' output. Header not written.")
+        return None
+    header_filepath = resolve_root(callback_context.state) / "examples" / "src" / "body_app" / f"{module_name(callback_context.state)}.h"
+    _write_code_to_file(str(header_filepath), header_code, agent_name, "module header file")
     return None
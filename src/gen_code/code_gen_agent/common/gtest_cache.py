@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from gen_code.code_gen_agent.common.constants import CACHE_DIR
+
+# examples/tests/CMakeLists.txt の FetchContent と同じコミットに固定します。
+GTEST_COMMIT = "03597a01ee50ed33e9dfd640b249b4be3799d395"
+GTEST_ARCHIVE_URL = f"https://github.com/google/googletest/archive/{GTEST_COMMIT}.zip"
+GTEST_CACHE_DIR = CACHE_DIR / "gtest"
+
+# ローカルのアーカイブ (zip) または展開済みソースツリーを指定すると、ネットワークなしでキャッシュを作成できます。
+# 例: GEN_CODE_GTEST_SOURCE=/usr/src/googletest
+GTEST_SOURCE_ENV = "GEN_CODE_GTEST_SOURCE"
+OFFLINE_ENV = "GEN_CODE_OFFLINE"
+
+_COMPLETE_MARKER = ".complete"
+# 解決済みの install prefix、または失敗の理由 (オフラインのホストで呼び出しのたびにダウンロードを再試行しないため)
+_memo: Dict[Tuple[str, bool], Union[Path, str]] = {}
+_memo_lock = threading.Lock()
+
+
+class GTestCacheError(RuntimeError):
+    """Raised when the prebuilt GoogleTest cache cannot be populated."""
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _sha256_tree(root: Path) -> str:
+    digest = hashlib.sha256()
+    for path in sorted(p for p in root.rglob("*") if p.is_file()):
+        digest.update(str(path.relative_to(root)).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _archive_path() -> Path:
+    return GTEST_CACHE_DIR / "archives" / f"{GTEST_COMMIT}.zip"
+
+
+def _locate_source() -> Path:
+    """Returns the archive (or source tree) to build from, downloading it once if allowed."""
+    override = os.environ.get(GTEST_SOURCE_ENV)
+    if override:
+        path = Path(override).expanduser()
+        if not path.exists():
+            raise GTestCacheError(f"{GTEST_SOURCE_ENV}='{override}' does not exist.")
+        return path
+
+    archive = _archive_path()
+    if archive.is_file():
+        return archive
+
+    if os.environ.get(OFFLINE_ENV):
+        raise GTestCacheError(
+            f"GoogleTest archive is not cached at '{archive}' and {OFFLINE_ENV} is set. "
+            f"Set {GTEST_SOURCE_ENV} to a local googletest archive or source tree."
+        )
+
+    print(f"  [GTest Cache] Downloading {GTEST_ARCHIVE_URL}")
+    archive.parent.mkdir(parents=True, exist_ok=True)
+    tmp_fd, tmp_name = tempfile.mkstemp(dir=str(archive.parent), suffix=".part")
+    try:
+        with os.fdopen(tmp_fd, "wb") as out, urllib.request.urlopen(GTEST_ARCHIVE_URL, timeout=60) as response:
+            shutil.copyfileobj(response, out)
+        os.replace(tmp_name, archive)
+    except OSError as e:
+        raise GTestCacheError(f"Failed to download GoogleTest: {e}") from e
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+    return archive
+
+
+def _source_key(source: Path) -> str:
+    key = _sha256_file(source) if source.is_file() else _sha256_tree(source)
+    # ABI はプラットフォームごとに異なるため、同じアーカイブでも別エントリにします。
+    return f"{key[:32]}-{sys.platform}"
+
+
+class _FileLock:
+    """Cross-process lock so that concurrent pipelines build the cache only once."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a+")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+
+def _run(command: List[str], cwd: Path) -> None:
+    process = subprocess.run(command, cwd=str(cwd), capture_output=True, text=True, check=False)
+    if process.returncode != 0:
+        raise GTestCacheError(
+            f"'{' '.join(command)}' failed with return code {process.returncode}:\n{process.stderr[-2000:]}"
+        )
+
+
+def _populate(source: Path, entry_dir: Path) -> None:
+    prefix = entry_dir / "install"
+    with tempfile.TemporaryDirectory(dir=str(GTEST_CACHE_DIR)) as work:
+        work_dir = Path(work)
+        if source.is_file():
+            with zipfile.ZipFile(source) as archive:
+                archive.extractall(work_dir / "src")
+            # GitHub のアーカイブは googletest-<commit>/ のような単一ディレクトリを含みます
+            entries = list((work_dir / "src").iterdir())
+            source_dir = entries[0] if len(entries) == 1 and entries[0].is_dir() else work_dir / "src"
+        else:
+            source_dir = source
+
+        generator = "MinGW Makefiles" if os.name == "nt" else "Ninja"
+        _run([
+            "cmake", "-S", str(source_dir), "-B", str(work_dir / "build"), "-G", generator,
+            "-D", "CMAKE_BUILD_TYPE=Release",
+            "-D", f"CMAKE_INSTALL_PREFIX={prefix}",
+            "-D", "BUILD_GMOCK=OFF",
+            "-D", "INSTALL_GTEST=ON",
+            "-D", "gtest_force_shared_crt=ON",
+        ], work_dir)
+        _run(["cmake", "--build", str(work_dir / "build")], work_dir)
+        _run(["cmake", "--install", str(work_dir / "build")], work_dir)
+
+    manifest = {"commit": GTEST_COMMIT, "source": str(source), "prefix": str(prefix)}
+    (entry_dir / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    (entry_dir / _COMPLETE_MARKER).touch()
+
+
+def _ensure_entry() -> Path:
+    source = _locate_source()
+    entry_dir = GTEST_CACHE_DIR / _source_key(source)
+    if not (entry_dir / _COMPLETE_MARKER).is_file():
+        with _FileLock(entry_dir.with_suffix(".lock")):
+            # 他のプロセスがロック待ちの間に作成済みの可能性があります
+            if not (entry_dir / _COMPLETE_MARKER).is_file():
+                print(f"  [GTest Cache] Building GoogleTest from {source} into {entry_dir}")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                entry_dir.mkdir(parents=True, exist_ok=True)
+                _populate(source, entry_dir)
+    return entry_dir / "install"
+
+
+def ensure_gtest() -> Path:
+    """
+    Returns the install prefix of a prebuilt GoogleTest, building it on first use.
+
+    Entries live under <cache>/gtest/<archive-hash>/ and are shared by every iteration,
+    every workspace and every concurrent run on the host. Population is serialized with a
+    file lock; later callers only check the completion marker.
+    The outcome, including a failure, is memoized per process and per GEN_CODE_GTEST_SOURCE /
+    GEN_CODE_OFFLINE setting, so a host without network tries to download the archive only once.
+    """
+    memo_key = (os.environ.get(GTEST_SOURCE_ENV, ""), bool(os.environ.get(OFFLINE_ENV)))
+    # 同時に呼ばれても解決 (ダウンロード・ビルド) はプロセス内で一度だけ行います
+    with _memo_lock:
+        memo = _memo.get(memo_key)
+        if memo is None:
+            try:
+                memo = _ensure_entry()
+            except (GTestCacheError, OSError, zipfile.BadZipFile) as e:
+                memo = str(e)
+            _memo[memo_key] = memo
+    if isinstance(memo, str):
+        raise GTestCacheError(memo)
+    return memo
+
+
+def gtest_configure_args() -> List[str]:
+    """
+    CMake arguments that make examples/tests link against the cached GoogleTest.
+    Returns an empty list (FetchContent fallback) if the cache cannot be populated.
+    """
+    try:
+        return ["-D", f"GEN_CODE_GTEST_ROOT={ensure_gtest()}"]
+    except (GTestCacheError, OSError, zipfile.BadZipFile) as e:
+        print(f"  [GTest Cache] Warning: falling back to FetchContent: {e}")
+        return []
@@ -0,0 +1,163 @@
+"""
+Virtual-time integration test of brake_app -> body_app, without real sleeps or sockets.
+
+`integration_sim` (examples/integration) links the speed generator of brake_app and the control step of
+body_app (body_control.c + the generated doorlock_control.c) with a simulated clock and an in-memory
+transport instead of UDP. The clock jumps from event to event, so a trace of hours of driving replays in
+milliseconds, and runs share no port, so any number of workspaces can run it at once.
+
+`run_integration(builder)` builds the target in the builder's tree and runs, concurrently in build job slots:
+
+- every trace `examples/integration/traces/*.trace` (speed, shift and switch events with expected lock
+  commands), GEN_CODE_INTEGRATION_REPEAT times back to back (default 10),
+- a soak run of the brake_app speed pattern for GEN_CODE_INTEGRATION_DURATION_MS of virtual time
+  (default one hour) that only has to finish cleanly.
+
+GEN_CODE_INTEGRATION_LATENCY_MS (default 0) delays every message of the transport. The result:
+
+    {"status": "error", "summary": "2 run(s), 100 check(s), 1 failure(s), 5.6 virtual hour(s)",
+     "runs": {"door_lock": {"virtual_ms": 2030000, "control_steps": 4061, "checks": 100, "failures": 1, ...},
+              "speed_pattern": {...}},
+     "failures": [{"trace": "door_lock", "line": 11, "time_ms": 2500, "expected": "LOCK", "actual": "UNLOCK",
+                   "speed_kph": 35}]}
+
+`IntegrationTestAgent` (test_runner_agent/agent.py) runs it as the last pipeline stage when
+GEN_CODE_INTEGRATION_TEST=1.
+"""
+import os
+import json
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from gen_code.code_gen_agent.common.build_engine import IncrementalBuilder
+from gen_code.code_gen_agent.common.build_scheduler import build_scheduler
+from gen_code.code_gen_agent.common.diagnostics import summarize
+
+INTEGRATION_TEST_ENV = "GEN_CODE_INTEGRATION_TEST"
+INTEGRATION_REPEAT_ENV = "GEN_CODE_INTEGRATION_REPEAT"
+INTEGRATION_DURATION_ENV = "GEN_CODE_INTEGRATION_DURATION_MS"
+INTEGRATION_LATENCY_ENV = "GEN_CODE_INTEGRATION_LATENCY_MS"
+
+INTEGRATION_STATE_KEY = "integration_result"
+INTEGRATION_TARGET = "integration_sim"
+# examples からの相対パス
+INTEGRATION_DIR = Path("integration")
+TRACE_DIR = INTEGRATION_DIR / "traces"
+SOAK_RUN = "speed_pattern"
+
+# 統合テストが検証するモジュール (body_control.c がリンクするもの)
+INTEGRATED_MODULE = "doorlock_control"
+# state/プロンプトに載せる失敗の上限
+MAX_FAILURES = 20
+
+
+def integration_enabled() -> bool:
+    return os.environ.get(INTEGRATION_TEST_ENV, "0") == "1"
+
+
+def integration_settings() -> Dict[str, int]:
+    return {
+        "repeat": max(1, int(os.environ.get(INTEGRATION_REPEAT_ENV, "10"))),
+        "duration_ms": int(os.environ.get(INTEGRATION_DURATION_ENV, str(60 * 60 * 1000))),
+        "latency_ms": int(os.environ.get(INTEGRATION_LATENCY_ENV, "0")),
+    }
+
+
+def register_integration_target(builder: IncrementalBuilder) -> str:
+    """Registers `integration_sim` with the builder so that its fingerprint covers the sources of both applications."""
+    builder.target_dirs.setdefault(INTEGRATION_TARGET, (INTEGRATION_DIR.as_posix(), "src/body_app", "src/brake_app"))
+    return INTEGRATION_TARGET
+
+
+def result_kind(builder: IncrementalBuilder, settings: Optional[Dict[str, int]] = None) -> str:
+    """Result cache kind: the settings and the traces, which the target fingerprint (C sources only) does not cover."""
+    digest = hashlib.sha256(json.dumps(settings or integration_settings(), sort_keys=True).encode("utf-8"))
+    for trace in sorted((builder.source_dir / TRACE_DIR).glob("*.trace")):
+        digest.update(trace.name.encode("utf-8"))
+        digest.update(trace.read_bytes())
+    return f"integration-{digest.hexdigest()[:16]}"
+
+
+def _executable(builder: IncrementalBuilder) -> Path:
+    path = builder.build_dir / INTEGRATION_DIR / INTEGRATION_TARGET
+    return path if path.is_file() else path.with_suffix(".exe")
+
+
+def _commands(builder: IncrementalBuilder, settings: Dict[str, int]) -> Dict[str, List[str]]:
+    executable = str(_executable(builder))
+    latency = ["--latency-ms", str(settings["latency_ms"])]
+    commands = {
+        trace.stem: [executable, "--trace", str(trace), "--repeat", str(settings["repeat"]), *latency]
+        for trace in sorted((builder.source_dir / TRACE_DIR).glob("*.trace"))
+    }
+    commands[SOAK_RUN] = [executable, "--duration-ms", str(settings["duration_ms"]), *latency]
+    return commands
+
+
+def _parse_run(stdout: str) -> Optional[Dict[str, Any]]:
+    for line in reversed(stdout.splitlines()):
+        if line.startswith("{"):
+            try:
+                return json.loads(line)
+            except ValueError:
+                return None
+    return None
+
+
+async def run_integration(
+        builder: IncrementalBuilder,
+        timeout: Optional[float] = None,
+        settings: Optional[Dict[str, int]] = None
+    ) -> Dict[str, Any]:
+    """Builds `integration_sim` and runs every trace and the soak run concurrently."""
+    settings = settings or integration_settings()
+    target = register_integration_target(builder)
+    build = await builder.build_async([target], timeout=timeout)
+    if build.returncode != 0:
+        result = summarize("error", build.stdout, build.stderr)
+        result["error_message"] = f"{target} did not build: {result['summary']}"
+        return result
+
+    commands = _commands(builder, settings)
+    # ポートも実時間も使わないので、全てのトレースを同時に実行できます
+    processes = await asyncio.gather(*(
+        build_scheduler.submit_async(command, builder.build_dir / INTEGRATION_DIR, timeout=timeout)
+        for command in commands.values()
+    ))
+
+    runs: Dict[str, Any] = {}
+    failures: List[Dict[str, Any]] = []
+    for name, process in zip(commands, processes):
+        run = _parse_run(process.stdout)
+        if run is None:
+            reason = "timed out" if process.timed_out else f"exited with {process.returncode}"
+            failures.append({"trace": name, "message": f"{reason}: {process.stderr.strip()[-500:]}"})
+            continue
+        runs[name] = run
+        failures += [{"trace": name, **failure} for failure in run.pop("first_failures", [])]
+
+    checks = sum(run["checks"] for run in runs.values())
+    failed = sum(run["failures"] for run in runs.values()) + len(commands) - len(runs)
+    virtual_hours = sum(run["virtual_ms"] for run in runs.values()) / 3_600_000
+    return {
+        "status": "success" if not failed else "error",
+        "summary": f"{len(commands)} run(s), {checks} check(s), {failed} failure(s), {virtual_hours:.1f} virtual hour(s)",
+        "runs": runs,
+        "failures": failures[:MAX_FAILURES],
+    }
+
+
+def format_integration(result: Dict[str, Any]) -> str:
+    """Prompt/console friendly text of a result: the summary and the failed checks."""
+    if "runs" not in result:
+        return f"Integration test not run: {result.get('error_message') or result.get('reason')}"
+    lines = [f"Integration test (virtual time): {result['summary']}"]
+    for failure in result["failures"]:
+        if "message" in failure:
+            lines.append(f"- {failure['trace']}: {failure['message']}")
+        else:
+            lines.append(f"- {failure['trace']}.trace line {failure['line']}, t={failure['time_ms']} ms: expected "
+                         f"{failure['expected']}, got {failure['actual']} (speed {failure['speed_kph']} km/h)")
+    return "\n".join(lines)
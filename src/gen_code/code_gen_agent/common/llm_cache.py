@@ -0,0 +1,107 @@
+import os
+import json
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+
+from gen_code.code_gen_agent.common.constants import CACHE_DIR
+from gen_code.code_gen_agent.common.disk_cache import DiskCache, hash_key
+from gen_code.code_gen_agent.common.models import Model
+from gen_code.code_gen_agent.common.workspace import resolve_root
+
+# 応答キャッシュはオプトインです (GEN_CODE_LLM_CACHE=1)。
+# GEN_CODE_LLM_CACHE_AGENTS にカンマ区切りでエージェント名を指定すると、そのエージェントだけが対象になります。
+LLM_CACHE_ENV = "GEN_CODE_LLM_CACHE"
+LLM_CACHE_AGENTS_ENV = "GEN_CODE_LLM_CACHE_AGENTS"
+
+
+def _model_name(model: Any) -> str:
+    # Model 列挙型とその値 (文字列) のどちらで指定されても同じキーになるよう正規化します
+    if isinstance(model, Model):
+        return model.value
+    return str(model or "")
+
+
+class LlmResponseCache:
+    """
+    Disk-backed cache of final model responses, layered on the model callbacks.
+
+    The key covers the model name, the rendered instruction (which already contains the injected
+    state values such as {generated_code}), the conversation contents sent to the model and the
+    generation config. The workspace path is normalized, so identical prompts hit across workspaces.
+    `before_model` returns the stored LlmResponse on a hit, which skips the model call entirely;
+    `after_model` stores final, error-free responses. Entries are evicted LRU by total size.
+    """
+
+    def __init__(self, store: DiskCache, agents: Optional[Iterable[str]] = None):
+        self.store = store
+        # None: 全エージェントで有効
+        self.agents = set(agents) if agents else None
+        self._pending: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.store.enabled
+
+    def is_enabled_for(self, agent_name: str) -> bool:
+        return self.store.enabled and (self.agents is None or agent_name in self.agents)
+
+    def enable(self, agents: Optional[Iterable[str]] = None) -> None:
+        """Turns the cache on, for the given agents only if any are given."""
+        self.store.enabled = True
+        self.agents = set(agents) if agents else None
+
+    def disable(self) -> None:
+        self.store.enabled = False
+
+    def key(self, callback_context: CallbackContext, llm_request: LlmRequest) -> str:
+        config = llm_request.config.model_dump(mode="json", exclude_none=True) if llm_request.config else {}
+        contents = [content.model_dump(mode="json", exclude_none=True) for content in llm_request.contents]
+        payload = json.dumps([config, contents], sort_keys=True, ensure_ascii=False)
+        # 生成物やビルドログに含まれるワークスペースの絶対パスはキーから除外します
+        payload = payload.replace(str(resolve_root(callback_context.state)), "<workspace>")
+        return hash_key(_model_name(llm_request.model), payload)
+
+    def before_model(self, callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+        agent_name = callback_context.agent_name
+        if not self.is_enabled_for(agent_name):
+            return None
+        key = self.key(callback_context, llm_request)
+        cached = self.store.get(key)
+        if cached is None:
+            with self._lock:
+                self._pending[(callback_context.invocation_id, agent_name)] = key
+            return None
+        print(f"[Callback] LLM response cache hit ({key[:12]}) for agent '{agent_name}'.")
+        response = LlmResponse.model_validate(cached)
+        response.custom_metadata = {**(response.custom_metadata or {}), "cache_hit": True}
+        return response
+
+    def after_model(self, callback_context: CallbackContext, llm_response: LlmResponse) -> None:
+        # ストリーミングの部分応答の後には最終応答が続くので、キーは残します
+        if llm_response.partial:
+            return None
+        with self._lock:
+            key = self._pending.pop((callback_context.invocation_id, callback_context.agent_name), None)
+        # エラー応答や空の応答は保存しません
+        if key is not None and not llm_response.error_code and llm_response.content:
+            self.store.put(key, llm_response.model_dump(mode="json", exclude_none=True))
+        return None
+
+
+def _agents_from_env() -> Optional[Iterable[str]]:
+    value = os.environ.get(LLM_CACHE_AGENTS_ENV, "").strip()
+    return [name.strip() for name in value.split(",") if name.strip()] or None
+
+
+llm_cache = LlmResponseCache(
+    DiskCache(
+        CACHE_DIR / "llm",
+        max_bytes=int(os.environ.get("GEN_CODE_LLM_CACHE_MAX_MB", "256")) * 1024 * 1024,
+        enabled=os.environ.get(LLM_CACHE_ENV, "0") == "1",
+    ),
+    agents=_agents_from_env(),
+)
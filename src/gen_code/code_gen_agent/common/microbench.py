@@ -0,0 +1,279 @@
+"""
+Runtime benchmark of the generated module: calls/sec, cycles per call and memory footprint at -O2.
+
+`run_benchmark(builder, module)` builds `bench_<module>` (examples/bench/bench_<module>.c linked with the
+module's sources at -O2 -fstack-usage) in the builder's tree, runs it in a build job slot and returns:
+
+    {"status": "success", "module": "doorlock_control", "toolchain": "gcc",
+     "calls": 4194304, "ns_per_call": 7.14, "calls_per_sec": 140031369, "cycles_per_call": 14.3,
+     "stack_bytes": 8, "stack": {"update_door_lock_state": 8},
+     "static_bytes": 20, "text_bytes": 254}
+
+The harness takes the best of several timed rounds; cycles are TSC cycles (x86 only, null elsewhere).
+`stack_bytes` is the largest stack frame of the module's functions and `static_bytes` its .data + .bss.
+Modules without a harness are reported as "unavailable".
+
+`PerformanceAgent` (code_builder_agent/agent.py) runs it once on the writer's code as the baseline and then
+after every green build of the refinement loop when GEN_CODE_PERF_BENCHMARK=1, and compares the numbers with
+the previous measurement. The writer saves its code as file_codewriter.h/.c, which the harness does not
+compile, so `stage_writer_output` copies it over the module's sources in a scratch workspace
+('examples/build-baseline', kept between runs like the candidate slots) and the baseline is built there.
+A metric that got worse by more than GEN_CODE_PERF_TOLERANCE percent (default 10), or a call that exceeds the per-cycle budget
+of the control loop (GEN_CODE_PERF_BUDGET_NS / GEN_CODE_PERF_BUDGET_CYCLES, 0 = none), is written to
+state['performance_report'] for the reviewer and refactorer, and the loop continues.
+GEN_CODE_SIZE selects the size binary (e.g. "llvm-size").
+"""
+import os
+import json
+import shlex
+import shutil
+import asyncio
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from gen_code.code_gen_agent.common.build_engine import IncrementalBuilder
+from gen_code.code_gen_agent.common.build_scheduler import build_scheduler
+from gen_code.code_gen_agent.common.diagnostics import summarize
+from gen_code.code_gen_agent.common.gen_file import output_file_paths
+from gen_code.code_gen_agent.common.modules import MODULE_SOURCE_DIR, module_name
+from gen_code.code_gen_agent.common.workspace import create_workspace
+
+PERF_BENCHMARK_ENV = "GEN_CODE_PERF_BENCHMARK"
+PERF_TOLERANCE_ENV = "GEN_CODE_PERF_TOLERANCE"
+PERF_BUDGET_NS_ENV = "GEN_CODE_PERF_BUDGET_NS"
+PERF_BUDGET_CYCLES_ENV = "GEN_CODE_PERF_BUDGET_CYCLES"
+SIZE_ENV = "GEN_CODE_SIZE"
+
+PERFORMANCE_STATE_KEY = "performance"
+PERFORMANCE_REPORT_STATE_KEY = "performance_report"
+# examples からの相対パス
+BENCH_DIR = Path("bench")
+# ライターのコードを測定するスクラッチのワークスペース (examples からの相対パス)
+BASELINE_DIR = "build-baseline"
+# スクラッチのワークスペースへ同期するディレクトリ
+_STAGED_DIRS = ("src", "bench")
+
+# 前回の反復と比較する指標 (いずれも小さいほど良い)
+COMPARED_METRICS = ("ns_per_call", "cycles_per_call", "stack_bytes", "static_bytes", "text_bytes")
+_OBJECT_SUFFIXES = (".o", ".obj")
+
+
+def benchmark_enabled() -> bool:
+    return os.environ.get(PERF_BENCHMARK_ENV, "0") == "1"
+
+
+def perf_tolerance() -> float:
+    """Percent by which a metric may get worse before it counts as a regression."""
+    return float(os.environ.get(PERF_TOLERANCE_ENV, "10"))
+
+
+def perf_budget() -> Tuple[float, float]:
+    """(ns, cycles) one call may take within a cycle of the control loop. 0 means no budget."""
+    return (float(os.environ.get(PERF_BUDGET_NS_ENV, "0")),
+            float(os.environ.get(PERF_BUDGET_CYCLES_ENV, "0")))
+
+
+def size_command() -> List[str]:
+    return shlex.split(os.environ.get(SIZE_ENV, "size"))
+
+
+def bench_target(module: str) -> str:
+    return f"bench_{module}"
+
+
+def harness_path(builder: IncrementalBuilder, module: str) -> Path:
+    return builder.source_dir / BENCH_DIR / f"{bench_target(module)}.c"
+
+
+def register_bench_target(builder: IncrementalBuilder, module: str) -> str:
+    """Registers `bench_<module>` with the builder so that its fingerprint covers the harness and the module."""
+    target = bench_target(module)
+    builder.target_dirs.setdefault(target, (BENCH_DIR.as_posix(), MODULE_SOURCE_DIR.as_posix()))
+    return target
+
+
+def stage_writer_output(root: Path, state: Mapping[str, Any]) -> Optional[Path]:
+    """
+    Workspace in which the module's .h/.c are the writer's output (file_codewriter.h/.c of `root`).
+    Returns None when the writer has not written its files.
+    """
+    written = output_file_paths(state, "CodeWriterAgent")
+    if not all(path.is_file() for path in written.values()):
+        return None
+    slot = root / "examples" / BASELINE_DIR
+    if (slot / "examples").is_dir():
+        # ビルドツリーを残したまま、ソースだけを最新にします
+        for name in _STAGED_DIRS:
+            if (root / "examples" / name).is_dir():
+                shutil.copytree(root / "examples" / name, slot / "examples" / name, dirs_exist_ok=True)
+    else:
+        create_workspace(slot, source_root=root)
+    module_files = slot / "examples" / MODULE_SOURCE_DIR / module_name(state)
+    for path in written.values():
+        shutil.copyfile(path, module_files.with_suffix(path.suffix))
+    return slot
+
+
+# ----------------------------------------------------------------------
+# Footprint
+# ----------------------------------------------------------------------
+def _module_objects(builder: IncrementalBuilder, module: str) -> List[Path]:
+    object_dir = builder.build_dir / BENCH_DIR / "CMakeFiles" / f"{bench_target(module)}.dir"
+    return sorted(p for suffix in _OBJECT_SUFFIXES for p in object_dir.rglob(f"{module}.c{suffix}"))
+
+
+def parse_stack_usage(text: str) -> Dict[str, int]:
+    """Frame size per function from a -fstack-usage file ("file:line:col:function<TAB>bytes<TAB>qualifier")."""
+    frames: Dict[str, int] = {}
+    for line in text.splitlines():
+        fields = line.split("\t")
+        if len(fields) < 2 or not fields[1].strip().isdigit():
+            continue
+        function = fields[0].rsplit(":", 1)[-1]
+        frames[function] = max(frames.get(function, 0), int(fields[1]))
+    return frames
+
+
+def _stack_usage(objects: List[Path]) -> Dict[str, int]:
+    frames: Dict[str, int] = {}
+    for obj in objects:
+        # gcc/clang は出力ファイル名の最後の拡張子を .su に置き換えます (x.c.o -> x.c.su)
+        try:
+            frames.update(parse_stack_usage(obj.with_suffix(".su").read_text(encoding="utf-8")))
+        except OSError:
+            pass
+    return frames
+
+
+def parse_size(text: str) -> Dict[str, int]:
+    """Sums the text/data/bss columns of the Berkeley format output of size."""
+    totals = {"text": 0, "data": 0, "bss": 0}
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) >= 3 and all(field.isdigit() for field in fields[:3]):
+            for key, value in zip(("text", "data", "bss"), fields[:3]):
+                totals[key] += int(value)
+    return totals
+
+
+def _section_sizes(objects: List[Path]) -> Optional[Dict[str, int]]:
+    try:
+        process = subprocess.run(size_command() + [str(p) for p in objects], capture_output=True, text=True, check=False)
+    except OSError:
+        return None
+    return parse_size(process.stdout) if process.returncode == 0 else None
+
+
+def footprint(builder: IncrementalBuilder, module: str) -> Dict[str, Any]:
+    """Stack frames and static memory of the module's -O2 object (the harness itself is left out)."""
+    objects = _module_objects(builder, module)
+    frames = _stack_usage(objects)
+    result: Dict[str, Any] = {"stack_bytes": max(frames.values()) if frames else None, "stack": frames,
+                              "static_bytes": None, "text_bytes": None}
+    sizes = _section_sizes(objects) if objects else None
+    if sizes is not None:
+        result["static_bytes"] = sizes["data"] + sizes["bss"]
+        result["text_bytes"] = sizes["text"]
+    return result
+
+
+# ----------------------------------------------------------------------
+# Measurement
+# ----------------------------------------------------------------------
+def _executable(builder: IncrementalBuilder, module: str) -> Path:
+    path = builder.build_dir / BENCH_DIR / bench_target(module)
+    return path if path.is_file() else path.with_suffix(".exe")
+
+
+def _parse_output(stdout: str) -> Optional[Dict[str, Any]]:
+    for line in reversed(stdout.splitlines()):
+        if line.startswith("{"):
+            try:
+                return json.loads(line)
+            except ValueError:
+                return None
+    return None
+
+
+async def run_benchmark(builder: IncrementalBuilder, module: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """Builds and runs the module's harness. Status "success", "error" (build/run failed) or "unavailable"."""
+    target = register_bench_target(builder, module)
+    if not harness_path(builder, module).is_file():
+        return {"status": "unavailable", "module": module,
+                "reason": f"no benchmark harness {(BENCH_DIR / f'{target}.c').as_posix()}"}
+
+    build = await builder.build_async([target], timeout=timeout)
+    if build.returncode != 0:
+        result = summarize("error", build.stdout, build.stderr)
+        result.update(module=module, reason=f"{target} did not build: {result['summary']}")
+        return result
+
+    # 他のビルドとジョブスロットを分け合い、計測中にコアを取り合わないようにします
+    process = await build_scheduler.submit_async([str(_executable(builder, module))], builder.build_dir / BENCH_DIR,
+                                                 timeout=timeout)
+    measured = _parse_output(process.stdout) if process.returncode == 0 else None
+    if measured is None:
+        reason = "timed out" if process.timed_out else f"exited with {process.returncode}: {process.stderr.strip()[-500:]}"
+        return {"status": "error", "module": module, "reason": f"{target} {reason}"}
+
+    result: Dict[str, Any] = {"status": "success", "module": module, "toolchain": builder.toolchain}
+    result.update(measured)
+    result.update(await asyncio.to_thread(footprint, builder, module))
+    return result
+
+
+# ----------------------------------------------------------------------
+# Evaluation
+# ----------------------------------------------------------------------
+def compare(previous: Optional[Dict[str, Any]], current: Dict[str, Any], tolerance: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Metrics that got worse than in the previous measurement of the same module by more than `tolerance` %."""
+    if not isinstance(previous, dict) or previous.get("status") != "success" or \
+            previous.get("module") != current.get("module"):
+        return []
+    tolerance = perf_tolerance() if tolerance is None else tolerance
+    regressions = []
+    for metric in COMPARED_METRICS:
+        before, after = previous.get(metric), current.get(metric)
+        if before is None or after is None or after <= before * (1 + tolerance / 100):
+            continue
+        change = round(100.0 * (after - before) / before, 1) if before else None
+        regressions.append({"metric": metric, "previous": before, "current": after, "change_percent": change})
+    return regressions
+
+
+def budget_violations(result: Dict[str, Any]) -> List[str]:
+    budget_ns, budget_cycles = perf_budget()
+    violations = []
+    if budget_ns and result.get("ns_per_call") is not None and result["ns_per_call"] > budget_ns:
+        violations.append(f"{result['ns_per_call']} ns per call exceeds the budget of {budget_ns:g} ns")
+    if budget_cycles and result.get("cycles_per_call") is not None and result["cycles_per_call"] > budget_cycles:
+        violations.append(f"{result['cycles_per_call']} cycles per call exceeds the budget of {budget_cycles:g} cycles")
+    return violations
+
+
+def format_measurement(result: Dict[str, Any]) -> str:
+    cycles = f", {result['cycles_per_call']} cycles/call" if result.get("cycles_per_call") is not None else ""
+    return (f"{result['module']} (-O2, {result['toolchain']}): {result['ns_per_call']} ns/call, "
+            f"{result['calls_per_sec']:.0f} calls/s{cycles}, stack {result.get('stack_bytes')} B, "
+            f"static {result.get('static_bytes')} B, code {result.get('text_bytes')} B")
+
+
+def format_report(result: Dict[str, Any], regressions: List[Dict[str, Any]], violations: List[str]) -> str:
+    """Text for the reviewer and refactorer prompts. Empty when there is nothing to flag."""
+    if result.get("status") == "error":
+        return (f"The runtime benchmark failed: {result.get('reason')}\n"
+                f"Keep the public API of {result.get('module')}.h that bench/bench_{result.get('module')}.c calls.")
+    if not regressions and not violations:
+        return ""
+    lines = [f"Runtime benchmark of the last build: {format_measurement(result)}"]
+    if regressions:
+        lines.append("Regressions against the previous iteration:")
+        for regression in regressions:
+            change = f" (+{regression['change_percent']}%)" if regression["change_percent"] is not None else ""
+            lines.append(f"- {regression['metric']}: {regression['previous']} -> {regression['current']}{change}")
+    if violations:
+        lines.append("Per-cycle budget of the control loop:")
+        lines += [f"- {violation}" for violation in violations]
+    lines.append("Make the code at least as fast and small as before without changing its behavior.")
+    return "\n".join(lines)
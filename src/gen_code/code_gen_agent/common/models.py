@@ -5,3 +5,4 @@ class Model(Enum):
     GEMINI_1_5_FLASH = "gemini-1.5-flash-latest"
     GEMINI_1_5_PRO = "gemini-1.5-pro-latest"
     GEMINI_2_0_FLASH = "gemini-2.0-flash"
+    GEMINI_2_5_PRO = "gemini-2.5-pro"
@@ -0,0 +1,224 @@
+"""
+Multi-module generation from a module manifest.
+
+A manifest (JSON) lists the modules of body_app and the modules each one uses:
+
+    {"modules": [
+        {"name": "battery_monitor", "spec": "items.md", "section": "1. バッテリー残量インジケータ＋エネルギー回生制御",
+         "summary": "Battery level/temperature monitoring and warning flags."},
+        {"name": "regen_control", "spec": "items.md", "section": "1. バッテリー残量インジケータ＋エネルギー回生制御",
+         "summary": "Regenerative braking strength.", "depends_on": ["battery_monitor"]}]}
+
+`spec` is relative to the manifest and `section` selects one heading of it (with everything below that
+heading). `batch.run_modules` first writes the header of every module (dependency levels in parallel),
+then runs the pipeline of each module in its own workspace as soon as the modules it depends on are done,
+and finally links body_app once with all modules.
+
+Inside a module run, state['module'] = {"name": ..., "depends_on": [...]} makes the refactorer write
+`<name>.h/.c`, the test writer `tests/test_<name>.cpp`, the builder compile the `<name>_module` object
+library and the test runner build and run `test_<name>`. Without it the pipeline produces doorlock_control.
+"""
+import re
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from gen_code.code_gen_agent.common.build_engine import IncrementalBuilder, TEST_TARGET
+
+MODULE_STATE_KEY = "module"
+DEFAULT_MODULE = "doorlock_control"
+# examples からの相対パス。cmake/*.cmake は構成のフィンガープリントに含まれるため、変更すると再構成されます
+MODULES_CMAKE = Path("cmake") / "modules.cmake"
+MODULE_SOURCE_DIR = Path("src") / "body_app"
+TEST_PLACEHOLDER = "// Placeholder: replaced by TestWriterAgent.\n"
+
+_MODULE_NAME = re.compile(r"^[a-z_][a-z0-9_]*$")
+_HEADING = re.compile(r"^(#+)\s+(.*?)\s*$")
+
+
+class ManifestError(ValueError):
+    """The manifest is malformed: unknown or cyclic dependencies, bad module names or missing sections."""
+
+
+@dataclass
+class ModuleSpec:
+    """One module of the manifest."""
+    name: str
+    spec_text: str
+    summary: str = ""
+    depends_on: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ModuleManifest:
+    path: Path
+    modules: Dict[str, ModuleSpec]
+
+    def levels(self) -> List[List[str]]:
+        """Modules grouped by dependency depth: every module only depends on modules of earlier levels."""
+        remaining = dict(self.modules)
+        done: List[str] = []
+        levels: List[List[str]] = []
+        while remaining:
+            level = sorted(name for name, module in remaining.items() if all(d in done for d in module.depends_on))
+            if not level:
+                raise ManifestError(f"Cyclic dependencies between modules: {', '.join(sorted(remaining))}")
+            levels.append(level)
+            done += level
+            for name in level:
+                del remaining[name]
+        return levels
+
+    def dependencies(self, name: str) -> List[str]:
+        """Transitive dependencies of a module, each after the modules it depends on."""
+        ordered: List[str] = []
+
+        def _visit(current: str) -> None:
+            for dependency in self.modules[current].depends_on:
+                if dependency not in ordered:
+                    _visit(dependency)
+                    ordered.append(dependency)
+
+        _visit(name)
+        return ordered
+
+
+def extract_section(text: str, heading: str) -> str:
+    """Returns the section whose heading text starts with `heading`, up to the next heading of the same or a higher level."""
+    lines = text.splitlines()
+    for start, line in enumerate(lines):
+        match = _HEADING.match(line)
+        if match and match.group(2).startswith(heading):
+            level = len(match.group(1))
+            end = next((i for i in range(start + 1, len(lines))
+                        if (m := _HEADING.match(lines[i])) and len(m.group(1)) <= level), len(lines))
+            return "\n".join(lines[start:end]).strip()
+    raise ManifestError(f"Section '{heading}' not found")
+
+
+def load_manifest(path: Path) -> ModuleManifest:
+    path = Path(path)
+    data = json.loads(path.read_text(encoding="utf-8"))
+    modules: Dict[str, ModuleSpec] = {}
+    for entry in data.get("modules", []):
+        name = entry.get("name", "")
+        if not _MODULE_NAME.match(name) or name in modules:
+            raise ManifestError(f"Invalid or duplicate module name '{name}' in {path}")
+        spec_text = entry.get("text", "")
+        if entry.get("spec"):
+            spec_text = (path.parent / entry["spec"]).read_text(encoding="utf-8")
+            if entry.get("section"):
+                try:
+                    spec_text = extract_section(spec_text, entry["section"])
+                except ManifestError as e:
+                    raise ManifestError(f"{e} in {entry['spec']} (module '{name}')") from None
+        modules[name] = ModuleSpec(name, spec_text, entry.get("summary", ""), list(entry.get("depends_on", [])))
+    if not modules:
+        raise ManifestError(f"No modules in {path}")
+    for module in modules.values():
+        unknown = [d for d in module.depends_on if d not in modules]
+        if unknown:
+            raise ManifestError(f"Module '{module.name}' depends on unknown module(s): {', '.join(unknown)}")
+    manifest = ModuleManifest(path, modules)
+    manifest.levels()
+    return manifest
+
+
+# ----------------------------------------------------------------------
+# Module of the current run
+# ----------------------------------------------------------------------
+def module_state(module: ModuleSpec, manifest: ModuleManifest) -> Dict[str, Any]:
+    return {"name": module.name, "depends_on": manifest.dependencies(module.name)}
+
+
+def module_name(state: Optional[Mapping[str, Any]]) -> str:
+    module = state.get(MODULE_STATE_KEY) if state is not None else None
+    return module["name"] if isinstance(module, dict) else DEFAULT_MODULE
+
+
+def module_targets(builder: IncrementalBuilder, state: Optional[Mapping[str, Any]]) -> Tuple[Optional[List[str]], str]:
+    """
+    (build targets, test target) of the current run. Registers the module's targets with the builder so
+    that their fingerprints cover the module's sources. The default run keeps body_app/brake_app.
+    """
+    module = state.get(MODULE_STATE_KEY) if state is not None else None
+    if not isinstance(module, dict):
+        return None, TEST_TARGET
+    name = module["name"]
+    builder.target_dirs.setdefault(f"{name}_module", (MODULE_SOURCE_DIR.as_posix(),))
+    builder.target_dirs.setdefault(f"test_{name}", ("tests", MODULE_SOURCE_DIR.as_posix()))
+    return [f"{name}_module"], f"test_{name}"
+
+
+# ----------------------------------------------------------------------
+# Workspaces
+# ----------------------------------------------------------------------
+def write_modules_cmake(examples_dir: Path, manifest: ModuleManifest, names: Optional[Sequence[str]] = None) -> Path:
+    """Writes the module list (default: all modules) read by the src/body_app and tests CMakeLists.txt."""
+    names = list(names) if names is not None else [name for level in manifest.levels() for name in level]
+    lines = ["# Generated by gen_code (common/modules.py) from the module manifest. Do not edit.",
+             f"set(GEN_CODE_MODULES {' '.join(names)})"]
+    lines += [f"set(GEN_CODE_MODULE_DEPENDS_{name} {' '.join(manifest.dependencies(name))})"
+              for name in names if manifest.dependencies(name)]
+    path = examples_dir / MODULES_CMAKE
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return path
+
+
+def prepare_module_workspace(examples_dir: Path, manifest: ModuleManifest, module: str) -> None:
+    """
+    Limits the workspace's CMake project to the module and its dependencies, and creates a placeholder
+    test file so that the `test_<module>` target exists from the first configure on.
+    """
+    write_modules_cmake(examples_dir, manifest, [*manifest.dependencies(module), module])
+    test_file = examples_dir / "tests" / f"test_{module}.cpp"
+    if not test_file.exists():
+        test_file.write_text(TEST_PLACEHOLDER, encoding="utf-8")
+
+
+def module_files(module: str) -> List[Path]:
+    """Generated files of a module (header, source, tests), relative to the examples directory."""
+    return [MODULE_SOURCE_DIR / f"{module}.h", MODULE_SOURCE_DIR / f"{module}.c", Path("tests") / f"test_{module}.cpp"]
+
+
+def read_headers(examples_dir: Path, modules: Sequence[str]) -> Dict[str, str]:
+    headers = {}
+    for name in modules:
+        path = examples_dir / MODULE_SOURCE_DIR / f"{name}.h"
+        if path.is_file():
+            headers[name] = path.read_text(encoding="utf-8")
+    return headers
+
+
+# ----------------------------------------------------------------------
+# Messages
+# ----------------------------------------------------------------------
+def _headers_block(headers: Mapping[str, str]) -> str:
+    return "\n\n".join(f"`{name}.h`:\n```c\n{text.strip()}\n```" for name, text in headers.items())
+
+
+def header_message(module: ModuleSpec, dependency_headers: Mapping[str, str]) -> str:
+    text = [f"Module: `{module.name}` (header `{module.name}.h`)"]
+    if module.summary:
+        text.append(f"Responsibility: {module.summary}")
+    if dependency_headers:
+        text.append("Headers of the modules it uses (include them, do not redeclare their types):\n\n"
+                    + _headers_block(dependency_headers))
+    text.append("Requirements:\n\n" + module.spec_text)
+    return "\n\n".join(text)
+
+
+def module_message(module: ModuleSpec, header: str, dependency_headers: Mapping[str, str]) -> str:
+    text = [
+        f"Implement the module `{module.name}` as `{module.name}.h` and `{module.name}.c` of body_app.",
+        f"Keep every declaration of its header below (other modules are written against it); the tests go to "
+        f"`test_{module.name}.cpp` and include `{module.name}.h`.",
+    ]
+    if module.summary:
+        text.append(f"Responsibility: {module.summary}")
+    text.append(_headers_block({module.name: header}))
+    if dependency_headers:
+        text.append("Modules it may use (already implemented, include their headers):\n\n" + _headers_block(dependency_headers))
+    text.append("Requirements:\n\n" + module.spec_text)
+    return "\n\n".join(text)
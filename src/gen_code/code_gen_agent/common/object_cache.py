@@ -0,0 +1,192 @@
+"""
+Content-addressed object cache, used as the CMake compiler launcher of every build tree.
+
+`build_scheduler.configure_args()` makes Ninja run each compile as
+
+    python -S object_cache.py <cache dir> <compiler> <flags...> -o x.c.o -c x.c
+
+The key is the hash of the compiler (resolved path, size, mtime), the flags that affect code generation
+and the preprocessed source. Include paths, macro definitions and output paths are left out of the key:
+their effect is already in the preprocessed text, so the same source compiles to the same entry in every
+workspace. Line markers are dropped too unless -g is given (they only carry paths and line numbers).
+
+Only clean compiles are stored: a compile that printed a warning runs again next time so that its
+diagnostics reach the build log. Coverage-instrumented compiles (--coverage) write .gcno files next to
+the object and are never cached. Each lookup appends "hit", "miss" or "skip" to the file named by
+GEN_CODE_OBJECT_CACHE_LOG, which the build scheduler reads to report the hit rate.
+
+The script runs once per compile, so it keeps its imports to os, sys, hashlib and subprocess: the import
+time of typing or pathlib is noticeable next to the compile of a small source file.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import hashlib
+import subprocess
+
+OBJECT_CACHE_LOG_ENV = "GEN_CODE_OBJECT_CACHE_LOG"
+OBJECT_SUFFIX = ".o"
+
+_SOURCE_SUFFIXES = (".c", ".cc", ".cpp", ".cxx")
+# 値を次の引数に取るオプション
+_OUTPUT_OPTIONS = ("-o", "-MF", "-MT", "-MQ")
+_PREPROCESSOR_OPTIONS = ("-I", "-D", "-U", "-isystem", "-iquote", "-idirafter", "-include", "-imacros")
+_UNCACHEABLE = ("--coverage", "-fprofile-arcs", "-ftest-coverage", "-fprofile-generate", "-save-temps")
+_LINE_MARKER = b"# "
+
+
+def object_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, key[:2], f"{key}{OBJECT_SUFFIX}")
+
+
+def parse_compile(args: list[str]) -> tuple[str, str, list[str]] | None:
+    """
+    Returns (source, output, flags that go into the key) of a cacheable `-c` compile, or None.
+    """
+    if "-c" not in args or any(arg.startswith(_UNCACHEABLE) for arg in args):
+        return None
+    source = output = None
+    flags: list[str] = []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg in _OUTPUT_OPTIONS or arg in _PREPROCESSOR_OPTIONS:
+            if arg == "-o":
+                output = args[index + 1] if index + 1 < len(args) else None
+            index += 2
+            continue
+        if arg.startswith(("-o", "-I", "-D", "-U", "-MF", "-MT", "-MQ")) or arg in ("-MD", "-MMD"):
+            if arg.startswith("-o"):
+                output = arg[2:]
+            index += 1
+            continue
+        if not arg.startswith("-") and arg.endswith(_SOURCE_SUFFIXES):
+            if source is not None:
+                return None  # 複数ソースの同時コンパイルは対象外です
+            source = arg
+        else:
+            flags.append(arg)
+        index += 1
+    if source is None or output is None:
+        return None
+    return source, output, flags
+
+
+def _compiler_identity(compiler: str) -> str:
+    path = compiler
+    if os.sep not in compiler:
+        for directory in os.environ.get("PATH", "").split(os.pathsep):
+            candidate = os.path.join(directory, compiler)
+            if os.access(candidate, os.X_OK):
+                path = candidate
+                break
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return compiler
+    return f"{os.path.realpath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}"
+
+
+def cache_key(compiler: str, flags: list[str], preprocessed: bytes) -> str:
+    digest = hashlib.sha256(_compiler_identity(compiler).encode("utf-8"))
+    digest.update("\0".join(flags).encode("utf-8"))
+    digest.update(b"\0")
+    if not any(flag.startswith("-g") and flag != "-g0" for flag in flags):
+        preprocessed = b"\n".join(line for line in preprocessed.split(b"\n") if not line.startswith(_LINE_MARKER))
+    digest.update(preprocessed)
+    return digest.hexdigest()
+
+
+def _preprocess_command(compiler: str, args: list[str]) -> list[str]:
+    # -o/-c を -E に置き換えます。-MD -MF は残すので、依存ファイル (.d) はここで書かれます
+    command = [compiler]
+    index = 0
+    while index < len(args):
+        if args[index] == "-o":
+            index += 2
+            continue
+        if args[index] != "-c":
+            command.append(args[index])
+        index += 1
+    return command + ["-E"]
+
+
+def _record(outcome: str) -> None:
+    log = os.environ.get(OBJECT_CACHE_LOG_ENV)
+    if not log:
+        return
+    try:
+        # O_APPEND の短い書き込みは並列のコンパイル間でも混ざりません
+        fd = os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, f"{outcome}\n".encode("ascii"))
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+
+def _copy(source: str, destination: str) -> None:
+    # 一時ファイル + rename で、並列の読み手に書きかけのファイルを見せません
+    tmp_name = f"{destination}.{os.getpid()}.tmp"
+    with open(source, "rb") as src, open(tmp_name, "wb") as dst:
+        dst.write(src.read())
+    os.replace(tmp_name, destination)
+
+
+def _store(path: str, output: str) -> None:
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _copy(output, path)
+    except OSError:
+        pass
+
+
+def _restore(path: str, output: str) -> bool:
+    try:
+        _copy(path, output)
+        os.utime(path)  # LRU: 参照時刻を更新
+    except OSError:
+        return False
+    return True
+
+
+def run(cache_dir: str, compiler: str, args: list[str]) -> int:
+    command = [compiler, *args]
+    parsed = parse_compile(args)
+    if parsed is None:
+        _record("skip")
+        return subprocess.call(command)
+    _, output, flags = parsed
+
+    preprocess = subprocess.run(_preprocess_command(compiler, args), capture_output=True)
+    if preprocess.returncode != 0:
+        # 前処理のエラーはコンパイラ自身に報告させます
+        _record("skip")
+        return subprocess.call(command)
+
+    path = object_path(cache_dir, cache_key(compiler, flags, preprocess.stdout))
+    if _restore(path, output):
+        _record("hit")
+        return 0
+
+    _record("miss")
+    process = subprocess.run(command, capture_output=True)
+    sys.stdout.buffer.write(process.stdout)
+    sys.stderr.buffer.write(process.stderr)
+    # JSON 形式の診断は警告がなくても "[]" を出力します
+    if process.returncode == 0 and process.stderr.strip() in (b"", b"[]"):
+        _store(path, output)
+    return process.returncode
+
+
+def main(argv: list[str]) -> int:
+    if len(argv) < 2:
+        print("usage: object_cache.py <cache dir> <compiler> [args...]", file=sys.stderr)
+        return 2
+    return run(argv[0], argv[1], argv[2:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,191 @@
+"""
+Patch-based code edits for the refactorer.
+
+Two formats are accepted, both addressed to a file by its label ("header" or "source"):
+
+Search/replace blocks:
+
+    <<<<<<< SEARCH header
+    int old(void);
+    =======
+    int new(void);
+    >>>>>>> REPLACE
+
+Unified diffs (`--- a/header` / `+++ b/header` followed by `@@` hunks). Each diff hunk is turned into
+a search/replace edit from its context and removed lines, so the line numbers in the `@@` header are
+not needed and stale numbers do not break the patch.
+
+`apply_edits` is all-or-nothing: if any edit does not match exactly one location, no file is changed
+and a PatchError listing every conflict is raised.
+"""
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# 出力形式: "full" (既定、ファイル全体の JSON) または "diff" (変更箇所だけの search/replace ブロック)
+REFACTOR_OUTPUT_ENV = "GEN_CODE_REFACTOR_OUTPUT"
+
+_SEARCH_BLOCK = re.compile(
+    r"^<{5,9} ?SEARCH[ \t]*(?P<file>[\w./-]*)[ \t]*\n(?P<search>.*?)^={5,9}[ \t]*\n(?P<replace>.*?)^>{5,9} ?REPLACE[ \t]*$",
+    re.DOTALL | re.MULTILINE,
+)
+_DIFF_FILE = re.compile(r"^\+\+\+ (?:b/)?(?P<file>\S+)", re.MULTILINE)
+
+
+def patch_output_enabled() -> bool:
+    return os.environ.get(REFACTOR_OUTPUT_ENV, "full").strip().lower() == "diff"
+
+
+class PatchError(ValueError):
+    """Raised when edits cannot be applied; `conflicts` has one message per failing edit."""
+
+    def __init__(self, conflicts: List[str]):
+        super().__init__("; ".join(conflicts))
+        self.conflicts = conflicts
+
+
+@dataclass
+class Edit:
+    file: str
+    search: str
+    replace: str
+
+
+def _file_label(name: str, files: List[str]) -> str:
+    # "doorlock_control.h" や "a/header" のような指定もラベルに対応付けます
+    name = name.strip()
+    if name in files:
+        return name
+    suffix = Path(name).suffix
+    for label in files:
+        if (label == "header" and suffix == ".h") or (label == "source" and suffix == ".c"):
+            return label
+    return name
+
+
+def _parse_unified_diff(text: str) -> List[Edit]:
+    edits: List[Edit] = []
+    current_file: Optional[str] = None
+    search: List[str] = []
+    replace: List[str] = []
+
+    def flush() -> None:
+        if current_file is not None and (search or replace):
+            edits.append(Edit(current_file, "".join(search), "".join(replace)))
+        search.clear()
+        replace.clear()
+
+    for line in text.splitlines(keepends=True):
+        if line.startswith("--- "):
+            flush()
+            continue
+        match = _DIFF_FILE.match(line)
+        if match:
+            flush()
+            current_file = match.group("file")
+            continue
+        if line.startswith("@@"):
+            flush()
+            continue
+        if current_file is None or line.startswith("\\"):
+            continue
+        body = line[1:] if line[:1] in (" ", "-", "+") else line
+        if not line.strip() and not line.startswith(" "):
+            body = "\n"
+        if line.startswith("-"):
+            search.append(body)
+        elif line.startswith("+"):
+            replace.append(body)
+        elif line.startswith(" ") or not line.strip():
+            search.append(body)
+            replace.append(body)
+        else:
+            # ```diff のフェンスなど hunk 外の行
+            flush()
+    flush()
+    return edits
+
+
+def parse_edits(text: str, files: Optional[List[str]] = None) -> List[Edit]:
+    """Extracts search/replace blocks, or unified diff hunks if there are none, from the model output."""
+    files = files or ["header", "source"]
+    edits = [
+        Edit(match.group("file"), match.group("search"), match.group("replace"))
+        for match in _SEARCH_BLOCK.finditer(text)
+    ]
+    if not edits and _DIFF_FILE.search(text):
+        edits = _parse_unified_diff(text)
+    for edit in edits:
+        edit.file = _file_label(edit.file, files)
+    return edits
+
+
+def _locate(content: str, search: str) -> List[int]:
+    positions = []
+    start = content.find(search)
+    while start != -1:
+        positions.append(start)
+        start = content.find(search, start + 1)
+    return positions
+
+
+def _normalize_trailing_whitespace(text: str) -> str:
+    return "\n".join(line.rstrip() for line in text.split("\n"))
+
+
+def apply_edits(files: Dict[str, str], edits: List[Edit]) -> Dict[str, str]:
+    """
+    Applies the edits in order to copies of `files` (label -> content) and returns the new contents.
+    Every search text must match exactly once; trailing whitespace differences are tolerated.
+    """
+    result = dict(files)
+    conflicts: List[str] = []
+    for index, edit in enumerate(edits, start=1):
+        if edit.file not in result:
+            conflicts.append(f"edit {index}: unknown file '{edit.file}' (expected one of {sorted(result)})")
+            continue
+        content = result[edit.file]
+        if not edit.search.strip():
+            # 空の SEARCH はファイル末尾への追記とみなします
+            result[edit.file] = content + ("" if content.endswith("\n") or not content else "\n") + edit.replace
+            continue
+        positions = _locate(content, edit.search)
+        if not positions:
+            # 行末の空白の違いだけなら正規化して再検索します
+            normalized = _normalize_trailing_whitespace(content)
+            normalized_search = _normalize_trailing_whitespace(edit.search)
+            if len(_locate(normalized, normalized_search)) == 1:
+                content = normalized
+                positions = _locate(normalized, normalized_search)
+                edit = Edit(edit.file, normalized_search, edit.replace)
+        if len(positions) != 1:
+            reason = "not found" if not positions else f"matches {len(positions)} locations"
+            first_line = edit.search.strip().splitlines()[0][:80]
+            conflicts.append(f"edit {index} ({edit.file}): search text {reason}: '{first_line}'")
+            continue
+        start = positions[0]
+        result[edit.file] = content[:start] + edit.replace + content[start + len(edit.search):]
+    if conflicts:
+        raise PatchError(conflicts)
+    return result
+
+
+def write_files_atomically(contents: Dict[Path, str]) -> None:
+    """Writes all files through temporary files that are only renamed into place once every write succeeded."""
+    staged: List[Tuple[str, Path]] = []
+    try:
+        for path, content in contents.items():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(content)
+            staged.append((temp_path, path))
+        for temp_path, path in staged:
+            os.replace(temp_path, path)
+    finally:
+        for temp_path, _ in staged:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
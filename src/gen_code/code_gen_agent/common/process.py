@@ -0,0 +1,151 @@
+import os
+import codecs
+import signal
+import asyncio
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List, Mapping, Optional, Sequence
+
+# (stream_name, line) -> None. stream_name は "stdout" または "stderr"
+OutputCallback = Callable[[str, str], None]
+
+_KILL_GRACE_SECONDS = 2.0
+_READ_CHUNK_BYTES = 64 * 1024
+
+
+@dataclass
+class ProcessResult:
+    """Outcome of an asynchronous command. On timeout the output captured so far is kept."""
+    returncode: int
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+
+
+async def _pump(stream: asyncio.StreamReader, name: str, chunks: List[str], on_output: Optional[OutputCallback]) -> None:
+    # readline() は 1 行が StreamReader の上限 (64 KiB) を超えると ValueError になります。
+    # gcc の -fdiagnostics-format=json は翻訳単位ごとの診断を 1 行で出力するため、固定長で読んで自前で行に分けます
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    while True:
+        data = await stream.read(_READ_CHUNK_BYTES)
+        *lines, pending = (pending + decoder.decode(data, final=not data)).split("\n")
+        texts = [line + "\n" for line in lines] + ([pending] if not data and pending else [])
+        for text in texts:
+            chunks.append(text)
+            if on_output:
+                on_output(name, text)
+        if not data:
+            return
+
+
+def _signal_group(process: asyncio.subprocess.Process, sig: int) -> None:
+    try:
+        if os.name == "nt":
+            process.kill()
+        else:
+            # make/cmake/ninja はコンパイラを子プロセスとして起動するため、プロセスグループごと終了させます
+            os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def _terminate(process: asyncio.subprocess.Process) -> None:
+    if process.returncode is not None:
+        return
+    _signal_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), _KILL_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        _signal_group(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+        await process.wait()
+
+
+async def run_process(
+        command: Sequence[str],
+        cwd: Path,
+        timeout: Optional[float] = None,
+        on_output: Optional[OutputCallback] = None,
+        env: Optional[Mapping[str, str]] = None
+    ) -> ProcessResult:
+    """
+    Runs a command without blocking the event loop, streaming its output line by line.
+
+    The command runs in its own process group. On timeout the whole group is killed and the
+    partial output is returned with timed_out=True; if the awaiting task is cancelled or reading
+    the output fails, the group is killed as well and the exception propagates. Lines of any length
+    are passed through. `env` adds variables to the inherited environment.
+    Raises FileNotFoundError if the executable does not exist.
+    """
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    if env:
+        kwargs["env"] = {**os.environ, **env}
+
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        cwd=str(cwd),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        **kwargs
+    )
+    stdout_chunks: List[str] = []
+    stderr_chunks: List[str] = []
+    readers = asyncio.gather(
+        _pump(process.stdout, "stdout", stdout_chunks, on_output),
+        _pump(process.stderr, "stderr", stderr_chunks, on_output),
+    )
+    timed_out = False
+    try:
+        try:
+            await asyncio.wait_for(asyncio.shield(readers), timeout)
+            await process.wait()
+        except asyncio.TimeoutError:
+            timed_out = True
+            await _terminate(process)
+            # パイプはプロセス終了で閉じられるので、残りの出力を読み切ります
+            try:
+                await asyncio.wait_for(readers, _KILL_GRACE_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        # キャンセルや読み取りの例外でも、プロセスグループを残さないようにします
+        if process.returncode is None:
+            await _terminate(process)
+        if not readers.done():
+            readers.cancel()
+            # キャンセルされた gather の例外を回収し、"exception was never retrieved" のログを防ぎます
+            readers.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+    return ProcessResult(
+        returncode=process.returncode if process.returncode is not None else -1,
+        stdout="".join(stdout_chunks),
+        stderr="".join(stderr_chunks),
+        timed_out=timed_out,
+    )
+
+
+class LiveLog:
+    """OutputCallback that appends every streamed line to a file, so a running build can be followed with 'tail -f'."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8")
+
+    def __call__(self, stream: str, line: str) -> None:
+        self._file.write(line if stream == "stdout" else f"[{stream}] {line}")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "LiveLog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,186 @@
+"""
+Local stand-in model that replays recorded responses.
+
+A recording maps every LlmAgent name to the list of responses it returned in one pipeline run:
+
+    {"responses": {"CodeWriterAgent": [{"text": "...", "usage": {"prompt_token_count": 812, ...}}], ...}}
+
+`use_replay_model(root_agent, recording)` swaps the model of every LlmAgent in the tree for a
+ReplayLlm, so the whole pipeline (callbacks, file writes, builds, loops) runs without network
+access or an API key. `record_responses(root_agent, recording)` wraps the real models and fills
+a recording while the pipeline runs against them.
+
+With a `SimulatedQuota` the stand-in also behaves like a throttled endpoint: calls above its
+per-window limit fail with the same 429 RESOURCE_EXHAUSTED error as the Gemini API.
+"""
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional
+
+from google.adk.agents import BaseAgent, LlmAgent
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.genai import errors, types
+
+from gen_code.code_gen_agent.common.scheduler import ScheduledLlm
+
+Recording = Dict[str, Any]
+
+
+def _own_turns(llm_request: LlmRequest) -> int:
+    # ADK は他のエージェントの発言を user ロールに変換するため、model ロールの数 = このエージェントの過去の応答数
+    return sum(1 for content in llm_request.contents if content.role == "model")
+
+
+class SimulatedQuota:
+    """
+    Accepts at most `calls` calls per sliding window (one minute by default), shared by all ReplayLlms
+    of a run like a per-project quota.
+    """
+
+    def __init__(self, calls: int, window_seconds: float = 60.0):
+        self.calls = calls
+        self.window_seconds = window_seconds
+        self.rejected = 0
+        self._calls: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def check(self) -> None:
+        """Records a call, or raises a 429 ClientError when the window is full."""
+        now = time.monotonic()
+        with self._lock:
+            while self._calls and now - self._calls[0] >= self.window_seconds:
+                self._calls.popleft()
+            if len(self._calls) >= self.calls:
+                self.rejected += 1
+                raise errors.ClientError(429, {"error": {
+                    "code": 429,
+                    "message": "Resource has been exhausted (e.g. check quota).",
+                    "status": "RESOURCE_EXHAUSTED",
+                }})
+            self._calls.append(now)
+
+
+class ReplayLlm(BaseLlm):
+    """
+    Returns the recorded responses of one agent in order.
+
+    The n-th call of the agent within a session gets the n-th recorded response (the position is
+    derived from the agent's own previous turns in the request history, so concurrent sessions
+    replay independently). Once the recording is exhausted the last response is repeated.
+    With stream=True the text is returned as partial responses followed by the final one.
+    """
+
+    model: str = "replay"
+    agent_name: str = ""
+    responses: List[Dict[str, Any]] = []
+    latency_seconds: float = 0.0
+    # stream=True (SSE) のときに部分応答 1 つあたりに含める文字数
+    stream_chunk_chars: int = 200
+    quota: Optional[Any] = None  # SimulatedQuota
+
+    async def generate_content_async(
+            self, llm_request: LlmRequest, stream: bool = False
+        ) -> AsyncGenerator[LlmResponse, None]:
+        if not self.responses:
+            raise ValueError(f"No recorded responses for agent '{self.agent_name}'.")
+        if self.quota is not None:
+            self.quota.check()
+        response = self.responses[min(_own_turns(llm_request), len(self.responses) - 1)]
+        usage = response.get("usage")
+        if stream:
+            # 実際のモデルと同様に、部分応答を順に返した後で全文の最終応答を返します
+            text = response["text"]
+            chunks = range(0, len(text), max(1, self.stream_chunk_chars))
+            for start in chunks:
+                if self.latency_seconds:
+                    await asyncio.sleep(self.latency_seconds / len(chunks))
+                yield LlmResponse(
+                    content=types.Content(role="model", parts=[types.Part(text=text[start:start + self.stream_chunk_chars])]),
+                    partial=True,
+                )
+        elif self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[types.Part(text=response["text"])]),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(**usage) if usage else None,
+        )
+
+
+class RecordingLlm(BaseLlm):
+    """Forwards every call to the real model and appends its final response to a recording."""
+
+    model: str = "recording"
+    agent_name: str = ""
+    inner: BaseLlm
+    recording: Any = None  # shared dict, filled in place
+
+    async def generate_content_async(
+            self, llm_request: LlmRequest, stream: bool = False
+        ) -> AsyncGenerator[LlmResponse, None]:
+        if not llm_request.model or llm_request.model == self.model:
+            llm_request.model = self.inner.model
+        async for response in self.inner.generate_content_async(llm_request, stream=stream):
+            if not response.partial and response.content and response.content.parts:
+                usage = response.usage_metadata
+                self.recording.setdefault("responses", {}).setdefault(self.agent_name, []).append({
+                    "text": "".join(part.text or "" for part in response.content.parts),
+                    "usage": usage.model_dump(exclude_none=True) if usage else None,
+                })
+            yield response
+
+
+def _llm_agents(agent: BaseAgent) -> List[LlmAgent]:
+    agents = [agent] if isinstance(agent, LlmAgent) else []
+    for sub_agent in agent.sub_agents:
+        agents += _llm_agents(sub_agent)
+    return agents
+
+
+def use_replay_model(
+        agent: BaseAgent,
+        recording: Recording,
+        latency_seconds: float = 0.0,
+        quota: Optional[SimulatedQuota] = None
+    ) -> BaseAgent:
+    """
+    Replaces the model of every LlmAgent in the tree with a ReplayLlm fed from the recording.
+    Models wrapped by the scheduler keep their wrapper, so the calls still go through it.
+    """
+    responses = recording.get("responses", {})
+    for llm_agent in _llm_agents(agent):
+        replay = ReplayLlm(
+            agent_name=llm_agent.name,
+            responses=responses.get(llm_agent.name, []),
+            latency_seconds=latency_seconds,
+            quota=quota,
+        )
+        if isinstance(llm_agent.model, ScheduledLlm):
+            llm_agent.model.inner = replay
+            llm_agent.model.model = replay.model
+        else:
+            llm_agent.model = replay
+    return agent
+
+
+def record_responses(agent: BaseAgent, recording: Recording) -> Recording:
+    """Wraps the model of every LlmAgent in the tree so that its responses are added to the recording."""
+    for llm_agent in _llm_agents(agent):
+        inner = llm_agent.canonical_model
+        if isinstance(inner, RecordingLlm):
+            inner = inner.inner
+        llm_agent.model = RecordingLlm(agent_name=llm_agent.name, inner=inner, recording=recording)
+    return recording
+
+
+def load_recording(path: Path) -> Recording:
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def save_recording(recording: Recording, path: Path) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(recording, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
@@ -0,0 +1,46 @@
+import os
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from gen_code.code_gen_agent.common.constants import CACHE_DIR
+from gen_code.code_gen_agent.common.disk_cache import DiskCache
+
+# ビルド/テスト結果 ({status, summary, diagnostics, failed_tests, ...}) のキャッシュ。
+# キーは生成ソース・CMake・ツールチェーンの内容ハッシュなので、同一内容なら make/cmake を呼ばずに結果を返せます。
+result_cache = DiskCache(
+    CACHE_DIR / "results",
+    max_bytes=int(os.environ.get("GEN_CODE_RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024,
+    enabled=os.environ.get("GEN_CODE_RESULT_CACHE", "1") != "0",
+)
+
+def reproducible(result: Dict[str, Any]) -> bool:
+    """
+    True if a build/test result can be replayed for the same sources: a success, or a failure with a
+    parsed cause (an error at a source location or a failed test). Failures without one (OOM-killed
+    compiler, full disk, killed ctest, missing cmake) may be transient and are not stored.
+    """
+    if result.get("status") == "success":
+        return True
+    located_errors = [d for d in result.get("diagnostics") or []
+                      if d.get("severity") in ("error", "fatal error") and d.get("file")]
+    return bool(located_errors or result.get("failed_tests"))
+
+
+# 結果にはワークスペースの絶対パス (テストディレクトリ、診断の file, log_file) が含まれるため、
+# 別のワークスペースで再利用できるよう保存時にプレースホルダへ置き換えます。
+WORKSPACE_PLACEHOLDER = "${workspace}"
+
+
+def _relocate(value: Dict[str, Any], old: str, new: str) -> Dict[str, Any]:
+    return json.loads(json.dumps(value, ensure_ascii=False).replace(json.dumps(old)[1:-1], json.dumps(new)[1:-1]))
+
+
+def get_result(key: str, workspace: Path) -> Optional[Dict[str, Any]]:
+    """Returns the stored result with its paths pointing into `workspace`, or None."""
+    value = result_cache.get(key)
+    return _relocate(value, WORKSPACE_PLACEHOLDER, str(workspace)) if value is not None else None
+
+
+def put_result(key: str, result: Dict[str, Any], workspace: Path) -> None:
+    result_cache.put(key, _relocate(result, str(workspace), WORKSPACE_PLACEHOLDER))
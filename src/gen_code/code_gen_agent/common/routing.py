@@ -0,0 +1,247 @@
+"""
+Adaptive model tiering.
+
+`route_models(root_agent)` adds `model_router.before_model` to every LlmAgent. Before each model call the
+router picks a model from MODEL_TIERS (cheapest first) and sets it on the request:
+
+- the first write, review, refactor and test-writing passes use the first (fast) tier;
+- after GEN_CODE_MODEL_ESCALATE_AFTER (default 2) consecutive failed attempts of the agent's stage
+  (failed builds for the writer, reviewers and refactorer, failed tests for the test writer) the agent
+  moves up one tier, and down again once its stage succeeds. Calls with no stage result yet (e.g. the
+  header writer, or the first review before any build) neither count as failures nor reset the count;
+- a tier whose observed latency exceeds the stage's latency budget is skipped in favour of the
+  strongest tier within budget (GEN_CODE_MODEL_BUDGETS, e.g. "CodeRefactorerAgent=60", default 120s).
+
+Every decision is logged with its outcome: the model latency, whether it stayed within budget, and the
+status of the stage result the next time the agent is routed (or when the pipeline ends). The resolved
+decisions are appended to GEN_CODE_ROUTING_LOG (JSONL) when it is set. GEN_CODE_MODEL_ROUTING=0 keeps
+every agent on its own model.
+"""
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from google.adk.agents import BaseAgent, LlmAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+
+from gen_code.code_gen_agent.common.models import Model
+
+MODEL_ROUTING_ENV = "GEN_CODE_MODEL_ROUTING"
+MODEL_TIERS_ENV = "GEN_CODE_MODEL_TIERS"
+ESCALATE_AFTER_ENV = "GEN_CODE_MODEL_ESCALATE_AFTER"
+MODEL_BUDGETS_ENV = "GEN_CODE_MODEL_BUDGETS"
+ROUTING_LOG_ENV = "GEN_CODE_ROUTING_LOG"
+
+# 安い (速い) モデルから順に並べます
+MODEL_TIERS: Tuple[Model, ...] = (Model.GEMINI_2_0_FLASH, Model.GEMINI_2_5_PRO)
+DEFAULT_LATENCY_BUDGET_SECONDS = 120.0
+# 段階の成否を表す state キー。ここにないエージェントはビルド結果で判定します。
+STAGE_RESULT_KEYS = {"TestWriterAgent": "test_result"}
+DEFAULT_STAGE_RESULT_KEY = "build_result"
+# まだビルド/テストの結果がない段階の結果 (成功とも失敗とも数えません)
+UNKNOWN_OUTCOME = "unknown"
+# 観測したレイテンシの指数移動平均の重み
+_LATENCY_WEIGHT = 0.3
+
+
+@dataclass
+class RoutingDecision:
+    """One routed model call and, once known, its outcome."""
+    session_id: str
+    agent: str
+    model: str
+    tier: int
+    reason: str
+    failures: int
+    budget_seconds: float
+    latency_seconds: Optional[float] = None
+    within_budget: Optional[bool] = None
+    stage_outcome: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+
+def _parse_budgets(value: Optional[str]) -> Dict[str, float]:
+    budgets: Dict[str, float] = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, seconds = item.split("=", 1)
+            budgets[name.strip()] = float(seconds)
+    return budgets
+
+
+def _status(result: Any) -> Optional[str]:
+    return result.get("status") if isinstance(result, dict) else None
+
+
+class ModelRouter:
+    """Chooses the model tier of every call from the agent's recent stage outcomes and latency budget."""
+
+    def __init__(
+            self,
+            tiers: Sequence[str],
+            escalate_after: int = 2,
+            budgets: Optional[Dict[str, float]] = None,
+            log_path: Optional[Path] = None,
+            enabled: bool = True
+        ):
+        self.tiers = list(tiers)
+        self.escalate_after = max(1, escalate_after)
+        self.budgets = budgets or {}
+        self.log_path = Path(log_path) if log_path else None
+        self.enabled = enabled
+        self._decisions: Dict[str, List[RoutingDecision]] = {}
+        self._pending: Dict[Tuple[str, str], Tuple[RoutingDecision, float]] = {}
+        self._latency: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def budget(self, agent_name: str) -> float:
+        return self.budgets.get(agent_name, DEFAULT_LATENCY_BUDGET_SECONDS)
+
+    def decisions(self, session_id: str) -> List[RoutingDecision]:
+        return list(self._decisions.get(session_id, []))
+
+    def _failures(self, history: List[RoutingDecision]) -> int:
+        """Consecutive failed stage outcomes at the end of the agent's routing history. Unknown outcomes are skipped."""
+        failures = 0
+        for decision in reversed(history):
+            if decision.stage_outcome == UNKNOWN_OUTCOME:
+                continue
+            if decision.stage_outcome in (None, "success"):
+                break
+            failures += 1
+        return failures
+
+    def choose(self, agent_name: str, failures: int) -> Tuple[int, str]:
+        """Returns (tier, reason) for an agent with `failures` consecutive failed stage outcomes."""
+        tier = min(len(self.tiers) - 1, failures // self.escalate_after)
+        reason = f"escalated after {failures} failure(s)" if tier else "first tier"
+        budget = self.budget(agent_name)
+        # 予算を超えると分かっている段は、予算内で最も強い段に下げます
+        while tier > 0 and self._latency.get(self.tiers[tier], 0.0) > budget:
+            tier -= 1
+            reason = f"capped by the {budget:.0f}s latency budget"
+        return tier, reason
+
+    # ------------------------------------------------------------------
+    # Callbacks
+    # ------------------------------------------------------------------
+    def before_model(self, callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+        if not self.enabled or not self.tiers:
+            return None
+        agent_name = callback_context.agent_name
+        session_id = callback_context._invocation_context.session.id
+        status = _status(callback_context.state.get(STAGE_RESULT_KEYS.get(agent_name, DEFAULT_STAGE_RESULT_KEY)))
+        with self._lock:
+            history = [d for d in self._decisions.get(session_id, []) if d.agent == agent_name]
+            # 前回の呼び出しの結果は、その後のビルド/テストの結果です
+            if history and history[-1].stage_outcome is None:
+                history[-1].stage_outcome = status or UNKNOWN_OUTCOME
+                self._write(history[-1])
+            failures = self._failures(history)
+            tier, reason = self.choose(agent_name, failures)
+            decision = RoutingDecision(
+                session_id=session_id,
+                agent=agent_name,
+                model=self.tiers[tier],
+                tier=tier,
+                reason=reason,
+                failures=failures,
+                budget_seconds=self.budget(agent_name),
+            )
+            self._decisions.setdefault(session_id, []).append(decision)
+            self._pending[(callback_context.invocation_id, agent_name)] = (decision, time.monotonic())
+        if tier:
+            print(f"[Routing] {agent_name}: {decision.model} (tier {tier}, {reason})")
+        llm_request.model = decision.model
+        return None
+
+    def after_model(self, callback_context: CallbackContext, llm_response: LlmResponse) -> None:
+        if llm_response.partial:
+            return None
+        with self._lock:
+            pending = self._pending.pop((callback_context.invocation_id, callback_context.agent_name), None)
+            if pending is None:
+                return None
+            decision, started = pending
+            decision.latency_seconds = round(time.monotonic() - started, 3)
+            decision.within_budget = decision.latency_seconds <= decision.budget_seconds
+            if not llm_response.error_code:
+                previous = self._latency.get(decision.model)
+                self._latency[decision.model] = decision.latency_seconds if previous is None else \
+                    (1 - _LATENCY_WEIGHT) * previous + _LATENCY_WEIGHT * decision.latency_seconds
+        if not decision.within_budget:
+            print(f"[Routing] {decision.agent} on {decision.model} took {decision.latency_seconds}s "
+                  f"(budget {decision.budget_seconds:.0f}s)")
+        return None
+
+    def after_pipeline(self, callback_context: CallbackContext) -> None:
+        """after_agent callback of the root agent: resolves the open decisions with the final results."""
+        session_id = callback_context._invocation_context.session.id
+        with self._lock:
+            decisions = self._decisions.pop(session_id, [])
+            for decision in decisions:
+                if decision.stage_outcome is None:
+                    result_key = STAGE_RESULT_KEYS.get(decision.agent, DEFAULT_STAGE_RESULT_KEY)
+                    decision.stage_outcome = _status(callback_context.state.get(result_key)) or UNKNOWN_OUTCOME
+                    self._write(decision)
+        escalated = sum(1 for d in decisions if d.tier)
+        if decisions:
+            print(f"[Routing] {len(decisions)} routed call(s), {escalated} on a stronger tier.")
+        return None
+
+    def _write(self, decision: RoutingDecision) -> None:
+        if self.log_path is None:
+            return
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(asdict(decision), ensure_ascii=False) + "\n")
+
+
+def _llm_agents(agent: BaseAgent) -> List[LlmAgent]:
+    agents = [agent] if isinstance(agent, LlmAgent) else []
+    for sub_agent in agent.sub_agents:
+        agents += _llm_agents(sub_agent)
+    return agents
+
+
+def _callbacks(existing: Any) -> List[Any]:
+    return existing if isinstance(existing, list) else [existing] if existing else []
+
+
+def route_models(agent: BaseAgent, router: Optional[ModelRouter] = None) -> BaseAgent:
+    """Adds the router to every LlmAgent in the tree and to the root's after_agent. Calling it twice is harmless."""
+    router = router or model_router
+    for llm_agent in _llm_agents(agent):
+        before = _callbacks(llm_agent.before_model_callback)
+        if router.before_model not in before:
+            # 応答キャッシュのキーに選んだモデルが含まれるよう、最初に実行します
+            llm_agent.before_model_callback = [router.before_model, *before]
+        after = _callbacks(llm_agent.after_model_callback)
+        if router.after_model not in after:
+            llm_agent.after_model_callback = [router.after_model, *after]
+    after_agent = _callbacks(agent.after_agent_callback)
+    if router.after_pipeline not in after_agent:
+        agent.after_agent_callback = [*after_agent, router.after_pipeline]
+    return agent
+
+
+def _tiers_from_env() -> List[str]:
+    value = os.environ.get(MODEL_TIERS_ENV)
+    if value:
+        return [name.strip() for name in value.split(",") if name.strip()]
+    return [model.value for model in MODEL_TIERS]
+
+
+# プロセス全体で共有するルーター
+model_router = ModelRouter(
+    tiers=_tiers_from_env(),
+    escalate_after=int(os.environ.get(ESCALATE_AFTER_ENV, "2")),
+    budgets=_parse_budgets(os.environ.get(MODEL_BUDGETS_ENV)),
+    log_path=Path(os.environ[ROUTING_LOG_ENV]) if os.environ.get(ROUTING_LOG_ENV) else None,
+    enabled=os.environ.get(MODEL_ROUTING_ENV, "1") != "0",
+)
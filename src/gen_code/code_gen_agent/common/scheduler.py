@@ -0,0 +1,369 @@
+"""
+Process-wide scheduler for model calls.
+
+`schedule_models(root_agent)` wraps the model of every LlmAgent in a `ScheduledLlm`. All calls, from
+every concurrent pipeline in the process, then pass through one `ModelScheduler`:
+
+- token buckets for requests per minute (GEN_CODE_MODEL_RPM) and tokens per minute
+  (GEN_CODE_MODEL_TPM); unset means unlimited. At most GEN_CODE_MODEL_BURST_SECONDS (default 60)
+  worth of quota is spent at once. The token cost of a call is estimated from the request and
+  corrected with the response's usage metadata.
+- a priority queue: calls of pipelines in a later stage (test loop > refinement loop > writer) are
+  served first, so nearly finished runs are not starved by new ones. Equal priorities are FIFO.
+- on a 429 / RESOURCE_EXHAUSTED error the whole scheduler pauses for a jittered exponential backoff
+  and the call is retried with its original queue position (GEN_CODE_MODEL_MAX_RETRIES, default 5).
+- queue metrics: current and maximum depth, wait times (the last MAX_WAIT_SAMPLES queued calls),
+  throttled and retried calls.
+"""
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+import contextvars
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from google.adk.agents import BaseAgent, LlmAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.models.registry import LLMRegistry
+
+from gen_code.code_gen_agent.common.telemetry import telemetry
+
+MODEL_RPM_ENV = "GEN_CODE_MODEL_RPM"
+MODEL_TPM_ENV = "GEN_CODE_MODEL_TPM"
+MODEL_MAX_RETRIES_ENV = "GEN_CODE_MODEL_MAX_RETRIES"
+MODEL_BURST_ENV = "GEN_CODE_MODEL_BURST_SECONDS"
+
+# 応答のトークン数が分からない場合の見積もり
+DEFAULT_OUTPUT_TOKENS = 2048
+_CHARS_PER_TOKEN = 4
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+# 待ち時間のパーセンタイルに使う直近の呼び出し数
+MAX_WAIT_SAMPLES = 10_000
+
+# before_model で設定し、同じタスク内のモデル呼び出しで読み出す優先度 (小さいほど先)
+_call_priority: contextvars.ContextVar[int] = contextvars.ContextVar("model_call_priority", default=0)
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to `burst_seconds` worth. Not thread-safe on its own."""
+
+    def __init__(self, per_minute: Optional[float], burst_seconds: float = 60.0):
+        self.per_minute = per_minute
+        self.capacity = (per_minute or 0) * burst_seconds / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.per_minute:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.per_minute / 60.0)
+        self._updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (0 when they are)."""
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        # 容量を超える呼び出しは、満杯になった時点で通します
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) * 60.0 / self.per_minute)
+
+    def consume(self, amount: float, now: float) -> None:
+        if self.per_minute:
+            self._refill(now)
+            self.level = min(self.capacity, self.level - amount)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    tokens: int = field(compare=False)
+    future: "asyncio.Future[None]" = field(compare=False)
+    enqueued: float = field(compare=False)
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """True for HTTP 429 / RESOURCE_EXHAUSTED errors of the Gemini clients."""
+    if getattr(error, "code", None) == 429:
+        return True
+    text = str(error)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text
+
+
+def estimate_tokens(llm_request: LlmRequest) -> int:
+    """Prompt characters / 4 plus the output limit (or DEFAULT_OUTPUT_TOKENS)."""
+    chars = sum(len(part.text or "") for content in llm_request.contents for part in (content.parts or []))
+    config = llm_request.config
+    if config and isinstance(config.system_instruction, str):
+        chars += len(config.system_instruction)
+    output = config.max_output_tokens if config and config.max_output_tokens else DEFAULT_OUTPUT_TOKENS
+    return chars // _CHARS_PER_TOKEN + output
+
+
+class ModelScheduler:
+    """Gates model calls through the rate limits in priority order. Safe to share across threads and event loops."""
+
+    def __init__(
+            self,
+            requests_per_minute: Optional[float] = None,
+            tokens_per_minute: Optional[float] = None,
+            max_retries: int = 5,
+            burst_seconds: float = 60.0
+        ):
+        self.requests = TokenBucket(requests_per_minute, burst_seconds)
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds)
+        self.max_retries = max_retries
+        self._queue: List[_Waiter] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._paused_until = 0.0
+        self._backoff_level = 0
+        self._metrics: Dict[str, Any] = {}
+        self.reset_metrics()
+
+    def configure(
+            self,
+            requests_per_minute: Optional[float] = None,
+            tokens_per_minute: Optional[float] = None,
+            burst_seconds: float = 60.0
+        ) -> None:
+        """Replaces the limits (None: unlimited). At most `burst_seconds` worth of quota is spent at once."""
+        with self._lock:
+            self.requests = TokenBucket(requests_per_minute, burst_seconds)
+            self.tokens = TokenBucket(tokens_per_minute, burst_seconds)
+
+    def reset_metrics(self) -> None:
+        with self._lock:
+            self._metrics = {"calls": 0, "throttled": 0, "retries": 0, "failed": 0, "queued": 0, "max_queue_depth": 0,
+                             "waits_ms": deque(maxlen=MAX_WAIT_SAMPLES)}
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def limited(self) -> bool:
+        return bool(self.requests.per_minute or self.tokens.per_minute)
+
+    # ------------------------------------------------------------------
+    # Queue
+    # ------------------------------------------------------------------
+    def _dispatch(self) -> None:
+        """Releases queued calls in priority order while the limits allow. Called with the lock held."""
+        while self._queue:
+            head = self._queue[0]
+            if head.future.cancelled():
+                heapq.heappop(self._queue)
+                continue
+            now = time.monotonic()
+            delay = max(self._paused_until - now, self.requests.delay(1, now), self.tokens.delay(head.tokens, now))
+            if delay > 0:
+                self._arm_timer(delay)
+                return
+            heapq.heappop(self._queue)
+            self.requests.consume(1, now)
+            self.tokens.consume(head.tokens, now)
+            self._metrics["queued"] += 1
+            self._metrics["waits_ms"].append((now - head.enqueued) * 1000)
+            loop = head.future.get_loop()
+            loop.call_soon_threadsafe(lambda future=head.future: future.done() or future.set_result(None))
+
+    def _arm_timer(self, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    async def acquire(self, tokens: int, priority: int = 0, sequence: Optional[int] = None) -> int:
+        """Waits for a slot. Returns the queue sequence number, which a retry passes back to keep its place."""
+        sequence = next(self._sequence) if sequence is None else sequence
+        if not self.limited and self._paused_until <= time.monotonic():
+            return sequence
+        waiter = _Waiter(priority, sequence, tokens, asyncio.get_running_loop().create_future(), time.monotonic())
+        with self._lock:
+            heapq.heappush(self._queue, waiter)
+            self._dispatch()
+            self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], len(self._queue))
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                self._dispatch()
+            raise
+        return sequence
+
+    def record_usage(self, estimated: int, actual: Optional[int]) -> None:
+        """Corrects the token bucket with the real token count of a finished call."""
+        if actual is None or not self.tokens.per_minute:
+            return
+        with self._lock:
+            self.tokens.consume(actual - estimated, time.monotonic())
+            self._dispatch()
+
+    def throttled(self) -> float:
+        """Pauses every queued call after a 429 and returns this caller's jittered backoff."""
+        with self._lock:
+            self._metrics["throttled"] += 1
+            self._backoff_level = min(self._backoff_level + 1, 10)
+            ceiling = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** (self._backoff_level - 1)))
+            # ジッター: 同時に制限された呼び出しが一斉に再試行しないようにします
+            delay = random.uniform(ceiling / 2, ceiling)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._arm_timer(self._paused_until - time.monotonic())
+        return delay
+
+    def succeeded(self) -> None:
+        with self._lock:
+            self._backoff_level = max(0, self._backoff_level - 1)
+
+    def record_call(self) -> None:
+        with self._lock:
+            self._metrics["calls"] += 1
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self._metrics["retries"] += 1
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._metrics["failed"] += 1
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._metrics["waits_ms"])
+
+        def _percentile(p: float) -> float:
+            return round(waits[min(len(waits) - 1, int(len(waits) * p / 100))], 3) if waits else 0.0
+
+        return {
+            "calls": self._metrics["calls"],
+            "throttled": self._metrics["throttled"],
+            "retries": self._metrics["retries"],
+            "failed": self._metrics["failed"],
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self._metrics["max_queue_depth"],
+            "queued_calls": self._metrics["queued"],
+            "wait_ms.p50": _percentile(50),
+            "wait_ms.p95": _percentile(95),
+        }
+
+    # ------------------------------------------------------------------
+    # Callback
+    # ------------------------------------------------------------------
+    def before_model(self, callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+        """Sets the priority of the coming call from the pipeline stage the agent belongs to."""
+        agent = callback_context._invocation_context.agent
+        top = agent
+        while top.parent_agent is not None and top.parent_agent.parent_agent is not None:
+            top = top.parent_agent
+        root = top.parent_agent
+        stage = root.sub_agents.index(top) if root is not None and top in root.sub_agents else 0
+        _call_priority.set(-stage)
+        return None
+
+
+class ScheduledLlm(BaseLlm):
+    """Runs the calls of the wrapped model through the scheduler, retrying rate-limited ones."""
+
+    model: str = "scheduled"
+    agent_name: str = ""
+    inner: Any  # BaseLlm, or a model name resolved on first use
+    scheduler: Any = None
+
+    def resolved(self) -> BaseLlm:
+        if not isinstance(self.inner, BaseLlm):
+            self.inner = LLMRegistry.new_llm(str(self.inner))
+        return self.inner
+
+    async def generate_content_async(
+            self, llm_request: LlmRequest, stream: bool = False
+        ) -> AsyncGenerator[LlmResponse, None]:
+        scheduler: ModelScheduler = self.scheduler or model_scheduler
+        inner = self.resolved()
+        # ルーターが選んだモデル (common/routing.py) はそのまま使います
+        if not llm_request.model or llm_request.model == self.model:
+            llm_request.model = inner.model
+        estimated = estimate_tokens(llm_request)
+        priority = _call_priority.get()
+        sequence: Optional[int] = None
+        attempt = 0
+        while True:
+            with telemetry.span("model_queue", "scheduler", "", agent=self.agent_name, priority=priority) as span:
+                sequence = await scheduler.acquire(estimated, priority, sequence)
+                span["queue_depth"] = scheduler.queue_depth
+            scheduler.record_call()
+            yielded = False
+            try:
+                async for response in inner.generate_content_async(llm_request, stream=stream):
+                    if not response.partial and response.usage_metadata:
+                        scheduler.record_usage(estimated, response.usage_metadata.total_token_count)
+                    yielded = True
+                    yield response
+                scheduler.succeeded()
+                return
+            except Exception as e:
+                # 部分応答を返した後は再試行できません (同じ内容が重複するため)
+                if yielded or not is_rate_limit_error(e) or attempt >= scheduler.max_retries:
+                    scheduler.record_failure()
+                    raise
+                attempt += 1
+                scheduler.record_retry()
+                delay = scheduler.throttled()
+                print(f"[Scheduler] {self.agent_name} was rate limited; retry {attempt}/{scheduler.max_retries} in {delay:.1f}s")
+
+
+def _float_env(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+def _llm_agents(agent: BaseAgent) -> List[LlmAgent]:
+    agents = [agent] if isinstance(agent, LlmAgent) else []
+    for sub_agent in agent.sub_agents:
+        agents += _llm_agents(sub_agent)
+    return agents
+
+
+def schedule_models(agent: BaseAgent, scheduler: Optional[ModelScheduler] = None) -> BaseAgent:
+    """Wraps the model of every LlmAgent in the tree in a ScheduledLlm. Calling it twice is harmless."""
+    scheduler = scheduler or model_scheduler
+    for llm_agent in _llm_agents(agent):
+        if not isinstance(llm_agent.model, ScheduledLlm):
+            inner = llm_agent.model
+            llm_agent.model = ScheduledLlm(
+                model=inner.model if isinstance(inner, BaseLlm) else str(inner),
+                agent_name=llm_agent.name,
+                inner=inner,
+                scheduler=scheduler,
+            )
+        existing = llm_agent.before_model_callback
+        existing = existing if isinstance(existing, list) else [existing] if existing else []
+        if scheduler.before_model not in existing:
+            llm_agent.before_model_callback = [scheduler.before_model, *existing]
+    return agent
+
+
+# プロセス全体で共有するスケジューラー。制限は GEN_CODE_MODEL_RPM / GEN_CODE_MODEL_TPM で設定します。
+model_scheduler = ModelScheduler(
+    requests_per_minute=_float_env(MODEL_RPM_ENV),
+    tokens_per_minute=_float_env(MODEL_TPM_ENV),
+    max_retries=int(os.environ.get(MODEL_MAX_RETRIES_ENV, "5")),
+    burst_seconds=float(os.environ.get(MODEL_BURST_ENV, "60")),
+)
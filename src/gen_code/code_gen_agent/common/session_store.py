@@ -0,0 +1,399 @@
+"""
+Persistent session service on a local SQLite database.
+
+Sessions (state) and their events are stored in SQLite, so runs survive process restarts.
+Large strings (generated code, review comments, build logs, ...) are not stored inline: they are
+compressed into a content-addressed `blobs` table and replaced by {"$blob": "<sha256>"}. The same code
+appearing in an output_key delta, in the event content and in the session state is stored once.
+
+When a state key is overwritten (e.g. 'refactored_code' in the next loop iteration), the superseded
+value is dropped from the older event's state_delta, both in the database and in the in-memory
+session. The current state always has the latest value, so the event log no longer keeps a copy of
+every iteration's code and build result. `collect_garbage()` deletes blobs no longer referenced.
+
+Event content (the model's messages) is not compacted: the agents read it back as conversation
+history. In the database it is deduplicated through the blobs, but the in-memory session still
+grows by one response per iteration, so a long loop keeps every response the model wrote.
+
+Usage:
+    python -m gen_code.code_gen_agent.common.session_store sessions.db            # statistics
+    python -m gen_code.code_gen_agent.common.session_store sessions.db --gc       # drop unreferenced blobs
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import sqlite3
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, InMemorySessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.state import State
+
+SESSION_DB_ENV = "GEN_CODE_SESSION_DB"
+# この文字数以上の文字列を blob として別テーブルに保存します
+BLOB_MIN_CHARS = 1024
+# 読み込んだ blob を共有するメモリキャッシュの上限 (文字数の合計)
+BLOB_CACHE_MAX_CHARS = 16 * 1024 * 1024
+_BLOB_REF = "$blob"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    last_update_time REAL NOT NULL,
+    PRIMARY KEY (app_name, user_id, id)
+);
+CREATE TABLE IF NOT EXISTS events (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    event TEXT NOT NULL,
+    PRIMARY KEY (app_name, user_id, session_id, seq)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+SessionKey = Tuple[str, str, str]
+
+
+class SqliteSessionService(BaseSessionService):
+    """
+    BaseSessionService backed by SQLite with content-addressed blob offloading and compaction
+    of superseded state deltas. `temp:` state keys are never persisted.
+    """
+
+    def __init__(self, db_path: Path, blob_min_chars: int = BLOB_MIN_CHARS):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.blob_min_chars = blob_min_chars
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._blob_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._blob_cache_chars = 0
+        # 実行中のトランザクションで書いた blob (COMMIT 後にキャッシュへ移します)
+        self._pending_blobs: Optional[Dict[str, str]] = None
+        # セッションごとに、各 state キーを最後に書いたイベントの位置 (圧縮用)
+        self._latest_writer: Dict[SessionKey, Tuple[Session, Dict[str, int]]] = {}
+
+    # ------------------------------------------------------------------
+    # Blobs
+    # ------------------------------------------------------------------
+    def _cache_blob(self, digest: str, text: str) -> str:
+        cached = self._blob_cache.get(digest)
+        if cached is not None:
+            self._blob_cache.move_to_end(digest)
+            return cached
+        self._blob_cache[digest] = text
+        self._blob_cache_chars += len(text)
+        while self._blob_cache_chars > BLOB_CACHE_MAX_CHARS and len(self._blob_cache) > 1:
+            _, evicted = self._blob_cache.popitem(last=False)
+            self._blob_cache_chars -= len(evicted)
+        return text
+
+    def _put_blob(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        pending = self._pending_blobs
+        if digest not in self._blob_cache and (pending is None or digest not in pending):
+            self._db.execute(
+                "INSERT OR IGNORE INTO blobs (hash, data, size) VALUES (?, ?, ?)",
+                (digest, zlib.compress(text.encode("utf-8")), len(text)),
+            )
+            # ROLLBACK されると行は残らないため、キャッシュに入れるのは COMMIT 後です
+            if pending is None:
+                self._cache_blob(digest, text)
+            else:
+                pending[digest] = text
+        return digest
+
+    def _get_blob(self, digest: str) -> str:
+        cached = self._blob_cache.get(digest)
+        if cached is not None:
+            self._blob_cache.move_to_end(digest)
+            return cached
+        row = self._db.execute("SELECT data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(f"Blob {digest[:12]} is missing from {self.db_path}")
+        return self._cache_blob(digest, zlib.decompress(row[0]).decode("utf-8"))
+
+    def _offload(self, value: Any) -> Any:
+        if isinstance(value, str):
+            return {_BLOB_REF: self._put_blob(value)} if len(value) >= self.blob_min_chars else value
+        if isinstance(value, dict):
+            return {k: self._offload(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._offload(v) for v in value]
+        return value
+
+    def _restore(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            if len(value) == 1 and _BLOB_REF in value:
+                return self._get_blob(value[_BLOB_REF])
+            return {k: self._restore(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._restore(v) for v in value]
+        return value
+
+    # ------------------------------------------------------------------
+    # Serialization
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _persistent_state(state: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in state.items() if not k.startswith(State.TEMP_PREFIX)}
+
+    def _dump_state(self, state: Dict[str, Any]) -> str:
+        return json.dumps(self._offload(self._persistent_state(state)), ensure_ascii=False, default=str)
+
+    def _dump_event(self, event: Event) -> str:
+        data = event.model_dump(mode="json", exclude_none=True)
+        delta = data.get("actions", {}).get("state_delta")
+        if delta:
+            data["actions"]["state_delta"] = self._persistent_state(delta)
+        return json.dumps(self._offload(data), ensure_ascii=False)
+
+    def _load_event(self, text: str) -> Event:
+        return Event.model_validate(self._restore(json.loads(text)))
+
+    # ------------------------------------------------------------------
+    # BaseSessionService
+    # ------------------------------------------------------------------
+    async def create_session(
+            self,
+            *,
+            app_name: str,
+            user_id: str,
+            state: Optional[Dict[str, Any]] = None,
+            session_id: Optional[str] = None
+        ) -> Session:
+        session_id = session_id.strip() if session_id and session_id.strip() else str(uuid.uuid4())
+        session = Session(app_name=app_name, user_id=user_id, id=session_id, state=state or {}, last_update_time=time.time())
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO sessions (app_name, user_id, id, state, last_update_time) VALUES (?, ?, ?, ?, ?)",
+                (app_name, user_id, session_id, self._dump_state(session.state), session.last_update_time),
+            )
+        return session
+
+    async def get_session(
+            self,
+            *,
+            app_name: str,
+            user_id: str,
+            session_id: str,
+            config: Optional[GetSessionConfig] = None
+        ) -> Optional[Session]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state, last_update_time FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?",
+                (app_name, user_id, session_id),
+            ).fetchone()
+            if row is None:
+                return None
+            query = "SELECT seq, event FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?"
+            params: List[Any] = [app_name, user_id, session_id]
+            if config and config.after_timestamp:
+                query += " AND timestamp >= ?"
+                params.append(config.after_timestamp)
+            rows = self._db.execute(query + " ORDER BY seq", params).fetchall()
+            if config and config.num_recent_events:
+                rows = rows[-config.num_recent_events:]
+            session = Session(
+                app_name=app_name,
+                user_id=user_id,
+                id=session_id,
+                state=self._restore(json.loads(row[0])),
+                events=[self._load_event(text) for _, text in rows],
+                last_update_time=row[1],
+            )
+        return session
+
+    async def list_sessions(self, *, app_name: str, user_id: str) -> ListSessionsResponse:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, last_update_time FROM sessions WHERE app_name = ? AND user_id = ?", (app_name, user_id)
+            ).fetchall()
+        # InMemorySessionService と同様に、一覧には state とイベントを含めません
+        return ListSessionsResponse(sessions=[
+            Session(app_name=app_name, user_id=user_id, id=session_id, last_update_time=updated)
+            for session_id, updated in rows
+        ])
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?", (app_name, user_id, session_id))
+            self._db.execute("DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?", (app_name, user_id, session_id))
+            self._latest_writer.pop((app_name, user_id, session_id), None)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        await super().append_event(session=session, event=event)
+        key = (session.app_name, session.user_id, session.id)
+        session.last_update_time = event.timestamp
+        with self._lock:
+            seq = len(session.events) - 1
+            self._pending_blobs = {}
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO events (app_name, user_id, session_id, seq, timestamp, event) VALUES (?, ?, ?, ?, ?, ?)",
+                    (*key, seq, event.timestamp, self._dump_event(event)),
+                )
+                self._compact(key, session, seq)
+                if event.actions.state_delta:
+                    self._db.execute(
+                        "UPDATE sessions SET state = ?, last_update_time = ? WHERE app_name = ? AND user_id = ? AND id = ?",
+                        (self._dump_state(session.state), session.last_update_time, *key),
+                    )
+                else:
+                    self._db.execute(
+                        "UPDATE sessions SET last_update_time = ? WHERE app_name = ? AND user_id = ? AND id = ?",
+                        (session.last_update_time, *key),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            else:
+                for digest, text in self._pending_blobs.items():
+                    self._cache_blob(digest, text)
+            finally:
+                self._pending_blobs = None
+        return event
+
+    # ------------------------------------------------------------------
+    # Compaction
+    # ------------------------------------------------------------------
+    def _writers(self, key: SessionKey, session: Session) -> Dict[str, int]:
+        cached = self._latest_writer.get(key)
+        if cached is not None and cached[0] is session:
+            return cached[1]
+        # 読み込み直したセッションでは、イベントから索引を作り直します
+        writers: Dict[str, int] = {}
+        for index, old_event in enumerate(session.events[:-1]):
+            for state_key in old_event.actions.state_delta:
+                writers[state_key] = index
+        self._latest_writer[key] = (session, writers)
+        return writers
+
+    def _compact(self, key: SessionKey, session: Session, seq: int) -> None:
+        """Drops the keys of the new event's state_delta from the events that wrote them before."""
+        writers = self._writers(key, session)
+        event = session.events[seq]
+        stale: Dict[int, Set[str]] = {}
+        for state_key in event.actions.state_delta:
+            previous = writers.get(state_key)
+            if previous is not None and previous < seq:
+                stale.setdefault(previous, set()).add(state_key)
+            writers[state_key] = seq
+        for index, keys in stale.items():
+            if index >= len(session.events):
+                continue
+            old_event = session.events[index]
+            # 他で参照されている可能性があるため、辞書を置き換えます (インプレースで変更しません)
+            old_event.actions.state_delta = {k: v for k, v in old_event.actions.state_delta.items() if k not in keys}
+            self._db.execute(
+                "UPDATE events SET event = ? WHERE app_name = ? AND user_id = ? AND session_id = ? AND seq = ?",
+                (self._dump_event(old_event), *key, index),
+            )
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+    def _referenced_blobs(self) -> Set[str]:
+        referenced: Set[str] = set()
+
+        def _walk(value: Any) -> Iterator[str]:
+            if isinstance(value, dict):
+                if len(value) == 1 and _BLOB_REF in value:
+                    yield value[_BLOB_REF]
+                    return
+                for v in value.values():
+                    yield from _walk(v)
+            elif isinstance(value, list):
+                for v in value:
+                    yield from _walk(v)
+
+        for (text,) in self._db.execute("SELECT state FROM sessions UNION ALL SELECT event FROM events"):
+            referenced.update(_walk(json.loads(text)))
+        return referenced
+
+    def collect_garbage(self) -> int:
+        """Deletes blobs that no session state or event references any more. Returns the number deleted."""
+        with self._lock:
+            referenced = self._referenced_blobs()
+            stored = [digest for (digest,) in self._db.execute("SELECT hash FROM blobs")]
+            unreferenced = [digest for digest in stored if digest not in referenced]
+            self._db.executemany("DELETE FROM blobs WHERE hash = ?", [(digest,) for digest in unreferenced])
+            for digest in unreferenced:
+                text = self._blob_cache.pop(digest, None)
+                if text is not None:
+                    self._blob_cache_chars -= len(text)
+        return len(unreferenced)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions, = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+            events, event_bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(event)), 0) FROM events").fetchone()
+            blobs, blob_chars, blob_bytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM blobs").fetchone()
+        return {
+            "sessions": sessions,
+            "events": events,
+            "event_bytes": event_bytes,
+            "blobs": blobs,
+            "blob_chars": blob_chars,
+            "blob_bytes_compressed": blob_bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def create_session_service(db_path: Optional[Path] = None) -> BaseSessionService:
+    """SqliteSessionService on `db_path` (or $GEN_CODE_SESSION_DB); InMemorySessionService when neither is set."""
+    db_path = db_path or os.environ.get(SESSION_DB_ENV)
+    if not db_path:
+        return InMemorySessionService()
+    print(f"[Session] Persisting sessions to {db_path}")
+    return SqliteSessionService(Path(db_path))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect or clean up a SQLite session database.")
+    parser.add_argument("db", type=Path, help="Session database file")
+    parser.add_argument("--gc", action="store_true", help="Delete blobs no longer referenced")
+    args = parser.parse_args(argv)
+    if not args.db.is_file():
+        print(f"[Session] No database at {args.db}")
+        return 1
+    service = SqliteSessionService(args.db)
+    if args.gc:
+        print(f"[Session] Deleted {service.collect_garbage()} unreferenced blob(s).")
+    print(json.dumps(service.stats(), indent=2))
+    service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+Speculative refactoring: K candidates in parallel, the first green one wins.
+
+`SpeculativeRefactorAgent` replaces the refactor -> build steps of the refinement loop. Every candidate
+runs the same stage agents (refactorer, builder and optionally a test runner) on a private copy of the
+session in its own workspace slot ('examples/build-candidates/<n>', reused across iterations so its
+CMake tree builds incrementally). Candidates differ only in their sampling settings. The builds are
+separate processes, so K candidates use K cores.
+
+The first candidate whose build (and tests, if enabled) succeeds wins: its sources are copied back into
+the session's workspace, its events are replayed into the real session and the loop is escalated; all
+other candidates are cancelled, which kills their build processes. If no candidate is green, the one
+with the fewest errors is applied so the next review round sees its diagnostics. When the time budget
+runs out before any candidate finishes, the stage agents run once on the real session instead.
+"""
+import os
+import shutil
+import asyncio
+from pathlib import Path
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.adk.models import LlmRequest
+from google.genai import types
+from typing_extensions import override
+
+from gen_code.code_gen_agent.common.workspace import WORKSPACE_STATE_KEY, create_workspace, resolve_root
+
+SPECULATIVE_CANDIDATES_ENV = "GEN_CODE_SPECULATIVE_CANDIDATES"
+SPECULATIVE_BUDGET_ENV = "GEN_CODE_SPECULATIVE_BUDGET"
+SPECULATIVE_TESTS_ENV = "GEN_CODE_SPECULATIVE_TESTS"
+
+# 候補ごとの state に入る番号。サンプリング設定の切り替えに使います。
+CANDIDATE_STATE_KEY = "speculative_candidate"
+SPECULATIVE_RESULT_KEY = "speculative_result"
+CANDIDATE_DIR = "build-candidates"
+# 候補間で同期する (生成物を含む) ディレクトリ
+_SYNCED_DIRS = ("src", "tests")
+
+
+def vary_sampling(callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+    """before_model callback: candidate 0 keeps the agent's settings, the others sample with other seeds/temperatures."""
+    index = callback_context.state.get(CANDIDATE_STATE_KEY)
+    if not index:
+        return None
+    config = llm_request.config or types.GenerateContentConfig()
+    base_temperature = config.temperature if config.temperature is not None else 0.7
+    config.temperature = min(1.5, base_temperature + 0.2 * index)
+    config.seed = index
+    llm_request.config = config
+    return None
+
+
+def _sync_dirs(source: Path, destination: Path) -> None:
+    for name in _SYNCED_DIRS:
+        if (source / name).is_dir():
+            shutil.copytree(source / name, destination / name, dirs_exist_ok=True)
+
+
+class SpeculativeRefactorAgent(BaseAgent):
+    """Runs its sub-agents for `candidates` candidates concurrently and keeps the first green one."""
+
+    candidates: int = 3
+    time_budget_seconds: float = 600.0
+    build_key: str = "build_result"
+    # 空の場合はビルドの成否だけで判定します
+    test_key: Optional[str] = None
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        # 候補ごとに異なるサンプリング設定で生成させます
+        for sub_agent in self.sub_agents:
+            if hasattr(sub_agent, "before_model_callback"):
+                existing = sub_agent.before_model_callback
+                existing = existing if isinstance(existing, list) else [existing] if existing else []
+                if vary_sampling not in existing:
+                    sub_agent.before_model_callback = [vary_sampling, *existing]
+
+    def _is_green(self, state: Dict[str, Any]) -> bool:
+        for key in filter(None, (self.build_key, self.test_key)):
+            result = state.get(key)
+            if not isinstance(result, dict) or result.get("status") != "success":
+                return False
+        return True
+
+    def _error_count(self, state: Dict[str, Any]) -> int:
+        result = state.get(self.build_key)
+        if not isinstance(result, dict):
+            return 1 << 30
+        return sum(1 for d in result.get("diagnostics", []) if d.get("severity") == "error") + len(result.get("failed_tests", []))
+
+    def _prepare_slot(self, root: Path, index: int) -> Path:
+        slot = root / "examples" / CANDIDATE_DIR / str(index)
+        if (slot / "examples").is_dir():
+            # ビルドツリーを残したまま、生成物だけを最新にします
+            _sync_dirs(root / "examples", slot / "examples")
+        else:
+            create_workspace(slot, source_root=root)
+        return slot
+
+    async def _run_candidate(self, ctx: InvocationContext, index: int, slot: Path) -> Dict[str, Any]:
+        session = ctx.session.model_copy(update={
+            "state": {**ctx.session.state, WORKSPACE_STATE_KEY: str(slot), CANDIDATE_STATE_KEY: index},
+            "events": list(ctx.session.events),
+        })
+        candidate_ctx = ctx.model_copy(update={"session": session, "invocation_id": f"{ctx.invocation_id}-candidate{index}"})
+        events: List[Event] = []
+        for sub_agent in self.sub_agents:
+            async for event in sub_agent.run_async(candidate_ctx):
+                if event.partial:
+                    continue
+                # Runner がセッションに対して行う処理 (state の更新と履歴への追加) を候補のコピーに行います
+                session.state.update({k: v for k, v in event.actions.state_delta.items() if not k.startswith("temp:")})
+                session.events.append(event)
+                events.append(event)
+        return {"index": index, "slot": slot, "events": events, "state": session.state, "green": self._is_green(session.state)}
+
+    def _apply(self, ctx: InvocationContext, root: Path, candidate: Dict[str, Any]) -> List[Event]:
+        _sync_dirs(candidate["slot"] / "examples", root / "examples")
+        replayed = []
+        for event in candidate["events"]:
+            actions = event.actions.model_copy(update={
+                "escalate": None,
+                "state_delta": {k: v for k, v in event.actions.state_delta.items() if k not in (WORKSPACE_STATE_KEY, CANDIDATE_STATE_KEY)},
+            })
+            replayed.append(event.model_copy(update={"invocation_id": ctx.invocation_id, "actions": actions}))
+        return replayed
+
+    @override
+    async def _run_async_impl(
+            self, ctx: InvocationContext
+        ) -> AsyncGenerator[Event, None]:
+        root = resolve_root(ctx.session.state)
+        slots = await asyncio.gather(*(asyncio.to_thread(self._prepare_slot, root, i) for i in range(self.candidates)))
+        tasks = [asyncio.create_task(self._run_candidate(ctx, i, slot)) for i, slot in enumerate(slots)]
+        print(f"[Speculative] Started {self.candidates} candidate(s) (budget {self.time_budget_seconds}s)")
+
+        winner: Optional[Dict[str, Any]] = None
+        finished: List[Dict[str, Any]] = []
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=self.time_budget_seconds):
+                try:
+                    candidate = await next_done
+                except asyncio.TimeoutError:
+                    raise
+                except Exception as e:
+                    print(f"[Speculative] A candidate failed: {type(e).__name__}: {e}")
+                    continue
+                finished.append(candidate)
+                if candidate["green"]:
+                    winner = candidate
+                    break
+        except asyncio.TimeoutError:
+            print(f"[Speculative] Time budget of {self.time_budget_seconds}s exhausted.")
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        chosen = winner or (min(finished, key=lambda c: self._error_count(c["state"])) if finished else None)
+        if chosen is None:
+            # どの候補も時間内に終わらなかった場合は、通常どおり 1 回だけ実行します
+            print("[Speculative] No candidate finished; running the stages on the session workspace.")
+            for sub_agent in self.sub_agents:
+                async for event in sub_agent.run_async(ctx):
+                    yield event
+            return
+
+        print(f"[Speculative] Candidate {chosen['index']} {'won (green)' if winner else 'applied (no green candidate)'}; "
+              f"{len(finished)} of {self.candidates} finished.")
+        for event in self._apply(ctx, root, chosen):
+            yield event
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(
+                escalate=True if winner else None,
+                state_delta={SPECULATIVE_RESULT_KEY: {
+                    "winner": chosen["index"] if winner else None,
+                    "applied": chosen["index"],
+                    "finished": len(finished),
+                    "candidates": self.candidates,
+                }},
+            ),
+        )
+
+
+def speculative_settings() -> Dict[str, Any]:
+    """K, time budget and whether candidates must also pass the tests, from the GEN_CODE_SPECULATIVE_* variables."""
+    return {
+        "candidates": int(os.environ.get(SPECULATIVE_CANDIDATES_ENV, "1")),
+        "time_budget_seconds": float(os.environ.get(SPECULATIVE_BUDGET_ENV, "600")),
+        "run_tests": os.environ.get(SPECULATIVE_TESTS_ENV, "0") == "1",
+    }
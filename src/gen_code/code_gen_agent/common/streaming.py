@@ -0,0 +1,213 @@
+"""
+Streaming code extraction for the writer and refactorer.
+
+With ADK's SSE streaming (RunConfig(streaming_mode=StreamingMode.SSE), `adk web` with streaming on, or
+`batch --stream`) the model's JSON arrives in chunks and every chunk passes the after_model callback.
+`CodeStreamer` feeds the chunks to an incremental JSON scanner and writes each file the moment its
+string value closes, so the header is on disk while the source is still being generated. As soon as
+the header is written a syntax-only compile of it starts in the background; its result is stored in
+state["header_syntax_check"] when the agent finishes.
+
+Without streaming there are no partial responses and the callbacks do nothing;
+generate_file_callback still writes the final files in both cases.
+"""
+import os
+import json
+import time
+import shutil
+import asyncio
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmResponse
+
+from gen_code.code_gen_agent.common.diagnostics import MAX_DIAGNOSTICS, parse_compiler_output
+from gen_code.code_gen_agent.common.gen_file import JSON_CODE_OUTPUTS, output_file_paths
+from gen_code.code_gen_agent.common.patch import write_files_atomically
+from gen_code.code_gen_agent.common.process import run_process
+from gen_code.code_gen_agent.common.telemetry import telemetry
+
+HEADER_SYNTAX_CHECK_KEY = "header_syntax_check"
+SYNTAX_CHECK_TIMEOUT = 30.0
+
+# スキャナーの状態
+_OUTSIDE, _EXPECT_KEY, _IN_KEY, _EXPECT_COLON, _EXPECT_VALUE, _IN_STRING, _IN_OTHER, _DONE = range(8)
+
+
+class JsonStringStream:
+    """
+    Incremental scanner over a JSON object that arrives in chunks (optionally inside a ```json fence).
+    `feed` returns the (key, value) pairs of the top-level string values completed by the chunk.
+    Every character is looked at once, so the cost is linear in the length of the output.
+    """
+
+    def __init__(self):
+        self._state = _OUTSIDE
+        self._escaped = False
+        self._key: List[str] = []
+        self._value: List[str] = []
+        self._depth = 0
+        self._other_in_string = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        completed: List[Tuple[str, str]] = []
+        for char in chunk:
+            state = self._state
+            if state == _OUTSIDE:
+                if char == "{":
+                    self._state = _EXPECT_KEY
+            elif state == _EXPECT_KEY:
+                if char == '"':
+                    self._key, self._escaped, self._state = [], False, _IN_KEY
+                elif char == "}":
+                    self._state = _DONE
+            elif state in (_IN_KEY, _IN_STRING):
+                target = self._key if state == _IN_KEY else self._value
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    if state == _IN_KEY:
+                        self._state = _EXPECT_COLON
+                    else:
+                        completed.append((self._decode(self._key), self._decode(self._value)))
+                        self._state = _EXPECT_KEY
+                    continue
+                target.append(char)
+            elif state == _EXPECT_COLON:
+                if char == ":":
+                    self._state = _EXPECT_VALUE
+            elif state == _EXPECT_VALUE:
+                if char == '"':
+                    self._value, self._escaped, self._state = [], False, _IN_STRING
+                elif not char.isspace():
+                    # 文字列以外の値 (数値、ネストしたオブジェクトなど) は読み飛ばします
+                    self._depth = 1 if char in "{[" else 0
+                    self._other_in_string = False
+                    self._state = _IN_OTHER
+            elif state == _IN_OTHER:
+                self._skip_other(char)
+        return completed
+
+    def _skip_other(self, char: str) -> None:
+        if self._other_in_string:
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._other_in_string = False
+        elif char == '"':
+            self._other_in_string = True
+        elif char in "{[":
+            self._depth += 1
+        elif char in "}]":
+            if self._depth == 0:
+                self._state = _DONE
+            else:
+                self._depth -= 1
+        elif char == "," and self._depth == 0:
+            self._state = _EXPECT_KEY
+
+    @staticmethod
+    def _decode(chars: List[str]) -> str:
+        raw = "".join(chars)
+        try:
+            return json.loads(f'"{raw}"')
+        except ValueError:
+            return raw
+
+
+async def check_header_syntax(header: Path) -> Dict[str, Any]:
+    """Runs a syntax-only compile of a header (`-fsyntax-only -x c`) and returns its parsed diagnostics."""
+    compiler = os.environ.get("CC") or shutil.which("gcc") or shutil.which("clang")
+    if not compiler:
+        return {"status": "skipped", "file": str(header), "reason": "no C compiler found", "diagnostics": []}
+    started = time.monotonic()
+    command = [compiler, "-fsyntax-only", "-std=gnu99", "-x", "c", "-I", str(header.parent), str(header)]
+    try:
+        process = await run_process(command, cwd=header.parent, timeout=SYNTAX_CHECK_TIMEOUT)
+    except FileNotFoundError:
+        return {"status": "skipped", "file": str(header), "reason": f"'{compiler}' not found", "diagnostics": []}
+    diagnostics = parse_compiler_output(process.stdout + process.stderr)
+    return {
+        "status": "success" if process.returncode == 0 and not process.timed_out else "error",
+        "file": str(header),
+        "diagnostics": diagnostics[:MAX_DIAGNOSTICS],
+        "elapsed_seconds": round(time.monotonic() - started, 3),
+    }
+
+
+class CodeStreamer:
+    """
+    after_model/after_agent callbacks of the JSON-emitting agents (see gen_file.JSON_CODE_OUTPUTS).
+    Streams are kept per (invocation, agent), so concurrent sessions do not interfere.
+    """
+
+    def __init__(self):
+        self._streams: Dict[Tuple[str, str], JsonStringStream] = {}
+        self._checks: Dict[Tuple[str, str], "asyncio.Task[Dict[str, Any]]"] = {}
+        self._lock = threading.Lock()
+
+    def _flush(self, callback_context: CallbackContext, key: Tuple[str, str], label: str, path: Path, content: str) -> None:
+        write_files_atomically({path: content})
+        print(f"[Streaming] Flushed {label} of '{callback_context.agent_name}' to {path} while the model is still generating.")
+        if label != "header":
+            return
+
+        session_id = callback_context._invocation_context.session.id
+
+        async def _check() -> Dict[str, Any]:
+            with telemetry.span("header_syntax_check", "tool", session_id, agent=callback_context.agent_name) as span:
+                result = await check_header_syntax(path)
+                span["status"] = result["status"]
+            return result
+
+        with self._lock:
+            previous = self._checks.pop(key, None)
+            self._checks[key] = asyncio.get_running_loop().create_task(_check())
+        if previous is not None:
+            previous.cancel()
+
+    async def after_model(self, callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+        agent_name = callback_context.agent_name
+        if agent_name not in JSON_CODE_OUTPUTS:
+            return None
+        key = (callback_context.invocation_id, agent_name)
+        if not llm_response.partial:
+            # 最終応答はストリームの区切りです。ファイル全体は generate_file_callback が書き込みます。
+            with self._lock:
+                self._streams.pop(key, None)
+            return None
+        if not llm_response.content or not llm_response.content.parts:
+            return None
+
+        with self._lock:
+            stream = self._streams.setdefault(key, JsonStringStream())
+        chunk = "".join(part.text or "" for part in llm_response.content.parts)
+        header_key, source_key, _ = JSON_CODE_OUTPUTS[agent_name]
+        labels = {header_key: "header", source_key: "source"}
+        for json_key, value in stream.feed(chunk):
+            label = labels.get(json_key)
+            if label and value.strip():
+                path = output_file_paths(callback_context.state, agent_name)[label]
+                self._flush(callback_context, key, label, path, value)
+        return None
+
+    async def after_agent(self, callback_context: CallbackContext) -> None:
+        key = (callback_context.invocation_id, callback_context.agent_name)
+        with self._lock:
+            task = self._checks.pop(key, None)
+        if task is None:
+            return None
+        result = await task
+        print(f"[Streaming] Header syntax check for '{callback_context.agent_name}': {result['status']} "
+              f"({len(result['diagnostics'])} diagnostic(s))")
+        callback_context.state[HEADER_SYNTAX_CHECK_KEY] = result
+        return None
+
+
+code_streamer = CodeStreamer()
@@ -0,0 +1,408 @@
+"""
+Latency, token and tool-time instrumentation for the agent pipeline.
+
+`instrument(root_agent)` attaches the recorder to the before/after agent, model and tool
+callbacks of every agent in the tree. Each finished span (agent run, model call, tool call)
+is kept in memory and, when GEN_CODE_TRACE_DIR is set, appended to '<dir>/trace.jsonl'.
+`export()` additionally writes a Chrome trace ('trace.json', open it in chrome://tracing or
+Perfetto) and 'summary.json' with per-agent p50/p95 latencies and iterations to green.
+
+Usage:
+    python -m gen_code.code_gen_agent.common.telemetry path/to/trace.jsonl
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import threading
+import contextlib
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from google.adk.agents import BaseAgent, LlmAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+
+TRACE_DIR_ENV = "GEN_CODE_TRACE_DIR"
+MAX_SPANS = 100_000
+
+# after_agent 時に結果の status を読む state キー ("success" になった反復が iterations to green)
+_RESULT_KEYS = {"CodeBuilderAgent": "build_result", "TestRunnerAgent": "test_result", "CoverageAgent": "test_coverage",
+                "PerformanceAgent": "performance", "IntegrationTestAgent": "integration_result"}
+
+
+def _now_us() -> int:
+    return time.time_ns() // 1000
+
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percentile / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+def _session_id(callback_context: CallbackContext) -> str:
+    session = getattr(callback_context._invocation_context, "session", None)
+    return getattr(session, "id", None) or callback_context.invocation_id
+
+
+class Telemetry:
+    """
+    Records one span per agent run, model call and tool call.
+
+    Spans follow the Chrome trace 'complete event' format ({"name", "cat", "ph": "X", "ts", "dur",
+    "pid", "tid", "args"}); every session gets its own track (tid), so concurrent runs stay readable.
+    """
+
+    def __init__(self, trace_dir: Optional[Path] = None, enabled: bool = True):
+        self.trace_dir = Path(trace_dir) if trace_dir else None
+        self.enabled = enabled
+        self.spans: Deque[Dict[str, Any]] = deque(maxlen=MAX_SPANS)
+        self._lock = threading.Lock()
+        self._open: Dict[Tuple[str, ...], List[Tuple[int, float, Dict[str, Any]]]] = defaultdict(list)
+        self._iterations: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._tids: Dict[str, int] = {}
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+    def _tid(self, session_id: str) -> int:
+        with self._lock:
+            return self._tids.setdefault(session_id, len(self._tids) + 1)
+
+    def _start(self, key: Tuple[str, ...], args: Dict[str, Any]) -> None:
+        with self._lock:
+            self._open[key].append((_now_us(), time.perf_counter(), args))
+
+    def _finish(self, key: Tuple[str, ...], name: str, category: str, session_id: str, args: Dict[str, Any]) -> None:
+        with self._lock:
+            stack = self._open.get(key)
+            if not stack:
+                return
+            started_us, started, start_args = stack.pop()
+            if not stack:
+                del self._open[key]
+        self.record({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": started_us,
+            "dur": int((time.perf_counter() - started) * 1_000_000),
+            "pid": os.getpid(),
+            "tid": self._tid(session_id),
+            "args": {"session_id": session_id, **start_args, **args},
+        })
+
+    def record(self, span: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.spans.append(span)
+            if self.trace_dir is not None:
+                try:
+                    self.trace_dir.mkdir(parents=True, exist_ok=True)
+                    with open(self.trace_dir / "trace.jsonl", "a", encoding="utf-8") as f:
+                        f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+                except OSError as e:
+                    print(f"[Telemetry] Warning: failed to append span to {self.trace_dir}: {e}")
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, session_id: str, **args: Any) -> Iterator[Dict[str, Any]]:
+        """Times a block of code. Values put into the yielded dict are stored in the span args."""
+        extra: Dict[str, Any] = {}
+        key = ("span", session_id, name, str(id(extra)))
+        self._start(key, args)
+        try:
+            yield extra
+        finally:
+            self._finish(key, name, category, session_id, extra)
+
+    # ------------------------------------------------------------------
+    # ADK callbacks
+    # ------------------------------------------------------------------
+    def before_agent(self, callback_context: CallbackContext) -> None:
+        if not self.enabled:
+            return None
+        session_id = _session_id(callback_context)
+        agent_name = callback_context.agent_name
+        with self._lock:
+            # LoopAgent はサブエージェントを反復ごとに 1 回ずつ実行するため、実行回数 = 反復番号です
+            self._iterations[(callback_context.invocation_id, agent_name)] += 1
+            iteration = self._iterations[(callback_context.invocation_id, agent_name)]
+        self._start(("agent", callback_context.invocation_id, agent_name), {"iteration": iteration})
+        return None
+
+    def _finish_agent(self, callback_context: CallbackContext, agent_name: str, **args: Any) -> None:
+        result_key = _RESULT_KEYS.get(agent_name)
+        if result_key:
+            result = callback_context.state.get(result_key)
+            if isinstance(result, dict):
+                args["status"] = result.get("status")
+        self._finish(("agent", callback_context.invocation_id, agent_name), agent_name, "agent",
+                     _session_id(callback_context), args)
+
+    def after_agent(self, callback_context: CallbackContext) -> None:
+        if not self.enabled:
+            return None
+        agent = callback_context._invocation_context.agent
+        # LoopAgent は escalate したサブエージェントのジェネレータを途中で閉じるため、
+        # そのサブエージェントの after_agent は呼ばれません。親の終了時に開いたままの計測を閉じます。
+        pending = list(agent.sub_agents)
+        while pending:
+            sub_agent = pending.pop()
+            pending.extend(sub_agent.sub_agents)
+            if ("agent", callback_context.invocation_id, sub_agent.name) in self._open:
+                self._finish_agent(callback_context, sub_agent.name, escalated=True)
+        self._finish_agent(callback_context, callback_context.agent_name)
+        if agent.parent_agent is None:
+            # ルートエージェントの終了時に、この呼び出しの反復カウンタを破棄します
+            with self._lock:
+                # 投機的実行の候補は "<invocation_id>-candidate<n>" を呼び出し ID に使います
+                for key in [k for k in self._iterations if k[0].split("-candidate")[0] == callback_context.invocation_id]:
+                    del self._iterations[key]
+        return None
+
+    def before_model(self, callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+        if not self.enabled:
+            return None
+        self._start(("model", callback_context.invocation_id, callback_context.agent_name),
+                    {"agent": callback_context.agent_name, "model": llm_request.model})
+        return None
+
+    def after_model(self, callback_context: CallbackContext, llm_response: LlmResponse) -> None:
+        # ストリーミング時は部分応答ごとに呼ばれるため、最終応答でのみ計測を閉じます
+        if not self.enabled or llm_response.partial:
+            return None
+        usage = llm_response.usage_metadata
+        args = {
+            "prompt_tokens": getattr(usage, "prompt_token_count", None),
+            "response_tokens": getattr(usage, "candidates_token_count", None),
+            "total_tokens": getattr(usage, "total_token_count", None),
+            "error_code": llm_response.error_code,
+            "cache_hit": bool((llm_response.custom_metadata or {}).get("cache_hit")),
+        }
+        self._finish(("model", callback_context.invocation_id, callback_context.agent_name), "model_call", "model",
+                     _session_id(callback_context), args)
+        return None
+
+    def before_tool(self, tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> None:
+        if not self.enabled:
+            return None
+        self._start(("tool", tool_context.invocation_id, tool_context.function_call_id or tool.name),
+                    {"agent": tool_context.agent_name})
+        return None
+
+    def after_tool(self, tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Any) -> None:
+        if not self.enabled:
+            return None
+        status = tool_response.get("status") if isinstance(tool_response, dict) else None
+        self._finish(("tool", tool_context.invocation_id, tool_context.function_call_id or tool.name), tool.name, "tool",
+                     _session_id(tool_context), {"status": status})
+        return None
+
+    # ------------------------------------------------------------------
+    # Export
+    # ------------------------------------------------------------------
+    def export(self, trace_dir: Optional[Path] = None) -> Dict[str, Any]:
+        """Writes trace.jsonl (unless already streamed), trace.json (Chrome trace) and summary.json."""
+        trace_dir = Path(trace_dir or self.trace_dir or ".")
+        trace_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            spans = list(self.spans)
+        if trace_dir != self.trace_dir:
+            with open(trace_dir / "trace.jsonl", "w", encoding="utf-8") as f:
+                for span in spans:
+                    f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+        (trace_dir / "trace.json").write_text(
+            json.dumps({"traceEvents": spans, "displayTimeUnit": "ms"}, ensure_ascii=False, default=str),
+            encoding="utf-8"
+        )
+        report = summarize(spans)
+        (trace_dir / "summary.json").write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"[Telemetry] Exported {len(spans)} span(s) to {trace_dir}")
+        return report
+
+    def reset(self) -> None:
+        with self._lock:
+            self.spans.clear()
+            self._open.clear()
+            self._iterations.clear()
+
+
+def summarize(spans: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Aggregates spans into a report: per-agent and per-tool wall time (p50/p95/total, ms),
+    model latency and token counts per agent, and loop iterations until the build/tests went green.
+    """
+    agents: Dict[str, List[float]] = defaultdict(list)
+    tools: Dict[str, List[float]] = defaultdict(list)
+    models: Dict[str, Dict[str, Any]] = defaultdict(
+        lambda: {"latencies": [], "prompt_tokens": 0, "response_tokens": 0, "cache_hits": 0})
+    green: Dict[str, Dict[str, Optional[int]]] = defaultdict(dict)
+
+    for span in spans:
+        duration_ms = span.get("dur", 0) / 1000
+        args = span.get("args", {})
+        if span.get("cat") == "agent":
+            agents[span["name"]].append(duration_ms)
+            if span["name"] in _RESULT_KEYS:
+                sessions = green[span["name"]]
+                session_id = args.get("session_id")
+                if args.get("status") == "success" and sessions.get(session_id) is None:
+                    sessions[session_id] = args.get("iteration")
+                else:
+                    sessions.setdefault(session_id, None)
+        elif span.get("cat") == "model":
+            model = models[args.get("agent", "?")]
+            model["latencies"].append(duration_ms)
+            if args.get("cache_hit"):
+                # キャッシュから返した応答のトークンは課金されないため数えません
+                model["cache_hits"] += 1
+                continue
+            model["prompt_tokens"] += args.get("prompt_tokens") or 0
+            model["response_tokens"] += args.get("response_tokens") or 0
+        elif span.get("cat") == "tool":
+            tools[span["name"]].append(duration_ms)
+
+    def _stats(values: List[float]) -> Dict[str, Any]:
+        return {"count": len(values), "p50_ms": _percentile(values, 50), "p95_ms": _percentile(values, 95),
+                "total_ms": round(sum(values), 3)}
+
+    iterations_to_green = {}
+    for agent_name, sessions in green.items():
+        reached = [iteration for iteration in sessions.values() if iteration is not None]
+        iterations_to_green[agent_name] = {
+            "sessions": len(sessions),
+            "green": len(reached),
+            "p50": _percentile(reached, 50),
+            "max": max(reached) if reached else None,
+        }
+
+    return {
+        "agents": {name: _stats(values) for name, values in sorted(agents.items())},
+        "models": {
+            name: {**_stats(model["latencies"]), "prompt_tokens": model["prompt_tokens"],
+                   "response_tokens": model["response_tokens"], "cache_hits": model["cache_hits"]}
+            for name, model in sorted(models.items())
+        },
+        "tools": {name: _stats(values) for name, values in sorted(tools.items())},
+        "iterations_to_green": iterations_to_green,
+    }
+
+
+def _callbacks(existing: Any) -> List[Any]:
+    if isinstance(existing, (_BeforeChain, _AfterChain)):
+        return list(existing.callbacks)
+    return existing if isinstance(existing, list) else ([existing] if existing else [])
+
+
+class _BeforeChain:
+    """
+    Runs the recorder callback first, then the agent's own before-callbacks (the first non-None
+    result wins). When one of them short-circuits the agent run or model call, ADK skips the
+    after-callbacks, so `finish` closes the span with that result.
+    """
+
+    def __init__(self, record: Any, callbacks: List[Any], finish: Optional[Any] = None):
+        self.record = record
+        self.callbacks = callbacks
+        self.finish = finish
+
+    async def __call__(self, **kwargs: Any) -> Any:
+        self.record(**kwargs)
+        for callback in self.callbacks:
+            result = callback(**kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            if result is not None:
+                if self.finish:
+                    self.finish(kwargs, result)
+                return result
+        return None
+
+
+def _prepend(callback: Any, existing: Any, finish: Optional[Any] = None) -> _BeforeChain:
+    return _BeforeChain(callback, [c for c in _callbacks(existing) if c is not callback], finish)
+
+
+class _AfterChain:
+    """
+    Runs an agent's own after-callbacks with ADK's semantics (the first non-None result wins),
+    then always the recorder callback. A plain list would skip the recorder whenever an earlier
+    callback returns content, as the test writer's file callback does.
+    """
+
+    def __init__(self, callbacks: List[Any], record: Any):
+        self.callbacks = callbacks
+        self.record = record
+
+    async def __call__(self, **kwargs: Any) -> Any:
+        result = None
+        try:
+            for callback in self.callbacks:
+                result = callback(**kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+                if result is not None:
+                    break
+        finally:
+            self.record(**kwargs)
+        return result
+
+
+def _append(callback: Any, existing: Any) -> _AfterChain:
+    return _AfterChain([c for c in _callbacks(existing) if c is not callback], callback)
+
+
+def instrument(agent: BaseAgent, recorder: Optional["Telemetry"] = None) -> BaseAgent:
+    """
+    Attaches the recorder to every agent in the tree. The timing callbacks wrap the existing ones
+    (start first, stop last) and always return None, so they never change the agents' behaviour.
+    Calling it twice on the same tree is harmless.
+    """
+    recorder = recorder or telemetry
+    agent.before_agent_callback = _prepend(
+        recorder.before_agent, agent.before_agent_callback,
+        lambda kwargs, _: recorder.after_agent(callback_context=kwargs["callback_context"]))
+    agent.after_agent_callback = _append(recorder.after_agent, agent.after_agent_callback)
+    if isinstance(agent, LlmAgent):
+        agent.before_model_callback = _prepend(
+            recorder.before_model, agent.before_model_callback,
+            lambda kwargs, response: recorder.after_model(callback_context=kwargs["callback_context"], llm_response=response))
+        agent.after_model_callback = _append(recorder.after_model, agent.after_model_callback)
+        agent.before_tool_callback = _prepend(recorder.before_tool, agent.before_tool_callback)
+        agent.after_tool_callback = _append(recorder.after_tool, agent.after_tool_callback)
+    for sub_agent in agent.sub_agents:
+        instrument(sub_agent, recorder)
+    return agent
+
+
+def load_spans(path: Path) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# プロセス全体で共有するレコーダー。GEN_CODE_TELEMETRY=0 で記録を止められます。
+telemetry = Telemetry(
+    trace_dir=Path(os.environ[TRACE_DIR_ENV]) if os.environ.get(TRACE_DIR_ENV) else None,
+    enabled=os.environ.get("GEN_CODE_TELEMETRY", "1") != "0",
+)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("Usage: python -m gen_code.code_gen_agent.common.telemetry <trace.jsonl>")
+        return 2
+    print(json.dumps(summarize(load_spans(Path(argv[0]))), indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
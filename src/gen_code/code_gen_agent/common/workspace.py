@@ -0,0 +1,61 @@
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Any, Mapping, Optional
+
+from gen_code.code_gen_agent.common.constants import ROOT_DIR
+
+# セッション state に保存するワークスペースのルート (examples ディレクトリを含むディレクトリ)。
+# 未設定の場合はリポジトリ自体 (ROOT_DIR) を使います。
+WORKSPACE_STATE_KEY = "workspace_dir"
+
+_IGNORED_DIRS = ("build", "build-*")
+
+
+def resolve_root(state: Optional[Mapping[str, Any]] = None) -> Path:
+    """Returns the workspace root of the current run, falling back to the repository root."""
+    workspace_dir = state.get(WORKSPACE_STATE_KEY) if state is not None else None
+    return Path(workspace_dir) if workspace_dir else ROOT_DIR
+
+
+def _reflink_copy(source: Path, destination: Path) -> bool:
+    """Copy-on-write clone (btrfs/XFS) of a directory. Returns False where cp is unavailable."""
+    if os.name == "nt" or shutil.which("cp") is None:
+        return False
+    destination.mkdir(parents=True, exist_ok=True)
+    children = [
+        str(child) for child in source.iterdir()
+        if not any(child.match(pattern) for pattern in _IGNORED_DIRS)
+    ]
+    if not children:
+        return True
+    process = subprocess.run(
+        ["cp", "-a", "--reflink=auto", *children, str(destination)],
+        capture_output=True,
+        text=True,
+        check=False
+    )
+    return process.returncode == 0
+
+
+def create_workspace(destination: Path, source_root: Path = ROOT_DIR) -> Path:
+    """
+    Creates an isolated workspace containing a copy of '<source_root>/examples'.
+
+    Generated files, the CMake build tree and test logs of one run stay inside the
+    workspace, so several pipelines can run at the same time. The copy is a reflink
+    clone where the filesystem supports it, so unchanged files share storage.
+    Build directories of the source tree are not copied.
+    """
+    destination = Path(destination)
+    examples = destination / "examples"
+    if examples.exists():
+        shutil.rmtree(examples)
+    destination.mkdir(parents=True, exist_ok=True)
+
+    source_examples = source_root / "examples"
+    if not _reflink_copy(source_examples, examples):
+        shutil.rmtree(examples, ignore_errors=True)
+        shutil.copytree(source_examples, examples, ignore=shutil.ignore_patterns(*_IGNORED_DIRS))
+    return destination
@@ -0,0 +1,20 @@
+from google.adk.agents import LlmAgent
+
+from gen_code.code_gen_agent.common.models import Model
+from gen_code.code_gen_agent.common.llm_cache import llm_cache
+from gen_code.code_gen_agent.common.gen_file import generate_header_callback
+from .prompt import agent_instruction
+
+# Header Writer Agent
+# Writes the public header of one module of a module manifest, before any module source is generated
+# (see common/modules.py and batch.run_modules).
+header_writer_agent = LlmAgent(
+    name="HeaderWriterAgent",
+    model=Model.GEMINI_2_0_FLASH.value,
+    instruction=agent_instruction,
+    description="Writes the public C header of one module of the application.",
+    output_key="generated_header",
+    before_model_callback=llm_cache.before_model,
+    after_model_callback=llm_cache.after_model,
+    after_agent_callback=generate_header_callback
+)
@@ -1,18 +1,206 @@
-from google.adk.agents import LlmAgent
+import asyncio
+from typing import AsyncGenerator
 
+from google.adk.agents import BaseAgent, LlmAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.adk.tools.tool_context import ToolContext
+from google.genai import types
+from typing_extensions import override
+
+from gen_code.code_gen_agent.common.build_engine import get_builder
+from gen_code.code_gen_agent.common.coverage import (
+    COVERAGE_STATE_KEY, COVERAGE_TARGETS_STATE_KEY, collect_coverage, format_targets, threshold_met,
+)
+from gen_code.code_gen_agent.common.diagnostics import format_result
+from gen_code.code_gen_agent.common.integration import (
+    INTEGRATED_MODULE, INTEGRATION_STATE_KEY, INTEGRATION_TARGET, format_integration, integration_settings,
+    register_integration_target, result_kind, run_integration,
+)
 from gen_code.code_gen_agent.common.models import Model
+from gen_code.code_gen_agent.common.modules import MODULE_SOURCE_DIR, module_name, module_targets
+from gen_code.code_gen_agent.common.result_cache import get_result, put_result
+from gen_code.code_gen_agent.common.telemetry import telemetry
+from gen_code.code_gen_agent.common.workspace import resolve_root
 from .prompt import agent_instruction
-from .tools import test_tool
+from .tools import DEFAULT_TEST_TIMEOUT_SECONDS, test_tool, execute_tests_async
+
+
+class TestRunnerAgent(BaseAgent):
+    """
+    Runs the unit tests by awaiting 'execute_tests_async' directly.
+
+    Drop-in replacement for the LLM-driven runner: the result dict is stored in
+    state['test_result'] and passing tests escalate to exit the loop, without spending
+    a model round trip to call the tool and format its output.
+    With escalate_on_success=False the loop is left to a following CoverageAgent.
+    """
+
+    output_key: str = "test_result"
+    escalate_on_success: bool = True
+
+    @override
+    async def _run_async_impl(
+            self, ctx: InvocationContext
+        ) -> AsyncGenerator[Event, None]:
+        tool_context = ToolContext(ctx)
+        with telemetry.span("execute_tests_async", "tool", ctx.session.id, agent=self.name) as span:
+            result = await execute_tests_async(tool_context)
+            span["status"] = result.get("status")
+        tool_context.state[self.output_key] = result
+        if not self.escalate_on_success:
+            tool_context.actions.escalate = None
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=format_result(result))]),
+            actions=tool_context.actions,
+        )
+
+
+class CoverageAgent(BaseAgent):
+    """
+    Collects the coverage of the last test run into state['test_coverage'] (see common/coverage.py).
+
+    Runs after a TestRunnerAgent that does not escalate itself and exits the loop once the tests pass
+    and the coverage thresholds are met (or coverage cannot be measured). Below the thresholds, the
+    uncovered regions are stored in state['coverage_targets'] for the next test writer pass.
+    """
+
+    output_key: str = COVERAGE_STATE_KEY
+    targets_key: str = COVERAGE_TARGETS_STATE_KEY
+    test_key: str = "test_result"
+
+    @override
+    async def _run_async_impl(
+            self, ctx: InvocationContext
+        ) -> AsyncGenerator[Event, None]:
+        tool_context = ToolContext(ctx)
+        test_result = tool_context.state.get(self.test_key)
+        # 失敗したテストのカバレッジでは判断しないため、テストが通った場合だけ測定します
+        tool_context.state[self.targets_key] = ""
+        if not isinstance(test_result, dict) or test_result.get("status") != "success":
+            summary = "Coverage not measured: the tests did not pass."
+        else:
+            workspace = resolve_root(tool_context.state)
+            builder = await asyncio.to_thread(get_builder, workspace / "examples")
+            _, test_target = module_targets(builder, tool_context.state)
+            # 依存モジュールのソースもリンクされますが、対象はこのモジュールのソースだけです
+            sources = [(MODULE_SOURCE_DIR / f"{module_name(tool_context.state)}.c").as_posix()]
+            # テスト結果と同じ入力で鍵を作るため、テスト結果のキャッシュヒット時もカバレッジを返せます
+            cache_key = builder.result_key("coverage", [test_target])
+            with telemetry.span("collect_coverage", "tool", ctx.session.id, agent=self.name) as span:
+                coverage = get_result(cache_key, workspace)
+                if coverage is None:
+                    coverage = await asyncio.to_thread(collect_coverage, builder, test_target, sources)
+                    if coverage["status"] == "success":
+                        put_result(cache_key, coverage, workspace)
+                span["status"] = coverage["status"]
+            tool_context.state[self.output_key] = coverage
+
+            if coverage["status"] != "success":
+                summary = f"Coverage not measured: {coverage.get('reason')}"
+            else:
+                summary = (f"Coverage: lines {coverage['line_percent']}% ({coverage['lines'][0]}/{coverage['lines'][1]}), "
+                           f"branches {coverage['branch_percent']}% ({coverage['branches'][0]}/{coverage['branches'][1]})")
+            print(f"[Coverage] {summary}")
+            if coverage["status"] == "success" and not threshold_met(coverage):
+                targets = format_targets(coverage, builder.source_dir, builder.source_dir / "tests" / f"{test_target}.cpp")
+                tool_context.state[self.targets_key] = targets
+                summary += "\n" + targets
+            else:
+                # 閾値を満たした (または測定できない) ので、テストの改善ループを終了します
+                tool_context.actions.escalate = True
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=summary)]),
+            actions=tool_context.actions,
+        )
+
+
+class IntegrationTestAgent(BaseAgent):
+    """
+    Runs the virtual-time brake_app -> body_app integration test into state['integration_result']
+    (see common/integration.py).
+
+    A validation stage after the test refinement loop: it replays the traces against the generated
+    doorlock_control and records the failed checks, without changing the control flow of the pipeline.
+    Module runs (state['module']) of other modules are not integrated and skip it.
+    """
+
+    output_key: str = INTEGRATION_STATE_KEY
+
+    @override
+    async def _run_async_impl(
+            self, ctx: InvocationContext
+        ) -> AsyncGenerator[Event, None]:
+        tool_context = ToolContext(ctx)
+        module = module_name(tool_context.state)
+        if module != INTEGRATED_MODULE:
+            result = {"status": "unavailable", "reason": f"the integration test covers {INTEGRATED_MODULE}, not {module}"}
+        else:
+            workspace = resolve_root(tool_context.state)
+            builder = await asyncio.to_thread(get_builder, workspace / "examples")
+            settings = integration_settings()
+            register_integration_target(builder)
+            # シミュレーションは決定的なので、同じソース・トレース・設定の結果はそのまま再利用できます
+            cache_key = builder.result_key(await asyncio.to_thread(result_kind, builder, settings), [INTEGRATION_TARGET])
+            with telemetry.span("run_integration", "tool", ctx.session.id, agent=self.name) as span:
+                result = get_result(cache_key, workspace)
+                if result is None:
+                    result = await run_integration(builder, DEFAULT_TEST_TIMEOUT_SECONDS, settings)
+                    if "runs" in result:
+                        put_result(cache_key, result, workspace)
+                span["status"] = result["status"]
+        tool_context.state[self.output_key] = result
+        summary = format_integration(result)
+        print(f"[Integration] {summary}")
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=summary)]),
+            actions=tool_context.actions,
+        )
+
+
+# Test Runner Agent
+# Executes the unit tests written by the test writer; the coverage agent after it decides whether the loop exits.
+test_runner_agent = TestRunnerAgent(
+    name="TestRunnerAgent",
+    description="Execute unit tests generated from requirements.",
+    escalate_on_success=False,
+)
+
+# Coverage Agent
+# Measures the coverage of the passing tests and exits the loop once
+# GEN_CODE_COVERAGE_THRESHOLD / GEN_CODE_BRANCH_COVERAGE_THRESHOLD are met (both 0 by default).
+coverage_agent = CoverageAgent(
+    name="CoverageAgent",
+    description="Collect the gcov coverage of the unit tests and list the uncovered regions.",
+)
+
+# Integration Test Agent
+# With GEN_CODE_INTEGRATION_TEST=1 it runs after the test refinement loop (see agent.py).
+integration_test_agent = IntegrationTestAgent(
+    name="IntegrationTestAgent",
+    description="Replay speed traces through brake_app and body_app in virtual time.",
+)
 
-# Code Builder Agent
-# Takes the original code and the review comments (read from state) and refactors the code.
-test_runner_agent = LlmAgent(
+# LLM-driven variant of the runner (one model call to invoke the tool and one to report its output).
+test_runner_llm_agent = LlmAgent(
     name="TestRunnerAgent",
-    model=Model.GEMINI_2_0_FLASH,
+    model=Model.GEMINI_2_0_FLASH.value,
     # Change 3: Improved instruction, correctly using state key injection
     instruction=agent_instruction,
     description="Execute unit tests generated from requirements.",
-    output_key="test_result", # Stores output in state['build_result']
+    output_key="test_result", # Stores output in state['test_result']
     tools=[
         test_tool
     ]
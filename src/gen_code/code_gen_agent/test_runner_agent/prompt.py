@@ -13,7 +13,8 @@ After the tool execution, report the complete results.
 
 **Output:**
 Present the results from the 'execute_unit_tests' tool.
-The tool returns a dictionary containing 'status', 'stdout', and 'stderr'.
+The tool returns a dictionary containing 'status', 'summary', 'diagnostics', 'failed_tests', the tail of 'stdout' and 'stderr', and 'log_file' (the full log).
+List every entry of 'failed_tests' and 'diagnostics' after the status.
 Include the standard output and standard error, if any, enclosed in a triple backtick block. For example:
 
 Status:
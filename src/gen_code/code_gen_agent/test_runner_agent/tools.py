@@ -1,108 +1,216 @@
-import subprocess
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Any, Mapping, Optional
 from google.adk.tools import FunctionTool
 from google.adk.tools.tool_context import ToolContext
 
-from gen_code.code_gen_agent.common.constants import ROOT_DIR
+from gen_code.code_gen_agent.common.build_engine import get_builders, BuildResult, IncrementalBuilder
+from gen_code.code_gen_agent.common.diagnostics import merge_results, summarize
+from gen_code.code_gen_agent.common.modules import module_targets
+from gen_code.code_gen_agent.common.process import LiveLog
+from gen_code.code_gen_agent.common.result_cache import get_result, put_result, reproducible
+from gen_code.code_gen_agent.common.workspace import resolve_root
 
-DEFAULT_TEST_ROOT_PATH = str(ROOT_DIR)
+DEFAULT_TEST_TIMEOUT_SECONDS = float(os.environ.get("GEN_CODE_TEST_TIMEOUT", "600"))
+
+def _resolve_test_directory(tool_context: ToolContext) -> str:
+    # Always test the workspace of this session (state['workspace_dir']), or the project root if none is set,
+    # never a path chosen by the LLM
+    effective_test_directory = str(resolve_root(tool_context.state))
+    print(f"  [Tool Call] Target directory for {tool_context.agent_name}: {effective_test_directory}")
+    return effective_test_directory
+
+def _missing_directory_result(effective_test_directory: str) -> dict:
+    error_msg = f"Test directory '{effective_test_directory}' not found or is not a directory."
+    print(f"  [Tool Call Error] {error_msg}")
+    return {
+        "status": "error",
+        "stdout": f"Checked path: {effective_test_directory}",
+        "stderr": f"[ERROR] 1: {error_msg}",
+        "error_message": error_msg
+    }
+
+def _to_result(
+        process: BuildResult,
+        effective_test_directory: str,
+        log_file: Path,
+        timeout_seconds: Optional[float] = None
+    ) -> dict:
+    # The raw build/ctest log goes to a file; state only keeps the parsed failures and a bounded tail
+    status = "success" if process.returncode == 0 else "error"
+    result = summarize(status, process.stdout, process.stderr, log_file=log_file, gtest_reports=[Path(p) for p in process.reports])
+    if process.timed_out:
+        error_msg = f"Test execution in '{effective_test_directory}' timed out after {timeout_seconds} seconds (partial output returned)"
+        print(f"  [Tool Call Error] {error_msg}")
+        result["error_message"] = f"[ERROR] 5: {error_msg}"
+    elif status == "error":
+        error_msg = f"Test execution failed in '{effective_test_directory}' with return code: {process.returncode}"
+        print(f"  [Tool Call Error] {error_msg}: {result['summary']} (full log: {result['log_file']})")
+        for failed in result["failed_tests"]:
+            print(f"  [Tool Call Error]   {failed['name']} at {failed['file']}:{failed['line']}")
+        result["error_message"] = f"[ERROR] 2: {error_msg}"
+    return result
+
+def _exception_result(e: Exception, effective_test_directory: str) -> dict:
+    if isinstance(e, FileNotFoundError):
+        # If the 'cmake' or 'ctest' command is not found
+        error_msg = "The 'cmake' or 'ctest' command was not found. Please ensure CMake and Ninja are installed and in your PATH."
+        print(f"  [Tool Call Error] {error_msg}")
+        return {
+            "status": "error",
+            "stdout": "",
+            "stderr": f"[ERROR] 3: {error_msg}",
+            "error_message": "The 'cmake' or 'ctest' command was not found."
+        }
+    # Other unexpected errors
+    error_msg = f"An unexpected error occurred during test execution in '{effective_test_directory}': {str(e)}"
+    print(f"  [Tool Call Error] {error_msg}")
+    return {
+        "status": "error",
+        "stdout": "",
+        "stderr": str(e),
+        "error_message": f"[ERROR] 4: {error_msg}"
+    }
+
+def _finish(result: dict, tool_context: ToolContext, effective_test_directory: str) -> dict:
+    if result["status"] == "success":
+        # On test success, terminate the agent's loop (this behavior can be adjusted based on agent design)
+        tool_context.actions.escalate = True
+        print(f"  [Tool Call] Test execution successful in '{effective_test_directory}'. Escalation triggered by {tool_context.agent_name}.")
+    return result
+
+def _test(
+        builder: IncrementalBuilder,
+        state: Mapping[str, Any],
+        test_path: Path,
+        effective_test_directory: str,
+        agent_name: str
+    ) -> dict:
+    # モジュール単位の実行 (state['module']) では test_<module> をビルドして実行します
+    _, test_target = module_targets(builder, state)
+    cache_key = builder.result_key("test", [test_target])
+    result = get_result(cache_key, test_path)
+    if result is not None:
+        print(f"  [Tool Call] Test result cache hit ({cache_key[:12]}, {builder.toolchain}) for {agent_name}")
+        return result
+    # Build the test target incrementally (GoogleTest comes from the local cache) and run ctest
+    print(f"  [Tool Call] Building and running unit tests in '{effective_test_directory}' ({builder.toolchain})")
+    result = _to_result(builder.test(test_target), effective_test_directory, builder.build_dir / "logs" / f"test-{cache_key[:12]}.log")
+    if reproducible(result):
+        put_result(cache_key, result, test_path)
+    return result
+
+async def _test_async(
+        builder: IncrementalBuilder,
+        state: Mapping[str, Any],
+        test_path: Path,
+        effective_test_directory: str,
+        agent_name: str,
+        timeout_seconds: float
+    ) -> dict:
+    _, test_target = module_targets(builder, state)
+    cache_key = builder.result_key("test", [test_target])
+    result = get_result(cache_key, test_path)
+    if result is not None:
+        print(f"  [Tool Call] Test result cache hit ({cache_key[:12]}, {builder.toolchain}) for {agent_name}")
+        return result
+    print(f"  [Tool Call] Building and running unit tests in '{effective_test_directory}' ({builder.toolchain})")
+    with LiveLog(builder.build_dir / "gen_code_live.log") as live_log:
+        process = await builder.test_async(test_target, timeout=timeout_seconds, on_output=live_log)
+    result = _to_result(process, effective_test_directory, builder.build_dir / "logs" / f"test-{cache_key[:12]}.log", timeout_seconds)
+    if not process.timed_out and reproducible(result):
+        put_result(cache_key, result, test_path)
+    return result
 
 def execute_tests(
         tool_context: ToolContext,
         target_directory: Optional[str] = None
     ) -> dict:
     """
-    Executes unit tests by running 'make tests' in the specified directory.
-    If no directory is specified, the project's root directory is used as the default.
+    Executes unit tests of the current workspace (state['workspace_dir'], or the project root).
+    The test executable is rebuilt incrementally in the persistent 'examples/build' tree and linked
+    against the cached prebuilt GoogleTest, then ctest is run.
+    If the same sources, tests and CMake/toolchain inputs were tested before (in any session),
+    the stored result is returned without building or running anything. With several toolchains
+    (GEN_CODE_TOOLCHAINS=gcc,clang) each one tests in its own build tree concurrently and the results are merged.
 
     Args:
-        target_directory (Optional[str]): The path to the directory where 'make tests' will be executed.
-                                     If None, the project root directory will be used.
+        target_directory (Optional[str]): Ignored; the tests always run in the current workspace.
         tool_context (ToolContext): The context for the tool execution, used for actions like escalation.
 
     Returns:
-        dict: A dictionary containing the status of the test execution, standard output, and standard error.
-              Example: {'status': 'success' or 'error', 'stdout': '...', 'stderr': '...'}
+        dict: A dictionary containing the status of the test execution, the failing tests with their
+              assertion locations, compiler diagnostics and the tail of standard output and standard error.
+              The full log is written to 'log_file'.
+              Example: {'status': 'success' or 'error', 'summary': '0 error(s), 0 warning(s), 1 failed test(s)',
+                        'diagnostics': [], 'failed_tests': [{'name': 'Suite.Case', 'file': '...', 'line': 42, 'message': '...'}],
+                        'stdout': '...', 'stderr': '...', 'log_file': '...'}
               In case of an error, an 'error_message' key may also be included.
     """
-    # Use the directory specified in the arguments, or the default path if not specified
-    target_directory = DEFAULT_TEST_ROOT_PATH
-    if target_directory is None:
-        effective_test_directory = DEFAULT_TEST_ROOT_PATH
-        print(f"  [Tool Call] No target directory specified for {tool_context.agent_name}, using default: {effective_test_directory}")
-    else:
-        effective_test_directory = target_directory
-        print(f"  [Tool Call] Target directory for {tool_context.agent_name}: {effective_test_directory}")
-
+    effective_test_directory = _resolve_test_directory(tool_context)
     try:
         test_path = Path(effective_test_directory)
         # Check if the test directory exists and is a directory
         if not test_path.is_dir():
-            error_msg = f"Test directory '{effective_test_directory}' not found or is not a directory."
-            print(f"  [Tool Call Error] {error_msg}")
-            return {
-                "status": "error",
-                "stdout": f"Checked path: {effective_test_directory}",
-                "stderr": f"[ERROR] 1: {error_msg}",
-                "error_message": error_msg
-            }
-
-        # Command to execute (for unit tests)
-        command = ["make", "tests"]
-        print(f"  [Tool Call] Executing command: '{' '.join(command)}' in '{effective_test_directory}'")
-
-        # Use subprocess.run to execute the command
-        # The cwd parameter specifies the working directory for the command
-        process = subprocess.run(
-            command,
-            cwd=str(test_path),
-            capture_output=True,  # Capture standard output and standard error
-            text=True,            # Decode output as text
-            check=False           # Do not raise an exception if the return code is non-zero
-        )
-
-        if process.returncode == 0:
-            # On test success, terminate the agent's loop (this behavior can be adjusted based on agent design)
-            tool_context.actions.escalate = True
-            print(f"  [Tool Call] Test execution successful in '{effective_test_directory}'. Escalation triggered by {tool_context.agent_name}.")
-            return {
-                "status": "success",
-                "stdout": process.stdout,
-                "stderr": process.stderr
-            }
-        else:
-            error_msg = f"Test execution failed in '{effective_test_directory}' with return code: {process.returncode}"
-            print(f"  [Tool Call Error] {error_msg}")
-            print(f"  [Tool Call STDOUT]:\n{process.stdout}")
-            print(f"  [Tool Call STDERR]:\n{process.stderr}")
-            return {
-                "status": "error",
-                "stdout": process.stdout,
-                "stderr": process.stderr,
-                "error_message": f"[ERROR] 2: {error_msg}"
-            }
-    except FileNotFoundError:
-        # If the 'make' command is not found
-        error_msg = "The 'make' command was not found. Please ensure make is installed and in your PATH."
-        print(f"  [Tool Call Error] {error_msg}")
-        return {
-            "status": "error",
-            "stdout": "",
-            "stderr": f"[ERROR] 3: {error_msg}",
-            "error_message": "The 'make' command was not found."
-        }
+            return _missing_directory_result(effective_test_directory)
+
+        # Every toolchain of the matrix tests in its own build tree concurrently; the results are merged
+        builders = get_builders(test_path / "examples")
+        with ThreadPoolExecutor(max_workers=len(builders)) as executor:
+            results = list(executor.map(
+                lambda builder: _test(builder, tool_context.state, test_path, effective_test_directory, tool_context.agent_name), builders))
+        return _finish(merge_results({builder.toolchain: result for builder, result in zip(builders, results)}), tool_context, effective_test_directory)
     except Exception as e:
-        # Other unexpected errors
-        error_msg = f"An unexpected error occurred during test execution in '{effective_test_directory}': {str(e)}"
-        print(f"  [Tool Call Error] {error_msg}")
-        return {
-            "status": "error",
-            "stdout": "",
-            "stderr": str(e),
-            "error_message": f"[ERROR] 4: {error_msg}"
-        }
+        return _exception_result(e, effective_test_directory)
+
+async def execute_tests_async(
+        tool_context: ToolContext,
+        target_directory: Optional[str] = None,
+        timeout_seconds: Optional[float] = None
+    ) -> dict:
+    """
+    Executes unit tests like 'execute_tests' without blocking other sessions.
+    The build and ctest output is streamed to 'examples/build/gen_code_live.log' while it runs.
+    If the tests do not finish within the timeout, the whole process group is killed and the
+    output captured so far is returned. Cancelling the call also kills the running processes.
+
+    Args:
+        target_directory (Optional[str]): Ignored; the tests always run in the current workspace.
+        timeout_seconds (Optional[float]): Maximum time for building and running the tests.
+                                     Defaults to GEN_CODE_TEST_TIMEOUT (600 seconds).
+        tool_context (ToolContext): The context for the tool execution, used for actions like escalation.
+
+    Returns:
+        dict: A dictionary containing the status of the test execution, the failing tests with their
+              assertion locations, compiler diagnostics and the tail of standard output and standard error.
+              The full log is written to 'log_file'.
+              Example: {'status': 'success' or 'error', 'summary': '0 error(s), 0 warning(s), 1 failed test(s)',
+                        'diagnostics': [], 'failed_tests': [{'name': 'Suite.Case', 'file': '...', 'line': 42, 'message': '...'}],
+                        'stdout': '...', 'stderr': '...', 'log_file': '...'}
+              In case of an error, an 'error_message' key may also be included.
+    """
+    effective_test_directory = _resolve_test_directory(tool_context)
+    timeout_seconds = timeout_seconds or DEFAULT_TEST_TIMEOUT_SECONDS
+    try:
+        test_path = Path(effective_test_directory)
+        if not test_path.is_dir():
+            return _missing_directory_result(effective_test_directory)
+
+        # 初回は GoogleTest キャッシュの作成を伴うことがあるため、イベントループの外で取得します
+        builders = await asyncio.to_thread(get_builders, test_path / "examples")
+        results = await asyncio.gather(*(
+            _test_async(builder, tool_context.state, test_path, effective_test_directory, tool_context.agent_name, timeout_seconds)
+            for builder in builders
+        ))
+        return _finish(merge_results({builder.toolchain: result for builder, result in zip(builders, results)}), tool_context, effective_test_directory)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        return _exception_result(e, effective_test_directory)
 
 # FunctionTool uses the updated execute_tests_in_directory function
 # Change the tool name to be more specific
 test_tool = FunctionTool(func=execute_tests)
+test_tool_async = FunctionTool(func=execute_tests_async)
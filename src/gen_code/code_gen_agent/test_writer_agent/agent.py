@@ -1,6 +1,7 @@
 from google.adk.agents import LlmAgent
 
 from gen_code.code_gen_agent.common.models import Model
+from gen_code.code_gen_agent.common.llm_cache import llm_cache
 from .tools import generate_test_callback
 from .prompt import agent_instruction
 
@@ -12,5 +13,7 @@ test_writer_agent = LlmAgent(
     instruction=agent_instruction,
     description="Generates GoogleTest (gtest) unit tests for C code based on the provided source and header files, and writes the test code to a .cpp file.",
     output_key="generated_test_code",  # Stores output in state['generated_test_code']
+    before_model_callback=llm_cache.before_model,
+    after_model_callback=llm_cache.after_model,
     after_agent_callback=generate_test_callback
 )
@@ -3,7 +3,7 @@ Your primary goal is to write comprehensive unit tests using the GoogleTest (gte
 
 **Input for Test Generation:**
 1.  **Source Code:** Primarily use the `refactored_code` variable if provided. Otherwise, use the C source and header files from the broader context.
-2.  **Previous Test Results (Optional):** You might receive a `test_result` variable in the state. This variable contains the outcome of previously executed tests. It will typically be a dictionary with 'status', 'stdout', and 'stderr'.
+2.  **Previous Test Results (Optional):** You might receive a `test_result` variable in the state. This variable contains the outcome of previously executed tests. It will typically be a dictionary with 'status', a 'summary', the parsed compiler 'diagnostics' (file, line, message), the 'failed_tests' (test name, assertion file/line and message), and the last part of 'stdout' and 'stderr'.
 
 **Task:**
 Based on the available inputs, generate or refine unit tests.
@@ -12,7 +12,7 @@ Based on the available inputs, generate or refine unit tests.
 *   **Iterative Refinement (if `test_result` is provided):**
     *   **Analyze `test_result`:**
         *   If `test_result.status` is 'error' or indicates test failures (e.g., non-zero return code, specific error messages in `stderr` or `stdout`), carefully examine the output.
-        *   Identify which tests failed and why.
+        *   Identify which tests failed and why. Start from `failed_tests` and `diagnostics`; they point at the exact test cases and assertion or compile-error locations.
         *   Your new set of tests should aim to:
             *   Fix the failing tests if the issue was in the test logic itself.
             *   Add new tests or modify existing ones to better cover the scenarios that led to failures.
@@ -22,6 +22,15 @@ Based on the available inputs, generate or refine unit tests.
         *   If the goal is to achieve a certain coverage or test specific new functionalities, focus on those.
         *   Otherwise, you can acknowledge the success and await further instructions or confirm completion if all requirements are met.
 
+**Coverage-guided Refinement:**
+If uncovered regions are listed below, all existing tests already pass but do not reach these lines and branches.
+In that case, output ONLY the new test cases (and any #includes they need) that exercise exactly these regions; they are appended to the existing test file.
+Do not repeat or redefine the existing test cases or fixtures (reuse the existing fixtures with TEST_F), and use new, unique test names.
+Derive the inputs that reach each uncovered line or untaken branch from its source line and the requirements.
+
+Uncovered regions (empty when there is nothing to target):
+{coverage_targets?}
+
 **General Guidelines for Test Code:**
 - Output only the test code for a single .cpp file.
 - Include all necessary #includes for the header under test and for gtest.
@@ -1,12 +1,21 @@
 import os
 import json
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional
 
 from google.adk.agents.callback_context import CallbackContext
 from google.genai import types
 
-from gen_code.code_gen_agent.common.constants import AGENT_STATE_KEYS, ROOT_DIR
+from gen_code.code_gen_agent.common.constants import AGENT_STATE_KEYS
+from gen_code.code_gen_agent.common.coverage import COVERAGE_TARGETS_STATE_KEY
+from gen_code.code_gen_agent.common.modules import module_name
+from gen_code.code_gen_agent.common.workspace import resolve_root
+
+def _append_tests(existing: str, code: str) -> str:
+    # 既存ファイルにある #include は重複させません
+    existing_lines = {line.strip() for line in existing.splitlines()}
+    added = [line for line in code.splitlines() if not (line.strip().startswith("#include") and line.strip() in existing_lines)]
+    return existing.rstrip("\n") + "\n\n" + "\n".join(added).strip("\n") + "\n"
 
 def generate_test_callback(
     callback_context: CallbackContext
@@ -14,6 +23,8 @@ def generate_test_callback(
     """
     Callback function for unit test generation.
     Receives LLM output and saves it as a test file.
+    When the passing tests were below the coverage thresholds (state['coverage_targets'] is set),
+    the output only holds the tests for the uncovered regions and is appended to the existing file.
     """
     agent_name = callback_context.agent_name
     llm_output_str: Optional[str] = None
@@ -21,7 +32,8 @@ def generate_test_callback(
     # 1. state から出力を取得試行
     agent_output_key = AGENT_STATE_KEYS.get(agent_name)
     if agent_output_key:
-        current_state: Dict[str, Any] = callback_context.state.to_dict()
+        # to_dict() は生成コードやビルド結果を含む state 全体をコピーするため、State を直接参照します
+        current_state = callback_context.state
         if agent_output_key in current_state:
             output_from_state = current_state.get(agent_output_key)
             if isinstance(output_from_state, str) and output_from_state.strip():
@@ -83,13 +95,16 @@ def generate_test_callback(
 
     # ファイル書き出し処理 (既存のロジックを流用)
     try:
-        test_dir = ROOT_DIR / "examples" / "tests"
+        test_dir = resolve_root(callback_context.state) / "examples" / "tests"
         test_dir.mkdir(parents=True, exist_ok=True)
         # ファイル名はエージェント名や入力に基づいて動的に変更することも検討可能
         test_file = test_dir / f"test_{agent_name.lower().replace('agent', '').replace('writer', '')}.cpp"
-        if agent_name == "TestWriterAgent": # より具体的なファイル名
-             test_file = test_dir / "test_doorlock_control.cpp"
+        if agent_name == "TestWriterAgent": # より具体的なファイル名 (実行中のモジュール、既定は doorlock_control)
+             test_file = test_dir / f"test_{module_name(callback_context.state)}.cpp"
 
+        if callback_context.state.get(COVERAGE_TARGETS_STATE_KEY) and test_file.is_file():
+            code = _append_tests(test_file.read_text(encoding="utf-8"), code)
+            print(f"[Callback TestWriter] Appending coverage-targeted tests from agent '{agent_name}' to {test_file}")
         with open(test_file, "w", encoding="utf-8") as f:
             f.write(code)
         print(f"[Callback TestWriter] Successfully wrote test code from agent '{agent_name}' to {test_file}")
@@ -0,0 +1,246 @@
+"""
+Offline benchmark of the pipeline machinery.
+
+Runs `root_agent` against ReplayLlm (recorded model responses, see recordings/*.json), so only the
+pipeline's own cost is measured: callbacks, JSON extraction, file writes, builds, tests and loop
+control. No network access or API key is needed; GoogleTest must be in the local cache or
+GEN_CODE_GTEST_SOURCE must point at a googletest archive/source tree.
+
+For every spec the pipeline runs `--repeat` times in a fresh workspace. Reported metrics:
+end-to-end wall time, per-agent wall time and overhead (agent time minus model and tool time),
+loop iterations, and peak memory of one extra run under tracemalloc. The metrics are compared
+against baseline.json; any metric above its threshold is reported and the exit code is 1.
+
+Usage:
+    python -m tests.benchmarks.pipeline_benchmark                      # compare with the baseline
+    python -m tests.benchmarks.pipeline_benchmark --repeat 5 --update-baseline
+    python -m tests.benchmarks.pipeline_benchmark examples/docs/door_lock.md --record recordings/door_lock.json  # needs an API key
+"""
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import fnmatch
+import logging
+import resource
+import tempfile
+import tracemalloc
+import warnings
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+
+from gen_code.code_gen_agent.agent import root_agent
+from gen_code.code_gen_agent.batch import APP_NAME, run_pipeline
+from gen_code.code_gen_agent.common.constants import ROOT_DIR
+from gen_code.code_gen_agent.common.llm_cache import llm_cache
+from gen_code.code_gen_agent.common.replay_model import load_recording, record_responses, save_recording, use_replay_model
+from gen_code.code_gen_agent.common.result_cache import result_cache
+from gen_code.code_gen_agent.common.telemetry import telemetry
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+RECORDINGS_DIR = BENCHMARK_DIR / "recordings"
+BASELINE_PATH = BENCHMARK_DIR / "baseline.json"
+DEFAULT_RECORDING = RECORDINGS_DIR / "door_lock.json"
+DEFAULT_SPECS = (ROOT_DIR / "examples" / "docs" / "door_lock.md", ROOT_DIR / "examples" / "docs" / "items.md")
+
+# ベースラインに閾値がない指標に使う既定値。小さな値のノイズで失敗しないよう絶対値の余裕も持たせます。
+DEFAULT_THRESHOLDS = {
+    "*": {"relative": 0.25, "absolute": 50.0},
+    "memory.*": {"relative": 0.20, "absolute": 5.0},
+    "iterations.*": {"relative": 0.0, "absolute": 0.0},
+}
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percentile / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+def _recording_for(spec: Path, recording: Optional[Path]) -> Dict[str, Any]:
+    if recording:
+        return load_recording(recording)
+    candidate = RECORDINGS_DIR / f"{spec.stem}.json"
+    return load_recording(candidate if candidate.is_file() else DEFAULT_RECORDING)
+
+
+def _stage_times(session_id: str) -> Dict[str, Dict[str, float]]:
+    """Sums agent, model and tool time per agent for one session from the telemetry spans."""
+    stages: Dict[str, Dict[str, float]] = defaultdict(lambda: {"wall_ms": 0.0, "model_ms": 0.0, "tool_ms": 0.0, "runs": 0})
+    for span in telemetry.spans:
+        args = span.get("args", {})
+        if args.get("session_id") != session_id:
+            continue
+        duration_ms = span["dur"] / 1000
+        if span["cat"] == "agent":
+            stages[span["name"]]["wall_ms"] += duration_ms
+            stages[span["name"]]["runs"] += 1
+        elif span["cat"] in ("model", "tool") and args.get("agent"):
+            stages[args["agent"]][f"{span['cat']}_ms"] += duration_ms
+    return stages
+
+
+async def _run_once(spec: Path, recording: Dict[str, Any], workspace: Path, stream: bool = False) -> Dict[str, Any]:
+    use_replay_model(root_agent, recording)
+    session_service = InMemorySessionService()
+    runner = Runner(agent=root_agent, app_name=APP_NAME, session_service=session_service)
+    run_config = RunConfig(streaming_mode=StreamingMode.SSE) if stream else None
+    run = await run_pipeline(runner, session_service, spec, workspace, run_config)
+    if run.error or run.build_status != "success" or run.test_status != "success":
+        raise RuntimeError(f"Benchmark run for '{spec}' did not finish green: {run}")
+    return {"wall_ms": run.elapsed_seconds * 1000, "stages": _stage_times(run.session_id)}
+
+
+def run_benchmark(
+        specs: Sequence[Path],
+        repeat: int = 3,
+        recording: Optional[Path] = None,
+        measure_memory: bool = True,
+        keep_workspaces: bool = False,
+        stream: bool = False
+    ) -> Dict[str, float]:
+    """Runs every spec `repeat` times and returns the flat metric dict compared against the baseline."""
+    workspace_root = Path(tempfile.mkdtemp(prefix="gen_code_bench_"))
+    wall: List[float] = []
+    stage_wall: Dict[str, List[float]] = defaultdict(list)
+    stage_overhead: Dict[str, List[float]] = defaultdict(list)
+    iterations: Dict[str, int] = {}
+    metrics: Dict[str, float] = {}
+    try:
+        for spec in specs:
+            spec_recording = _recording_for(spec, recording)
+            for index in range(repeat):
+                result = asyncio.run(_run_once(spec, spec_recording, workspace_root / f"{spec.stem}-{index}", stream))
+                wall.append(result["wall_ms"])
+                for name, stage in result["stages"].items():
+                    stage_wall[name].append(stage["wall_ms"])
+                    if stage["model_ms"] or stage["tool_ms"]:
+                        stage_overhead[name].append(stage["wall_ms"] - stage["model_ms"] - stage["tool_ms"])
+                    if name in ("CodeBuilderAgent", "TestRunnerAgent"):
+                        iterations[f"iterations.{spec.stem}.{name}"] = stage["runs"]
+
+        metrics["e2e_ms.p50"] = _percentile(wall, 50)
+        metrics["e2e_ms.p95"] = _percentile(wall, 95)
+        for name, values in sorted(stage_wall.items()):
+            metrics[f"stage.{name}.wall_ms.p50"] = _percentile(values, 50)
+        for name, values in sorted(stage_overhead.items()):
+            metrics[f"stage.{name}.overhead_ms.p50"] = _percentile(values, 50)
+        metrics.update(iterations)
+
+        if measure_memory:
+            # tracemalloc は実行を遅くするため、時間計測とは別の 1 回で測ります
+            tracemalloc.start()
+            asyncio.run(_run_once(specs[0], _recording_for(specs[0], recording), workspace_root / "memory", stream))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            metrics["memory.python_peak_mb"] = round(peak / 1024 / 1024, 3)
+            metrics["memory.max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 3)
+    finally:
+        if not keep_workspaces:
+            shutil.rmtree(workspace_root, ignore_errors=True)
+    return metrics
+
+
+def record(spec: Path, path: Path) -> None:
+    """Runs the pipeline once against the real models and stores their responses as a new recording."""
+    recording: Dict[str, Any] = {"description": f"Recorded from {spec.name}", "responses": {}}
+    record_responses(root_agent, recording)
+    session_service = InMemorySessionService()
+    runner = Runner(agent=root_agent, app_name=APP_NAME, session_service=session_service)
+    workspace_root = Path(tempfile.mkdtemp(prefix="gen_code_record_"))
+    try:
+        asyncio.run(run_pipeline(runner, session_service, spec, workspace_root / spec.stem))
+    finally:
+        shutil.rmtree(workspace_root, ignore_errors=True)
+    save_recording(recording, path)
+    print(f"[Benchmark] Recorded {sum(len(r) for r in recording['responses'].values())} response(s) to {path}")
+
+
+def _threshold(name: str, thresholds: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    # 最も具体的な (長い) パターンを優先します
+    for pattern in sorted(thresholds, key=len, reverse=True):
+        if fnmatch.fnmatch(name, pattern):
+            return thresholds[pattern]
+    return DEFAULT_THRESHOLDS["*"]
+
+
+def compare(metrics: Dict[str, float], baseline: Dict[str, Any]) -> List[str]:
+    """Returns a message for every metric above baseline * (1 + relative) + absolute."""
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get("thresholds", {})}
+    regressions = []
+    for name, value in metrics.items():
+        reference = baseline.get("metrics", {}).get(name)
+        if reference is None:
+            continue
+        limit = _threshold(name, thresholds)
+        allowed = reference * (1 + limit.get("relative", 0.0)) + limit.get("absolute", 0.0)
+        if value > allowed:
+            regressions.append(f"{name}: {value} > {round(allowed, 3)} (baseline {reference})")
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark of the code generation pipeline.")
+    parser.add_argument("specs", nargs="*", type=Path, default=list(DEFAULT_SPECS), help="Requirement documents to run")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Runs per spec (default: 3)")
+    parser.add_argument("--recording", type=Path, default=None, help="Recorded responses to replay for every spec")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="Baseline to compare with")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the measured metrics as the new baseline")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run")
+    parser.add_argument("--with-result-cache", action="store_true", help="Allow build/test result cache hits")
+    parser.add_argument("--keep-workspaces", action="store_true", help="Keep the temporary workspaces")
+    parser.add_argument("--stream", action="store_true", help="Replay the responses as SSE partial responses")
+    parser.add_argument("--output", type=Path, default=None, help="Write the measured metrics to this file")
+    parser.add_argument("--record", type=Path, default=None, help="Record the real model's responses for the first spec to this file")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    logging.basicConfig(level=logging.ERROR)
+    # LoopAgent の escalate で閉じられたジェネレータについて OpenTelemetry が出す無害なエラーログを抑えます
+    logging.getLogger("opentelemetry.context").setLevel(logging.CRITICAL)
+    # キャッシュヒットでビルドが省略されると計測にならないため、既定では結果キャッシュを無効にします
+    result_cache.enabled = args.with_result_cache
+    # 応答キャッシュは再生モデルの呼び出しや記録を素通りさせてしまうため使いません
+    llm_cache.disable()
+
+    if args.record:
+        load_dotenv()
+        record(args.specs[0], args.record)
+        return 0
+
+    started = time.monotonic()
+    metrics = run_benchmark(args.specs, args.repeat, args.recording, not args.no_memory, args.keep_workspaces, args.stream)
+    print(f"[Benchmark] {len(args.specs)} spec(s) x {args.repeat} run(s) in {time.monotonic() - started:.1f}s")
+    print(json.dumps(metrics, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(metrics, indent=2) + "\n", encoding="utf-8")
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.is_file() else {}
+    if args.update_baseline:
+        baseline["metrics"] = metrics
+        baseline.setdefault("thresholds", DEFAULT_THRESHOLDS)
+        args.baseline.write_text(json.dumps(baseline, indent=2) + "\n", encoding="utf-8")
+        print(f"[Benchmark] Baseline written to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"[Benchmark] No baseline at {args.baseline}; run with --update-baseline to create one.")
+        return 0
+    regressions = compare(metrics, baseline)
+    for regression in regressions:
+        print(f"[Benchmark] REGRESSION {regression}")
+    if not regressions:
+        print("[Benchmark] No regressions against the baseline.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Concurrent pipelines against a throttled stand-in model.
+
+Runs `--concurrency` pipelines at once on ReplayLlm behind a SimulatedQuota (a shared sliding-window
+request limit that answers 429 RESOURCE_EXHAUSTED like the Gemini API), once with the scheduler's rate
+limits off (rate-limited calls are only retried with backoff) and once with them set just below the
+quota. Reports, per mode, the wall time, rejected calls and the scheduler's queue metrics.
+
+Usage:
+    python -m tests.benchmarks.throttling_benchmark                         # 6 pipelines, 40 calls per 10s quota
+    python -m tests.benchmarks.throttling_benchmark -c 8 --quota 30 --window 10
+"""
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import logging
+import tempfile
+import warnings
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence
+
+from gen_code.code_gen_agent.agent import root_agent
+from gen_code.code_gen_agent.batch import run_batch
+from gen_code.code_gen_agent.common.constants import ROOT_DIR
+from gen_code.code_gen_agent.common.llm_cache import llm_cache
+from gen_code.code_gen_agent.common.replay_model import SimulatedQuota, load_recording, use_replay_model
+from gen_code.code_gen_agent.common.result_cache import result_cache
+from gen_code.code_gen_agent.common.scheduler import model_scheduler
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+DEFAULT_RECORDING = BENCHMARK_DIR / "recordings" / "door_lock.json"
+DEFAULT_SPEC = ROOT_DIR / "examples" / "docs" / "door_lock.md"
+# 制限をクォータよりこの割合だけ下に設定します
+HEADROOM = 0.9
+
+
+def run_mode(
+        spec: Path,
+        recording: Dict[str, Any],
+        concurrency: int,
+        quota_calls: int,
+        window_seconds: float,
+        scheduled: bool
+    ) -> Dict[str, Any]:
+    """Runs `concurrency` pipelines at once and returns the wall time and the throttling metrics."""
+    quota = SimulatedQuota(quota_calls, window_seconds=window_seconds)
+    use_replay_model(root_agent, recording, quota=quota)
+    if scheduled:
+        # バケットの容量と窓内の補充分の合計がクォータを超えないよう、バーストを小さくします
+        model_scheduler.configure(requests_per_minute=quota_calls * HEADROOM * 60.0 / window_seconds,
+                                  burst_seconds=window_seconds * (1 - HEADROOM))
+    else:
+        model_scheduler.configure()
+    model_scheduler.reset_metrics()
+
+    workspace_root = Path(tempfile.mkdtemp(prefix="gen_code_throttle_"))
+    started = time.monotonic()
+    try:
+        runs = asyncio.run(run_batch([spec] * concurrency, agent=root_agent, max_parallel=concurrency, workspace_root=workspace_root))
+    finally:
+        shutil.rmtree(workspace_root, ignore_errors=True)
+    return {
+        "wall_s": round(time.monotonic() - started, 3),
+        "green_runs": sum(1 for run in runs if run.build_status == "success" and run.test_status == "success"),
+        "failed_runs": sum(1 for run in runs if run.error),
+        "rejected_by_quota": quota.rejected,
+        **model_scheduler.metrics(),
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrent pipelines against a throttled stand-in model.")
+    parser.add_argument("spec", nargs="?", type=Path, default=DEFAULT_SPEC, help="Requirement document to run")
+    parser.add_argument("-c", "--concurrency", type=int, default=6, help="Pipelines running at once (default: 6)")
+    parser.add_argument("--recording", type=Path, default=DEFAULT_RECORDING, help="Recorded responses to replay")
+    parser.add_argument("--quota", type=int, default=40, help="Calls the stand-in accepts per window (default: 40)")
+    parser.add_argument("--window", type=float, default=10.0, help="Quota window in seconds (default: 10)")
+    parser.add_argument("--output", type=Path, default=None, help="Write the report to this file")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger("opentelemetry.context").setLevel(logging.CRITICAL)
+    result_cache.enabled = False
+    llm_cache.disable()
+
+    recording = load_recording(args.recording)
+    report = {
+        mode: run_mode(args.spec, recording, args.concurrency, args.quota, args.window, scheduled)
+        for mode, scheduled in (("backoff_only", False), ("scheduled", True))
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    return 0 if all(result["failed_runs"] == 0 for result in report.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, AsyncGenerator, Dict, List
+
+import pytest
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.adk.sessions import InMemorySessionService
+from typing_extensions import override
+
+from gen_code.code_gen_agent import batch
+from gen_code.code_gen_agent.common.modules import MODULE_SOURCE_DIR, MODULE_STATE_KEY
+from gen_code.code_gen_agent.common.workspace import WORKSPACE_STATE_KEY
+
+
+@pytest.mark.parametrize("argv", [
+    ["examples/docs/door_lock.md", "--manifest", "examples/docs/items_modules.json"],
+    ["--resume", ".checkpoints/door_lock-1a2b3c4d", "--manifest", "examples/docs/items_modules.json"],
+])
+def test_manifest_is_not_combined_with_other_runs(argv, monkeypatch, capsys):
+    monkeypatch.setattr(batch, "run_modules", lambda *_args, **_kwargs: pytest.fail("ran the manifest"))
+    with pytest.raises(SystemExit) as exit_info:
+        batch.main(argv)
+    assert exit_info.value.code == 2
+    assert "--manifest cannot be combined" in capsys.readouterr().err
+
+
+class _HeaderAgent(BaseAgent):
+    """Writes `<module>.h` into the shared application workspace."""
+
+    @override
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        name = ctx.session.state[MODULE_STATE_KEY]["name"]
+        examples = Path(ctx.session.state[WORKSPACE_STATE_KEY]) / "examples"
+        (examples / MODULE_SOURCE_DIR / f"{name}.h").write_text(f"int {name}(void);\n", encoding="utf-8")
+        yield Event(invocation_id=ctx.invocation_id, author=self.name)
+
+
+class _ModuleAgent(BaseAgent):
+    """Writes the module's source into its workspace and records what the workspace contained."""
+
+    seen: Dict[str, Dict[str, Any]]
+    failing: List[str] = []
+
+    @override
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        name = ctx.session.state[MODULE_STATE_KEY]["name"]
+        workspace = Path(ctx.session.state[WORKSPACE_STATE_KEY])
+        body_app = workspace / "examples" / MODULE_SOURCE_DIR
+        self.seen[name] = {"workspace": workspace, "sources": {p.name for p in body_app.glob("*.c")}}
+        (body_app / f"{name}.c").write_text(f"int {name}(void) {{ return 0; }}\n", encoding="utf-8")
+        status = "error" if name in self.failing else "success"
+        yield Event(invocation_id=ctx.invocation_id, author=self.name,
+                    actions=EventActions(state_delta={"build_result": {"status": status}}))
+
+
+@pytest.fixture
+def manifest(tmp_path: Path) -> Path:
+    path = tmp_path / "modules.json"
+    path.write_text(json.dumps({"modules": [
+        {"name": "battery_monitor", "text": "Battery."},
+        {"name": "odometer", "text": "Distance."},
+        {"name": "regen_control", "text": "Regeneration.", "depends_on": ["battery_monitor"]},
+        {"name": "maintenance_notice", "text": "Maintenance.", "depends_on": ["odometer"]},
+    ]}), encoding="utf-8")
+    return path
+
+
+def _run_modules(monkeypatch, tmp_path: Path, manifest: Path, failing: List[str] = ()):
+    linked: List[List[str]] = []
+
+    async def link(_manifest, app: Path, modules):
+        linked.append(sorted(modules))
+        return batch.PipelineRun(spec="link", session_id="", workspace=str(app), build_status="success")
+
+    monkeypatch.setattr(batch, "_link", link)
+    agent = _ModuleAgent(name="Pipeline", seen={}, failing=list(failing))
+    runs = asyncio.run(batch.run_modules(manifest, agent=agent, header_agent=_HeaderAgent(name="HeaderWriter"),
+                                         max_parallel=2, workspace_root=tmp_path / "runs",
+                                         session_service=InMemorySessionService()))
+    return runs, agent.seen, linked
+
+
+def test_each_module_runs_in_its_own_workspace(monkeypatch, tmp_path: Path, manifest: Path):
+    runs, seen, linked = _run_modules(monkeypatch, tmp_path, manifest)
+
+    workspaces = {name: run["workspace"] for name, run in seen.items()}
+    assert sorted(workspaces) == ["battery_monitor", "maintenance_notice", "odometer", "regen_control"]
+    assert len(set(workspaces.values())) == 4
+    assert all(workspace.name == name for name, workspace in workspaces.items())
+    # 依存モジュールの生成物は、アプリケーションのワークスペースを経由して後続のモジュールに渡ります
+    assert "battery_monitor.c" in seen["regen_control"]["sources"]
+    assert "odometer.c" in seen["maintenance_notice"]["sources"]
+    assert "regen_control.c" not in seen["battery_monitor"]["sources"]
+    assert [run.build_status for run in runs] == ["success"] * 5
+    assert linked == [["battery_monitor", "maintenance_notice", "odometer", "regen_control"]]
+    app = Path(runs[-1].workspace) / "examples" / MODULE_SOURCE_DIR
+    assert (app / "regen_control.c").is_file() and (app / "regen_control.h").is_file()
+
+
+def test_modules_depending_on_a_failed_module_are_skipped(monkeypatch, tmp_path: Path, manifest: Path):
+    runs, seen, linked = _run_modules(monkeypatch, tmp_path, manifest, failing=["odometer"])
+
+    assert "maintenance_notice" not in seen
+    errors = {run.spec.rsplit("#", 1)[-1]: run.error for run in runs[:-1]}
+    assert errors["maintenance_notice"] == "Dependency not built: odometer"
+    assert errors["regen_control"] is None
+    assert linked == [["battery_monitor", "regen_control"]]
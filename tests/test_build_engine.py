@@ -0,0 +1,52 @@
+from pathlib import Path
+
+import pytest
+
+from gen_code.code_gen_agent.common import build_engine
+from gen_code.code_gen_agent.common.build_engine import get_builder, release_builders
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(build_engine, "_builders", build_engine.OrderedDict())
+    monkeypatch.setattr(build_engine, "MAX_BUILDERS", 3)
+    monkeypatch.setattr(build_engine, "gtest_configure_args", lambda: [])
+    return build_engine._builders
+
+
+def _examples(tmp_path: Path, name: str) -> Path:
+    return tmp_path / name / "examples"
+
+
+def test_the_same_tree_gets_the_same_builder(tmp_path: Path):
+    builder = get_builder(_examples(tmp_path, "a"))
+    assert get_builder(_examples(tmp_path, "a")) is builder
+    assert get_builder(_examples(tmp_path, "a"), "clang") is not builder
+
+
+def test_least_recently_used_idle_builders_are_evicted(tmp_path: Path, registry):
+    a, b, c = (get_builder(_examples(tmp_path, name)) for name in "abc")
+    get_builder(_examples(tmp_path, "a"))
+    b.lock.acquire()
+    try:
+        # b は最も古いですがビルド中なので残し、次に古い c を外します
+        get_builder(_examples(tmp_path, "d"))
+    finally:
+        b.lock.release()
+
+    assert [path.parent.parent.name for path in registry] == ["b", "a", "d"]
+    assert get_builder(_examples(tmp_path, "a")) is a
+    assert get_builder(_examples(tmp_path, "c")) is not c
+
+
+def test_released_workspaces_drop_their_builders(tmp_path: Path, registry, monkeypatch):
+    monkeypatch.setattr(build_engine, "MAX_BUILDERS", 10)
+    get_builder(_examples(tmp_path, "a"))
+    get_builder(_examples(tmp_path, "a"), "clang")
+    # 候補スロットなど、ワークスペースの中の別のツリーも外します
+    get_builder(tmp_path / "a" / "examples" / "build-candidates" / "0" / "examples")
+    get_builder(_examples(tmp_path, "ab"))
+
+    assert release_builders(tmp_path / "a") == 3
+    assert [path.parent.parent.name for path in registry] == ["ab"]
+    assert release_builders(tmp_path / "a") == 0
@@ -0,0 +1,30 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+from gen_code.code_gen_agent.common.build_scheduler import BuildScheduler
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="the jobserver needs FIFOs")
+
+
+def test_sync_jobs_from_a_coroutine_wait_for_a_slot(tmp_path: Path):
+    scheduler = BuildScheduler(jobs=1)
+
+    async def run():
+        slow = asyncio.create_task(scheduler.submit_async([sys.executable, "-c", "import time; time.sleep(0.5)"], tmp_path))
+        await asyncio.sleep(0.1)
+        # ブロックする submit() はイベントループのスレッドでは実行しません
+        with pytest.raises(RuntimeError, match="submit_async"):
+            scheduler.submit(["true"], tmp_path)
+        quick = await asyncio.to_thread(scheduler.submit, [sys.executable, "-c", "print('done')"], tmp_path)
+        return await slow, quick
+
+    slow, quick = asyncio.run(run())
+
+    assert slow.returncode == 0 and quick.stdout == "done\n"
+    metrics = scheduler.metrics()
+    # 2 つ目のジョブはスロットなしで走らず、1 つ目の終了を待ちます
+    assert metrics["jobs"] == 2 and metrics["max_running"] == 1
+    assert metrics["slot_wait_ms.p95"] >= 200
@@ -0,0 +1,150 @@
+import asyncio
+from pathlib import Path
+from typing import AsyncGenerator, List
+
+import pytest
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+from typing_extensions import override
+
+from gen_code.code_gen_agent.common import checkpoint
+from gen_code.code_gen_agent.common.checkpoint import (
+    CheckpointMismatchError, Checkpointer, ResumableLoopAgent, ResumableSequentialAgent, load_checkpoint,
+    restore_session,
+)
+from gen_code.code_gen_agent.common.workspace import WORKSPACE_STATE_KEY
+
+APP, USER, SESSION = "app", "user", "door_lock-1"
+SOURCE = "examples/src/body_app/doorlock_control.c"
+
+
+class Crash(Exception):
+    pass
+
+
+class StepAgent(BaseAgent):
+    """Appends its name to state['log'] and writes the next version of the source in the workspace."""
+
+    crash_at: int = 0
+
+    @override
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        log: List[str] = ctx.session.state.get("log", []) + [self.name]
+        if self.crash_at and len(log) == self.crash_at:
+            raise Crash(self.name)
+        source = Path(ctx.session.state[WORKSPACE_STATE_KEY]) / SOURCE
+        source.write_text(f"/* {len(log)} */\n", encoding="utf-8")
+        yield Event(invocation_id=ctx.invocation_id, author=self.name, actions=EventActions(state_delta={"log": log}))
+
+
+def _pipeline(crash_at: int = 0) -> ResumableSequentialAgent:
+    return ResumableSequentialAgent(name="Pipeline", sub_agents=[
+        StepAgent(name="writer"),
+        ResumableLoopAgent(name="RefactorLoop", max_iterations=3, sub_agents=[
+            StepAgent(name="refactor", crash_at=crash_at),
+            StepAgent(name="build"),
+        ]),
+        StepAgent(name="integration"),
+    ])
+
+
+@pytest.fixture
+def recorder(monkeypatch, tmp_path: Path) -> Checkpointer:
+    recorder = Checkpointer(tmp_path / "checkpoints")
+    monkeypatch.setattr(checkpoint, "checkpointer", recorder)
+    return recorder
+
+
+@pytest.fixture
+def workspace(tmp_path: Path) -> Path:
+    (tmp_path / "workspace" / SOURCE).parent.mkdir(parents=True)
+    return tmp_path / "workspace"
+
+
+async def _run(agent: BaseAgent, service: InMemorySessionService, message: str = None) -> None:
+    content = types.Content(role="user", parts=[types.Part(text=message)]) if message else None
+    async for _ in Runner(agent=agent, app_name=APP, session_service=service).run_async(
+            user_id=USER, session_id=SESSION, new_message=content):
+        pass
+
+
+def _crash_in_second_iteration(workspace: Path) -> Path:
+    service = InMemorySessionService()
+    asyncio.run(service.create_session(app_name=APP, user_id=USER, session_id=SESSION,
+                                       state={WORKSPACE_STATE_KEY: str(workspace)}))
+    # writer, refactor, build, refactor(2 回目) の 4 番目で落ちます
+    with pytest.raises(Crash):
+        asyncio.run(_run(_pipeline(crash_at=4), service, "requirements"))
+    return checkpoint.checkpointer.root / SESSION
+
+
+def test_checkpoint_is_saved_after_each_sub_agent(recorder, workspace):
+    directory = _crash_in_second_iteration(workspace)
+
+    saved = load_checkpoint(directory)
+    assert saved["position"] == {"Pipeline": {"index": 1}, "RefactorLoop": {"iteration": 2, "index": 0}}
+    assert saved["state"]["log"] == ["writer", "refactor", "build"]
+    assert saved["files"] == {SOURCE: checkpoint.hash_sources(workspace)[SOURCE]}
+    # ユーザーのメッセージと 3 つのエージェントのイベント
+    assert saved["events"] == 4
+    assert len((directory / checkpoint.EVENTS_FILE).read_text(encoding="utf-8").splitlines()) == 4
+
+
+def test_resume_at_loop_iteration(recorder, workspace):
+    directory = _crash_in_second_iteration(workspace)
+
+    service = InMemorySessionService()
+    session = asyncio.run(restore_session(service, directory))
+    assert session.state["log"] == ["writer", "refactor", "build"]
+    assert len(session.events) == 4
+
+    asyncio.run(_run(_pipeline(), service))
+
+    session = asyncio.run(service.get_session(app_name=APP, user_id=USER, session_id=SESSION))
+    # writer と 1 回目の反復はやり直さず、2 回目の反復から続けます
+    assert session.state["log"] == ["writer", "refactor", "build", "refactor", "build", "refactor", "build",
+                                    "integration"]
+    assert (workspace / SOURCE).read_text(encoding="utf-8") == "/* 8 */\n"
+    assert load_checkpoint(directory)["position"] == {"Pipeline": {"index": 3}}
+
+
+def test_changed_sources_are_rejected_unless_restored(recorder, workspace):
+    directory = _crash_in_second_iteration(workspace)
+    (workspace / SOURCE).write_text("/* edited */\n", encoding="utf-8")
+    (workspace / "examples/src/extra.c").write_text("int x;\n", encoding="utf-8")
+
+    with pytest.raises(CheckpointMismatchError) as error:
+        asyncio.run(restore_session(InMemorySessionService(), directory))
+    assert error.value.mismatched == [SOURCE, "examples/src/extra.c"]
+
+    asyncio.run(restore_session(InMemorySessionService(), directory, restore=True))
+    assert (workspace / SOURCE).read_text(encoding="utf-8") == "/* 3 */\n"
+    assert not (workspace / "examples/src/extra.c").exists()
+
+
+def test_finished_sessions_are_forgotten(recorder, workspace):
+    service = InMemorySessionService()
+    asyncio.run(service.create_session(app_name=APP, user_id=USER, session_id=SESSION,
+                                       state={WORKSPACE_STATE_KEY: str(workspace)}))
+    asyncio.run(_run(_pipeline(), service, "requirements"))
+
+    assert (recorder._positions, recorder._armed, recorder._written_events) == ({}, {}, {})
+    assert load_checkpoint(recorder.root / SESSION)["events"] == 9
+
+    # 同じセッションの次の実行は、書き込み済みのイベントを重ねて書きません
+    asyncio.run(_run(_pipeline(), service, "more requirements"))
+    events = (recorder.root / SESSION / checkpoint.EVENTS_FILE).read_text(encoding="utf-8").splitlines()
+    assert len(events) == load_checkpoint(recorder.root / SESSION)["events"] == 18
+    assert recorder._written_events == {}
+
+
+def test_crashed_sessions_are_forgotten_on_request(recorder, workspace):
+    _crash_in_second_iteration(workspace)
+    assert SESSION in recorder._positions and SESSION in recorder._written_events
+
+    recorder.forget(SESSION)
+    assert (recorder._positions, recorder._written_events) == ({}, {})
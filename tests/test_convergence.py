@@ -0,0 +1,148 @@
+import asyncio
+import json
+from typing import Any, AsyncGenerator, Dict, List
+
+import pytest
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+from typing_extensions import override
+
+from gen_code.code_gen_agent.common.convergence import (
+    EXIT_BUILD_SUCCEEDED, EXIT_CODE_UNCHANGED, EXIT_MAX_ITERATIONS, VERDICT_ISSUES, VERDICT_NO_ISSUES,
+    VERDICT_UNKNOWN, ConvergentLoopAgent, code_hash, parse_review_verdict,
+)
+
+APP, USER, SESSION = "app", "user", "s1"
+
+
+@pytest.mark.parametrize("review, verdict", [
+    ("No major issues found.", VERDICT_NO_ISSUES),
+    ("**No major issues found**", VERDICT_NO_ISSUES),
+    ("```\nno major issues found.\n```\n", VERDICT_NO_ISSUES),
+    ("1. `update_door_lock_state` does not check the manual override timer.", VERDICT_ISSUES),
+    ("No major issues found. However, the timer can overflow after 49 days of uptime.", VERDICT_ISSUES),
+    ("", VERDICT_UNKNOWN),
+    ("   \n", VERDICT_UNKNOWN),
+    (None, VERDICT_UNKNOWN),
+])
+def test_parse_review_verdict(review, verdict):
+    assert parse_review_verdict(review) == verdict
+
+
+def _output(header: str, source: str) -> str:
+    return json.dumps({"refactored_header_file_content": header, "refactored_source_file_content": source})
+
+
+def test_code_hash_ignores_whitespace_only_edits():
+    code = _output("int lock(int speed);\n", "int lock(int speed) {\n    return speed >= 20;\n}\n")
+    reformatted = _output("int lock(int speed);   \n\n", "\nint lock(int speed) {  \n    return speed >= 20;\t\n}")
+
+    assert code_hash(code) == code_hash(reformatted)
+    assert code_hash(f"```json\n{code}\n```") == code_hash(code)
+    # キーの順序の違いも変更とは数えません
+    assert code_hash(json.dumps(dict(reversed(list(json.loads(code).items()))))) == code_hash(code)
+    assert code_hash(_output("int lock(int speed);\n", "int lock(int speed) {\n    return speed > 20;\n}\n")) != code_hash(code)
+    # インデントの変更はコードの変更です
+    assert code_hash(_output("int lock(int speed);\n", "int lock(int speed) {\nreturn speed >= 20;\n}\n")) != code_hash(code)
+    assert code_hash("") is None and code_hash(None) is None
+
+
+class StubAgent(BaseAgent):
+    """Writes the next value of `outputs` to state[key] on each run; escalates when it writes `escalate_on`."""
+
+    key: str
+    outputs: List[Any]
+    escalate_on: Any = None
+    runs: int = 0
+
+    @override
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        value = self.outputs[min(self.runs, len(self.outputs) - 1)]
+        self.runs += 1
+        delta: Dict[str, Any] = {self.key: value}
+        if isinstance(value, dict) and "patch" in value:
+            delta = {self.key: value["code"], "refactor_patch_status": {"status": value["patch"]}}
+        escalate = self.escalate_on is not None and value == self.escalate_on
+        yield Event(invocation_id=ctx.invocation_id, author=self.name,
+                    actions=EventActions(state_delta=delta, escalate=escalate or None))
+
+
+def _loop(reviews: List[str], refactors: List[Any], builds: List[str], max_iterations: int = 5):
+    reviewer = StubAgent(name="CodeReviewerAgent", key="review_comments", outputs=reviews)
+    refactorer = StubAgent(name="CodeRefactorerAgent", key="refactored_code", outputs=refactors)
+    builder = StubAgent(name="CodeBuilderAgent", key="build_result", outputs=[{"status": s} for s in builds],
+                        escalate_on={"status": "success"})
+    loop = ConvergentLoopAgent(name="CodeRefinementLoop", sub_agents=[reviewer, refactorer, builder],
+                               max_iterations=max_iterations)
+    return loop, reviewer, refactorer, builder
+
+
+def _run(loop: ConvergentLoopAgent) -> Dict[str, Any]:
+    service = InMemorySessionService()
+
+    async def run() -> Dict[str, Any]:
+        await service.create_session(app_name=APP, user_id=USER, session_id=SESSION,
+                                     state={"generated_code": _output("int lock(int speed);\n", "int lock(int s) { return 0; }\n")})
+        message = types.Content(role="user", parts=[types.Part(text="requirements")])
+        async for _ in Runner(agent=loop, app_name=APP, session_service=service).run_async(
+                user_id=USER, session_id=SESSION, new_message=message):
+            pass
+        session = await service.get_session(app_name=APP, user_id=USER, session_id=SESSION)
+        return session.state
+
+    return asyncio.run(run())
+
+
+def test_stops_when_the_build_succeeds():
+    loop, reviewer, refactorer, builder = _loop(["1. Missing check."], [_output("a", "1"), _output("a", "2")],
+                                                ["error", "success"])
+    state = _run(loop)
+
+    assert state["refinement_exit_reason"] == EXIT_BUILD_SUCCEEDED
+    assert [entry["build_status"] for entry in state["refinement_history"]] == ["error", "success"]
+    assert builder.runs == 2
+
+
+def test_stops_without_building_when_the_refactored_code_is_unchanged():
+    # 2 回目の出力は空白だけが異なります
+    loop, reviewer, refactorer, builder = _loop(["1. Missing check."], [_output("a", "int x;\n"), _output("a", "int x;   \n")],
+                                                ["error"])
+    state = _run(loop)
+
+    assert state["refinement_exit_reason"] == EXIT_CODE_UNCHANGED
+    assert (reviewer.runs, refactorer.runs, builder.runs) == (2, 2, 1)
+    history = state["refinement_history"]
+    assert len(history) == 2 and history[0]["code_hash"] == history[1]["code_hash"]
+
+
+def test_skips_the_reviewer_when_its_input_is_unchanged_and_approved():
+    loop, reviewer, refactorer, builder = _loop(["No major issues found."], [_output("a", str(i)) for i in range(3)],
+                                                ["error"], max_iterations=3)
+    state = _run(loop)
+
+    assert state["refinement_exit_reason"] == EXIT_MAX_ITERATIONS
+    assert (reviewer.runs, refactorer.runs, builder.runs) == (1, 3, 3)
+    assert [entry["skipped"] for entry in state["refinement_history"]] == [[], ["CodeReviewerAgent"], ["CodeReviewerAgent"]]
+    assert all(entry["review_verdict"] == VERDICT_NO_ISSUES for entry in state["refinement_history"])
+
+
+def test_reviewer_is_not_skipped_after_a_verdict_with_issues():
+    loop, reviewer, refactorer, builder = _loop(["1. Missing check."], [_output("a", str(i)) for i in range(2)],
+                                                ["error"], max_iterations=2)
+    _run(loop)
+    assert reviewer.runs == 2
+
+
+def test_skips_the_build_when_the_patch_could_not_be_applied():
+    refactors = [{"code": _output("a", "1"), "patch": "applied"}, {"code": _output("a", "2"), "patch": "conflict"},
+                 {"code": _output("a", "3"), "patch": "applied"}]
+    loop, reviewer, refactorer, builder = _loop(["1. Missing check."], refactors, ["error", "success"])
+    state = _run(loop)
+
+    assert state["refinement_exit_reason"] == EXIT_BUILD_SUCCEEDED
+    assert [entry["skipped"] for entry in state["refinement_history"]] == [[], ["CodeBuilderAgent"], []]
+    assert builder.runs == 2
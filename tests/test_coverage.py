@@ -0,0 +1,84 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from gen_code.code_gen_agent.common.build_engine import IncrementalBuilder
+from gen_code.code_gen_agent.common.coverage import parse_gcov_json, format_targets, threshold_met
+
+DATA_DIR = Path(__file__).parent / "data"
+# gcov --json-format --stdout of test_doorlock_control, recorded in a workspace at /workspace
+WORKSPACE_EXAMPLES = Path("/workspace/examples")
+SOURCE = "src/body_app/doorlock_control.c"
+
+
+@pytest.fixture
+def documents():
+    with open(DATA_DIR / "gcov_doorlock_control.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def coverage(documents):
+    return parse_gcov_json(documents, WORKSPACE_EXAMPLES)
+
+
+def test_parse_gcov_json_totals(coverage):
+    assert coverage["status"] == "success"
+    assert coverage["lines"] == [38, 39]
+    assert coverage["branches"] == [22, 28]
+    assert coverage["line_percent"] == 97.4
+    assert coverage["branch_percent"] == 78.6
+
+
+def test_parse_gcov_json_lists_only_gaps_of_module_sources(coverage):
+    # テストコードと gtest のヘッダーは含めません
+    assert list(coverage["uncovered"]) == [SOURCE]
+    gaps = coverage["uncovered"][SOURCE]
+    assert gaps["update_door_lock_state"] == {"lines": [46], "branches": {"45": "2/4", "74": "5/6"}, "called": True}
+    assert gaps["is_manual_operation"] == {"lines": [], "branches": {"27": "4/6"}, "called": True}
+    assert set(gaps) == {"update_manual_override_timer", "is_manual_operation", "update_door_lock_state"}
+
+
+def test_parse_gcov_json_filters_sources(documents):
+    assert parse_gcov_json(documents, WORKSPACE_EXAMPLES, [SOURCE])["lines"] == [38, 39]
+    other = parse_gcov_json(documents, WORKSPACE_EXAMPLES, ["src/brake_app/speed_generator.c"])
+    assert other["lines"] == [0, 0] and other["uncovered"] == {}
+    assert other["line_percent"] == 100.0
+
+
+def test_threshold_met(coverage):
+    assert threshold_met(coverage, (95.0, 75.0))
+    assert not threshold_met(coverage, (95.0, 80.0))
+
+
+def test_format_targets(coverage, tmp_path: Path):
+    source = tmp_path / SOURCE
+    source.parent.mkdir(parents=True)
+    shutil.copy(DATA_DIR / "doorlock_control.c", source)
+    test_file = tmp_path / "test_doorlock_control.cpp"
+    test_file.write_text("TEST(DoorLockTest, LocksAt20Kph) {}\nTEST_F(DoorLockFixture, ManualOverride) {}\n",
+                         encoding="utf-8")
+
+    text = format_targets(coverage, tmp_path, test_file, thresholds=(100.0, 90.0)).splitlines()
+
+    assert text[0] == "Line coverage 97.4% (target 100%), branch coverage 78.6% (target 90%)."
+    assert f"- {SOURCE} update_door_lock_state(): lines 46; branches taken 2/4 at line 45, 5/6 at line 74" in text
+    assert f"- {SOURCE} is_manual_operation(): branches taken 4/6 at line 27" in text
+    assert f"{SOURCE}:46: return door_lock_state == LOCKED ? LOCK : UNLOCK;" in text
+    assert text[-1] == ("Existing test cases (already passing, do not redefine them): "
+                        "DoorLockTest.LocksAt20Kph, DoorLockFixture.ManualOverride")
+
+
+def test_ctest_command_resets_the_counters(tmp_path: Path):
+    builder = IncrementalBuilder(tmp_path / "examples", tmp_path / "examples" / "build")
+    object_dir = builder.build_dir / "tests" / "CMakeFiles" / "test_doorlock_control.dir"
+    object_dir.mkdir(parents=True)
+    (object_dir / "test_doorlock_control.cpp.gcda").write_bytes(b"old")
+
+    command, _ = builder.ctest_command("test_doorlock_control")
+
+    # gcov は checksum の一致する .gcda に加算するため、前回の実行分は残してはいけません
+    assert command[-1] == "^test_doorlock_control$"
+    assert not list(object_dir.rglob("*.gcda"))
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import pytest
+
+from gen_code.code_gen_agent.common import gtest_cache
+from gen_code.code_gen_agent.common.gtest_cache import GTestCacheError, ensure_gtest, gtest_configure_args
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch, tmp_path: Path):
+    monkeypatch.setattr(gtest_cache, "GTEST_CACHE_DIR", tmp_path / "gtest")
+    monkeypatch.setattr(gtest_cache, "_memo", {})
+    monkeypatch.delenv(gtest_cache.GTEST_SOURCE_ENV, raising=False)
+    monkeypatch.delenv(gtest_cache.OFFLINE_ENV, raising=False)
+
+
+def test_failed_download_is_tried_once_per_process(monkeypatch):
+    attempts = []
+
+    def unreachable(url: str, timeout: float):
+        attempts.append(url)
+        raise OSError("network is unreachable")
+
+    monkeypatch.setattr(gtest_cache.urllib.request, "urlopen", unreachable)
+
+    assert gtest_configure_args() == []
+    assert gtest_configure_args() == []
+    with pytest.raises(GTestCacheError, match="network is unreachable"):
+        ensure_gtest()
+    assert len(attempts) == 1
+
+
+def test_prefix_is_memoized(monkeypatch, tmp_path: Path):
+    source = tmp_path / "googletest"
+    source.mkdir()
+    (source / "CMakeLists.txt").write_text("project(googletest)\n", encoding="utf-8")
+    monkeypatch.setenv(gtest_cache.GTEST_SOURCE_ENV, str(source))
+    builds = []
+    monkeypatch.setattr(gtest_cache, "_populate", lambda src, entry_dir: builds.append(src)
+                        or (entry_dir / gtest_cache._COMPLETE_MARKER).touch())
+
+    first = ensure_gtest()
+    source.rename(tmp_path / "moved")  # 2 回目以降はソースを見に行きません
+    assert ensure_gtest() == first
+    assert first.name == "install"
+    assert builds == [source]
+
+
+def test_changed_setting_is_resolved_again(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv(gtest_cache.OFFLINE_ENV, "1")
+    with pytest.raises(GTestCacheError, match="GEN_CODE_OFFLINE"):
+        ensure_gtest()
+
+    monkeypatch.setenv(gtest_cache.GTEST_SOURCE_ENV, str(tmp_path / "missing"))
+    with pytest.raises(GTestCacheError, match="does not exist"):
+        ensure_gtest()
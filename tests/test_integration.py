@@ -0,0 +1,177 @@
+import asyncio
+import json
+import stat
+import sys
+from pathlib import Path
+
+import pytest
+
+from gen_code.code_gen_agent.common import integration
+from gen_code.code_gen_agent.common.build_scheduler import BuildScheduler
+from gen_code.code_gen_agent.common.integration import (
+    INTEGRATION_DIR, INTEGRATION_TARGET, MAX_FAILURES, SOAK_RUN, TRACE_DIR, _parse_run, format_integration,
+    result_kind, run_integration,
+)
+from gen_code.code_gen_agent.common.process import ProcessResult
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="the stub simulator is a script with a shebang")
+
+SETTINGS = {"repeat": 2, "duration_ms": 3_600_000, "latency_ms": 0}
+
+# integration_sim の代わりに、トレース名に応じた出力をするスクリプト
+SIMULATOR = """
+import json, sys, time
+
+def run(checks, failures):
+    return {"virtual_ms": 1800000, "control_steps": 3600, "messages": 360, "dropped": 0, "transitions": 4,
+            "checks": checks, "failures": len(failures), "first_failures": failures}
+
+args = sys.argv[1:]
+trace = args[args.index("--trace") + 1].rsplit("/", 1)[-1][:-len(".trace")] if "--trace" in args else None
+if trace == "ok" or trace is None:
+    print(json.dumps(run(50, [])))
+elif trace == "bad":
+    failures = [{"time_ms": 1000 * i, "line": i + 1, "expected": "LOCK", "actual": "UNLOCK", "speed_kph": 35}
+                for i in range(25)]
+    for failure in failures:
+        print(f"FAIL t={failure['time_ms']} ms (trace line {failure['line']}): expected LOCK, got UNLOCK")
+    print(json.dumps(run(40, failures)))
+    sys.exit(1)
+elif trace == "silent":
+    print("Segmentation fault in update_door_lock_state", file=sys.stderr)
+    sys.exit(3)
+elif trace == "hang":
+    time.sleep(30)
+"""
+
+
+class FakeBuilder:
+    """The parts of IncrementalBuilder run_integration uses; the build writes the stub simulator."""
+
+    def __init__(self, root: Path, build_returncode: int = 0):
+        self.source_dir = root / "examples"
+        self.build_dir = root / "examples" / "build"
+        self.target_dirs = {}
+        self.built = []
+        self.build_returncode = build_returncode
+
+    async def build_async(self, targets, timeout=None):
+        self.built.append(targets)
+        if self.build_returncode:
+            return ProcessResult(returncode=self.build_returncode, stdout="",
+                                 stderr="sim_main.c:12:5: error: unknown type name 'DoorLockCommand'\n")
+        executable = self.build_dir / INTEGRATION_DIR / INTEGRATION_TARGET
+        executable.parent.mkdir(parents=True, exist_ok=True)
+        executable.write_text(f"#!{sys.executable}\n{SIMULATOR}", encoding="utf-8")
+        executable.chmod(executable.stat().st_mode | stat.S_IXUSR)
+        return ProcessResult(returncode=0, stdout="", stderr="")
+
+
+def _builder(tmp_path: Path, traces, build_returncode: int = 0) -> FakeBuilder:
+    builder = FakeBuilder(tmp_path, build_returncode)
+    (builder.source_dir / TRACE_DIR).mkdir(parents=True)
+    for name in traces:
+        (builder.source_dir / TRACE_DIR / f"{name}.trace").write_text(f"# {name}\n0 speed 0\n", encoding="utf-8")
+    return builder
+
+
+@pytest.fixture(autouse=True)
+def scheduler(monkeypatch) -> BuildScheduler:
+    scheduler = BuildScheduler(jobs=4)
+    monkeypatch.setattr(integration, "build_scheduler", scheduler)
+    return scheduler
+
+
+def test_parse_run_of_recorded_stdout():
+    run = {"virtual_ms": 2030000, "checks": 100, "failures": 1,
+           "first_failures": [{"time_ms": 2500, "line": 11, "expected": "LOCK", "actual": "UNLOCK", "speed_kph": 35}]}
+    stdout = ("FAIL t=2500 ms (trace line 11): expected LOCK, got UNLOCK (speed 35 km/h, shift 3)\n"
+              f"{json.dumps(run)}\n")
+    assert _parse_run(stdout) == run
+    # JSON の行がない、または途中で切れた出力は結果なしです
+    assert _parse_run("") is None
+    assert _parse_run("FAIL t=2500 ms (trace line 11): expected LOCK, got UNLOCK\n") is None
+    assert _parse_run('{"virtual_ms": 2030000, "checks": 1\n') is None
+
+
+def test_all_runs_pass(tmp_path: Path):
+    builder = _builder(tmp_path, ["ok"])
+    result = asyncio.run(run_integration(builder, timeout=10, settings=SETTINGS))
+
+    assert builder.built == [[INTEGRATION_TARGET]] and INTEGRATION_TARGET in builder.target_dirs
+    assert result["status"] == "success"
+    assert set(result["runs"]) == {"ok", SOAK_RUN}
+    assert result["summary"] == "2 run(s), 100 check(s), 0 failure(s), 1.0 virtual hour(s)"
+    assert result["failures"] == []
+
+
+def test_runs_without_a_result_count_as_failures(tmp_path: Path):
+    builder = _builder(tmp_path, ["hang", "ok", "silent"])
+    result = asyncio.run(run_integration(builder, timeout=2, settings=SETTINGS))
+
+    assert result["status"] == "error"
+    assert set(result["runs"]) == {"ok", SOAK_RUN}
+    # JSON を出さなかった hang と silent を 1 件ずつ数えます
+    assert result["summary"] == "4 run(s), 100 check(s), 2 failure(s), 1.0 virtual hour(s)"
+    hang, silent = result["failures"]
+    assert hang["trace"] == "hang" and hang["message"].startswith("timed out")
+    assert silent == {"trace": "silent", "message": "exited with 3: Segmentation fault in update_door_lock_state"}
+
+
+def test_failures_are_aggregated_and_capped(tmp_path: Path):
+    builder = _builder(tmp_path, ["bad", "ok", "silent"])
+    result = asyncio.run(run_integration(builder, timeout=10, settings=SETTINGS))
+
+    # bad の 25 件と silent の 1 件は全て集計しますが、state に載せるのは先頭の MAX_FAILURES 件だけです
+    assert result["summary"] == "4 run(s), 140 check(s), 26 failure(s), 1.5 virtual hour(s)"
+    failures = result["failures"]
+    assert len(failures) == MAX_FAILURES
+    assert [failure["line"] for failure in failures] == list(range(1, MAX_FAILURES + 1))
+    assert failures[0] == {"trace": "bad", "time_ms": 0, "line": 1, "expected": "LOCK", "actual": "UNLOCK",
+                           "speed_kph": 35}
+    assert "first_failures" not in result["runs"]["bad"]
+
+
+def test_build_failure(tmp_path: Path):
+    result = asyncio.run(run_integration(_builder(tmp_path, ["ok"], build_returncode=1), settings=SETTINGS))
+
+    assert result["status"] == "error" and "runs" not in result
+    assert result["error_message"].startswith(f"{INTEGRATION_TARGET} did not build: ")
+    assert format_integration(result) == f"Integration test not run: {result['error_message']}"
+
+
+def test_format_integration():
+    result = {
+        "summary": "2 run(s), 100 check(s), 2 failure(s), 5.6 virtual hour(s)",
+        "runs": {},
+        "failures": [
+            {"trace": "door_lock", "line": 11, "time_ms": 2500, "expected": "LOCK", "actual": "UNLOCK", "speed_kph": 35},
+            {"trace": SOAK_RUN, "message": "timed out: "},
+        ],
+    }
+    assert format_integration(result).splitlines() == [
+        "Integration test (virtual time): 2 run(s), 100 check(s), 2 failure(s), 5.6 virtual hour(s)",
+        "- door_lock.trace line 11, t=2500 ms: expected LOCK, got UNLOCK (speed 35 km/h)",
+        f"- {SOAK_RUN}: timed out: ",
+    ]
+    assert format_integration({"status": "unavailable", "reason": "no build"}) == "Integration test not run: no build"
+
+
+def test_result_kind_follows_the_traces_and_settings(tmp_path: Path):
+    builder = _builder(tmp_path, ["door_lock"])
+    trace = builder.source_dir / TRACE_DIR / "door_lock.trace"
+    kind = result_kind(builder, SETTINGS)
+
+    assert result_kind(builder, dict(SETTINGS)) == kind
+    assert result_kind(builder, {**SETTINGS, "repeat": 3}) != kind
+
+    trace.write_text(trace.read_text(encoding="utf-8") + "2500 expect LOCK\n", encoding="utf-8")
+    edited = result_kind(builder, SETTINGS)
+    assert edited != kind
+
+    (builder.source_dir / TRACE_DIR / "child_lock.trace").write_text("0 speed 0\n", encoding="utf-8")
+    assert result_kind(builder, SETTINGS) not in (kind, edited)
+    # トレース以外のファイルは結果に影響しません
+    added = result_kind(builder, SETTINGS)
+    (builder.source_dir / TRACE_DIR / "README.md").write_text("notes\n", encoding="utf-8")
+    assert result_kind(builder, SETTINGS) == added
@@ -0,0 +1,94 @@
+import asyncio
+from pathlib import Path
+from typing import AsyncGenerator, List, Optional
+
+import pytest
+from google.adk.agents import LlmAgent
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from gen_code.code_gen_agent.common.disk_cache import DiskCache
+from gen_code.code_gen_agent.common.llm_cache import LlmResponseCache
+from gen_code.code_gen_agent.common.workspace import WORKSPACE_STATE_KEY
+
+APP, USER = "app", "user"
+
+
+class CountingLlm(BaseLlm):
+    """Answers with the next of `answers` (None: an error response) and records the prompts it was sent."""
+
+    model: str = "fake-model"
+    answers: List[Optional[str]] = []
+    prompts: List[str] = []
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        self.prompts.append(llm_request.config.system_instruction)
+        answer = self.answers[min(len(self.prompts), len(self.answers)) - 1]
+        if answer is None:
+            yield LlmResponse(error_code="RESOURCE_EXHAUSTED", error_message="quota exceeded")
+            return
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=answer)]))
+
+
+@pytest.fixture
+def cache(tmp_path: Path) -> LlmResponseCache:
+    return LlmResponseCache(DiskCache(tmp_path / "llm"))
+
+
+def _agent(cache: LlmResponseCache, model: CountingLlm) -> LlmAgent:
+    return LlmAgent(name="CodeWriterAgent", model=model, instruction="Write the code under {workspace_dir}/examples.",
+                    output_key="generated_code", before_model_callback=cache.before_model,
+                    after_model_callback=cache.after_model)
+
+
+def _run(agent: LlmAgent, workspace: Path, session_id: str) -> str:
+    service = InMemorySessionService()
+
+    async def run() -> str:
+        await service.create_session(app_name=APP, user_id=USER, session_id=session_id,
+                                     state={WORKSPACE_STATE_KEY: str(workspace)})
+        message = types.Content(role="user", parts=[types.Part(text="Lock the doors above 20 km/h.")])
+        async for _ in Runner(agent=agent, app_name=APP, session_service=service).run_async(
+                user_id=USER, session_id=session_id, new_message=message):
+            pass
+        session = await service.get_session(app_name=APP, user_id=USER, session_id=session_id)
+        return session.state.get("generated_code")
+
+    return asyncio.run(run())
+
+
+def test_a_hit_skips_the_model_across_workspaces(cache, tmp_path: Path):
+    model = CountingLlm(answers=["int lock(void);"])
+    agent = _agent(cache, model)
+
+    assert _run(agent, tmp_path / "workspace-1", "s1") == "int lock(void);"
+    # ワークスペースのパスだけが異なるプロンプトは同じキーになります
+    assert _run(agent, tmp_path / "workspace-2", "s2") == "int lock(void);"
+    assert len(model.prompts) == 1
+    assert str(tmp_path / "workspace-1") in model.prompts[0]
+    assert cache._pending == {}
+
+
+def test_the_key_ignores_the_workspace_path_only(cache, tmp_path: Path):
+    model = CountingLlm(answers=["int lock(void);", "int unlock(void);"])
+    _run(_agent(cache, model), tmp_path / "workspace-1", "s1")
+
+    other = _agent(cache, model)
+    other.instruction = "Write the tests under {workspace_dir}/examples."
+    assert _run(other, tmp_path / "workspace-2", "s2") == "int unlock(void);"
+    assert len(model.prompts) == 2
+
+
+def test_error_responses_are_not_stored(cache, tmp_path: Path):
+    model = CountingLlm(answers=[None, "int lock(void);"])
+    agent = _agent(cache, model)
+
+    _run(agent, tmp_path / "workspace-1", "s1")
+    # エラー応答の後も保留中のキーは残りません
+    assert cache._pending == {}
+    assert _run(agent, tmp_path / "workspace-1", "s2") == "int lock(void);"
+    assert len(model.prompts) == 2
+    assert _run(agent, tmp_path / "workspace-1", "s3") == "int lock(void);"
+    assert len(model.prompts) == 2
@@ -0,0 +1,101 @@
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from gen_code.code_gen_agent.common.build_engine import TEST_TARGET
+from gen_code.code_gen_agent.common.modules import (
+    ManifestError, extract_section, load_manifest, module_state, module_targets,
+)
+
+ITEMS_MANIFEST = Path(__file__).resolve().parents[1] / "examples" / "docs" / "items_modules.json"
+
+SPEC = """# Themes
+
+## 1. Battery
+### 1.1 Overview
+Monitor the battery.
+
+## 2. Charging
+Charge at night.
+### 2.1 Peak shift
+Pause during peak hours.
+
+## 3. Climate
+"""
+
+
+def _manifest(tmp_path: Path, modules: list) -> Path:
+    (tmp_path / "spec.md").write_text(SPEC, encoding="utf-8")
+    path = tmp_path / "modules.json"
+    path.write_text(json.dumps({"modules": modules}), encoding="utf-8")
+    return path
+
+
+def test_extract_section_up_to_the_next_heading_of_the_same_level():
+    assert extract_section(SPEC, "1. Battery") == "## 1. Battery\n### 1.1 Overview\nMonitor the battery."
+    assert extract_section(SPEC, "2.") == "## 2. Charging\nCharge at night.\n### 2.1 Peak shift\nPause during peak hours."
+    assert extract_section(SPEC, "2.1") == "### 2.1 Peak shift\nPause during peak hours."
+    assert extract_section(SPEC, "3. Climate") == "## 3. Climate"
+    with pytest.raises(ManifestError, match="'4. Doors' not found"):
+        extract_section(SPEC, "4. Doors")
+
+
+def test_load_manifest_reads_the_sections(tmp_path: Path):
+    manifest = load_manifest(_manifest(tmp_path, [
+        {"name": "battery_monitor", "spec": "spec.md", "section": "1. Battery", "summary": "Battery level."},
+        {"name": "charge_timer", "text": "Inline requirements.", "depends_on": ["battery_monitor"]},
+    ]))
+    assert manifest.modules["battery_monitor"].spec_text.endswith("Monitor the battery.")
+    assert manifest.modules["battery_monitor"].summary == "Battery level."
+    assert manifest.modules["charge_timer"].spec_text == "Inline requirements."
+
+
+@pytest.mark.parametrize("modules, message", [
+    ([{"name": "a", "text": "x", "depends_on": ["b"]}], "'a' depends on unknown module\\(s\\): b"),
+    ([{"name": "a", "text": "x", "depends_on": ["c"]}, {"name": "b", "text": "x", "depends_on": ["a"]},
+      {"name": "c", "text": "x", "depends_on": ["b"]}, {"name": "d", "text": "x"}],
+     "Cyclic dependencies between modules: a, b, c"),
+    ([{"name": "a", "text": "x", "depends_on": ["a"]}], "Cyclic dependencies between modules: a"),
+    ([{"name": "Battery-Monitor", "text": "x"}], "Invalid or duplicate module name 'Battery-Monitor'"),
+    ([{"name": "a", "text": "x"}, {"name": "a", "text": "y"}], "Invalid or duplicate module name 'a'"),
+    ([{"name": "a", "spec": "spec.md", "section": "9. Missing"}], "'9. Missing' not found in spec.md \\(module 'a'\\)"),
+    ([], "No modules"),
+])
+def test_load_manifest_rejects_malformed_manifests(tmp_path: Path, modules, message):
+    with pytest.raises(ManifestError, match=message):
+        load_manifest(_manifest(tmp_path, modules))
+
+
+def test_levels_group_modules_by_dependency_depth(tmp_path: Path):
+    manifest = load_manifest(_manifest(tmp_path, [
+        {"name": "report", "text": "x", "depends_on": ["regen", "timer"]},
+        {"name": "regen", "text": "x", "depends_on": ["battery"]},
+        {"name": "timer", "text": "x", "depends_on": ["battery", "clock"]},
+        {"name": "clock", "text": "x"},
+        {"name": "battery", "text": "x"},
+    ]))
+    assert manifest.levels() == [["battery", "clock"], ["regen", "timer"], ["report"]]
+    assert manifest.dependencies("report") == ["battery", "regen", "clock", "timer"]
+    assert module_state(manifest.modules["timer"], manifest) == {"name": "timer", "depends_on": ["battery", "clock"]}
+
+
+def test_levels_of_the_items_manifest():
+    assert load_manifest(ITEMS_MANIFEST).levels() == [
+        ["battery_monitor", "cabin_climate", "child_lock_control", "odometer"],
+        ["charge_timer", "maintenance_notice", "regen_control"],
+    ]
+
+
+def test_module_targets():
+    builder = SimpleNamespace(target_dirs={})
+    assert module_targets(builder, {}) == (None, TEST_TARGET)
+    assert module_targets(builder, None) == (None, TEST_TARGET)
+    assert builder.target_dirs == {}
+
+    state = {"module": {"name": "regen_control", "depends_on": ["battery_monitor"]}}
+    assert module_targets(builder, state) == (["regen_control_module"], "test_regen_control")
+    # フィンガープリントがモジュールのソースとテストを含むよう、ターゲットを登録します
+    assert builder.target_dirs == {"regen_control_module": ("src/body_app",),
+                                   "test_regen_control": ("tests", "src/body_app")}
@@ -0,0 +1,117 @@
+import pytest
+
+from gen_code.code_gen_agent.common.patch import Edit, PatchError, apply_edits, parse_edits, write_files_atomically
+
+HEADER = "#ifndef DOORLOCK_H\n#define DOORLOCK_H\nint lock(int speed);\n#endif\n"
+SOURCE = (
+    "#include \"doorlock_control.h\"\n"
+    "\n"
+    "int lock(int speed) {\n"
+    "    if (speed >= 20) {\n"
+    "        return 1;\n"
+    "    }\n"
+    "    return 0;\n"
+    "}\n"
+)
+FILES = {"header": HEADER, "source": SOURCE}
+
+
+def test_search_replace_blocks():
+    text = (
+        "Rename the threshold.\n"
+        "<<<<<<< SEARCH source\n"
+        "    if (speed >= 20) {\n"
+        "=======\n"
+        "    if (speed >= LOCK_SPEED_KPH) {\n"
+        ">>>>>>> REPLACE\n"
+    )
+    edits = parse_edits(text)
+
+    assert edits == [Edit("source", "    if (speed >= 20) {\n", "    if (speed >= LOCK_SPEED_KPH) {\n")]
+    assert "LOCK_SPEED_KPH) {" in apply_edits(FILES, edits)["source"]
+
+
+def test_unified_diff_becomes_edits_from_context_and_removed_lines():
+    # @@ の行番号は古くても構いません
+    text = (
+        "```diff\n"
+        "--- a/doorlock_control.c\n"
+        "+++ b/doorlock_control.c\n"
+        "@@ -40,4 +40,4 @@\n"
+        " int lock(int speed) {\n"
+        "-    if (speed >= 20) {\n"
+        "+    if (speed > 19) {\n"
+        "         return 1;\n"
+        "--- a/doorlock_control.h\n"
+        "+++ b/doorlock_control.h\n"
+        "@@ -3 +3,2 @@\n"
+        " int lock(int speed);\n"
+        "+int unlock(void);\n"
+        "```\n"
+    )
+    edits = parse_edits(text)
+
+    assert edits == [
+        Edit("source", "int lock(int speed) {\n    if (speed >= 20) {\n        return 1;\n",
+             "int lock(int speed) {\n    if (speed > 19) {\n        return 1;\n"),
+        Edit("header", "int lock(int speed);\n", "int lock(int speed);\nint unlock(void);\n"),
+    ]
+    result = apply_edits(FILES, edits)
+    assert "if (speed > 19)" in result["source"]
+    assert result["header"] == "#ifndef DOORLOCK_H\n#define DOORLOCK_H\nint lock(int speed);\nint unlock(void);\n#endif\n"
+
+
+def test_unified_diff_blank_context_line():
+    text = (
+        "--- a/source\n"
+        "+++ b/source\n"
+        "@@ -1,3 +1,4 @@\n"
+        " #include \"doorlock_control.h\"\n"
+        "\n"
+        "+#define LOCK_SPEED_KPH 20\n"
+        " int lock(int speed) {\n"
+    )
+    result = apply_edits(FILES, parse_edits(text))
+    assert result["source"].startswith("#include \"doorlock_control.h\"\n\n#define LOCK_SPEED_KPH 20\nint lock")
+
+
+def test_all_conflicts_are_reported_together():
+    edits = [
+        Edit("source", "    return", "    return -"),  # 2 箇所に一致
+        Edit("source", "int unlock(void) {\n", ""),  # 見つからない
+        Edit("header", "int lock(int speed);\n", "int lock(int kph);\n"),
+        Edit("footer", "x", "y"),
+    ]
+    with pytest.raises(PatchError) as error:
+        apply_edits(FILES, edits)
+
+    assert error.value.conflicts == [
+        "edit 1 (source): search text matches 2 locations: 'return'",
+        "edit 2 (source): search text not found: 'int unlock(void) {'",
+        "edit 4: unknown file 'footer' (expected one of ['header', 'source'])",
+    ]
+
+
+def test_trailing_whitespace_fallback():
+    files = {"source": "int a;   \nint b;\t\nint c;\n"}
+    result = apply_edits(files, [Edit("source", "int a;\nint b;\n", "int ab;\n")])
+    assert result["source"] == "int ab;\nint c;\n"
+
+
+def test_trailing_whitespace_fallback_still_requires_a_unique_match():
+    files = {"source": "int a; \nint a;\n"}
+    with pytest.raises(PatchError, match="not found"):
+        apply_edits(files, [Edit("source", "int a;  \n", "int b;\n")])
+
+
+def test_empty_search_appends():
+    result = apply_edits({"source": "int a;"}, [Edit("source", "", "int b;\n")])
+    assert result["source"] == "int a;\nint b;\n"
+
+
+def test_write_files_atomically(tmp_path):
+    header, source = tmp_path / "inc" / "a.h", tmp_path / "a.c"
+    write_files_atomically({header: HEADER, source: SOURCE})
+    assert header.read_text(encoding="utf-8") == HEADER
+    assert source.read_text(encoding="utf-8") == SOURCE
+    assert sorted(p.name for p in tmp_path.rglob("*.tmp")) == []
@@ -0,0 +1,145 @@
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.sessions import InMemorySessionService, Session
+
+from gen_code.code_gen_agent.code_builder_agent import agent as builder_agent
+from gen_code.code_gen_agent.code_builder_agent.agent import PerformanceAgent
+from gen_code.code_gen_agent.common.workspace import WORKSPACE_STATE_KEY
+
+WRITER_SOURCE = "#include \"doorlock_control.h\"\nint lock(int speed) { return speed >= 20; } /* writer */\n"
+
+
+def _measurement(ns_per_call: float) -> Dict[str, Any]:
+    return {"status": "success", "module": "doorlock_control", "toolchain": "gcc", "calls": 1048576,
+            "ns_per_call": ns_per_call, "calls_per_sec": 1e9 / ns_per_call, "cycles_per_call": ns_per_call * 3,
+            "stack_bytes": 16, "stack": {"update_door_lock_state": 16}, "static_bytes": 20, "text_bytes": 254}
+
+
+class _FakeBuilder:
+    def __init__(self, source_dir: Path):
+        self.source_dir = source_dir
+        self.target_dirs: Dict[str, Any] = {}
+        self.calls = 0
+
+    def result_key(self, kind: str, targets: List[str]) -> str:
+        # 呼び出しごとに別のソースとして扱い、結果キャッシュを経由させません
+        self.calls += 1
+        return f"{kind}-{self.calls}"
+
+
+@pytest.fixture
+def benchmarked() -> List[str]:
+    """Module source each benchmark compiled, in order."""
+    return []
+
+
+@pytest.fixture
+def measurements(monkeypatch, benchmarked) -> List[Dict[str, Any]]:
+    """Queue of benchmark results the agents get, in order."""
+    queue: List[Dict[str, Any]] = []
+    builders: Dict[Path, _FakeBuilder] = {}
+
+    async def run_benchmark(builder: _FakeBuilder, module: str, *_args: Any) -> Dict[str, Any]:
+        # bench_<module> は builder のソースツリーにあるモジュールのソースをコンパイルします
+        benchmarked.append((builder.source_dir / "src" / "body_app" / f"{module}.c").read_text(encoding="utf-8"))
+        return queue.pop(0)
+
+    monkeypatch.setattr(builder_agent, "get_builder", lambda path: builders.setdefault(path, _FakeBuilder(path)))
+    monkeypatch.setattr(builder_agent, "get_result", lambda _key, _workspace: None)
+    monkeypatch.setattr(builder_agent, "put_result", lambda _key, _result, _workspace: None)
+    monkeypatch.setattr(builder_agent, "run_benchmark", run_benchmark)
+    monkeypatch.delenv("GEN_CODE_PERF_BUDGET_NS", raising=False)
+    monkeypatch.delenv("GEN_CODE_PERF_BUDGET_CYCLES", raising=False)
+    monkeypatch.delenv("GEN_CODE_PERF_TOLERANCE", raising=False)
+    return queue
+
+
+def _run(agent: PerformanceAgent, session: Session) -> bool:
+    """Runs the agent on the session and returns whether it exited the loop."""
+    ctx = InvocationContext(session_service=InMemorySessionService(), invocation_id="inv", agent=agent,
+                            session=session)
+
+    async def run() -> list:
+        return [event async for event in agent.run_async(ctx)]
+
+    events = asyncio.run(run())
+    return bool(events[-1].actions.escalate)
+
+
+@pytest.fixture
+def session(tmp_path: Path) -> Session:
+    """Session on a workspace where the writer has written file_codewriter.h/.c."""
+    body_app = tmp_path / "examples" / "src" / "body_app"
+    body_app.mkdir(parents=True)
+    (body_app / "doorlock_control.h").write_text("int lock(int speed);\n", encoding="utf-8")
+    (body_app / "doorlock_control.c").write_text("/* checked in */\n", encoding="utf-8")
+    (body_app / "file_codewriter.h").write_text("int lock(int speed); /* writer */\n", encoding="utf-8")
+    (body_app / "file_codewriter.c").write_text(WRITER_SOURCE, encoding="utf-8")
+    (tmp_path / "examples" / "bench").mkdir()
+    (tmp_path / "examples" / "bench" / "bench_doorlock_control.c").write_text("int main(void) { return 0; }\n",
+                                                                            encoding="utf-8")
+    return Session(id="session", app_name="app", user_id="user", state={WORKSPACE_STATE_KEY: str(tmp_path)})
+
+
+def test_baseline_benchmarks_the_writers_code(measurements, benchmarked, session, tmp_path: Path):
+    measurements += [_measurement(10.0), _measurement(10.0)]
+
+    _run(PerformanceAgent(name="PerformanceBaselineAgent", baseline=True), session)
+    # ワークスペースのモジュールのソースはそのままで、スクラッチの作業場所でライターのコードを測定します
+    assert benchmarked == [WRITER_SOURCE]
+    body_app = tmp_path / "examples" / "src" / "body_app"
+    assert (body_app / "doorlock_control.c").read_text(encoding="utf-8") == "/* checked in */\n"
+    staged = tmp_path / "examples" / "build-baseline" / "examples" / "src" / "body_app"
+    assert (staged / "doorlock_control.h").read_text(encoding="utf-8") == "int lock(int speed); /* writer */\n"
+
+    # 2 回目はスクラッチの作業場所を作り直さず、ライターの新しい出力で上書きします
+    (body_app / "file_codewriter.c").write_text("/* rewritten */\n", encoding="utf-8")
+    _run(PerformanceAgent(name="PerformanceBaselineAgent", baseline=True), session)
+    assert benchmarked[-1] == "/* rewritten */\n"
+
+    session.state["build_result"] = {"status": "success"}
+    measurements.append(_measurement(10.0))
+    _run(PerformanceAgent(name="PerformanceAgent"), session)
+    assert benchmarked[-1] == "/* checked in */\n"
+
+
+def test_baseline_without_the_writers_output(measurements, benchmarked, session, tmp_path: Path):
+    (tmp_path / "examples" / "src" / "body_app" / "file_codewriter.c").unlink()
+
+    assert not _run(PerformanceAgent(name="PerformanceBaselineAgent", baseline=True), session)
+    assert benchmarked == []
+    assert "performance" not in session.state
+
+
+def test_slower_first_refactor_is_flagged_against_the_baseline(measurements, session):
+    measurements += [_measurement(10.0), _measurement(20.0)]
+
+    assert not _run(PerformanceAgent(name="PerformanceBaselineAgent", baseline=True), session)
+    assert session.state["performance"]["ns_per_call"] == 10.0
+
+    session.state["build_result"] = {"status": "success"}
+    assert not _run(PerformanceAgent(name="PerformanceAgent"), session)
+    report = session.state["performance_report"]
+    assert "ns_per_call: 10.0 -> 20.0 (+100.0%)" in report
+    assert "cycles_per_call: 30.0 -> 60.0 (+100.0%)" in report
+
+
+def test_refactor_within_tolerance_exits_the_loop(measurements, session):
+    measurements += [_measurement(10.0), _measurement(10.5)]
+
+    _run(PerformanceAgent(name="PerformanceBaselineAgent", baseline=True), session)
+    session.state["build_result"] = {"status": "success"}
+    assert _run(PerformanceAgent(name="PerformanceAgent"), session)
+    assert session.state["performance_report"] == ""
+    assert session.state["performance"]["ns_per_call"] == 10.5
+
+
+def test_failed_build_is_not_measured(measurements, session):
+    session.state["build_result"] = {"status": "error"}
+
+    assert not _run(PerformanceAgent(name="PerformanceAgent"), session)
+    assert "performance" not in session.state
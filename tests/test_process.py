@@ -0,0 +1,53 @@
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from gen_code.code_gen_agent.common.process import run_process
+
+
+def _python(code: str) -> list:
+    return [sys.executable, "-c", code]
+
+
+def test_passes_lines_longer_than_the_stream_limit(tmp_path: Path):
+    # gcc -fdiagnostics-format=json prints all diagnostics of a translation unit as one line
+    code = "import sys; sys.stdout.write('x' * 300000 + '\\nnext\\nlast')"
+    lines = []
+    result = asyncio.run(run_process(_python(code), tmp_path, on_output=lambda _, line: lines.append(line)))
+
+    assert result.returncode == 0
+    assert result.stdout == "x" * 300000 + "\nnext\nlast"
+    assert lines == ["x" * 300000 + "\n", "next\n", "last"]
+
+
+def test_keeps_multibyte_characters_split_across_reads(tmp_path: Path):
+    code = "import sys; sys.stdout.buffer.write(b'a' * 65535 + 'ドア\\n'.encode('utf-8'))"
+    result = asyncio.run(run_process(_python(code), tmp_path))
+
+    assert result.stdout == "a" * 65535 + "ドア\n"
+
+
+def test_timeout_kills_the_process_and_keeps_partial_output(tmp_path: Path):
+    code = "import time; print('started', flush=True); time.sleep(30)"
+    result = asyncio.run(run_process(_python(code), tmp_path, timeout=1.0))
+
+    assert result.timed_out
+    assert result.stdout == "started\n"
+
+
+def test_callback_error_kills_the_process_group(tmp_path: Path):
+    marker = tmp_path / "still_running"
+    code = f"import time; print('go', flush=True); time.sleep(1); open({str(marker)!r}, 'w').close()"
+
+    def fail(_stream: str, _line: str) -> None:
+        raise RuntimeError("callback failed")
+
+    async def run() -> None:
+        with pytest.raises(RuntimeError):
+            await run_process(_python(code), tmp_path, on_output=fail)
+        await asyncio.sleep(1.5)
+
+    asyncio.run(run())
+    assert not marker.exists()
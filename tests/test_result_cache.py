@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from gen_code.code_gen_agent.common.diagnostics import summarize
+from gen_code.code_gen_agent.common.result_cache import WORKSPACE_PLACEHOLDER, _relocate, reproducible
+
+COMPILE_ERROR = "/ws/examples/src/doorlock_control.c:12:5: error: 'speed' undeclared (first use in this function)\n"
+GTEST_FAILURE = (
+    "[ RUN      ] DoorLockTest.LocksAboveThreshold\n"
+    "/ws/examples/tests/test_doorlock_control.cpp:42: Failure\n"
+    "Expected equality of these values:\n"
+    "[  FAILED  ] DoorLockTest.LocksAboveThreshold (0 ms)\n"
+)
+
+
+def test_success_and_located_failures_are_reproducible():
+    assert reproducible(summarize("success", "", ""))
+    assert reproducible(summarize("error", "", COMPILE_ERROR))
+    assert reproducible(summarize("error", GTEST_FAILURE, ""))
+
+
+def test_failures_without_a_parsed_cause_are_not_reproducible():
+    # OOM で kill されたコンパイラ、ディスクフル、kill された ctest、cmake が見つからない場合
+    assert not reproducible(summarize("error", "", "gcc: fatal error: Killed signal terminated program cc1\n"))
+    assert not reproducible(summarize("error", "", "No space left on device\n"))
+    assert not reproducible(summarize("error", "", ""))
+    assert not reproducible({"status": "error", "stdout": "", "stderr": "cmake: not found"})
+
+
+def test_relocate_round_trip():
+    result = {"log_file": "/ws/examples/build/logs/build.log", "diagnostics": [{"file": "/ws/examples/src/a.c"}]}
+    stored = _relocate(result, str(Path("/ws")), WORKSPACE_PLACEHOLDER)
+    assert stored["log_file"] == "${workspace}/examples/build/logs/build.log"
+    assert _relocate(stored, WORKSPACE_PLACEHOLDER, "/other")["diagnostics"][0]["file"] == "/other/examples/src/a.c"
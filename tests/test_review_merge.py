@@ -0,0 +1,90 @@
+from gen_code.code_gen_agent.code_reviewer_agent import tools
+from gen_code.code_gen_agent.code_reviewer_agent.tools import format_findings, merge_reviews, parse_findings
+
+FOCUSES = ["correctness", "safety", "performance", "concurrency"]
+
+
+def test_parse_findings_bullets_severity_and_continuation_lines():
+    review = (
+        "1. [HIGH] update_door_lock_state() reads speed before checking the ignition state.\n"
+        "   The door can unlock while the car is moving.\n"
+        "\n"
+        "- [low] Use a named constant for 20 km/h.\n"
+        "* The timer is never reset after a manual unlock.\n"
+    )
+    assert parse_findings(review) == [
+        {"severity": "high", "text": "update_door_lock_state() reads speed before checking the ignition state. "
+                                     "The door can unlock while the car is moving."},
+        {"severity": "low", "text": "Use a named constant for 20 km/h."},
+        {"severity": "medium", "text": "The timer is never reset after a manual unlock."},
+    ]
+
+
+def test_parse_findings_of_malformed_output():
+    assert parse_findings("") == []
+    assert parse_findings("  \n") == []
+    assert parse_findings("**No major issues found.**") == []
+    # 箇条書きでない文章は 1 つの指摘として扱います
+    assert parse_findings("The module looks fine\nbut the timer can overflow.") == [
+        {"severity": "medium", "text": "The module looks fine but the timer can overflow."}]
+    # 重大度だけで本文のない項目は捨て、未知の重大度は本文に残します
+    assert parse_findings("- [high]\n- [critical] Stack overflow in the ISR.") == [
+        {"severity": "medium", "text": "[critical] Stack overflow in the ISR."}]
+    assert parse_findings('{"findings": ["x"]}') == [{"severity": "medium", "text": '{"findings": ["x"]}'}]
+
+
+def test_duplicates_across_reviewers_are_merged():
+    reviews = {
+        "correctness": "- [medium] The manual override timer is never reset after unlocking.",
+        "safety": "- [high] The manual override timer is never reset after an unlock.",
+        "performance": "No major issues found.",
+        "concurrency": "- [low] door_lock_state is written from the ISR without volatile.",
+    }
+    merged = merge_reviews(reviews, FOCUSES)
+
+    assert merged == [
+        # 重い方の重大度を採り、指摘した全てのレビュアーを残します
+        {"severity": "high", "text": "The manual override timer is never reset after unlocking.",
+         "focus": ["correctness", "safety"]},
+        {"severity": "low", "text": "door_lock_state is written from the ISR without volatile.", "focus": ["concurrency"]},
+    ]
+    assert format_findings(merged).splitlines() == [
+        "- [high] (correctness, safety) The manual override timer is never reset after unlocking.",
+        "- [low] (concurrency) door_lock_state is written from the ISR without volatile.",
+    ]
+
+
+def test_ranking_by_severity_then_reviewer_count_then_focus_order():
+    reviews = {
+        "correctness": "- [low] Rename lock_flag to is_locked.\n- [medium] Missing range check on the speed input.",
+        "safety": "- [medium] Missing range check on the speed input value.\n- [medium] No default case in the state switch.",
+        "performance": "- [medium] Division in the 100 ms loop can be replaced by a shift.",
+        "concurrency": "- [high] Shared state is not protected against the UDP receiver thread.",
+        "unknown_focus": "- [high] Ignored: not in the focus order.",
+    }
+    texts = [(finding["severity"], finding["focus"]) for finding in merge_reviews(reviews, FOCUSES)]
+
+    assert texts == [
+        ("high", ["concurrency"]),
+        ("medium", ["correctness", "safety"]),
+        ("medium", ["safety"]),
+        ("medium", ["performance"]),
+        ("low", ["correctness"]),
+    ]
+
+
+def test_merged_findings_are_truncated(monkeypatch):
+    monkeypatch.setattr(tools, "MAX_REVIEW_COMMENTS", 3)
+    reviews = {"correctness": "- [low] Rename lock_flag.\n- [low] Add a header guard comment.\n"
+                              "- [low] Sort the includes.\n- [low] Drop the unused timer macro.",
+               "safety": "- [high] The watchdog is never kicked."}
+    merged = merge_reviews(reviews, FOCUSES)
+
+    # 切り詰めは順位付けの後なので、重大な指摘は残ります
+    assert [finding["text"] for finding in merged] == [
+        "The watchdog is never kicked.", "Rename lock_flag.", "Add a header guard comment."]
+
+
+def test_nothing_found_formats_the_no_issues_verdict():
+    assert merge_reviews({"correctness": "No major issues found.", "safety": ""}, FOCUSES) == []
+    assert format_findings([]) == "No major issues found."
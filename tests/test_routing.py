@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import pytest
+from google.adk.models import LlmRequest, LlmResponse
+
+from gen_code.code_gen_agent.common import routing
+from gen_code.code_gen_agent.common.routing import ModelRouter, RoutingDecision
+
+FLASH, PRO = "gemini-2.0-flash", "gemini-2.5-pro"
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(routing, "time", clock)
+    return clock
+
+
+def _history(*outcomes: Any) -> List[RoutingDecision]:
+    return [RoutingDecision(session_id="s", agent="CodeRefactorerAgent", model=FLASH, tier=0, reason="first tier",
+                            failures=0, budget_seconds=120.0, stage_outcome=outcome) for outcome in outcomes]
+
+
+def _context(agent: str, state: Dict[str, Any], invocation_id: str = "inv") -> SimpleNamespace:
+    session = SimpleNamespace(id="s")
+    return SimpleNamespace(agent_name=agent, state=state, invocation_id=invocation_id,
+                           _invocation_context=SimpleNamespace(session=session))
+
+
+def _call(router: ModelRouter, clock: _Clock, agent: str, state: Dict[str, Any], seconds: float = 1.0) -> str:
+    """Routes one model call that takes `seconds` and returns the chosen model."""
+    request = LlmRequest()
+    router.before_model(_context(agent, state), request)
+    clock.now += seconds
+    router.after_model(_context(agent, state), LlmResponse())
+    return request.model
+
+
+def test_failures_count_consecutive_failed_outcomes():
+    router = ModelRouter([FLASH, PRO])
+    assert router._failures(_history()) == 0
+    assert router._failures(_history("error", "error")) == 2
+    assert router._failures(_history("error", "success", "error")) == 1
+    # 次のビルドの前の呼び出しは、まだ結果がありません
+    assert router._failures(_history("error", None)) == 0
+
+
+def test_unknown_outcomes_are_neutral():
+    router = ModelRouter([FLASH, PRO])
+    assert router._failures(_history("unknown", "unknown", "unknown")) == 0
+    assert router._failures(_history("error", "unknown", "error", "unknown")) == 2
+    assert router._failures(_history("success", "unknown", "error")) == 1
+
+
+def test_choose_escalates_one_tier_per_escalate_after_failures():
+    router = ModelRouter([FLASH, "gemini-2.5-flash", PRO], escalate_after=2)
+    assert router.choose("CodeRefactorerAgent", 0) == (0, "first tier")
+    assert router.choose("CodeRefactorerAgent", 1) == (0, "first tier")
+    assert router.choose("CodeRefactorerAgent", 2) == (1, "escalated after 2 failure(s)")
+    assert router.choose("CodeRefactorerAgent", 9) == (2, "escalated after 9 failure(s)")
+
+
+def test_choose_is_capped_by_the_latency_budget(clock):
+    router = ModelRouter([FLASH, PRO], escalate_after=1, budgets={"CodeRefactorerAgent": 60.0})
+    state: Dict[str, Any] = {"build_result": {"status": "error"}}
+
+    assert _call(router, clock, "CodeRefactorerAgent", state) == FLASH
+    # 1 回失敗したので強い段に上がりますが、その呼び出しは予算を超えます
+    assert _call(router, clock, "CodeRefactorerAgent", state, seconds=90.0) == PRO
+    assert router.choose("CodeRefactorerAgent", 2) == (0, "capped by the 60s latency budget")
+    # 予算の既定値 (120s) の別のエージェントは、まだ強い段を使えます
+    assert router.choose("CodeWriterAgent", 2) == (1, "escalated after 2 failure(s)")
+    assert _call(router, clock, "CodeRefactorerAgent", state) == FLASH
+
+
+def test_calls_without_a_stage_result_do_not_escalate(clock):
+    router = ModelRouter([FLASH, PRO], escalate_after=1)
+    state: Dict[str, Any] = {}
+
+    # ビルド前のレビューやヘッダーの生成を何度繰り返しても、失敗とは数えません
+    for _ in range(3):
+        assert _call(router, clock, "HeaderWriterAgent", state) == FLASH
+        assert _call(router, clock, "CorrectnessReviewerAgent", state) == FLASH
+
+    # 直前の呼び出しの後のビルドが失敗したので、次の呼び出しから強い段に上がります
+    state["build_result"] = {"status": "error"}
+    assert _call(router, clock, "CorrectnessReviewerAgent", state) == PRO
+    outcomes = [d.stage_outcome for d in router.decisions("s") if d.agent == "CorrectnessReviewerAgent"]
+    assert outcomes == ["unknown", "unknown", "error", None]
@@ -0,0 +1,176 @@
+import asyncio
+from typing import AsyncGenerator, List, Optional
+
+import pytest
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.genai import types
+
+from gen_code.code_gen_agent.common import scheduler as scheduler_module
+from gen_code.code_gen_agent.common.scheduler import ModelScheduler, ScheduledLlm, TokenBucket
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(scheduler_module, "time", clock)
+    # バックオフは上限値を使います
+    monkeypatch.setattr(scheduler_module.random, "uniform", lambda low, high: high)
+    return clock
+
+
+class _VirtualScheduler(ModelScheduler):
+    """Arms no thread timers: `drain()` advances the fake clock to the armed time instead."""
+
+    def __init__(self, clock: _Clock, **kwargs):
+        self.clock = clock
+        self.due: Optional[float] = None
+        super().__init__(**kwargs)
+
+    def _arm_timer(self, delay: float) -> None:
+        self.due = self.clock.now + delay
+
+    async def drain(self, tasks: List["asyncio.Task"]) -> None:
+        while not all(task.done() for task in tasks):
+            for _ in range(5):
+                await asyncio.sleep(0)
+            if self.due is not None and not all(task.done() for task in tasks):
+                self.clock.now, self.due = max(self.clock.now, self.due), None
+                self._on_timer()
+
+
+def test_token_bucket_refills_up_to_its_burst(clock):
+    bucket = TokenBucket(per_minute=60, burst_seconds=10)
+    assert bucket.capacity == 10 and bucket.delay(10, now=0.0) == 0.0
+
+    bucket.consume(10, now=0.0)
+    assert bucket.delay(1, now=0.0) == pytest.approx(1.0)
+    assert bucket.delay(3, now=1.0) == pytest.approx(2.0)
+    # 満杯以上には貯まらず、容量を超える量は満杯になった時点で通します
+    assert bucket.delay(10, now=100.0) == 0.0 and bucket.level == 10
+    assert bucket.delay(50, now=100.0) == 0.0
+    # 見積もりの補正で残量が負になると、その分だけ待ちます
+    bucket.consume(15, now=100.0)
+    assert bucket.delay(1, now=100.0) == pytest.approx(6.0)
+
+
+def test_unlimited_bucket_never_waits(clock):
+    bucket = TokenBucket(per_minute=None)
+    bucket.consume(1_000_000, now=0.0)
+    assert bucket.delay(1_000_000, now=0.0) == 0.0
+
+
+def test_queued_calls_are_served_by_priority_then_fifo(clock):
+    scheduler = _VirtualScheduler(clock, requests_per_minute=60, burst_seconds=1)
+    served: List[str] = []
+
+    async def call(name: str, priority: int) -> None:
+        await scheduler.acquire(100, priority)
+        served.append(name)
+
+    async def run() -> None:
+        # 1 つ目でバケットが空になり、残りはキューに並びます
+        tasks = [asyncio.create_task(call(name, priority)) for name, priority in
+                 [("first", 0), ("writer", 0), ("test_loop", -2), ("writer2", 0), ("refinement", -1)]]
+        await scheduler.drain(tasks)
+
+    asyncio.run(run())
+
+    assert served == ["first", "test_loop", "refinement", "writer", "writer2"]
+    # 1 分あたり 60 回なので 1 秒に 1 つずつ通ります
+    assert clock.now == pytest.approx(4.0)
+    metrics = scheduler.metrics()
+    assert metrics["max_queue_depth"] == 4 and metrics["queue_depth"] == 0
+    assert metrics["wait_ms.p95"] == pytest.approx(4000.0)
+
+
+def test_wait_samples_are_bounded(clock, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "MAX_WAIT_SAMPLES", 3)
+    scheduler = _VirtualScheduler(clock, requests_per_minute=6000, burst_seconds=1)
+
+    async def run() -> None:
+        for _ in range(10):
+            task = asyncio.create_task(scheduler.acquire(1))
+            await scheduler.drain([task])
+
+    asyncio.run(run())
+
+    assert len(scheduler._metrics["waits_ms"]) == 3
+    assert scheduler.metrics()["queued_calls"] == 10
+
+
+class RateLimitError(Exception):
+    code = 429
+
+
+class FlakyLlm(BaseLlm):
+    """Raises the next error of `errors` on each call, then answers."""
+
+    model: str = "fake-model"
+    errors: List[Exception] = []
+    calls: int = 0
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text="ok")]))
+
+
+def _generate(scheduler: _VirtualScheduler, inner: FlakyLlm) -> List[LlmResponse]:
+    llm = ScheduledLlm(model="fake-model", agent_name="CodeWriterAgent", inner=inner, scheduler=scheduler)
+    request = LlmRequest(contents=[types.Content(role="user", parts=[types.Part(text="requirements")])])
+
+    async def collect() -> List[LlmResponse]:
+        return [response async for response in llm.generate_content_async(request)]
+
+    async def run() -> List[LlmResponse]:
+        task = asyncio.create_task(collect())
+        await scheduler.drain([task])
+        return task.result()
+
+    return asyncio.run(run())
+
+
+def test_rate_limited_calls_back_off_exponentially(clock):
+    scheduler = _VirtualScheduler(clock, max_retries=5)
+    inner = FlakyLlm(errors=[RateLimitError("429"), RateLimitError("429"), Exception("RESOURCE_EXHAUSTED: quota")])
+
+    responses = _generate(scheduler, inner)
+
+    assert [response.content.parts[0].text for response in responses] == ["ok"]
+    assert inner.calls == 4
+    # 1 + 2 + 4 秒のバックオフの後に成功します
+    assert clock.now == pytest.approx(7.0)
+    assert {key: scheduler.metrics()[key] for key in ("calls", "throttled", "retries", "failed")} == {
+        "calls": 4, "throttled": 3, "retries": 3, "failed": 0}
+    # 成功するたびにバックオフを 1 段戻します
+    assert scheduler._backoff_level == 2
+
+
+def test_backoff_is_capped(clock):
+    scheduler = _VirtualScheduler(clock)
+    delays = [scheduler.throttled() for _ in range(9)]
+    assert delays == [1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 60.0, 60.0, 60.0]
+
+
+def test_retries_are_limited_and_other_errors_are_not_retried(clock):
+    scheduler = _VirtualScheduler(clock, max_retries=2)
+    inner = FlakyLlm(errors=[RateLimitError("429") for _ in range(3)])
+    with pytest.raises(RateLimitError):
+        _generate(scheduler, inner)
+    assert inner.calls == 3
+
+    inner = FlakyLlm(errors=[ValueError("invalid request")])
+    with pytest.raises(ValueError):
+        _generate(scheduler, inner)
+    assert inner.calls == 1
+    assert {key: scheduler.metrics()[key] for key in ("calls", "retries", "failed")} == {
+        "calls": 4, "retries": 2, "failed": 2}
@@ -0,0 +1,99 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from google.adk.events import Event, EventActions
+from google.genai import types
+
+from gen_code.code_gen_agent.common.session_store import SqliteSessionService
+
+APP, USER = "app", "user"
+
+
+def _code(iteration: int) -> str:
+    return f"/* iteration {iteration} */\n" + "int lock(int speed) { return speed >= 20; }\n" * 40
+
+
+def _event(author: str, delta: dict, text: str = "") -> Event:
+    content = types.Content(role="model", parts=[types.Part(text=text)]) if text else None
+    return Event(invocation_id="inv", author=author, content=content, actions=EventActions(state_delta=delta))
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def db_path(tmp_path: Path) -> Path:
+    return tmp_path / "sessions.db"
+
+
+async def _write_iterations(service: SqliteSessionService, iterations: int):
+    session = await service.create_session(app_name=APP, user_id=USER, session_id="s1", state={"requirements": "x"})
+    for iteration in range(iterations):
+        code = _code(iteration)
+        await service.append_event(session, _event("RefactorAgent", {"refactored_code": code}, text=code))
+        await service.append_event(session, _event("BuildAgent", {"build_result": {"status": "success"},
+                                                                  "temp:scratch": "not persisted"}))
+    return session
+
+
+def test_reload_restores_state_and_events(db_path: Path):
+    service = SqliteSessionService(db_path)
+    written = _run(_write_iterations(service, 2))
+    service.close()
+
+    reloaded = SqliteSessionService(db_path)
+    session = _run(reloaded.get_session(app_name=APP, user_id=USER, session_id="s1"))
+
+    assert session.state == {"requirements": "x", "refactored_code": _code(1), "build_result": {"status": "success"}}
+    assert [event.author for event in session.events] == [event.author for event in written.events]
+    assert session.events[2].content.parts[0].text == _code(1)
+    # 同じコードは state、state_delta、content で 1 つの blob を共有します
+    assert reloaded.stats()["blobs"] == 2
+    reloaded.close()
+
+
+def test_superseded_state_delta_is_compacted(db_path: Path):
+    service = SqliteSessionService(db_path)
+    session = _run(_write_iterations(service, 3))
+
+    expected = [{}, {}, {}, {}, {"refactored_code": _code(2)}, {"build_result": {"status": "success"}}]
+    assert [event.actions.state_delta for event in session.events][:5] == expected[:5]
+
+    # temp: キーはデータベースに書きません
+    reloaded = _run(service.get_session(app_name=APP, user_id=USER, session_id="s1"))
+    assert [event.actions.state_delta for event in reloaded.events] == expected
+    # 古い世代のコードはイベントの content からだけ参照されます
+    assert service.collect_garbage() == 0
+
+    # 読み込み直したセッションに追記しても、索引を作り直して圧縮します
+    _run(service.append_event(reloaded, _event("RefactorAgent", {"refactored_code": _code(3)})))
+    reloaded = _run(service.get_session(app_name=APP, user_id=USER, session_id="s1"))
+    assert reloaded.events[4].actions.state_delta == {}
+    assert reloaded.state["refactored_code"] == _code(3)
+    service.close()
+
+
+def test_blobs_of_a_rolled_back_event_are_not_cached(db_path: Path, monkeypatch):
+    service = SqliteSessionService(db_path)
+    session = _run(service.create_session(app_name=APP, user_id=USER, session_id="s1"))
+
+    def fail(*_args):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(service, "_compact", fail)
+    with pytest.raises(RuntimeError):
+        _run(service.append_event(session, _event("RefactorAgent", {"refactored_code": _code(0)})))
+    monkeypatch.undo()
+    assert service.stats()["blobs"] == 0
+
+    # 同じ内容を書き直すと blob も保存し直され、読み込めます
+    session = _run(service.get_session(app_name=APP, user_id=USER, session_id="s1"))
+    _run(service.append_event(session, _event("RefactorAgent", {"refactored_code": _code(0)})))
+    service.close()
+
+    reloaded = SqliteSessionService(db_path)
+    session = _run(reloaded.get_session(app_name=APP, user_id=USER, session_id="s1"))
+    assert session.state["refactored_code"] == _code(0)
+    reloaded.close()
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from gen_code.code_gen_agent.common.streaming import JsonStringStream
+
+HEADER = '#ifndef DOORLOCK_H\n#define DOORLOCK_H\n#define NAME "door\\tlock"\n#endif\n'
+SOURCE = 'const char *label = "Türverriegelung \\u00e9";\nint lock(void) { return 1; }\n'
+OUTPUT = json.dumps({"header_code": HEADER, "source_code": SOURCE})
+
+
+def _feed_in_chunks(text: str, size: int):
+    stream = JsonStringStream()
+    completed = []
+    for start in range(0, len(text), size):
+        completed += stream.feed(text[start:start + size])
+    return completed
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, len(OUTPUT)])
+def test_chunk_boundaries_anywhere(size):
+    assert _feed_in_chunks(OUTPUT, size) == [("header_code", HEADER), ("source_code", SOURCE)]
+
+
+def test_chunk_boundaries_inside_escapes():
+    text = '{"header_code": "a\\\\\\"b\\n\\u00e9c"}'
+    # バックスラッシュの直後、\uXXXX の途中、連続するエスケープの間で区切ります
+    for cut in range(len(text)):
+        stream = JsonStringStream()
+        assert stream.feed(text[:cut]) + stream.feed(text[cut:]) == [("header_code", 'a\\"b\né' + "c")]
+
+
+def test_value_is_returned_by_the_chunk_that_closes_it():
+    stream = JsonStringStream()
+    assert stream.feed('```json\n{"header_code": "int a;') == []
+    assert stream.feed('\\n", "source_') == [("header_code", "int a;\n")]
+    assert stream.feed('code": "int b;') == []
+    assert stream.feed('"}\n```') == [("source_code", "int b;")]
+
+
+def test_non_string_values_are_skipped():
+    text = json.dumps({
+        "notes": {"text": "a } brace and a \" quote", "list": [1, "]", {"x": "}"}]},
+        "count": 3,
+        "header_code": "int a;",
+        "flag": True,
+        "source_code": "int b;",
+    })
+    assert _feed_in_chunks(text, 4) == [("header_code", "int a;"), ("source_code", "int b;")]
+
+
+def test_stops_at_the_end_of_the_object():
+    stream = JsonStringStream()
+    assert stream.feed('{"header_code": "int a;"} {"source_code": "int b;"}') == [("header_code", "int a;")]
+
+
+def test_invalid_escape_is_returned_raw():
+    assert JsonStringStream().feed('{"header_code": "a\\qb"}') == [("header_code", "a\\qb")]